@@ -0,0 +1,131 @@
+"""
+管理 API
+- 按需请求采样分析：开启 / 查看 / 关闭，以及下载采样结果
+- Gemini 故障注入：查看 / 修改 / 清除（需开启 GEMINI_FAULT_INJECTION）
+"""
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import FileResponse
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from dataclasses import asdict
+from app.core.security import get_current_admin
+from app.core import profiling
+from app.services import fault_injection
+from app.services.fault_injection import FaultConfig
+
+router = APIRouter(prefix="/admin", tags=["管理"])
+
+
+class ProfilingRequest(BaseModel):
+    """开启采样请求"""
+    route: str = Field(..., description="请求路径，如 /api/analyze")
+    count: int = Field(1, ge=1, le=profiling.MAX_PROFILE_REQUESTS, description="采样的请求数")
+    interval_ms: int = Field(5, ge=profiling.MIN_INTERVAL_MS, le=profiling.MAX_INTERVAL_MS, description="采样间隔（毫秒）")
+    all_threads: bool = Field(False, description="是否同时采样线程池中的线程")
+    method: Optional[str] = Field(None, description="只匹配该 HTTP 方法，如 POST")
+
+
+class ProfilingStatus(BaseModel):
+    """当前采样计划"""
+    armed: bool
+    route: Optional[str] = None
+    remaining: int = 0
+    interval_ms: Optional[int] = None
+    all_threads: bool = False
+    method: Optional[str] = None
+
+
+class ProfileFile(BaseModel):
+    """采样结果文件"""
+    name: str
+    size: int
+    created_at: int
+
+
+def _status() -> ProfilingStatus:
+    plan = profiling.current_plan()
+    if plan is None:
+        return ProfilingStatus(armed=False)
+    return ProfilingStatus(armed=True, **asdict(plan))
+
+
+@router.get("/profiling", response_model=ProfilingStatus)
+async def get_profiling_status(_: str = Depends(get_current_admin)):
+    """查看当前采样计划"""
+    return _status()
+
+
+@router.post("/profiling", response_model=ProfilingStatus)
+async def start_profiling(request: ProfilingRequest, _: str = Depends(get_current_admin)):
+    """
+    开启采样：接下来 count 个匹配 route 的请求在采样分析器下运行
+    结果为折叠栈格式，可用 flamegraph.pl 或 https://www.speedscope.app 打开
+    """
+    try:
+        profiling.arm(request.route, request.count, request.interval_ms, request.all_threads, request.method)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return _status()
+
+
+@router.delete("/profiling", response_model=ProfilingStatus)
+async def stop_profiling(_: str = Depends(get_current_admin)):
+    """关闭采样"""
+    profiling.disarm()
+    return _status()
+
+
+@router.get("/profiles", response_model=List[ProfileFile])
+async def list_profiles(_: str = Depends(get_current_admin)):
+    """列出采样结果（新的在前）"""
+    return profiling.list_profiles()
+
+
+@router.get("/profiles/{name}")
+async def download_profile(name: str, _: str = Depends(get_current_admin)):
+    """下载采样结果"""
+    path = profiling.profile_path(name)
+    if not path:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="采样结果不存在")
+    return FileResponse(path, media_type="text/plain; charset=utf-8", filename=name)
+
+
+class FaultStatus(BaseModel):
+    """故障注入状态"""
+    enabled: bool = Field(..., description="是否开启了 GEMINI_FAULT_INJECTION")
+    config: Optional[FaultConfig] = None
+
+
+def _injector() -> fault_injection.FaultInjector:
+    injector = fault_injection.get_injector()
+    if injector is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="未开启故障注入 (GEMINI_FAULT_INJECTION=false)")
+    return injector
+
+
+@router.get("/faults", response_model=FaultStatus)
+async def get_faults(_: str = Depends(get_current_admin)):
+    """查看当前故障注入配置"""
+    injector = fault_injection.get_injector()
+    if injector is None:
+        return FaultStatus(enabled=False)
+    return FaultStatus(enabled=True, config=injector.config)
+
+
+@router.put("/faults", response_model=FaultStatus)
+async def set_faults(config: FaultConfig, _: str = Depends(get_current_admin)):
+    """
+    替换故障注入配置，立即对后续的模型调用生效
+    注入次数见 /metrics 的 gemini_faults_injected_total
+    """
+    injector = _injector()
+    injector.configure(config)
+    return FaultStatus(enabled=True, config=injector.config)
+
+
+@router.delete("/faults", response_model=FaultStatus)
+async def clear_faults(_: str = Depends(get_current_admin)):
+    """清除故障注入（恢复正常调用）"""
+    injector = _injector()
+    injector.configure(FaultConfig())
+    return FaultStatus(enabled=True, config=injector.config)
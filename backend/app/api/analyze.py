@@ -2,22 +2,27 @@
 照片分析 API
 对应设计文档 7.2 上传与分析
 """
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Header
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Header, Query, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import defer
 from pydantic import BaseModel
 from typing import Optional, List
-from datetime import datetime
-import json
-import os
-import uuid
+from datetime import timedelta
+import asyncio
+import time
 from app.core.database import get_db
 from app.core.config import get_settings
-from app.models import CardKey, CardStatus
-from app.services.gemini_service import gemini_service
-from PIL import Image
-from PIL import ImageOps
-import io
+from app.core import metrics, tracing
+from app.core.logging_config import bind_card_id
+from app.models import CardKey, CardResultBody, CardStatus
+from app.services.gemini_loader import get_gemini_service
+from app.services import result_cache, blob_store
+from app.services.storage import get_storage
+from app.services.image_pipeline import (
+    prepare_image_for_gemini, InvalidImageError, CHILD_PROFILE, PARENT_PROFILE,
+)
 import logging
 
 logger = logging.getLogger(__name__)
@@ -39,12 +44,37 @@ class AnalysisResultItem(BaseModel):
     description: str
 
 
+class ChildResult(BaseModel):
+    """多个孩子一次分析时单个孩子的结果"""
+    analysis_results: List[AnalysisResultItem]
+    face_center: Optional[FaceCenter] = None
+    face_width: Optional[int] = None
+
+
 class AnalysisResponse(BaseModel):
-    """分析响应"""
+    """分析响应（多个孩子时顶层为第一个孩子的结果，children 为按上传顺序的每个孩子的结果）"""
     success: bool
     analysis_results: List[AnalysisResultItem]
     face_center: Optional[FaceCenter] = None
     face_width: Optional[int] = None
+    children: Optional[List[ChildResult]] = None
+
+
+class CoordinatesResponse(BaseModel):
+    """孩子鼻尖坐标与脸宽（final 表示来自已保存的完整结果）"""
+    ready: bool
+    final: bool = False
+    face_center: Optional[FaceCenter] = None
+    face_width: Optional[int] = None
+
+
+# 授权查询不加载的大列：结果 JSON、图片路径与预序列化响应体只在需要时通过 db.refresh 加载
+_AUTH_DEFERRED = (
+    defer(CardKey.result_cache),
+    defer(CardKey.image_paths),
+    defer(CardKey.image_keys),
+    defer(CardKey.result_body),
+)
 
 
 async def verify_authorization(
@@ -63,7 +93,7 @@ async def verify_authorization(
     
     code = authorization[7:].strip().upper()
     
-    stmt = select(CardKey).where(CardKey.code == code)
+    stmt = select(CardKey).options(*_AUTH_DEFERRED).where(CardKey.code == code)
     result = await db.execute(stmt)
     card = result.scalar_one_or_none()
     
@@ -74,168 +104,82 @@ async def verify_authorization(
             detail="兑换码未激活或无效"
         )
     
+    bind_card_id(card.id)
     return card
 
 
-def process_image(file_bytes: bytes, max_size: int = 8192) -> bytes:
-    """
-    处理上传的图片：
-    1. 验证格式
-    2. 保留原图分辨率（仅在超大图片时压缩）
-    3. 转换为 JPEG
+# 简单的内存锁，防止同一激活码并发调用 Gemini
+# 注意：多实例部署时依然可能并发，但 Docker Compose 单实例足够用
+processing_codes = set()
+metrics.PROCESSING_CODES.set_function(lambda: len(processing_codes))
 
-    注意：max_size 提升到 8192px，确保坐标精度
-    Gemini 2.5 支持最大 7MB，Gemini 3 支持最大 20MB
-    """
-    try:
-        img = Image.open(io.BytesIO(file_bytes))
-        original_size = img.size
+# 拆分模式下先于完整结果返回的坐标（兑换码 -> face_center / face_width），分析结束时清除
+# 与 processing_codes 一样只在本进程内有效
+early_locations = {}
+
+
+class ClientDisconnected(Exception):
+    """客户端在分析完成前断开连接"""
+
+
+class _Progress:
+    """分析进行到的阶段: preprocess / gemini / persist"""
+    stage = "preprocess"
 
-        # 统一方向（避免 EXIF Orientation 导致“同图不同坐标”）
-        img = ImageOps.exif_transpose(img)
-        
-        # 转换为 RGB（去除透明通道）
-        if img.mode in ("RGBA", "P"):
-            img = img.convert("RGB")
-        
-        # 按比例缩放（提高阈值以保持更高分辨率）
-        if max(img.size) > max_size:
-            ratio = max_size / max(img.size)
-            new_size = (int(img.width * ratio), int(img.height * ratio))
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
-            logger.info(f"图片已压缩: {original_size} -> {img.size}")
-        else:
-            logger.info(f"图片无需压缩: {original_size}")
-        
-        # 转为 JPEG bytes（提高质量到 95）
-        buffer = io.BytesIO()
-        img.save(buffer, format="JPEG", quality=95)
-        return buffer.getvalue()
-    
-    except Exception as e:
-        logger.error(f"图片处理失败: {e}")
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="图片格式无效或已损坏"
-        )
 
+async def _wait_for_disconnect(request: Request) -> None:
+    """请求体已读完，之后 receive() 只会在客户端断开时返回 http.disconnect"""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
 
-def _normalize_mime_type(content_type: Optional[str]) -> Optional[str]:
-    if not content_type:
-        return None
-    ct = content_type.strip().lower()
-    if ct == "image/jpg":
-        return "image/jpeg"
-    if ct.startswith("image/"):
-        return ct
-    return None
-
-
-def _pil_format_to_mime(pil_format: Optional[str]) -> Optional[str]:
-    if not pil_format:
-        return None
-    fmt = pil_format.upper()
-    if fmt == "JPEG":
-        return "image/jpeg"
-    if fmt == "PNG":
-        return "image/png"
-    if fmt == "WEBP":
-        return "image/webp"
-    if fmt == "GIF":
-        return "image/gif"
-    if fmt == "BMP":
-        return "image/bmp"
-    if fmt == "TIFF":
-        return "image/tiff"
-    return None
-
-
-def format_mb(size_in_bytes: int) -> str:
-    return f"{size_in_bytes / (1024 * 1024):.2f} MB"
-
-def prepare_image_for_gemini(
-    file_bytes: bytes,
-    content_type: Optional[str],
-    label: str,
-    *,
-    max_dim: int = 8192,
-    max_bytes: int = 10 * 1024 * 1024,
-    quality: int = 95
-) -> tuple[bytes, str]:
+
+async def _run_until_disconnect(request: Request, coro, progress: _Progress):
     """
-    为 Gemini 准备图片输入
+    运行分析，客户端断开时取消（预处理 / Gemini 调用 / 重试等待均在下一个 await 处中断；
+    预处理在线程池中逐张进行，事件循环不被解码阻塞，取消在两张图片之间生效）
+    Gemini 已返回结果（进入 persist 阶段）后不再取消：结果照常保存，用户刷新后可通过 /result 取回
     """
-    normalized_ct = _normalize_mime_type(content_type)
-
+    task = asyncio.ensure_future(coro)
+    watcher = asyncio.ensure_future(_wait_for_disconnect(request))
     try:
-        img = Image.open(io.BytesIO(file_bytes))
-        pil_mime = _pil_format_to_mime(img.format)
-        mime_type = normalized_ct or pil_mime or "image/jpeg"
-
-        exif = getattr(img, "getexif", lambda: None)()
-        orientation = 1
-        if exif:
-            orientation = int(exif.get(274, 1) or 1)
-
-        within_dim = max(img.size) <= max_dim
-        within_bytes = len(file_bytes) <= max_bytes
-        orientation_ok = (orientation == 1)
-        keep_mimes = {"image/jpeg", "image/png", "image/webp"}
-
-        # 满足条件: 保持原样
-        if (
-            mime_type in keep_mimes
-            and within_dim
-            and within_bytes
-            and (mime_type != "image/jpeg" or orientation_ok)
-        ):
-            logger.info(
-                f"[{label}] 保持原始发送: mime={mime_type}, "
-                f"尺寸={img.size}, 大小={len(file_bytes)} bytes ({format_mb(len(file_bytes))})"
-            )
-            return file_bytes, mime_type
-
-        # 否则: 标准化处理
-        # 1. 自动旋转
-        img = ImageOps.exif_transpose(img)
-        # 2. 转 RGB
-        if img.mode in ("RGBA", "P"):
-            img = img.convert("RGB")
-        
-        # 3. 压缩尺寸 (仅当超过 max_dim 时)
-        if max(img.size) > max_dim:
-            ratio = max_dim / max(img.size)
-            new_size = (int(img.width * ratio), int(img.height * ratio))
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
-            logger.info(f"[{label}] 触发尺寸压缩: {max_dim}px 限制")
-        
-        # 4. 重新编码 (JPEG)
-        buffer = io.BytesIO()
-        img.save(buffer, format="JPEG", quality=quality)
-        out_bytes = buffer.getvalue()
-        
-        logger.info(
-            f"[{label}] 标准化处理后 (Q={quality}): "
-            f"in_mime={mime_type}, in_size={img.size}, in_bytes={format_mb(len(file_bytes))} -> "
-            f"out_mime=image/jpeg, out_bytes={format_mb(len(out_bytes))}"
-        )
-        return out_bytes, "image/jpeg"
-    except Exception as e:
-        logger.error(f"[{label}] 图片处理失败: {e}")
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"{label} 图片格式无效或已损坏"
-        )
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if not task.done():
+            metrics.ANALYZE_ABANDONED.labels(stage=progress.stage).inc()
+            if progress.stage == "persist":
+                logger.info("客户端已断开，分析结果已生成，继续保存")
+            else:
+                logger.info("客户端已断开，取消分析 (阶段: %s)", progress.stage)
+                task.cancel()
+                try:
+                    # 等待取消完成：finally 中释放并发锁
+                    await task
+                except BaseException:
+                    pass
+                raise ClientDisconnected(progress.stage)
+        return await task
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
 
 
+async def _read_upload(upload: UploadFile) -> bytes:
+    """读取上传文件（记录 read 阶段耗时）"""
+    with metrics.stage("read").time(), tracing.span("upload.read", filename=upload.filename or ""):
+        return await upload.read()
+
+
+async def _prepare_image(data: bytes, content_type: Optional[str], label: str, profile: dict) -> tuple:
+    """在线程池中预处理一张图片（解码 / 缩放 / 编码为 CPU 密集操作，不在事件循环上执行）"""
+    return await asyncio.to_thread(prepare_image_for_gemini, data, content_type, label, **profile)
 
-# 简单的内存锁，防止同一激活码并发调用 Gemini
-# 注意：多实例部署时依然可能并发，但 Docker Compose 单实例足够用
-processing_codes = set()
 
 @router.post("", response_model=AnalysisResponse)
 async def analyze_photos(
-    child: UploadFile = File(..., description="孩子照片（必填）"),
+    request: Request,
+    child: List[UploadFile] = File(..., description="孩子照片（必填；同一对父母的多个孩子可重复上传该字段）"),
     father: Optional[UploadFile] = File(None, description="父亲照片（选填）"),
     mother: Optional[UploadFile] = File(None, description="母亲照片（选填）"),
     card: CardKey = Depends(verify_authorization),
@@ -244,6 +188,37 @@ async def analyze_photos(
     """
     上传照片并进行 AI 分析
     """
+    metrics.ANALYZE_IN_FLIGHT.inc()
+    outcome = "failed"
+    progress = _Progress()
+    try:
+        with tracing.span("analyze", card_id=card.id):
+            response = await _run_until_disconnect(
+                request, _run_analysis(child, father, mother, card, db, progress), progress
+            )
+        outcome = "success"
+        return response
+    except ClientDisconnected:
+        outcome = "abandoned"
+        # 客户端已断开，响应不会被读取（状态码沿用 nginx 的 499 约定，便于日志统计）
+        return Response(status_code=499)
+    except HTTPException as e:
+        outcome = metrics.outcome_for_status(e.status_code)
+        raise
+    finally:
+        metrics.ANALYZE_IN_FLIGHT.dec()
+        metrics.ANALYZE_REQUESTS.labels(outcome=outcome).inc()
+
+
+async def _run_analysis(
+    child: List[UploadFile],
+    father: Optional[UploadFile],
+    mother: Optional[UploadFile],
+    card: CardKey,
+    db: AsyncSession,
+    progress: _Progress,
+) -> AnalysisResponse:
+    """分析流程主体"""
     # 0. 并发控制: 内存锁
     if card.code in processing_codes:
         logger.warning(f"拒绝并发请求: {card.code} 正在分析中")
@@ -252,6 +227,12 @@ async def analyze_photos(
             detail="分析正在进行中，请耐心等待..."
         )
 
+    if len(child) > settings.max_children_per_analysis:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"一次最多分析 {settings.max_children_per_analysis} 个孩子"
+        )
+
     # 检查是否至少有一个家长照片
     if not father and not mother:
         raise HTTPException(
@@ -260,7 +241,7 @@ async def analyze_photos(
         )
     
     # 【安全加固 2026-01-15】: 防止二次分析覆盖结果
-    if card.result_cache:
+    if card.has_result:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="此兑换码已使用且结果已生成，禁止重复分析"
@@ -274,99 +255,139 @@ async def analyze_photos(
         # 读取并处理图片
         # 1. 孩子照片: 阈值 6MB。保持高分辨率 (max_dim=8192)，压缩质量 95 (轻微)。
         # 关键：避免 resize 导致坐标偏移。
-        child_bytes_raw = await child.read()
-        child_bytes, child_mime_type = prepare_image_for_gemini(
-            child_bytes_raw, 
-            child.content_type, 
-            "Child",
-            max_dim=8192, 
-            max_bytes=6 * 1024 * 1024,
-            quality=90
-        )
+        # 多个孩子时逐个处理，之后与父母照片在同一次调用中分析
+        children = []
+        for index, upload in enumerate(child, 1):
+            child_bytes_raw = await _read_upload(upload)
+            children.append(await _prepare_image(
+                child_bytes_raw, 
+                upload.content_type, 
+                "Child" if index == 1 else f"Child {index}",
+                CHILD_PROFILE
+            ))
+        child_bytes, child_mime_type = children[0]
 
         # 2. 父亲照片: 阈值 3MB。可以压缩 (max_dim=2048)，质量 85。
         father_bytes = None
         father_mime_type = None
         if father:
-            father_bytes_raw = await father.read()
-            father_bytes, father_mime_type = prepare_image_for_gemini(
+            father_bytes_raw = await _read_upload(father)
+            father_bytes, father_mime_type = await _prepare_image(
                 father_bytes_raw, 
                 father.content_type, 
                 "Father",
-                max_dim=2048,
-                max_bytes=3 * 1024 * 1024,
-                quality=85
+                PARENT_PROFILE
             )
 
         # 3. 母亲照片: 阈值 3MB。可以压缩 (max_dim=2048)，质量 85。
         mother_bytes = None
         mother_mime_type = None
         if mother:
-            mother_bytes_raw = await mother.read()
-            mother_bytes, mother_mime_type = prepare_image_for_gemini(
+            mother_bytes_raw = await _read_upload(mother)
+            mother_bytes, mother_mime_type = await _prepare_image(
                 mother_bytes_raw, 
                 mother.content_type, 
                 "Mother",
-                max_dim=2048,
-                max_bytes=3 * 1024 * 1024,
-                quality=85
+                PARENT_PROFILE
             )
 
 
-        # 调用 Gemini 分析
-        result = await gemini_service.analyze_family_photos(
-            child_image=child_bytes,
-            child_mime_type=child_mime_type,
-            father_image=father_bytes,
-            father_mime_type=father_mime_type,
-            mother_image=mother_bytes,
-            mother_mime_type=mother_mime_type,
-        )
-        
-        # 保存图片到磁盘，生成持久化 URL (用于页面刷新/意外退出恢复)
-        images_dir = "data/images"
-        # os.makedirs(images_dir, exist_ok=True) # main.py 里已经创建了，这里可以直接用
-        
+        # 调用 Gemini 分析（SDK 在应用启动后于后台加载，通常已就绪）
+        progress.stage = "gemini"
+        gemini_service = await get_gemini_service()
+        gemini_start = time.perf_counter()
+
+        def on_location(location: dict) -> None:
+            # 坐标先到：结果页可通过 /api/analyze/coordinates 提前渲染
+            early_locations[card.code] = location
+            metrics.stage("first_coordinates").observe(time.perf_counter() - gemini_start)
+
+        # 拆分模式只用于单个孩子
+        split = settings.gemini_split_coordinates and len(children) == 1
+        with tracing.span("gemini.analyze", split=split, children=len(children)):
+            if split:
+                result = await gemini_service.analyze_family_photos_split(
+                    child_image=child_bytes,
+                    child_mime_type=child_mime_type,
+                    father_image=father_bytes,
+                    father_mime_type=father_mime_type,
+                    mother_image=mother_bytes,
+                    mother_mime_type=mother_mime_type,
+                    on_location=on_location,
+                )
+            else:
+                result = await gemini_service.analyze_family_photos(
+                    child_image=child_bytes,
+                    child_mime_type=child_mime_type,
+                    father_image=father_bytes,
+                    father_mime_type=father_mime_type,
+                    mother_image=mother_bytes,
+                    mother_mime_type=mother_mime_type,
+                    sibling_images=children[1:],
+                )
+        if card.code not in early_locations:
+            # 坐标随完整结果一起到达（未拆分，或坐标请求未先完成）
+            metrics.stage("first_coordinates").observe(time.perf_counter() - gemini_start)
+
+        # 结果已生成，之后客户端断开也继续保存
+        progress.stage = "persist"
+
+        # 保存图片，生成持久化 URL (用于页面刷新/意外退出恢复)
+        # 内容寻址存储：相同图片只写一份，字节写入本地目录或对象存储
+        storage = get_storage()
         saved_paths = {}
+        blob_keys = []
+        blob_sizes = {}
+        # 签名 / 预签名图片 URL 与兑换码同时过期
+        expires_at = (
+            card.activated_at + timedelta(hours=settings.data_retention_hours)
+            if card.activated_at else None
+        )
         
-        # 保存 Child
-        child_filename = f"{card.code}_child.jpg"
-        child_path = os.path.join(images_dir, child_filename)
-        with open(child_path, "wb") as f:
-            f.write(child_bytes)
-        saved_paths["child"] = f"/api/images/{child_filename}" # 前端可访问的 URL
+        images_to_save = [
+            (result_cache.child_image_key(index), data, mime_type)
+            for index, (data, mime_type) in enumerate(children, 1)
+        ] + [
+            ("father", father_bytes, father_mime_type),
+            ("mother", mother_bytes, mother_mime_type),
+        ]
+        for role, data, mime_type in images_to_save:
+            if not data:
+                continue
+            with metrics.stage("storage_write").time(), tracing.span("storage.put", role=role, bytes=len(data)):
+                key = await blob_store.put(data, mime_type)
+            blob_keys.append(key)
+            blob_sizes[key] = len(data)
+            saved_paths[role] = storage.url(key, expires_at) # 前端可访问的 URL
         
-        # 保存 Father
-        if father_bytes:
-            father_filename = f"{card.code}_father.jpg"
-            father_path = os.path.join(images_dir, father_filename)
-            with open(father_path, "wb") as f:
-                f.write(father_bytes)
-            saved_paths["father"] = f"/api/images/{father_filename}"
-            
-        # 保存 Mother
-        if mother_bytes:
-            mother_filename = f"{card.code}_mother.jpg"
-            mother_path = os.path.join(images_dir, mother_filename)
-            with open(mother_path, "wb") as f:
-                f.write(mother_bytes)
-            saved_paths["mother"] = f"/api/images/{mother_filename}"
+        # 引用计数与结果在同一事务中提交
+        await blob_store.add_refs(db, blob_keys, blob_sizes)
         
         # 缓存结果到数据库
-        card.result_cache = json.dumps(result, ensure_ascii=False)
-        card.image_paths = json.dumps(saved_paths, ensure_ascii=False) # 保存图片路径
+        card.result_cache = result
+        card.image_paths = saved_paths # 保存图片路径
+        card.image_keys = blob_keys
+        store_result_body(card, result, saved_paths)
+        db.add_all(sibling_result_bodies(card.id, result, saved_paths))
         
-        await db.commit()
+        with metrics.stage("db_commit").time(), tracing.span("db.commit"):
+            await db.commit()
         
-        logger.info(f"分析完成，兑换码: {card.code}")
+        logger.info("分析完成，兑换码: %s", card.code)
         
         return AnalysisResponse(
             success=True,
             analysis_results=result.get("analysis_results", []),
             face_center=result.get("face_center"),
-            face_width=result.get("face_width")
+            face_width=result.get("face_width"),
+            children=result.get("children"),
         )
     
+    except InvalidImageError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -383,36 +404,149 @@ async def analyze_photos(
     finally:
         # 释放锁
         processing_codes.discard(card.code)
+        early_locations.pop(card.code, None)
+
+
+def _encode_result_body(result: dict, images: Optional[dict], child: int = 1) -> tuple:
+    """序列化第 child 个孩子的 /result 响应体，返回 (存储字节, 编码, ETag)"""
+    body = result_cache.serialize_payload(result_cache.build_result_payload(result, images, child))
+    stored, encoding = result_cache.encode_body(body, settings.result_body_compression)
+    return stored, encoding, result_cache.compute_etag(body)
+
+
+def store_result_body(card: CardKey, result: dict, images: Optional[dict]) -> None:
+    """一次性序列化 /result 的响应体，并写入压缩后的字节与 ETag"""
+    card.result_body, card.result_encoding, card.result_etag = _encode_result_body(result, images)
+
+
+def sibling_result_body(card_id: int, result: dict, images: Optional[dict], child: int) -> CardResultBody:
+    """第 child (>= 2) 个孩子的预序列化响应体行"""
+    stored, encoding, etag = _encode_result_body(result, images, child)
+    return CardResultBody(card_id=card_id, child=child, body=stored, encoding=encoding, etag=etag)
+
+
+def sibling_result_bodies(card_id: int, result: dict, images: Optional[dict]) -> List[CardResultBody]:
+    """多个孩子时其余孩子的响应体（单个孩子时为空）"""
+    return [
+        sibling_result_body(card_id, result, images, child)
+        for child in range(2, result_cache.child_count(result) + 1)
+    ]
+
+
+def _image_paths(card: CardKey) -> Optional[dict]:
+    return card.image_paths if isinstance(card.image_paths, dict) else None
+
+
+@router.get("/coordinates", response_model=CoordinatesResponse)
+async def get_coordinates(
+    response: Response,
+    card: CardKey = Depends(verify_authorization),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    获取孩子鼻尖坐标与脸宽
+    拆分模式 (GEMINI_SPLIT_COORDINATES) 下坐标请求先于完整分析完成，结果页可在 POST /api/analyze 返回前轮询本接口提前渲染；
+    分析进行中但坐标未就绪时返回 202
+    """
+    if card.has_result:
+        await db.refresh(card, ["result_cache"])
+        return CoordinatesResponse(
+            ready=True,
+            final=True,
+            face_center=card.result_cache.get("face_center"),
+            face_width=card.result_cache.get("face_width"),
+        )
+    location = early_locations.get(card.code)
+    if location is not None:
+        return CoordinatesResponse(ready=True, **location)
+    if card.code in processing_codes:
+        response.status_code = status.HTTP_202_ACCEPTED
+        return CoordinatesResponse(ready=False)
+    raise HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail="未找到分析结果，请重新上传分析"
+    )
 
 
 @router.get("/result")
 async def get_cached_result(
-    card: CardKey = Depends(verify_authorization)
+    request: Request,
+    child: int = Query(1, ge=1, description="孩子序号（多个孩子一次分析时，从 1 开始）"),
+    card: CardKey = Depends(verify_authorization),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     获取缓存的分析结果
     用于页面刷新后恢复结果
+
+    响应体在分析完成时已序列化，这里原样返回；
+    携带 If-None-Match 的重复查看直接返回 304（只比较 ETag，不读取结果 JSON 与响应体）
+    多个孩子时 child 选择孩子（默认第一个，存于 card_keys；其余孩子存于 card_result_bodies，处理方式相同）
     """
-    if not card.result_cache:
+    if not card.has_result:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="未找到分析结果，请重新上传分析"
         )
-    
-    result = json.loads(card.result_cache)
-    
-    # 尝试解析保存的图片路径
-    images = None
-    if card.image_paths:
-        try:
-            images = json.loads(card.image_paths)
-        except Exception:
-            logger.warning(f"Failed to parse image_paths for card {card.code}")
-            
-    return {
-        "success": True,
-        "analysis_results": result.get("analysis_results", []),
-        "face_center": result.get("face_center"),
-        "face_width": result.get("face_width"),
-        "images": images  # 返回图片 URL
+
+    stored = None
+    if child == 1:
+        if not card.result_etag:
+            # 旧数据：首次查看时补齐预序列化响应体
+            await db.refresh(card, ["result_cache", "image_paths"])
+            store_result_body(card, card.result_cache, _image_paths(card))
+            await db.commit()
+            stored = card.result_body
+        encoding, stored_etag = card.result_encoding or result_cache.IDENTITY, card.result_etag
+
+        async def load_body() -> bytes:
+            await db.refresh(card, ["result_body"])
+            return card.result_body
+    else:
+        row = await db.get(CardResultBody, (card.id, child), options=[defer(CardResultBody.body)])
+        if row is None:
+            # 超出孩子数，或旧数据尚未预序列化该孩子：首次查看时补齐
+            await db.refresh(card, ["result_cache", "image_paths"])
+            if child > result_cache.child_count(card.result_cache):
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="未找到该孩子的分析结果"
+                )
+            row = sibling_result_body(card.id, card.result_cache, _image_paths(card), child)
+            stored, encoding, stored_etag = row.body, row.encoding, row.etag
+            db.add(row)
+            try:
+                await db.commit()
+            except IntegrityError:
+                # 并发的首次查看已写入
+                await db.rollback()
+        else:
+            encoding, stored_etag = row.encoding, row.etag
+
+        async def load_body() -> bytes:
+            await db.refresh(row, ["body"])
+            return row.body
+
+    send_encoded = result_cache.accepts_encoding(request.headers.get("accept-encoding"), encoding)
+    etag = result_cache.format_etag(
+        stored_etag, encoding if send_encoded else result_cache.IDENTITY
+    )
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, no-cache",
+        "Vary": "Authorization, Accept-Encoding",
     }
+
+    if result_cache.etag_matches(request.headers.get("if-none-match"), stored_etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if stored is None:
+        stored = await load_body()
+
+    if send_encoded:
+        body = stored
+        if encoding != result_cache.IDENTITY:
+            headers["Content-Encoding"] = encoding
+    else:
+        body = result_cache.decode_body(stored, encoding)
+
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -2,15 +2,29 @@
 兑换码相关 API
 对应设计文档 7.1 验证兑换码
 """
-from fastapi import APIRouter, Depends, HTTPException, status, Header
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from pydantic import BaseModel
-from datetime import datetime, timedelta
-from app.core.database import get_db
+from pydantic import BaseModel, Field
+from datetime import timedelta
+from typing import AsyncIterator, List
+from app.core.database import get_db, async_session
 from app.core.config import get_settings
 from app.core.security import verify_rate_limiter, get_current_admin
-from app.models import CardKey, CardStatus
+from app.models import CardKey, CardStatus, utcnow
+from app.services.code_provisioning import (
+    INSERT_CHUNK_SIZE,
+    insert_codes,
+    insert_codes_chunked,
+    generate_codes,
+    discard_codes,
+    validate_generate_params,
+)
+import anyio
+import csv
+import json
 import logging
 
 logger = logging.getLogger(__name__)
@@ -84,7 +98,7 @@ async def verify_code(
         # 首次使用，绑定设备
         card.status = CardStatus.USED
         card.device_id = device_id
-        card.activated_at = datetime.now()
+        card.activated_at = utcnow()
         await db.commit()
         
         logger.info(f"兑换码 {code} 首次激活，绑定设备 {device_id[:8]}...")
@@ -97,7 +111,7 @@ async def verify_code(
     
     else:
         # 【安全熔断】如果已激活超过 24 小时，即视为过期
-        if card.activated_at and datetime.now() - card.activated_at > timedelta(hours=settings.data_retention_hours):
+        if card.activated_at and utcnow() - card.activated_at > timedelta(hours=settings.data_retention_hours):
              raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="此兑换码已过期失效"
@@ -146,6 +160,18 @@ class CreateCodeResponse(BaseModel):
     skipped: int
 
 
+class ImportCodeResponse(CreateCodeResponse):
+    """流式导入兑换码响应"""
+    invalid: int = 0  # 无法解析的行数
+
+
+class GenerateCodeRequest(BaseModel):
+    """服务端生成兑换码请求（管理接口）"""
+    count: int = Field(..., ge=1, le=1_000_000)
+    length: int = Field(8, ge=6, le=20)
+    prefix: str = ""
+
+
 @router.get("/check-status", response_model=CheckStatusResponse)
 async def check_status(
     authorization: str = Header(..., description="Bearer <兑换码>"),
@@ -167,7 +193,7 @@ async def check_status(
         return CheckStatusResponse(valid=False, has_result=False, message="无效的兑换码")
         
     # 过期检查
-    if card.activated_at and datetime.now() - card.activated_at > timedelta(hours=settings.data_retention_hours):
+    if card.activated_at and utcnow() - card.activated_at > timedelta(hours=settings.data_retention_hours):
          return CheckStatusResponse(valid=False, has_result=False, is_expired=True, message="已过期")
 
     if card.status != CardStatus.USED:
@@ -191,29 +217,169 @@ async def batch_create_codes(
     需要 HTTP Basic Auth 管理员验证
     """
     # 鉴权由 Depends(get_current_admin) 自动处理，能进来就是合法的
+    created, skipped = await insert_codes_chunked(db, request.codes)
+    logger.info(f"批量创建兑换码: 新增 {created}, 跳过 {skipped}")
+    
+    return CreateCodeResponse(created=created, skipped=skipped)
+
+
+async def _iter_body_lines(request: Request) -> AsyncIterator[str]:
+    """
+    逐行读取请求体（不把整个文件读入内存）
+    每个块只切分一次，块之间只保留未结束的行尾（按片段累积，超长行也不会被反复拼接）
+    """
+    pending: List[bytes] = []
+    first = True
+
+    def decode(line: bytes) -> str:
+        nonlocal first
+        text = line.decode("utf-8", errors="replace")
+        if first:
+            text = text.lstrip("\ufeff")
+            first = False
+        return text
+
+    async for chunk in request.stream():
+        lines = chunk.split(b"\n")
+        if len(lines) == 1:
+            pending.append(chunk)
+            continue
+        pending.append(lines[0])
+        yield decode(b"".join(pending))
+        for line in lines[1:-1]:
+            yield decode(line)
+        pending = [lines[-1]]
+    tail = b"".join(pending)
+    if tail:
+        yield decode(tail)
+
+
+def _parse_import_line(line: str, ndjson: bool) -> str:
+    """
+    解析一行导入数据，返回兑换码（空行/表头返回空串）
+    无法解析时抛出 ValueError
+    """
+    line = line.strip()
+    if not line:
+        return ""
+
+    if ndjson:
+        value = json.loads(line)
+        if isinstance(value, dict):
+            value = value.get("code")
+        if not isinstance(value, str):
+            raise ValueError("缺少 code 字段")
+        return value
+
+    # CSV: 取第一列（按 CSV 规则处理引号与转义），忽略 code 表头
+    try:
+        row = next(csv.reader([line]), [])
+    except csv.Error as e:
+        raise ValueError(str(e))
+    value = row[0].strip() if row else ""
+    if value.lower() == "code":
+        return ""
+    return value
+
+
+@router.post("/import", response_model=ImportCodeResponse)
+async def import_codes(
+    request: Request,
+    _: str = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    流式导入兑换码（管理接口）
+    请求体为 CSV（取第一列，可带 code 表头）或 NDJSON（Content-Type: application/x-ndjson，
+    每行为 "CODE" 或 {"code": "CODE"}），边读边按块入库
+    """
+    content_type = request.headers.get("content-type", "").lower()
+    ndjson = "ndjson" in content_type or "jsonl" in content_type
+
     created = 0
     skipped = 0
-    
-    for code in request.codes:
-        code = code.strip().upper()
-        if not code:
+    invalid = 0
+    chunk = []
+
+    async for line in _iter_body_lines(request):
+        try:
+            code = _parse_import_line(line, ndjson)
+        except ValueError:
+            invalid += 1
             continue
-        
-        # 检查是否已存在
-        stmt = select(CardKey).where(CardKey.code == code)
-        result = await db.execute(stmt)
-        existing = result.scalar_one_or_none()
-        
-        if existing:
-            skipped += 1
+        if not code:
             continue
-        
-        # 创建新兑换码
-        new_card = CardKey(code=code)
-        db.add(new_card)
-        created += 1
-    
-    await db.commit()
-    logger.info(f"批量创建兑换码: 新增 {created}, 跳过 {skipped}")
-    
-    return CreateCodeResponse(created=created, skipped=skipped)
+        chunk.append(code)
+        if len(chunk) >= INSERT_CHUNK_SIZE:
+            c, s = await insert_codes(db, chunk)
+            created += c
+            skipped += s
+            chunk = []
+
+    if chunk:
+        c, s = await insert_codes(db, chunk)
+        created += c
+        skipped += s
+
+    logger.info(f"流式导入兑换码: 新增 {created}, 跳过 {skipped}, 无效行 {invalid}")
+    return ImportCodeResponse(created=created, skipped=skipped, invalid=invalid)
+
+
+@router.post("/generate")
+async def generate_codes_endpoint(
+    request: GenerateCodeRequest,
+    _: str = Depends(get_current_admin),
+):
+    """
+    服务端生成兑换码（管理接口）
+    生成 count 个密码学安全的随机码，以 CSV 流式返回：每块提交后才发送该块，内存中只保留本次已发放的码；
+    生成中途失败或客户端断开时响应不完整，删除本次已入库的码，不留下未交付的码
+    """
+    try:
+        validate_generate_params(request.count, request.length, request.prefix)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+
+    async def stream() -> AsyncIterator[str]:
+        issued: List[str] = []
+        complete = False
+        # 流式响应发送时依赖注入的会话已关闭，这里单独开会话
+        async with async_session() as db:
+            try:
+                yield "code\n"
+                async for inserted in generate_codes(db, request.count, request.length, request.prefix):
+                    issued.extend(inserted)
+                    yield "".join(f"{code}\n" for code in inserted)
+                # 最后一块已交给连接后才会执行到这里
+                complete = True
+                logger.info(f"服务端生成兑换码: {len(issued)} 个")
+            except Exception as e:
+                logger.warning(f"服务端生成兑换码失败: {e}")
+                raise
+            finally:
+                if not complete and issued:
+                    # 断开时所在的取消域已被取消，删除需屏蔽取消才能完成
+                    with anyio.CancelScope(shield=True):
+                        await db.rollback()
+                        discarded = await discard_codes(db, issued)
+                    logger.warning(f"兑换码未完整交付，已删除本次入库的 {discarded} 个")
+
+    body = stream()
+
+    async def close_stream() -> None:
+        # aclose 是内置方法，直接交给 BackgroundTask 会被当作同步函数放进线程池而不被 await
+        await body.aclose()
+
+    return StreamingResponse(
+        body,
+        media_type="text/csv",
+        headers={
+            "Content-Disposition": 'attachment; filename="codes.csv"',
+            "X-Code-Count": str(request.count),
+        },
+        # 无论正常结束还是客户端断开都会执行：关闭仍挂起的生成器，触发上面的清理
+        background=BackgroundTask(close_stream),
+    )
@@ -0,0 +1,116 @@
+"""
+图片分发 API
+非 static 分发模式下替代 StaticFiles 挂载：先鉴权，再由 nginx (accel) 或 Python (signed) 发送文件
+"""
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Response
+from fastapi.responses import FileResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+from datetime import timedelta
+from typing import Optional
+from app.core.database import get_db
+from app.core.config import get_settings
+from app.models import CardKey, CardStatus, utcnow
+from app.services import image_storage, blob_store
+import mimetypes
+import os
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+router = APIRouter(prefix="/images", tags=["图片"])
+
+
+async def _authorize_by_code(authorization: str, filename: str, db: AsyncSession) -> int:
+    """
+    通过兑换码鉴权：图片必须属于该兑换码的分析结果
+    返回该兑换码的过期时间戳
+    """
+    if not authorization.startswith("Bearer "):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="无效的授权格式"
+        )
+    code = authorization[7:].strip().upper()
+
+    stmt = select(CardKey.status, CardKey.activated_at, CardKey.image_paths).where(CardKey.code == code)
+    card = (await db.execute(stmt)).one_or_none()
+    if not card or card.status != CardStatus.USED or not card.activated_at:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="兑换码未激活或无效"
+        )
+
+    expires_at = card.activated_at + timedelta(hours=settings.data_retention_hours)
+    if expires_at < utcnow():
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="此兑换码已过期失效"
+        )
+
+    urls = card.image_paths.values() if isinstance(card.image_paths, dict) else []
+    if filename not in {image_storage.filename_for_url(url) for url in urls}:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="无权访问该图片"
+        )
+    return int(expires_at.timestamp())
+
+
+def _cache_control(filename: str, max_age: int, signed: bool) -> str:
+    """
+    图片内容写入后不再变化，在链接有效期内可以放心缓存
+    内容寻址的 Blob 经签名 URL 访问时允许 CDN / 共享缓存保存（凭证在 URL 中，缓存键随之区分）；
+    兑换码鉴权（凭证在请求头中）与旧版按兑换码命名的文件只允许浏览器缓存
+    """
+    scope = "public" if signed and blob_store.is_blob_key(filename) else "private"
+    return f"{scope}, max-age={max_age}, immutable"
+
+
+@router.get("/{filename}")
+async def get_image(
+    filename: str,
+    exp: Optional[int] = None,
+    sig: Optional[str] = None,
+    authorization: Optional[str] = Header(None, description="Bearer <兑换码>（无签名参数时使用）"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    获取分析图片
+    鉴权方式（二选一）：
+    - 签名 URL: ?exp=<过期时间戳>&sig=<签名>（分析结果中返回的图片地址即为签名 URL）
+    - 兑换码: Authorization: Bearer <兑换码>
+    """
+    if not image_storage.SAFE_FILENAME.match(filename):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="图片不存在")
+
+    signed = exp is not None and bool(sig)
+    if signed:
+        if not image_storage.verify_signature(filename, exp, sig):
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail="图片链接无效或已过期"
+            )
+        expires = exp
+    elif authorization:
+        expires = await _authorize_by_code(authorization, filename, db)
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="缺少图片访问凭证"
+        )
+
+    max_age = max(int(expires - time.time()), 0)
+    headers = {"Cache-Control": _cache_control(filename, max_age, signed)}
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+    if settings.image_delivery_mode == "accel":
+        # 由 nginx 从磁盘发送（自带 ETag / Range / sendfile），Python 不再搬运文件字节
+        headers["X-Accel-Redirect"] = f"{settings.image_accel_prefix}{filename}"
+        return Response(headers=headers, media_type=media_type)
+
+    path = image_storage.image_path(filename)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="图片不存在")
+    return FileResponse(path, media_type=media_type, headers=headers)
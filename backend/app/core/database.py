@@ -2,22 +2,102 @@
 数据库连接模块
 使用 SQLAlchemy 异步引擎
 """
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy import event, inspect, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession, AsyncEngine
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from app.core.config import get_settings
+from app.core.tracing import instrument_engine
+from typing import Optional
+import json
+import logging
 import os
 
+logger = logging.getLogger(__name__)
 settings = get_settings()
 
-# 确保数据目录存在
-os.makedirs(os.path.dirname(settings.database_url.replace("sqlite+aiosqlite:///", "")) or "./data", exist_ok=True)
+# 确保数据目录存在 (仅 SQLite 文件数据库)
+if settings.database_url.startswith("sqlite+aiosqlite:///"):
+    os.makedirs(os.path.dirname(settings.database_url.replace("sqlite+aiosqlite:///", "")) or "./data", exist_ok=True)
+
+# PostgreSQL 多副本同时启动时，用 advisory lock 串行化建表/升级
+SCHEMA_LOCK_ID = 0x67656E65
+
+# PostgreSQL 旧库列类型转换：目标类型 -> USING 表达式
+# 旧版本以 TEXT 保存 JSON、以无时区 timestamp 保存时间（按 UTC 写入）
+PG_TYPE_CONVERSIONS = {
+    "JSONB": "NULLIF({column}::text, '')::jsonb",
+    "TIMESTAMP WITH TIME ZONE": "{column} AT TIME ZONE 'UTC'",
+}
+
+
+def sqlite_pragmas(profile: str) -> dict:
+    """
+    SQLite 性能配置对应的 PRAGMA
+    - production: WAL（读写互不阻塞）+ synchronous=NORMAL（WAL 下仍保证一致性，
+      只在掉电时可能丢失最后几个事务）+ 更大的页缓存与 mmap + 写锁等待
+    - default: 不做任何调整（回滚日志模式，写入会阻塞读取）
+    """
+    if profile != "production":
+        return {}
+    return {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -settings.sqlite_cache_size_kb,  # 负数表示 KiB
+        "mmap_size": settings.sqlite_mmap_size_mb * 1024 * 1024,
+        "busy_timeout": settings.sqlite_busy_timeout_ms,
+        "temp_store": "MEMORY",
+    }
+
+
+def create_engine_for(database_url: str, sqlite_profile: Optional[str] = None) -> AsyncEngine:
+    """按数据库类型创建异步引擎（SQLite 每个新连接都会应用 PRAGMA）"""
+    options = {
+        "echo": settings.debug,  # 调试模式下打印 SQL
+        "future": True,
+        # JSON 列保留中文原文，不转义为 \uXXXX
+        "json_serializer": lambda obj: json.dumps(obj, ensure_ascii=False),
+    }
+
+    is_sqlite = database_url.startswith("sqlite")
+    in_memory = is_sqlite and (":memory:" in database_url or database_url.endswith("://"))
+    if not in_memory:
+        # aiosqlite 默认使用 NullPool（每次会话新建连接和后台线程并重新执行 PRAGMA），
+        # 这里显式使用队列连接池复用连接。
+        # SQLite 同一时刻只有一个写者，WAL 下读可以并发：
+        # 常驻少量连接即可，突发时允许少量溢出，超出后排队等待
+        options.update(
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+            pool_pre_ping=not is_sqlite,
+        )
+        if not is_sqlite:
+            # 服务端数据库：定期回收连接，避免被数据库或中间代理断开的空闲连接
+            options["pool_recycle"] = settings.db_pool_recycle
+
+    new_engine = create_async_engine(database_url, **options)
+    instrument_engine(new_engine.sync_engine)
+
+    if is_sqlite:
+        pragmas = sqlite_pragmas(sqlite_profile or settings.sqlite_profile)
+        if pragmas:
+            @event.listens_for(new_engine.sync_engine, "connect")
+            def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                try:
+                    for name, value in pragmas.items():
+                        cursor.execute(f"PRAGMA {name}={value}")
+                finally:
+                    cursor.close()
+
+    return new_engine
+
 
 # 创建异步引擎
-engine = create_async_engine(
-    settings.database_url,
-    echo=settings.debug,  # 调试模式下打印 SQL
-    future=True
-)
+engine = create_engine_for(settings.database_url)
 
 # 创建异步会话工厂
 async_session = async_sessionmaker(
@@ -42,6 +122,70 @@ async def get_db() -> AsyncSession:
 
 
 async def init_db():
-    """初始化数据库（创建表）"""
+    """初始化数据库（创建表，并补齐已有表缺失的列和索引）"""
     async with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            await conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": SCHEMA_LOCK_ID})
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_upgrade_schema)
+
+
+def _upgrade_schema(conn):
+    """
+    轻量级结构升级
+    create_all 只创建缺失的表，不会修改已有表，
+    这里为旧库补齐模型中新增的列（必须可为空）和索引；
+    PostgreSQL 上还会把旧版本的 TEXT / 无时区时间列转换为 JSONB / timestamptz
+    """
+    inspector = inspect(conn)
+    preparer = conn.dialect.identifier_preparer
+
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+
+        existing_columns = {c["name"]: c["type"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                if conn.dialect.name == "postgresql":
+                    _convert_column_type(conn, table, column, existing_columns[column.name])
+                continue
+            column_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(
+                f"ALTER TABLE {preparer.format_table(table)} "
+                f"ADD COLUMN {preparer.format_column(column)} {column_type}"
+            ))
+            logger.info(f"数据库升级: {table.name} 新增列 {column.name}")
+
+        existing_indexes = {i["name"] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            index.create(conn)
+            logger.info(f"数据库升级: {table.name} 新增索引 {index.name}")
+
+
+def _convert_column_type(conn, table, column, existing_type):
+    """
+    把 PostgreSQL 旧库中类型不一致的列转换为模型类型（仅限 PG_TYPE_CONVERSIONS 中的类型）
+    数据无法转换（如非 JSON 文本）时拒绝启动，避免应用以错误的列类型运行
+    """
+    target = column.type.compile(dialect=conn.dialect)
+    current = existing_type.compile(dialect=conn.dialect)
+    if current == target or target not in PG_TYPE_CONVERSIONS:
+        return
+
+    preparer = conn.dialect.identifier_preparer
+    column_name = preparer.format_column(column)
+    using = PG_TYPE_CONVERSIONS[target].format(column=column_name)
+    try:
+        conn.execute(text(
+            f"ALTER TABLE {preparer.format_table(table)} "
+            f"ALTER COLUMN {column_name} TYPE {target} USING {using}"
+        ))
+    except DBAPIError as e:
+        raise RuntimeError(
+            f"数据库升级失败: {table.name}.{column.name} 无法从 {current} 转换为 {target}"
+            f"（{e.orig}），请先修正该列中的数据后再启动"
+        ) from e
+    logger.info(f"数据库升级: {table.name}.{column.name} 类型 {current} -> {target}")
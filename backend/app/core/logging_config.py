@@ -0,0 +1,162 @@
+"""
+日志配置
+- 结构化输出：LOG_FORMAT=json 时每条日志一行 JSON（JSON Lines），text 为传统格式
+- 非阻塞：根 logger 只挂 QueueHandler，格式化与写出在后台线程 (QueueListener) 完成，
+  事件循环上只做一次入队；队列满时丢弃并计数，不反压请求
+- 惰性格式化：入队时不拼接 msg % args，由后台线程格式化
+- 每条日志自动附带当前请求的 trace_id 与 card_id
+- 大体积的调试载荷（请求摘要 / 完整结果）按 LOG_PAYLOAD_SAMPLE_RATE 采样记录
+"""
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+from app.core.config import get_settings
+from app.core import metrics
+from app.core.tracing import current_trace_id
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+
+settings = get_settings()
+
+# 日志队列长度上限
+LOG_QUEUE_SIZE = 10000
+
+# LogRecord 自带的属性，JSON 输出时其余属性视为 extra 字段
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "trace_id", "card_id"}
+
+_card_id: ContextVar[Optional[int]] = ContextVar("log_card_id", default=None)
+
+_listener: Optional[QueueListener] = None
+
+
+def bind_card_id(card_id: Optional[int]) -> None:
+    """把兑换码记录 id 绑定到当前请求上下文，之后的日志都会带上"""
+    _card_id.set(card_id)
+
+
+def payload_sampled() -> bool:
+    """是否记录本次请求的详细载荷日志"""
+    rate = settings.log_payload_sample_rate
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+class ContextFilter(logging.Filter):
+    """在产生日志的线程中附加 trace_id / card_id（后台线程无法读取请求上下文）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = current_trace_id() or "-"
+        record.card_id = _card_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "trace_id": getattr(record, "trace_id", "-"),
+        }
+        card_id = getattr(record, "card_id", None)
+        if card_id is not None:
+            entry["card_id"] = card_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        elif record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    入队不阻塞、不格式化的 QueueHandler
+    标准 QueueHandler.prepare 会在调用线程里完成格式化，这里只把异常堆栈转成文本
+    （traceback 对象不能安全地跨线程延迟使用），其余留给后台线程
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _TextFormatter(logging.Formatter):
+    """传统文本格式（本地开发用）"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        if not hasattr(record, "trace_id"):
+            record.trace_id = "-"
+        return super().format(record)
+
+
+def setup_logging() -> None:
+    """配置根 logger：QueueHandler -> 后台线程 -> stdout"""
+    global _listener
+    if _listener is not None:
+        return
+
+    if settings.log_format == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = _TextFormatter("%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s")
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.addHandler(queue_handler)
+    root.setLevel(settings.log_level.upper())
+
+    # uvicorn 自带的 handler 同步写出，改为汇入根 logger
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers.clear()
+        uvicorn_logger.propagate = True
+
+    _listener = QueueListener(queue_handler.queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging() -> None:
+    """写完队列中剩余的日志并停止后台线程"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def dropped_records() -> int:
+    """因队列满被丢弃的日志条数"""
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, NonBlockingQueueHandler):
+            return handler.dropped
+    return 0
+
+
+LOG_RECORDS_DROPPED = metrics.Gauge("log_records_dropped", "Log records dropped because the log queue was full")
+LOG_RECORDS_DROPPED.set_function(dropped_records)
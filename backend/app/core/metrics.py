@@ -0,0 +1,402 @@
+"""
+指标采集模块
+轻量实现 Prometheus 的 Counter / Gauge / Histogram，并以文本格式导出 (GET /metrics)
+
+热路径上的记录只做一次 bisect + 两次加法（带锁），带标签的子指标可预先取出复用
+"""
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import math
+import threading
+import time
+
+# 默认延迟分桶 (秒)，覆盖从图片处理 (毫秒级) 到 Gemini 调用 (分钟级)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(pairs: Iterable[Tuple[str, str]]) -> str:
+    body = ",".join(f'{k}="{_escape(str(v))}"' for k, v in pairs)
+    return f"{{{body}}}" if body else ""
+
+
+class _Metric:
+    """指标基类：管理标签组合与子指标"""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[tuple, "_Metric"] = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, **labels):
+        """按标签取子指标（同一组合返回同一对象，可缓存复用）"""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+    def _items(self):
+        if not self.labelnames:
+            return [((), self)]
+        with self._lock:
+            return [(tuple(zip(self.labelnames, key)), child) for key, child in self._children.items()]
+
+
+class Counter(_Metric):
+    """单调递增计数器"""
+
+    type_name = "counter"
+
+    def __init__(self, *args, **kwargs):
+        self._value = 0.0
+        super().__init__(*args, **kwargs)
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    def _samples(self) -> List[str]:
+        if not self.labelnames:
+            return [f"{self.name}_total {_format_value(self._value)}"]
+        return [
+            f"{self.name}_total{_format_labels(labels)} {_format_value(child._value)}"
+            for labels, child in self._items()
+        ]
+
+
+class _CounterValue:
+    __slots__ = ("_value", "_lock")
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+
+class Gauge(_Metric):
+    """可增可减的瞬时值；也可绑定一个取值函数，导出时再计算"""
+
+    type_name = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+        super().__init__(*args, **kwargs)
+
+    def _new_child(self):
+        raise ValueError("Gauge 暂不支持标签")
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value: float) -> None:
+        self._value = float(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._function = function
+
+    def _samples(self) -> List[str]:
+        value = self._function() if self._function else self._value
+        return [f"{self.name} {_format_value(value)}"]
+
+
+class _HistogramValue:
+    __slots__ = ("_upper_bounds", "_counts", "_sum", "_lock")
+
+    def __init__(self, upper_bounds: Tuple[float, ...]):
+        self._upper_bounds = upper_bounds
+        self._counts = [0] * (len(upper_bounds) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self._upper_bounds, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def time(self) -> "_Timer":
+        """with histogram.time(): ... 记录代码块耗时"""
+        return _Timer(self)
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        with self._lock:
+            return list(self._counts), self._sum
+
+
+class _Timer:
+    __slots__ = ("_target", "_start")
+
+    def __init__(self, target: _HistogramValue):
+        self._target = target
+        self._start = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._target.observe(time.perf_counter() - self._start)
+        return False
+
+
+class Histogram(_Metric):
+    """分桶直方图（导出累计桶计数、总和与样本数）"""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS, registry=None):
+        self._upper_bounds = tuple(sorted(buckets))
+        self._value = _HistogramValue(self._upper_bounds)
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self._upper_bounds)
+
+    def observe(self, value: float) -> None:
+        self._value.observe(value)
+
+    def time(self) -> _Timer:
+        return _Timer(self._value)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        items = [((), self._value)] if not self.labelnames else self._items()
+        for labels, child in items:
+            counts, total = child.snapshot()
+            cumulative = 0
+            for bound, count in zip(self._upper_bounds + (math.inf,), counts):
+                cumulative += count
+                le = labels + (("le", _format_value(bound)),)
+                lines.append(f"{self.name}_bucket{_format_labels(le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"指标重复注册: {metric.name}")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """导出 Prometheus 文本格式 (text/plain; version=0.0.4)"""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE_LATEST = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# ---------------------------------------------------------------
+# 分析链路指标
+# ---------------------------------------------------------------
+
+ANALYZE_STAGE_SECONDS = Histogram(
+    "analyze_stage_seconds",
+    "Latency of each /api/analyze pipeline stage",
+    labelnames=("stage",),
+)
+
+ANALYZE_REQUESTS = Counter(
+    "analyze_requests",
+    "Analysis requests by outcome",
+    labelnames=("outcome",),
+)
+
+ANALYZE_IN_FLIGHT = Gauge(
+    "analyze_in_flight",
+    "Analyses currently being processed",
+)
+
+ANALYZE_ABANDONED = Counter(
+    "analyze_abandoned",
+    "Analyses whose client disconnected before the response, by stage reached",
+    labelnames=("stage",),
+)
+
+PROCESSING_CODES = Gauge(
+    "analyze_processing_codes",
+    "Size of the in-memory processing_codes lock set",
+)
+
+GEMINI_ATTEMPTS = Counter(
+    "gemini_attempts",
+    "Gemini generate_content attempts by outcome",
+    labelnames=("outcome",),
+)
+
+GEMINI_RETRY_GIVE_UPS = Counter(
+    "gemini_retry_give_ups",
+    "Gemini calls that stopped retrying, by reason",
+    labelnames=("reason",),
+)
+
+GEMINI_FAULTS_INJECTED = Counter(
+    "gemini_faults_injected",
+    "Faults injected into Gemini calls by kind (GEMINI_FAULT_INJECTION only)",
+    labelnames=("kind",),
+)
+
+GEMINI_TRUNCATIONS = Counter(
+    "gemini_truncations",
+    "Gemini responses cut off by MAX_TOKENS, by how they were recovered",
+    labelnames=("recovery",),
+)
+
+GEMINI_PARSE_FAILURES = Counter(
+    "gemini_parse_failures",
+    "Gemini responses that failed strict JSON parsing, by reason (fenced/ast were recovered leniently)",
+    labelnames=("reason",),
+)
+
+GEMINI_RESULT_REPAIRS = Counter(
+    "gemini_result_repairs",
+    "Schema violations in Gemini results repaired locally, by kind",
+    labelnames=("kind",),
+)
+
+GEMINI_SPLIT_COORDINATES = Counter(
+    "gemini_split_coordinates",
+    "Split-mode analyses by where the final coordinates came from (locate / full_first / locate_failed)",
+    labelnames=("source",),
+)
+
+GEMINI_SIBLING_CHILDREN = Counter(
+    "gemini_sibling_children",
+    "Children analyzed in multi-child requests, by source (combined call / fallback single-child call)",
+    labelnames=("source",),
+)
+
+GEMINI_CONTEXT_CACHE = Counter(
+    "gemini_context_cache_events",
+    "Context cache lifecycle events (created / refreshed / create_failed / refresh_failed / invalidated)",
+    labelnames=("event",),
+)
+
+GEMINI_INPUT_TOKENS = Counter(
+    "gemini_input_tokens",
+    "Gemini prompt tokens by kind (total / cached; cached tokens are billed at the reduced rate)",
+    labelnames=("kind",),
+)
+
+GEMINI_CACHED_INPUT_TOKENS = Histogram(
+    "gemini_cached_input_tokens",
+    "Prompt tokens served from the context cache per Gemini request",
+    buckets=(0, 256, 512, 1024, 2048, 4096, 8192, 16384),
+)
+
+GEMINI_OUTPUT_BUDGET = Gauge(
+    "gemini_output_budget_tokens",
+    "Current max_output_tokens sent to Gemini",
+)
+
+GEMINI_THINKING_BUDGET = Gauge(
+    "gemini_thinking_budget_tokens",
+    "Current SLO-driven thinking budget before load scaling",
+)
+
+
+# ---------------------------------------------------------------
+# 定时清理指标
+# ---------------------------------------------------------------
+
+CLEANUP_RUNS = Counter(
+    "cleanup_runs",
+    "Expired-data cleanup runs by outcome (success / failed: a step raised and was logged)",
+    labelnames=("outcome",),
+)
+
+CLEANUP_ROWS_DELETED = Counter(
+    "cleanup_rows_deleted",
+    "Expired card_keys rows deleted by cleanup",
+)
+
+CLEANUP_FILES_REMOVED = Counter(
+    "cleanup_files_removed",
+    "Image files and blobs removed by cleanup (including orphans), by result (deleted / missing / failed)",
+    labelnames=("result",),
+)
+
+CLEANUP_ORPHANS_SWEPT = Counter(
+    "cleanup_orphans_swept",
+    "Orphan image files (no card or blob reference) deleted by cleanup",
+)
+
+CLEANUP_DURATION = Histogram(
+    "cleanup_duration_seconds",
+    "Duration of each cleanup run",
+    buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0),
+)
+
+CLEANUP_LAST_SUCCESS = Gauge(
+    "cleanup_last_success_timestamp_seconds",
+    "Unix time of the last cleanup run that finished without errors",
+)
+
+
+def stage(name: str) -> _HistogramValue:
+    """取分析阶段直方图: with stage("decode").time(): ..."""
+    return ANALYZE_STAGE_SECONDS.labels(stage=name)
+
+
+def outcome_for_status(status_code: int) -> str:
+    """HTTP 状态码 -> 请求结果标签"""
+    return {
+        200: "success",
+        400: "invalid_input",
+        401: "unauthorized",
+        403: "already_analyzed",
+        409: "busy",
+    }.get(status_code, "failed")
@@ -0,0 +1,254 @@
+"""
+按需请求采样分析
+管理员指定路由与次数后，接下来 N 个匹配请求在采样分析器下运行：
+后台线程按固定间隔读取目标线程的调用栈 (sys._current_frames)，
+结果以折叠栈格式 (collapsed stacks，flamegraph.pl / speedscope 均可直接导入) 写入数据目录
+
+未开启时中间件只做一次 None 判断；同一时刻只采样一个请求，单次采样有时长上限；
+停止采样（等待采样线程结束）与写结果文件在线程中进行，不阻塞事件循环
+
+注意：采样的是事件循环线程的调用栈，不区分协程——采样期间同一线程上并发执行的其他请求也会被计入，
+事件循环空闲时的样本落在 selector 的 select 上。需要单个请求的干净结果时，在低并发时段采样或在压测环境中单独重放该请求
+"""
+from collections import Counter
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+from typing import List, Optional
+from app.core.config import get_settings
+import asyncio
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# 单次开启最多采样的请求数
+MAX_PROFILE_REQUESTS = 100
+
+# 单个请求最长采样时间（超出后停止采样，请求本身不受影响）
+MAX_PROFILE_SECONDS = 300
+
+# 采样间隔范围 (毫秒)
+MIN_INTERVAL_MS = 1
+MAX_INTERVAL_MS = 100
+
+# 采样结果文件名
+PROFILE_FILENAME = re.compile(r"^[0-9]{8}T[0-9]{6}_[A-Za-z0-9_.-]{1,120}\.collapsed$")
+
+
+@dataclass
+class ProfilingPlan:
+    """当前的采样计划"""
+    route: str
+    remaining: int
+    interval_ms: int = 5
+    all_threads: bool = False
+    method: Optional[str] = None
+
+
+_plan: Optional[ProfilingPlan] = None
+_plan_lock = threading.Lock()
+_active = threading.Event()  # 是否有请求正在采样
+
+
+def profiles_dir() -> str:
+    return settings.profiles_storage_path
+
+
+def arm(route: str, count: int, interval_ms: int = 5, all_threads: bool = False,
+        method: Optional[str] = None) -> ProfilingPlan:
+    """开启采样：接下来 count 个路径为 route 的请求"""
+    global _plan
+    if not route.startswith("/"):
+        raise ValueError("route 必须以 / 开头")
+    if not 1 <= count <= MAX_PROFILE_REQUESTS:
+        raise ValueError(f"count 范围 1-{MAX_PROFILE_REQUESTS}")
+    if not MIN_INTERVAL_MS <= interval_ms <= MAX_INTERVAL_MS:
+        raise ValueError(f"interval_ms 范围 {MIN_INTERVAL_MS}-{MAX_INTERVAL_MS}")
+    with _plan_lock:
+        _plan = ProfilingPlan(
+            route=route, remaining=count, interval_ms=interval_ms,
+            all_threads=all_threads, method=method.upper() if method else None,
+        )
+    logger.info(f"已开启请求采样: {asdict(_plan)}")
+    return _plan
+
+
+def disarm() -> None:
+    """关闭采样（正在采样的请求会正常完成）"""
+    global _plan
+    with _plan_lock:
+        _plan = None
+
+
+def current_plan() -> Optional[ProfilingPlan]:
+    return _plan
+
+
+def _claim(method: str, path: str) -> Optional[ProfilingPlan]:
+    """匹配则占用一次采样名额；已有请求在采样时不占用"""
+    global _plan
+    with _plan_lock:
+        plan = _plan
+        if plan is None or path != plan.route or (plan.method and method != plan.method):
+            return None
+        if _active.is_set():
+            return None
+        plan.remaining -= 1
+        if plan.remaining <= 0:
+            _plan = None
+        _active.set()
+        return plan
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", os.path.basename(code.co_filename))
+    return f"{module}:{code.co_name}"
+
+
+def _collapse(frame) -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return ";".join(labels)
+
+
+class StackSampler:
+    """在后台线程中定时采样目标线程（或全部线程）的调用栈"""
+
+    def __init__(self, target_thread_id: int, interval_ms: int, all_threads: bool = False):
+        self.target_thread_id = target_thread_id
+        self.interval = interval_ms / 1000
+        self.all_threads = all_threads
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self) -> None:
+        self.started_at = time.perf_counter()
+        self._thread.start()
+
+    def stop(self) -> float:
+        self._stop.set()
+        self._thread.join()
+        return time.perf_counter() - self.started_at
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + MAX_PROFILE_SECONDS
+        names = {}
+        while not self._stop.wait(self.interval):
+            if time.monotonic() > deadline:
+                logger.warning("采样时间超过上限，已停止采样")
+                break
+            frames = sys._current_frames()
+            if self.all_threads:
+                if len(names) != threading.active_count():
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                for thread_id, frame in frames.items():
+                    if thread_id == own_id:
+                        continue
+                    self.stacks[f"{names.get(thread_id, thread_id)};{_collapse(frame)}"] += 1
+            else:
+                frame = frames.get(self.target_thread_id)
+                if frame is not None:
+                    self.stacks[_collapse(frame)] += 1
+            self.samples += 1
+
+    def write(self, path: str) -> None:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        os.replace(tmp_path, path)
+
+
+def _profile_filename(method: str, path: str, trace_id: Optional[str]) -> str:
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    route = re.sub(r"[^A-Za-z0-9]+", "-", path).strip("-") or "root"
+    suffix = f"_{trace_id[:16]}" if trace_id else f"_{os.urandom(4).hex()}"
+    return f"{stamp}_{method}_{route[:60]}{suffix}.collapsed"
+
+
+def _prune_profiles(directory: str) -> None:
+    """只保留最近 PROFILES_KEEP 个结果文件"""
+    files = sorted(name for name in os.listdir(directory) if PROFILE_FILENAME.match(name))
+    for name in files[:-settings.profiles_keep]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+
+def list_profiles() -> List[dict]:
+    directory = profiles_dir()
+    if not os.path.isdir(directory):
+        return []
+    items = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if not PROFILE_FILENAME.match(name):
+            continue
+        stat = os.stat(os.path.join(directory, name))
+        items.append({"name": name, "size": stat.st_size, "created_at": int(stat.st_mtime)})
+    return items
+
+
+def profile_path(name: str) -> Optional[str]:
+    """结果文件名 -> 路径（文件名不合法或不存在时返回 None）"""
+    if not PROFILE_FILENAME.match(name):
+        return None
+    path = os.path.join(profiles_dir(), name)
+    return path if os.path.isfile(path) else None
+
+
+class ProfilingMiddleware:
+    """ASGI 中间件：对命中采样计划的请求运行 StackSampler"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if _plan is None or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        plan = _claim(scope["method"], scope["path"])
+        if plan is None:
+            await self.app(scope, receive, send)
+            return
+
+        from app.core.tracing import current_trace_id
+
+        # 异步请求在事件循环线程上执行，采样当前线程（同一线程上的其他请求也会被采到，见模块说明）
+        sampler = StackSampler(threading.get_ident(), plan.interval_ms, plan.all_threads)
+        sampler.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            trace_id = current_trace_id()
+            try:
+                # join 采样线程最多等待一个采样间隔，不在事件循环上等待
+                elapsed = await asyncio.to_thread(sampler.stop)
+            finally:
+                _active.clear()
+            await asyncio.to_thread(self._save, sampler, scope, elapsed, trace_id)
+
+    @staticmethod
+    def _save(sampler: StackSampler, scope, elapsed: float, trace_id: Optional[str]) -> None:
+        try:
+            directory = profiles_dir()
+            os.makedirs(directory, exist_ok=True)
+            name = _profile_filename(scope["method"], scope["path"], trace_id)
+            sampler.write(os.path.join(directory, name))
+            _prune_profiles(directory)
+            logger.info(f"请求采样完成: {name}, 耗时 {elapsed:.2f}s, 样本 {sampler.samples}")
+        except Exception:
+            logger.exception("保存采样结果失败")
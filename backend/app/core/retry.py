@@ -0,0 +1,236 @@
+"""
+模型调用重试策略
+- 总截止时间 (deadline)：整次调用（含所有重试与等待）不超过该时长
+- 单次超时：由剩余时间推导，min(单次上限, 剩余时间)；剩余时间不足一次最短尝试时不再重试
+- 退避：full jitter 指数退避 uniform(0, min(上限, base × 2^n))；服务端给出 Retry-After 时以其为准
+- 重试预算：进程级令牌桶，每个新调用存入 ratio 个令牌、每次重试消耗 1 个，另按时间补充少量保底令牌，
+  服务端整体故障时重试量被限制在正常流量的 ratio 倍以内，不会放大故障
+- 每次尝试的结果与原因都会记录日志，并可通过 on_attempt 回调记录指标
+"""
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, FrozenSet, Optional, TypeVar
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from app.core import tracing
+import asyncio
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 默认可重试的 HTTP 状态码
+RETRYABLE_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+class DeadlineExceeded(TimeoutError):
+    """总截止时间内未能完成调用"""
+
+
+@dataclass
+class RetryPolicy:
+    """重试参数（时间单位均为秒）"""
+    deadline: float = 90.0
+    max_attempts: int = 4
+    attempt_timeout: float = 60.0
+    min_attempt_timeout: float = 5.0
+    backoff_base: float = 1.0
+    backoff_max: float = 16.0
+    retryable_status_codes: FrozenSet[int] = field(default_factory=lambda: RETRYABLE_STATUS_CODES)
+
+    def backoff(self, retry_index: int, rng: random.Random = random) -> float:
+        """第 retry_index 次重试前的等待时间 (full jitter)"""
+        return rng.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** retry_index)))
+
+
+class RetryBudget:
+    """
+    进程级重试预算（令牌桶）
+    ratio=0.2 表示重试量最多约为首次调用量的 20%；min_per_second 为低流量时的保底重试速率
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 0.5, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.max_tokens, self._tokens + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def record_request(self) -> None:
+        """新调用（首次尝试）存入 ratio 个令牌"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def try_acquire(self) -> bool:
+        """尝试为一次重试取得令牌"""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    @property
+    def tokens(self) -> float:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+
+def status_code_of(exc: BaseException) -> Optional[int]:
+    """从 SDK / HTTP 异常中取 HTTP 状态码"""
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        return code
+    response = getattr(exc, "response", None)
+    code = getattr(response, "status_code", None)
+    return code if isinstance(code, int) else None
+
+
+def retry_after_of(exc: BaseException) -> Optional[float]:
+    """解析异常响应中的 Retry-After 头（秒数或 HTTP 日期）"""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if not headers:
+        return None
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def classify(exc: BaseException, policy: RetryPolicy) -> Optional[str]:
+    """
+    判断异常是否可重试，返回原因标签；不可重试返回 None
+    rate_limited (429) / server_error (5xx, 408) / timeout / network
+    """
+    if isinstance(exc, asyncio.TimeoutError):
+        return "timeout"
+    code = status_code_of(exc)
+    if code is not None:
+        if code not in policy.retryable_status_codes:
+            return None
+        return "rate_limited" if code == 429 else "server_error"
+    name = type(exc).__name__
+    # requests / httpx / aiohttp 的超时与连接错误
+    if isinstance(exc, TimeoutError) or "Timeout" in name:
+        return "timeout"
+    if isinstance(exc, ConnectionError) or name in ("ConnectionError", "ConnectError", "ClientConnectionError",
+                                                    "RemoteProtocolError", "ChunkedEncodingError"):
+        return "network"
+    return None
+
+
+class RetryRunner:
+    """按 RetryPolicy 与 RetryBudget 执行异步调用"""
+
+    def __init__(self, name: str, policy: RetryPolicy, budget: Optional[RetryBudget] = None,
+                 on_attempt: Optional[Callable[[str, float], None]] = None,
+                 on_give_up: Optional[Callable[[str], None]] = None):
+        self.name = name
+        self.policy = policy
+        self.budget = budget
+        self.on_attempt = on_attempt
+        self.on_give_up = on_give_up
+
+    async def run(self, call: Callable[[int, float], Awaitable[T]], deadline: Optional[float] = None) -> T:
+        """
+        执行 call(attempt, timeout)，attempt 从 1 开始，timeout 为本次尝试的超时秒数
+        deadline 为 time.monotonic() 时间点，默认 now + policy.deadline
+        """
+        policy = self.policy
+        deadline = deadline if deadline is not None else time.monotonic() + policy.deadline
+        if self.budget is not None:
+            self.budget.record_request()
+
+        attempt = 0
+        while True:
+            attempt += 1
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self._give_up("deadline")
+                raise DeadlineExceeded(f"{self.name} 调用超过截止时间 ({policy.deadline:.0f}s)")
+            timeout = min(policy.attempt_timeout, remaining)
+
+            start = time.perf_counter()
+            try:
+                with tracing.span(f"{self.name}.attempt", attempt=attempt, timeout_s=round(timeout, 2)):
+                    result = await asyncio.wait_for(call(attempt, timeout), timeout)
+            except Exception as e:
+                elapsed = time.perf_counter() - start
+                cause = classify(e, policy)
+                self._record(cause or "error", elapsed)
+                if cause is None:
+                    logger.warning("%s 调用失败 (尝试 %d/%d, %.2fs)，不可重试: %s",
+                                   self.name, attempt, policy.max_attempts, elapsed, _describe(e))
+                    self._give_up("not_retryable")
+                    raise
+
+                delay = self._next_delay(e, attempt, deadline)
+                if delay is None:
+                    if isinstance(e, asyncio.TimeoutError):
+                        raise DeadlineExceeded(f"{self.name} 调用超时 (已尝试 {attempt} 次，最后一次超时 {timeout:.1f}s)") from e
+                    raise
+                logger.warning("%s 调用失败 (尝试 %d/%d, %.2fs)，原因 %s: %s，%.2fs 后重试",
+                               self.name, attempt, policy.max_attempts, elapsed, cause, _describe(e), delay)
+                if delay > 0:
+                    with tracing.span(f"{self.name}.backoff", seconds=round(delay, 2), cause=cause):
+                        await asyncio.sleep(delay)
+                continue
+
+            elapsed = time.perf_counter() - start
+            self._record("success", elapsed)
+            if attempt > 1:
+                logger.info("%s 调用在第 %d 次尝试成功 (%.2fs)", self.name, attempt, elapsed)
+            return result
+
+    def _next_delay(self, exc: BaseException, attempt: int, deadline: float) -> Optional[float]:
+        """计算重试前的等待时间；不应再重试时记录原因并返回 None"""
+        policy = self.policy
+        if attempt >= policy.max_attempts:
+            self._give_up("max_attempts")
+            return None
+
+        retry_after = retry_after_of(exc)
+        delay = retry_after if retry_after is not None else policy.backoff(attempt - 1)
+        # 等待之后剩余时间不够一次最短尝试，直接放弃
+        if time.monotonic() + delay + min(policy.min_attempt_timeout, policy.attempt_timeout) > deadline:
+            logger.warning("%s 剩余时间不足以再次尝试 (需等待 %.2fs)，放弃重试", self.name, delay)
+            self._give_up("deadline")
+            return None
+
+        if self.budget is not None and not self.budget.try_acquire():
+            logger.warning("%s 重试预算已用尽，放弃重试", self.name)
+            self._give_up("budget_exhausted")
+            return None
+        return delay
+
+    def _record(self, outcome: str, elapsed: float) -> None:
+        if self.on_attempt is not None:
+            self.on_attempt(outcome, elapsed)
+
+    def _give_up(self, reason: str) -> None:
+        if self.on_give_up is not None:
+            self.on_give_up(reason)
+
+
+def _describe(exc: BaseException) -> str:
+    if isinstance(exc, asyncio.TimeoutError):
+        return "单次尝试超时"
+    return f"{type(exc).__name__}: {str(exc)[:200]}"
@@ -0,0 +1,400 @@
+"""
+请求链路追踪
+- 每个 HTTP 请求一个 trace id（兼容 W3C traceparent 请求头），通过 contextvars 传递到
+  日志 (见 logging_config.ContextFilter)、gemini_service 与数据库查询，响应头返回 X-Trace-Id
+- span 记录在请求内存中，请求结束时做尾部采样：慢请求 / 出错请求全部保留，
+  其余按 TRACE_SAMPLE_RATE 采样，再交给后台线程导出
+- 导出器可插拔: none / console / file / otlp / "模块路径:类名"
+"""
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from app.core.config import get_settings
+import importlib
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# 单个 trace 最多保留的 span 数（防止异常循环撑爆内存）
+MAX_SPANS_PER_TRACE = 512
+
+# 导出队列长度上限，超出时丢弃（导出不能反压请求）
+EXPORT_QUEUE_SIZE = 1000
+
+TRACEPARENT_PATTERN = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+
+@dataclass
+class Span:
+    """一个计时区间"""
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    name: str
+    start_time: float
+    attributes: Dict[str, object] = field(default_factory=dict)
+    duration_ms: float = 0.0
+    error: Optional[str] = None
+    _start_perf: float = 0.0
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+@dataclass
+class Trace:
+    """单个请求内收集的 span"""
+    trace_id: str
+    remote_parent_id: Optional[str] = None
+    spans: List[Span] = field(default_factory=list)
+    has_error: bool = False
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_trace_id() -> Optional[str]:
+    """当前请求的 trace id（不在请求中时为 None）"""
+    trace = _current_trace.get()
+    return trace.trace_id if trace else None
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+class _NoopSpanContext:
+    """未启用追踪 / 不在请求中时返回的空 span，开销只有一次属性查找"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+
+_NOOP = _NoopSpanContext()
+
+
+class _SpanContext:
+    __slots__ = ("_trace", "_span", "_token")
+
+    def __init__(self, trace: Trace, name: str, attributes: dict):
+        parent = _current_span.get()
+        self._trace = trace
+        self._span = Span(
+            trace_id=trace.trace_id,
+            span_id=_new_id(8),
+            parent_id=parent.span_id if parent else trace.remote_parent_id,
+            name=name,
+            start_time=time.time(),
+            attributes=attributes,
+        )
+        self._token = None
+
+    def __enter__(self) -> Span:
+        self._span._start_perf = time.perf_counter()
+        self._token = _current_span.set(self._span)
+        return self._span
+
+    def __exit__(self, exc_type, exc, tb):
+        span = self._span
+        span.duration_ms = (time.perf_counter() - span._start_perf) * 1000
+        if exc_type is not None:
+            span.error = f"{exc_type.__name__}: {exc}"[:500]
+            self._trace.has_error = True
+        _current_span.reset(self._token)
+        if len(self._trace.spans) < MAX_SPANS_PER_TRACE:
+            self._trace.spans.append(span)
+        return False
+
+
+def span(name: str, **attributes):
+    """
+    记录一个 span（同步 / 异步代码中均可使用）:
+        with tracing.span("gemini.attempt", attempt=1) as s:
+            ...
+    """
+    trace = _current_trace.get()
+    if trace is None or _exporter is None:
+        return _NOOP
+    return _SpanContext(trace, name, attributes)
+
+
+# ---------------------------------------------------------------
+# 导出器
+# ---------------------------------------------------------------
+
+class SpanExporter:
+    """导出器接口：在后台线程中调用，一次一批 span"""
+
+    def export(self, spans: List[dict]) -> None:
+        raise NotImplementedError
+
+    def shutdown(self) -> None:
+        pass
+
+
+class ConsoleExporter(SpanExporter):
+    """输出到 stdout（JSON Lines）"""
+
+    def export(self, spans: List[dict]) -> None:
+        for item in spans:
+            print(json.dumps(item, ensure_ascii=False, default=str), flush=True)
+
+
+class FileExporter(SpanExporter):
+    """追加写入本地 JSON Lines 文件，离线分析用"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, spans: List[dict]) -> None:
+        for item in spans:
+            self._file.write(json.dumps(item, ensure_ascii=False, default=str) + "\n")
+        self._file.flush()
+
+    def shutdown(self) -> None:
+        self._file.close()
+
+
+class OTLPHttpExporter(SpanExporter):
+    """OTLP/HTTP JSON 导出（Jaeger / Tempo / OpenTelemetry Collector 的 4318 端口）"""
+
+    def __init__(self, endpoint: str, service_name: str = "gene-detector-backend"):
+        self.endpoint = endpoint
+        self.service_name = service_name
+
+    @staticmethod
+    def _attribute(key: str, value) -> dict:
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    def _otlp_span(self, item: dict) -> dict:
+        start_ns = int(item["start_time"] * 1e9)
+        otlp = {
+            "traceId": item["trace_id"],
+            "spanId": item["span_id"],
+            "name": item["name"],
+            "kind": 1,
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(start_ns + int(item["duration_ms"] * 1e6)),
+            "attributes": [self._attribute(k, v) for k, v in item["attributes"].items()],
+            "status": {"code": 2, "message": item["error"]} if item["error"] else {"code": 1},
+        }
+        if item["parent_id"]:
+            otlp["parentSpanId"] = item["parent_id"]
+        return otlp
+
+    def export(self, spans: List[dict]) -> None:
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [self._attribute("service.name", self.service_name)]},
+                "scopeSpans": [{"scope": {"name": "app.core.tracing"}, "spans": [self._otlp_span(s) for s in spans]}],
+            }]
+        }
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(body, default=str).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=5):
+            pass
+
+
+def create_exporter(name: str) -> Optional[SpanExporter]:
+    """按配置创建导出器；'package.module:ClassName' 形式加载自定义导出器"""
+    if not name or name == "none":
+        return None
+    if name == "console":
+        return ConsoleExporter()
+    if name == "file":
+        return FileExporter(settings.trace_file_path)
+    if name == "otlp":
+        return OTLPHttpExporter(settings.trace_otlp_endpoint)
+    module_name, _, class_name = name.partition(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+class _ExportWorker:
+    """后台导出线程：请求线程只做入队，导出异常不会影响请求"""
+
+    def __init__(self, exporter: SpanExporter):
+        self.exporter = exporter
+        self._queue: "queue.Queue[Optional[List[dict]]]" = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._run, name="trace-export", daemon=True)
+        self._thread.start()
+        self.dropped = 0
+
+    def submit(self, spans: List[dict]) -> None:
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                break
+            try:
+                self.exporter.export(batch)
+            except Exception as e:
+                logger.warning(f"导出追踪数据失败: {e}")
+
+    def shutdown(self) -> None:
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        self.exporter.shutdown()
+
+
+_exporter: Optional[_ExportWorker] = None
+
+
+def setup_tracing() -> None:
+    """按配置启用追踪（应用启动时调用）"""
+    global _exporter
+    exporter = create_exporter(settings.trace_exporter)
+    if exporter is not None:
+        _exporter = _ExportWorker(exporter)
+        logger.info(f"链路追踪已启用: exporter={settings.trace_exporter}, sample_rate={settings.trace_sample_rate}")
+
+
+def shutdown_tracing() -> None:
+    """导出剩余数据并关闭导出器"""
+    global _exporter
+    if _exporter is not None:
+        _exporter.shutdown()
+        _exporter = None
+
+
+def _should_export(trace: Trace, duration_ms: float) -> bool:
+    """尾部采样：慢请求与出错请求全部保留"""
+    if trace.has_error or duration_ms >= settings.trace_slow_threshold_ms:
+        return True
+    return random.random() < settings.trace_sample_rate
+
+
+def _finish_trace(trace: Trace, root: Span) -> None:
+    """请求结束：采样并提交导出"""
+    if _exporter is None:
+        return
+    if root not in trace.spans:
+        trace.spans.append(root)
+    if _should_export(trace, root.duration_ms):
+        _exporter.submit([s.to_dict() for s in trace.spans])
+
+
+def _parse_traceparent(value: Optional[str]):
+    if not value:
+        return None, None
+    match = TRACEPARENT_PATTERN.match(value.strip().lower())
+    if not match or match.group(1) == "0" * 32:
+        return None, None
+    return match.group(1), match.group(2)
+
+
+class TracingMiddleware:
+    """
+    ASGI 中间件：为每个 HTTP 请求建立 trace 与根 span
+    （纯 ASGI 实现，不缓冲响应体，不影响流式响应）
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        trace_id, parent_id = _parse_traceparent(headers.get(b"traceparent", b"").decode("latin-1"))
+        trace = Trace(trace_id=trace_id or _new_id(16), remote_parent_id=parent_id)
+        trace_token = _current_trace.set(trace)
+        status_code = 500
+
+        async def send_with_trace_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-trace-id", trace.trace_id.encode())]
+            await send(message)
+
+        root = span(f"{scope['method']} {scope['path']}", **{"http.method": scope["method"], "http.path": scope["path"]})
+        try:
+            with root as root_span:
+                await self.app(scope, receive, send_with_trace_id)
+                root_span.set_attribute("http.status_code", status_code)
+                if status_code >= 500:
+                    trace.has_error = True
+        finally:
+            _current_trace.reset(trace_token)
+            if isinstance(root, _SpanContext):
+                _finish_trace(trace, root._span)
+
+
+def instrument_engine(sync_engine) -> None:
+    """为 SQLAlchemy 引擎的每条 SQL 记录 span（仅在请求的 trace 中）"""
+    from sqlalchemy import event
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        ctx = span("db.query", **{"db.statement": statement[:200], "db.executemany": executemany})
+        if ctx is not _NOOP:
+            ctx.__enter__()
+            conn.info.setdefault("trace_spans", []).append(ctx)
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        stack = conn.info.get("trace_spans")
+        if stack:
+            stack.pop().__exit__(None, None, None)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(exception_context):
+        conn = exception_context.connection
+        stack = conn.info.get("trace_spans") if conn is not None else None
+        if stack:
+            err = exception_context.original_exception
+            stack.pop().__exit__(type(err), err, None)
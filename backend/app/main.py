@@ -4,20 +4,21 @@ AI 亲子基因探测器 - 后端服务入口
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import asyncio
 from app.core.config import get_settings
 from app.core.database import init_db
 from app.api import api_router
-from app.services.scheduler import start_scheduler, stop_scheduler
+from app.services.storage import get_storage
+from app.services import gemini_loader
 from app.core.security import get_current_admin
+from app.core import tracing, profiling
+from app.core.logging_config import setup_logging
 from fastapi import Depends
 from fastapi.openapi.docs import get_swagger_ui_html, get_redoc_html
 import logging
 
-# 配置日志
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-)
+# 配置日志（后台线程写出，每条日志附带当前请求的 trace id / card id）
+setup_logging()
 logger = logging.getLogger(__name__)
 
 settings = get_settings()
@@ -29,18 +30,31 @@ async def lifespan(app: FastAPI):
     # 启动时
     logger.info("🚀 正在启动 AI 亲子基因探测器后端服务...")
     
+    # 链路追踪导出器
+    tracing.setup_tracing()
+
+    # Gemini SDK / Pillow 在后台线程加载，不阻塞启动（首个分析请求如早于预热完成会等待加载）
+    warmup = asyncio.create_task(gemini_loader.preload())
+    
     # 初始化数据库
     await init_db()
     logger.info("✅ 数据库初始化完成")
     
-    # 启动定时任务
+    # 初始化图片存储（本地目录 / 对象存储桶）
+    await get_storage().startup()
+    logger.info(f"✅ 图片存储已就绪 ({settings.storage_backend})")
+    
+    # 启动定时任务（APScheduler 只在此处导入）
+    from app.services.scheduler import start_scheduler, stop_scheduler
     start_scheduler()
     logger.info("✅ 定时任务已启动")
     
     yield
     
     # 关闭时
+    warmup.cancel()
     stop_scheduler()
+    tracing.shutdown_tracing()
     logger.info("👋 服务已关闭")
 
 
@@ -63,18 +77,30 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id"],
 )
 
+# 按需请求采样（未开启时无开销）
+app.add_middleware(profiling.ProfilingMiddleware)
+
+# 链路追踪（最外层：覆盖 CORS 与全部路由）
+app.add_middleware(tracing.TracingMiddleware)
+
 # 注册路由 (API)
 # 注册路由 (API)
 app.include_router(api_router)
 
-# 挂载静态文件目录 (用于存储和访问图片)
+# 图片访问 (用于存储和访问图片)
+# static: 直接挂载静态目录；signed / accel: 走鉴权路由 (app/api/images.py)
 from fastapi.staticfiles import StaticFiles
+from app.api.images import router as images_router
 import os
 
-os.makedirs("data/images", exist_ok=True)
-app.mount("/api/images", StaticFiles(directory="data/images"), name="images")
+os.makedirs(settings.images_storage_path, exist_ok=True)
+if settings.image_delivery_mode == "static":
+    app.mount("/api/images", StaticFiles(directory=settings.images_storage_path), name="images")
+else:
+    app.include_router(images_router, prefix="/api")
 
 
 # --- 路由：文档安全保护 ---
@@ -97,6 +123,16 @@ async def get_open_api_endpoint(username: str = Depends(get_current_admin)):
     return app.openapi()
 
 
+# --- 路由：监控指标 ---
+from fastapi import Response
+from app.core.metrics import REGISTRY, CONTENT_TYPE_LATEST
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(username: str = Depends(get_current_admin)):
+    """Prometheus 指标（需管理员 Basic Auth）"""
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/")
 async def root():
     """健康检查"""
@@ -2,5 +2,8 @@
 模型导出
 """
 from app.models.card_key import CardKey, CardStatus
+from app.models.image_blob import ImageBlob
+from app.models.result_body import CardResultBody
+from app.models.types import utcnow
 
-__all__ = ["CardKey", "CardStatus"]
+__all__ = ["CardKey", "CardResultBody", "CardStatus", "ImageBlob", "utcnow"]
@@ -2,9 +2,11 @@
 兑换码数据模型
 对应设计文档中的 card_keys 表
 """
-from sqlalchemy import Column, Integer, String, DateTime, Text, Enum as SQLEnum
+from sqlalchemy import Column, Integer, String, DateTime, LargeBinary
+from sqlalchemy.orm import column_property
 from sqlalchemy.sql import func
 from app.core.database import Base
+from app.models.types import UTCDateTime, JSONDocument
 import enum
 
 
@@ -29,17 +31,32 @@ class CardKey(Base):
     # 绑定的设备指纹
     device_id = Column(String(64), nullable=True, index=True)
     
-    # 激活时间
-    activated_at = Column(DateTime, nullable=True)
+    # 激活时间 (索引：过期清理按此字段范围扫描)
+    activated_at = Column(UTCDateTime, nullable=True, index=True)
     
-    # 缓存 Gemini 返回的 JSON 结果
-    result_cache = Column(Text, nullable=True)
+    # 缓存 Gemini 返回的 JSON 结果 (PostgreSQL 为 JSONB)
+    result_cache = Column(JSONDocument, nullable=True)
     
     # 临时图片路径 (JSON 格式)
-    image_paths = Column(Text, nullable=True)
+    image_paths = Column(JSONDocument, nullable=True)
+    
+    # 引用的图片 Blob key 列表 (清理时释放引用，不依赖 URL 格式)
+    image_keys = Column(JSONDocument, nullable=True)
+    
+    # 预序列化的 /api/analyze/result 响应体 (可能已压缩)
+    result_body = Column(LargeBinary, nullable=True)
+    
+    # 响应体压缩方式: identity / gzip / zstd
+    result_encoding = Column(String(16), nullable=True)
+    
+    # 响应体强 ETag (基于未压缩内容)
+    result_etag = Column(String(64), nullable=True)
     
     # 创建时间
     created_at = Column(DateTime, server_default=func.now())
     
+    # 是否已生成结果 (SQL 中判断 result_cache IS NOT NULL，不读取 JSON 内容；只反映加载时的状态)
+    has_result = column_property(result_cache.isnot(None))
+    
     def __repr__(self):
         return f"<CardKey(code={self.code}, status={self.status})>"
@@ -0,0 +1,28 @@
+"""
+图片 Blob 数据模型
+内容寻址存储的引用计数表：同一张图片（相同内容）只存一份，
+每个引用它的兑换码计一次引用，最后一个引用过期时才删除文件
+"""
+from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy.sql import func
+from app.core.database import Base
+
+
+class ImageBlob(Base):
+    """图片 Blob 引用计数表"""
+    __tablename__ = "image_blobs"
+    
+    # 文件名: {sha256}{扩展名}
+    key = Column(String(80), primary_key=True)
+    
+    # 文件大小 (字节)
+    size = Column(Integer, nullable=False, default=0)
+    
+    # 引用计数
+    ref_count = Column(Integer, nullable=False, default=0)
+    
+    # 创建时间
+    created_at = Column(DateTime, server_default=func.now())
+    
+    def __repr__(self):
+        return f"<ImageBlob(key={self.key}, ref_count={self.ref_count})>"
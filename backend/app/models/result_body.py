@@ -0,0 +1,30 @@
+"""
+多个孩子的预序列化结果响应体
+第一个孩子的响应体存于 card_keys.result_body；同一次分析的其余孩子各占一行，
+分析完成时一并写入，/api/analyze/result?child=N 与第一个孩子一样原样返回、按 ETag 返回 304
+"""
+from sqlalchemy import Column, Integer, String, LargeBinary
+from app.core.database import Base
+
+
+class CardResultBody(Base):
+    """孩子序号 >= 2 的结果响应体"""
+    __tablename__ = "card_result_bodies"
+    
+    # 所属兑换码 (card_keys.id)，随兑换码一起清理
+    card_id = Column(Integer, primary_key=True)
+    
+    # 孩子序号 (从 2 开始)
+    child = Column(Integer, primary_key=True)
+    
+    # 预序列化的响应体 (可能已压缩)
+    body = Column(LargeBinary, nullable=False)
+    
+    # 响应体压缩方式: identity / gzip / zstd
+    encoding = Column(String(16), nullable=False)
+    
+    # 响应体强 ETag (基于未压缩内容)
+    etag = Column(String(64), nullable=False)
+    
+    def __repr__(self):
+        return f"<CardResultBody(card_id={self.card_id}, child={self.child})>"
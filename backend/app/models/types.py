@@ -0,0 +1,47 @@
+"""
+跨数据库的列类型
+同一模型在 SQLite 与 PostgreSQL 上分别映射到各自的原生类型
+"""
+from sqlalchemy import DateTime, JSON
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.types import TypeDecorator
+from datetime import datetime, timezone
+
+
+def utcnow() -> datetime:
+    """当前 UTC 时间（带时区）"""
+    return datetime.now(timezone.utc)
+
+
+class UTCDateTime(TypeDecorator):
+    """
+    统一以 UTC 存取的时间类型
+    - PostgreSQL: timestamptz
+    - SQLite: 无时区文本，写入时转换为 UTC，读出时补上 UTC 时区
+    应用代码始终拿到带时区的 datetime
+    """
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            # 旧代码写入的无时区时间按 UTC 处理
+            value = value.replace(tzinfo=timezone.utc)
+        value = value.astimezone(timezone.utc)
+        if dialect.name == "sqlite":
+            return value.replace(tzinfo=None)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value.astimezone(timezone.utc)
+
+
+# JSON 文档：PostgreSQL 使用 JSONB，其余数据库以 JSON 文本存储
+# none_as_null: Python None 存为 SQL NULL，而不是 JSON 'null'
+JSONDocument = JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), "postgresql")
@@ -0,0 +1,95 @@
+"""
+内容寻址的图片 Blob 存储
+- 文件名由内容哈希决定，相同图片（如多个兑换码复用的父母照片）只写一次
+- 字节写入由存储后端负责（本地目录 / S3，见 app/services/storage.py）
+- 引用计数保存在 image_blobs 表，最后一个引用释放时才删除文件
+"""
+from collections import Counter
+from typing import Iterable, List, Optional
+from sqlalchemy import delete, update, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import ImageBlob
+from app.services.storage import get_storage
+import hashlib
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Blob 文件名: {sha256}{扩展名}
+BLOB_KEY_PATTERN = re.compile(r"^[0-9a-f]{64}\.(jpg|png|webp)$")
+
+_MIME_EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+}
+
+
+def blob_key(data: bytes, mime_type: Optional[str] = None) -> str:
+    """按内容计算 Blob 文件名"""
+    return hashlib.sha256(data).hexdigest() + _MIME_EXTENSIONS.get(mime_type or "", ".jpg")
+
+
+def is_blob_key(filename: str) -> bool:
+    """是否为内容寻址的 Blob 文件名（旧版文件名为 {兑换码}_{角色}.jpg）"""
+    return bool(BLOB_KEY_PATTERN.match(filename))
+
+
+async def put(data: bytes, mime_type: Optional[str] = None) -> str:
+    """写入 Blob（已存在则跳过），返回文件名"""
+    key = blob_key(data, mime_type)
+    written = await get_storage().put(key, data, mime_type or "image/jpeg")
+    if not written:
+        logger.info(f"Blob 已存在，复用: {key[:12]}...")
+    return key
+
+
+def _upsert_ref(db: AsyncSession):
+    """INSERT ... ON CONFLICT (key) DO UPDATE SET ref_count = ref_count + 1"""
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(ImageBlob.__table__)
+    return stmt.on_conflict_do_update(
+        index_elements=["key"],
+        set_={"ref_count": ImageBlob.__table__.c.ref_count + stmt.excluded.ref_count},
+    )
+
+
+async def add_refs(db: AsyncSession, keys: Iterable[str], sizes: Optional[dict] = None) -> None:
+    """
+    为 Blob 增加引用（不提交，随调用方事务一起提交）
+    同一个 key 出现多次则计多次引用
+    """
+    counts = Counter(keys)
+    if not counts:
+        return
+    sizes = sizes or {}
+    rows = [{"key": key, "size": sizes.get(key, 0), "ref_count": n} for key, n in counts.items()]
+    await db.execute(_upsert_ref(db), rows)
+
+
+async def release_refs(db: AsyncSession, keys: Iterable[str]) -> List[str]:
+    """
+    释放 Blob 引用（不提交，随调用方事务一起提交）
+    返回引用已归零、记录已删除的 Blob 文件名，调用方在提交后删除文件
+    """
+    counts = Counter(k for k in keys if is_blob_key(k))
+    if not counts:
+        return []
+
+    table = ImageBlob.__table__
+    await db.execute(
+        update(table)
+        .where(table.c.key == bindparam("b_key"))
+        .values(ref_count=table.c.ref_count - bindparam("b_n")),
+        [{"b_key": key, "b_n": n} for key, n in counts.items()],
+    )
+    result = await db.execute(
+        delete(table)
+        .where(table.c.key.in_(list(counts)), table.c.ref_count <= 0)
+        .returning(table.c.key)
+    )
+    return [row[0] for row in result.all()]
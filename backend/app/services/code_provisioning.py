@@ -0,0 +1,167 @@
+"""
+兑换码批量发放服务
+基于分块的集合插入 (INSERT ... ON CONFLICT DO NOTHING)，
+每块一个短事务，避免长时间持有写锁
+"""
+from typing import AsyncIterator, Iterable, List, Tuple
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.models import CardKey, CardStatus
+import secrets
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 每个事务插入的最大行数
+INSERT_CHUNK_SIZE = 5000
+
+# 服务端生成兑换码使用的字符集（去除易混淆的 0/O/1/I/L）
+CODE_ALPHABET = "ABCDEFGHJKMNPQRSTUVWXYZ23456789"
+
+# 兑换码字段长度上限 (card_keys.code String(20))
+MAX_CODE_LENGTH = 20
+
+
+def normalize_code(code: str) -> str:
+    """统一兑换码格式（去空白、转大写）"""
+    return code.strip().upper()
+
+
+def _insert_ignore(db: AsyncSession):
+    """按数据库方言构造 INSERT ... ON CONFLICT (code) DO NOTHING"""
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(CardKey.__table__).on_conflict_do_nothing(index_elements=["code"])
+
+
+async def insert_codes(db: AsyncSession, codes: Iterable[str]) -> Tuple[int, int]:
+    """
+    插入一块兑换码并提交
+    已存在或块内重复的码计入 skipped
+    返回 (created, skipped)
+    """
+    seen = set()
+    rows = []
+    total = 0
+    for code in codes:
+        code = normalize_code(code)
+        if not code:
+            continue
+        total += 1
+        if code in seen or len(code) > MAX_CODE_LENGTH:
+            continue
+        seen.add(code)
+        rows.append({"code": code, "status": CardStatus.UNUSED})
+
+    if not rows:
+        return 0, total
+
+    stmt = _insert_ignore(db)
+    if db.bind.dialect.supports_sane_multi_rowcount:
+        # SQLite: executemany 的 rowcount 即实际插入行数
+        result = await db.execute(stmt, rows)
+        created = result.rowcount
+    else:
+        # asyncpg 等驱动的 executemany 不返回可靠的 rowcount，改用 RETURNING 计数
+        result = await db.execute(stmt.returning(CardKey.__table__.c.code), rows)
+        created = len(result.all())
+    await db.commit()
+
+    return created, total - created
+
+
+async def insert_codes_chunked(db: AsyncSession, codes: Iterable[str]) -> Tuple[int, int]:
+    """按 INSERT_CHUNK_SIZE 分块插入，返回累计 (created, skipped)"""
+    created = 0
+    skipped = 0
+    chunk: List[str] = []
+    for code in codes:
+        chunk.append(code)
+        if len(chunk) >= INSERT_CHUNK_SIZE:
+            c, s = await insert_codes(db, chunk)
+            created += c
+            skipped += s
+            chunk = []
+    if chunk:
+        c, s = await insert_codes(db, chunk)
+        created += c
+        skipped += s
+    return created, skipped
+
+
+async def discard_codes(db: AsyncSession, codes: List[str]) -> int:
+    """
+    删除生成后未能交付的兑换码（只删除仍未使用的），按块提交
+    返回删除的行数
+    """
+    deleted = 0
+    for i in range(0, len(codes), INSERT_CHUNK_SIZE):
+        chunk = codes[i:i + INSERT_CHUNK_SIZE]
+        result = await db.execute(
+            delete(CardKey).where(CardKey.code.in_(chunk), CardKey.status == CardStatus.UNUSED)
+        )
+        await db.commit()
+        deleted += result.rowcount
+    return deleted
+
+
+def random_code(length: int, prefix: str = "") -> str:
+    """生成一个密码学安全的随机兑换码"""
+    return prefix + "".join(secrets.choice(CODE_ALPHABET) for _ in range(length))
+
+
+def validate_generate_params(count: int, length: int, prefix: str = "") -> None:
+    """校验生成参数，不合法时抛出 ValueError"""
+    if count <= 0:
+        raise ValueError("生成数量必须大于 0")
+    if len(normalize_code(prefix)) + length > MAX_CODE_LENGTH:
+        raise ValueError(f"前缀与长度之和不能超过 {MAX_CODE_LENGTH}")
+    if len(CODE_ALPHABET) ** length < count * 100:
+        # 码空间过小时碰撞率急剧上升，直接拒绝
+        raise ValueError("兑换码长度过短，无法生成足够多的不重复码")
+
+
+async def generate_codes(
+    db: AsyncSession,
+    count: int,
+    length: int = 8,
+    prefix: str = "",
+) -> AsyncIterator[List[str]]:
+    """
+    服务端生成 count 个新兑换码并入库，按块产出实际插入成功的码
+
+    每块通过 INSERT ... ON CONFLICT DO NOTHING RETURNING 一次性完成碰撞检查：
+    RETURNING 只返回真正插入的行，碰撞的部分在下一轮补足
+    """
+    validate_generate_params(count, length, prefix)
+    prefix = normalize_code(prefix)
+    remaining = count
+    collisions = 0
+    stalled_rounds = 0
+
+    while remaining > 0:
+        batch = set()
+        target = min(remaining, INSERT_CHUNK_SIZE)
+        while len(batch) < target:
+            batch.add(random_code(length, prefix))
+
+        stmt = _insert_ignore(db).returning(CardKey.__table__.c.code)
+        result = await db.execute(stmt, [{"code": c, "status": CardStatus.UNUSED} for c in batch])
+        inserted = [row[0] for row in result.all()]
+        await db.commit()
+
+        collisions += target - len(inserted)
+        remaining -= len(inserted)
+        if inserted:
+            stalled_rounds = 0
+            yield inserted
+        else:
+            # 整块全部碰撞，说明码空间接近耗尽
+            stalled_rounds += 1
+            if stalled_rounds >= 3:
+                raise ValueError("兑换码空间不足，请增加长度或更换前缀")
+
+    if collisions:
+        logger.info(f"生成兑换码: {count} 个，碰撞重试 {collisions} 个")
@@ -0,0 +1,126 @@
+"""
+Gemini 上下文缓存 (cached content)
+系统提示词在每次 generate_content 时都会作为输入重新处理；开启 GEMINI_CONTEXT_CACHE 后，
+按 (模型, 系统提示词) 创建一份 cached content，请求以 cached_content 引用它，不再发送 system_instruction：
+- 剩余有效期不足 refresh_seconds 时续期 (caches.update)，续期失败则重新创建
+- 创建失败（提示词低于模型的最小缓存 token 数、配额、权限等）后 retry_seconds 内直接发送系统提示词
+- 请求时缓存已被删除或过期（服务端返回 404 等），调用方 invalidate() 后改为直接发送，对分析透明
+同一 key 同时只有一个请求负责创建/续期，其余请求不等待（沿用仍有效的缓存或直接发送）
+
+缓存接口来自 create_client() 的客户端：live / record 为 Gemini 服务端缓存，replay 为本地替身 LocalCaches
+"""
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+from google.genai import types
+from app.core import metrics
+from app.core.retry import status_code_of
+import asyncio
+import hashlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def is_cache_miss(exc: BaseException) -> bool:
+    """请求引用的缓存已不存在或已过期（需要改为直接发送系统提示词）"""
+    code = status_code_of(exc)
+    if code == 404:
+        return True
+    return code in (400, 403) and "cache" in str(exc).lower()
+
+
+@dataclass
+class _Entry:
+    name: Optional[str] = None
+    expires_at: float = 0.0  # time.monotonic() 时间点
+    retry_at: float = 0.0    # 创建失败后的冷却截止时间
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+class ContextCache:
+    """按 (模型, 系统提示词) 管理 cached content 的创建、续期与失效"""
+
+    def __init__(self, client, ttl_seconds: int = 3600, refresh_seconds: int = 300,
+                 retry_seconds: int = 600, timeout_seconds: float = 10.0):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.refresh_seconds = min(refresh_seconds, ttl_seconds / 2)
+        self.retry_seconds = retry_seconds
+        self.timeout_seconds = timeout_seconds
+        self._entries: Dict[str, _Entry] = {}
+
+    @staticmethod
+    def _key(model: str, system_instruction: str) -> str:
+        return hashlib.sha256(f"{model}\n{system_instruction}".encode("utf-8")).hexdigest()
+
+    def _http_options(self) -> types.HttpOptions:
+        return types.HttpOptions(timeout=int(self.timeout_seconds * 1000))
+
+    async def resolve(self, model: str, system_instruction) -> Optional[str]:
+        """返回本次请求可引用的缓存名；暂无可用缓存时返回 None（直接发送系统提示词）"""
+        if not isinstance(system_instruction, str) or not system_instruction:
+            return None
+        key = self._key(model, system_instruction)
+        entry = self._entries.setdefault(key, _Entry())
+        now = time.monotonic()
+        if entry.name and entry.expires_at - now > self.refresh_seconds:
+            return entry.name
+        if entry.lock.locked():
+            # 其他请求正在创建/续期，不等待
+            return entry.name if entry.name and entry.expires_at > now else None
+        if not entry.name and now < entry.retry_at:
+            return None
+
+        async with entry.lock:
+            if entry.name and await self._refresh(entry):
+                return entry.name
+            await self._create(entry, key, model, system_instruction)
+            return entry.name
+
+    async def _create(self, entry: _Entry, key: str, model: str, system_instruction: str) -> None:
+        try:
+            cached = await self.client.aio.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=system_instruction,
+                    display_name=f"gene-detector-{key[:12]}",
+                    ttl=f"{self.ttl_seconds}s",
+                    http_options=self._http_options(),
+                ),
+            )
+        except Exception as e:
+            entry.name = None
+            entry.retry_at = time.monotonic() + self.retry_seconds
+            metrics.GEMINI_CONTEXT_CACHE.labels(event="create_failed").inc()
+            logger.warning("创建上下文缓存失败，%ds 内直接发送系统提示词: %s: %s",
+                           self.retry_seconds, type(e).__name__, str(e)[:200])
+            return
+        entry.name = cached.name
+        entry.expires_at = time.monotonic() + self.ttl_seconds
+        metrics.GEMINI_CONTEXT_CACHE.labels(event="created").inc()
+        logger.info("已创建上下文缓存 %s (模型 %s, TTL %ds)", cached.name, model, self.ttl_seconds)
+
+    async def _refresh(self, entry: _Entry) -> bool:
+        try:
+            await self.client.aio.caches.update(
+                name=entry.name,
+                config=types.UpdateCachedContentConfig(ttl=f"{self.ttl_seconds}s", http_options=self._http_options()),
+            )
+        except Exception as e:
+            metrics.GEMINI_CONTEXT_CACHE.labels(event="refresh_failed").inc()
+            logger.warning("上下文缓存 %s 续期失败，重新创建: %s: %s", entry.name, type(e).__name__, str(e)[:200])
+            entry.name = None
+            return False
+        entry.expires_at = time.monotonic() + self.ttl_seconds
+        metrics.GEMINI_CONTEXT_CACHE.labels(event="refreshed").inc()
+        return True
+
+    def invalidate(self, name: str) -> None:
+        """请求发现缓存已失效：丢弃该缓存，下一次请求重新创建"""
+        for entry in self._entries.values():
+            if entry.name == name:
+                entry.name = None
+                entry.expires_at = 0.0
+                metrics.GEMINI_CONTEXT_CACHE.labels(event="invalidated").inc()
+                logger.warning("上下文缓存 %s 已失效，本次直接发送系统提示词", name)
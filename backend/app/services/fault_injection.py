@@ -0,0 +1,229 @@
+"""
+模型调用故障注入
+GEMINI_FAULT_INJECTION=true 时 create_client() 会用 FaultInjectingClient 包装模型客户端（live / record / replay 均可），
+按配置的概率注入：
+- 额外延迟（fixed / uniform / exponential / lognormal 分布）
+- 429 / 5xx 错误，可成串出现 (error_burst)，可带 Retry-After
+- 空响应（response.text 为 None）
+- MAX_TOKENS 截断（返回文本被截断）
+- 被 ```json 代码块包裹的响应、非 JSON 文本
+
+初始配置来自 GEMINI_FAULTS (JSON)，运行时可通过 /api/admin/faults 修改，
+配合压测观察重试与解析逻辑在 Gemini 降级时的吞吐和错误放大；未开启时不包装，无任何开销
+
+管理接口导入本模块只需 FaultConfig，google-genai 与 model_backends 在构造响应/包装客户端时才导入
+"""
+from typing import TYPE_CHECKING, List, Literal, Optional
+from pydantic import BaseModel, Field, model_validator
+from app.core.config import get_settings
+from app.core import metrics
+import asyncio
+import json
+import logging
+import random
+import threading
+import time
+
+if TYPE_CHECKING:
+    from google.genai import errors, types
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# 非 JSON 响应的示例文本
+NON_JSON_TEXT = "抱歉，我无法根据提供的图片完成分析，请上传清晰的正脸照片。"
+
+class FaultConfig(BaseModel):
+    """故障注入配置（概率均为 0-1，按调用独立抽样）"""
+    latency_rate: float = Field(0.0, ge=0, le=1, description="注入额外延迟的概率")
+    latency_ms: float = Field(0.0, ge=0, le=600_000, description="额外延迟（fixed 为固定值，其余分布为中位数/均值）")
+    latency_distribution: Literal["fixed", "uniform", "exponential", "lognormal"] = Field(
+        "fixed", description="fixed / uniform (0~2 倍) / exponential / lognormal (长尾)")
+    error_rate: float = Field(0.0, ge=0, le=1, description="返回错误的概率")
+    error_codes: List[int] = Field(default_factory=lambda: [503], description="错误码，随机选取，如 [429, 503]")
+    error_burst: int = Field(1, ge=1, le=1000, description="触发错误后连续失败的调用数")
+    retry_after_s: Optional[float] = Field(None, ge=0, description="错误响应的 Retry-After (秒)")
+    empty_rate: float = Field(0.0, ge=0, le=1, description="返回空文本的概率")
+    truncate_rate: float = Field(0.0, ge=0, le=1, description="返回 MAX_TOKENS 截断文本的概率")
+    fence_rate: float = Field(0.0, ge=0, le=1, description="返回 ```json 代码块包裹文本的概率")
+    non_json_rate: float = Field(0.0, ge=0, le=1, description="返回非 JSON 文本的概率")
+    seed: Optional[int] = Field(None, description="随机种子（便于复现）")
+
+    @model_validator(mode="after")
+    def _check(self):
+        for code in self.error_codes:
+            if not 400 <= code <= 599:
+                raise ValueError(f"error_codes 只能是 4xx/5xx: {code}")
+        if self.error_rate > 0 and not self.error_codes:
+            raise ValueError("error_rate > 0 时 error_codes 不能为空")
+        total = self.error_rate + self.empty_rate + self.truncate_rate + self.fence_rate + self.non_json_rate
+        if total > 1:
+            raise ValueError("error / empty / truncate / fence / non_json 概率之和不能超过 1")
+        return self
+
+    @property
+    def active(self) -> bool:
+        return any((self.latency_rate and self.latency_ms, self.error_rate, self.empty_rate,
+                    self.truncate_rate, self.fence_rate, self.non_json_rate))
+
+
+class FaultInjector:
+    """按当前配置为每次调用抽样故障"""
+
+    def __init__(self, config: Optional[FaultConfig] = None):
+        self._lock = threading.Lock()
+        self.configure(config or FaultConfig())
+
+    def configure(self, config: FaultConfig) -> None:
+        with self._lock:
+            self.config = config
+            self._rng = random.Random(config.seed)
+            self._burst_remaining = 0
+        if config.active:
+            logger.warning("Gemini 故障注入已生效: %s", config.model_dump(exclude_defaults=True))
+        else:
+            logger.info("Gemini 故障注入已关闭")
+
+    def plan(self):
+        """返回 (额外延迟秒数, 故障类型或 None, 错误码)"""
+        with self._lock:
+            config, rng = self.config, self._rng
+            delay = 0.0
+            if config.latency_ms and rng.random() < config.latency_rate:
+                delay = self._sample_latency(config, rng) / 1000
+
+            if self._burst_remaining > 0:
+                self._burst_remaining -= 1
+                return delay, "error", rng.choice(config.error_codes)
+
+            roll = rng.random()
+            for kind in ("error", "empty", "truncate", "fence", "non_json"):
+                rate = getattr(config, f"{kind}_rate")
+                if roll < rate:
+                    if kind == "error":
+                        self._burst_remaining = config.error_burst - 1
+                        return delay, kind, rng.choice(config.error_codes)
+                    return delay, kind, None
+                roll -= rate
+            return delay, None, None
+
+    @staticmethod
+    def _sample_latency(config: FaultConfig, rng: random.Random) -> float:
+        if config.latency_distribution == "uniform":
+            return rng.uniform(0, 2 * config.latency_ms)
+        if config.latency_distribution == "exponential":
+            return rng.expovariate(1 / config.latency_ms)
+        if config.latency_distribution == "lognormal":
+            # 中位数为 latency_ms，sigma=1 时 p99 约为中位数的 10 倍
+            return config.latency_ms * rng.lognormvariate(0, 1)
+        return config.latency_ms
+
+    def truncate_at(self, length: int) -> int:
+        with self._lock:
+            return int(length * self._rng.uniform(0.3, 0.9))
+
+
+def _error(code: int, retry_after: Optional[float]) -> "errors.APIError":
+    """构造与 SDK 真实错误一致的异常（含 response，可读取 Retry-After 头）"""
+    from app.services.model_backends import _STATUS_NAMES, api_error
+    return api_error(code, f"Injected fault ({_STATUS_NAMES.get(code, 'UNKNOWN')})", retry_after)
+
+
+def _text_response(original: "types.GenerateContentResponse", text: Optional[str],
+                   finish_reason: str) -> "types.GenerateContentResponse":
+    from google.genai import types
+    parts = [types.Part(text=text)] if text is not None else []
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(content=types.Content(role="model", parts=parts), finish_reason=finish_reason)],
+        usage_metadata=original.usage_metadata if original is not None else None,
+        model_version=original.model_version if original is not None else None,
+    )
+
+
+class _FaultModels:
+    def __init__(self, injector: FaultInjector, models, is_async: bool):
+        self._injector = injector
+        self._models = models
+        self._is_async = is_async
+
+    def generate_content(self, *, model: str, contents, config=None):
+        if self._is_async:
+            return self._generate_async(model, contents, config)
+        delay, kind, code = self._injector.plan()
+        if delay:
+            time.sleep(delay)
+        self._before_call(kind, code)
+        response = self._models.generate_content(model=model, contents=contents, config=config)
+        return self._after_call(kind, response)
+
+    async def _generate_async(self, model, contents, config):
+        delay, kind, code = self._injector.plan()
+        if delay:
+            await asyncio.sleep(delay)
+        self._before_call(kind, code)
+        response = await self._models.generate_content(model=model, contents=contents, config=config)
+        return self._after_call(kind, response)
+
+    def _before_call(self, kind: Optional[str], code: Optional[int]) -> None:
+        if kind == "error":
+            metrics.GEMINI_FAULTS_INJECTED.labels(kind=f"error_{code}").inc()
+            raise _error(code, self._injector.config.retry_after_s)
+
+    def _after_call(self, kind: Optional[str], response):
+        if kind is None:
+            return response
+        metrics.GEMINI_FAULTS_INJECTED.labels(kind=kind).inc()
+        text = response.text or ""
+        if kind == "empty":
+            return _text_response(response, None, "STOP")
+        if kind == "truncate":
+            return _text_response(response, text[:self._injector.truncate_at(len(text))], "MAX_TOKENS")
+        if kind == "fence":
+            return _text_response(response, f"```json\n{text}\n```", "STOP")
+        return _text_response(response, NON_JSON_TEXT, "STOP")
+
+
+class FaultInjectingClient:
+    """包装模型客户端，按 FaultInjector 的配置注入故障"""
+
+    def __init__(self, client, injector: FaultInjector):
+        from app.services.model_backends import _AsyncNamespace
+        self._client = client
+        self.injector = injector
+        self.models = _FaultModels(injector, client.models, is_async=False)
+        self.aio = _AsyncNamespace(_FaultModels(injector, client.aio.models, is_async=True),
+                                   getattr(client.aio, "caches", None))
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+_injector: Optional[FaultInjector] = None
+
+
+_injector_lock = threading.Lock()
+
+
+def get_injector() -> Optional[FaultInjector]:
+    """
+    当前进程的故障注入器（未开启 GEMINI_FAULT_INJECTION 时为 None）
+    首次调用时按 GEMINI_FAULTS 创建，与模型客户端是否已加载无关
+    """
+    global _injector
+    if not settings.gemini_fault_injection:
+        return None
+    if _injector is None:
+        with _injector_lock:
+            if _injector is None:
+                config = (FaultConfig.model_validate(json.loads(settings.gemini_faults))
+                          if settings.gemini_faults else FaultConfig())
+                _injector = FaultInjector(config)
+    return _injector
+
+
+def wrap_client(client):
+    """按配置包装客户端；未开启时原样返回"""
+    injector = get_injector()
+    if injector is None:
+        return client
+    return FaultInjectingClient(client, injector)
@@ -0,0 +1,43 @@
+"""
+Gemini 服务的延迟加载
+导入 google-genai 与创建客户端约占应用导入时间的一半，应用导入时不再加载：
+- lifespan 中 preload() 在后台线程预热（同时预热 Pillow），不阻塞启动与健康检查
+- 请求通过 await get_gemini_service() 取得服务；预热未完成时在线程中等待，不阻塞事件循环
+预热失败（如未配置 GEMINI_API_KEY）只记录日志，首次分析时再次尝试
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+_service = None
+
+
+def _load():
+    global _service
+    from app.services import image_pipeline
+    from app.services.gemini_service import get_gemini_service
+    image_pipeline.preload()
+    _service = get_gemini_service()
+    return _service
+
+
+async def get_gemini_service():
+    """GeminiService 单例（首次调用时在线程中导入 SDK 并创建客户端）"""
+    if _service is not None:
+        return _service
+    try:
+        return await asyncio.to_thread(_load)
+    except Exception as e:
+        # 配置错误等不应作为分析错误详情返回给用户
+        raise RuntimeError(f"Gemini 服务初始化失败: {type(e).__name__}: {e}") from e
+
+
+async def preload() -> None:
+    """后台预热（lifespan 中以 task 方式启动）"""
+    try:
+        await get_gemini_service()
+    except Exception:
+        logger.exception("Gemini 服务预热失败，将在首次分析时重试")
+        return
+    logger.info("✅ Gemini 客户端已就绪")
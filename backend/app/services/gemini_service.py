@@ -2,24 +2,31 @@
 Gemini AI 服务
 负责调用 Google Gemini API 进行面部特征分析
 """
-from google import genai
 from google.genai import types
 from app.core.config import get_settings
+from app.services.model_backends import create_client
+from app.services.context_cache import ContextCache, is_cache_miss
+from app.services.truncation import OutputBudget, output_tokens, salvage_truncated
+from app.services.thinking_budget import ThinkingBudgetController, thinking_config
+from app.services.result_schema import (
+    FaceLocationSchema, ResultParseError, ResultValidationError, ResultValidator, ValidationReport,
+    parse_model_json, response_schema, sibling_response_schema,
+)
+from app.core import metrics, tracing
+from app.core.logging_config import payload_sampled
+from app.core.retry import RetryBudget, RetryPolicy, RetryRunner
+import asyncio
 import json
-import base64
-import ast
-import re
-from typing import List, Optional
+import threading
+import time
+from typing import Callable, List, Optional, Sequence, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
-# Gemini 系统提示词（来自设计文档）
-SYSTEM_INSTRUCTION = """Role: 你是一位精通计算机视觉和图像解析的专家，擅长对图像中的关键点进行像素级分析和坐标归一化计算，同时精通人脸特征比对。
-Task: 请分析上传的图片，精准定位图中孩子鼻尖的位置，计算脸部宽度比例，并对比父母与孩子的五官特征识别相似度。
-
-**Coordinate System Definition (严格遵守):**
+# 坐标系与关键点定义（完整分析与坐标请求共用）
+COORDINATE_SPEC = """**Coordinate System Definition (严格遵守):**
 *   原点 (0,0)：位于图片的左上角。
 *   终点 (100,100)：位于图片的右下角。
 *   X 轴：从左向右延伸，范围 0 到 100。
@@ -29,7 +36,13 @@ Task: 请分析上传的图片，精准定位图中孩子鼻尖的位置，计
 *   **face_center (鼻尖坐标)**: 请仔细观察孩子鼻子的轮廓，找到鼻尖（最突出点）的正中心位置。
 *   **face_width (脸部宽度比例)**: 测量孩子面部左右最宽处（通常为两颊边缘）的距离，并将其转换为占整张图片宽度的百分比（0-100 之间的数值）。
 
-**核心分析任务（面部特征）：**
+"""
+
+# Gemini 系统提示词（来自设计文档）
+SYSTEM_INSTRUCTION = """Role: 你是一位精通计算机视觉和图像解析的专家，擅长对图像中的关键点进行像素级分析和坐标归一化计算，同时精通人脸特征比对。
+Task: 请分析上传的图片，精准定位图中孩子鼻尖的位置，计算脸部宽度比例，并对比父母与孩子的五官特征识别相似度。
+
+""" + COORDINATE_SPEC + """**核心分析任务（面部特征）：**
 **分析部位（固定7项，严禁增减）：**
 1. 眉毛、2. 眼睛、3. 鼻子、4. 嘴巴、5. 脸型、6. 头型、7. 总结
 
@@ -64,6 +77,96 @@ Task: 请分析上传的图片，精准定位图中孩子鼻尖的位置，计
     *   **未来寄语**：一句温暖或幽默的成长祝福。
 """
 
+# 坐标请求（拆分模式）的系统提示词：只定位孩子鼻尖与脸宽
+LOCATE_INSTRUCTION = """Role: 你是一位精通计算机视觉和图像解析的专家，擅长对图像中的关键点进行像素级分析和坐标归一化计算。
+Task: 请精准定位图中孩子鼻尖的位置，并计算脸部宽度比例。
+
+""" + COORDINATE_SPEC + """**输出格式：**
+直接返回纯 JSON：{"face_center": {"x": 整数(0-100), "y": 整数(0-100)}, "face_width": 整数(0-100)}
+"""
+
+SAFETY_SETTINGS = [
+    types.SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="BLOCK_NONE"),
+    types.SafetySetting(category="HARM_CATEGORY_DANGEROUS_CONTENT", threshold="BLOCK_NONE"),
+    types.SafetySetting(category="HARM_CATEGORY_SEXUALLY_EXPLICIT", threshold="BLOCK_NONE"),
+    types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="BLOCK_NONE"),
+]
+
+# 多个孩子一次分析时追加的提示（系统提示词不变，可继续复用上下文缓存）
+SIBLINGS_PROMPT = """**多个孩子 (Siblings Mode):**
+本次共有 {count} 个孩子的照片（孩子 1 ~ 孩子 {count}），父母照片相同。请对每个孩子分别完成完整分析，坐标基于该孩子自己的照片。
+只输出 JSON：{{"children": [{{"child": 孩子序号, "face_center": ..., "face_width": ..., "analysis_results": [...]}}, ...]}}，
+每个孩子的字段与单个孩子的 JSON 结构相同，按孩子序号排列，不要遗漏任何孩子。"""
+
+# 输出被截断或缺少部位时，只请求缺失部位的补充提示
+CONTINUATION_PROMPT = """上一次的输出不完整，已完成的部分见上文。
+请只补充以下缺失的内容：{parts}。
+只输出 JSON：{{"analysis_results": [...]}}，每项字段与之前相同，不要重复已完成的部位；
+缺失内容包含 face_center / face_width 时在同一对象中一并输出，不要输出其它字段。"""
+
+
+
+def _parent_parts(father_image: Optional[bytes], father_mime_type: Optional[str],
+                  mother_image: Optional[bytes], mother_mime_type: Optional[str]) -> Tuple[List[types.Part], str]:
+    """父母照片与单亲约束提示 -> (parts, 单亲模式下在场的家长，双亲为空字符串)"""
+    parts = []
+    if father_image:
+        parts.append(types.Part.from_text(text="父亲照片："))
+        parts.append(
+            types.Part.from_bytes(
+                data=father_image, mime_type=father_mime_type or "image/jpeg"
+            )
+        )
+    else:
+        parts.append(types.Part.from_text(text="父亲照片：未提供"))
+
+    if mother_image:
+        parts.append(types.Part.from_text(text="母亲照片："))
+        parts.append(
+            types.Part.from_bytes(
+                data=mother_image, mime_type=mother_mime_type or "image/jpeg"
+            )
+        )
+    else:
+        parts.append(types.Part.from_text(text="母亲照片：未提供"))
+    
+    # 动态提示词：处理单亲情况 (逻辑优化 v2)
+    # 核心策略：单亲模式下，所有相似度必须相对于"存在的家长"。
+    # 像对方 = 不像我 (分数 100 - X)
+    
+    target_role = ""
+
+    if father_image and not mother_image:
+        target_role = "Father"
+        parts.append(types.Part.from_text(text="""
+            **重要约束 (Single Parent Mode):**
+            1. 用户仅上传了【父亲】照片。
+            2. JSON 中所有 analysis_results 的 `similar_to` 字段必须严格强制为 "Father"。**严禁出现 "Mother"。**
+            3. 评分逻辑：
+               - 如果部位像父亲：`similarity_score` 给高分 (60-99)。
+               - 如果部位**不像**父亲 (或像缺席的母亲)：`similarity_score` 必须给**低分 (10-40)**，代表相似度低。
+            4. description 文案：请只点评"孩子与父亲在xx处的相似或不同"，**不要提及母亲**。
+            """))
+        
+    elif mother_image and not father_image:
+        target_role = "Mother"
+        parts.append(types.Part.from_text(text="""
+            **重要约束 (Single Parent Mode):**
+            1. 用户仅上传了【母亲】照片。
+            2. JSON 中所有 analysis_results 的 `similar_to` 字段必须严格强制为 "Mother"。**严禁出现 "Father"。**
+            3. 评分逻辑：
+               - 如果部位像母亲：`similarity_score` 给高分 (60-99)。
+               - 如果部位**不像**母亲 (或像缺席的父亲)：`similarity_score` 必须给**低分 (10-40)**，代表相似度低。
+            4. description 文案：请只点评"孩子与母亲在xx处的相似或不同"，**不要提及父亲**。
+            """))
+
+    return parts, target_role
+
+
+def _record_attempt(outcome: str, elapsed: float) -> None:
+    """每次尝试单独记录结果与耗时"""
+    metrics.GEMINI_ATTEMPTS.labels(outcome=outcome).inc()
+    metrics.stage("gemini_call").observe(elapsed)
 
 
 class GeminiService:
@@ -71,10 +174,389 @@ class GeminiService:
     
     def __init__(self):
         """初始化 Gemini 客户端"""
-        self.client = genai.Client(api_key=settings.gemini_api_key)
+        self.client = create_client()
         self.model_name = settings.gemini_model
-        logger.info(f"Gemini 服务已初始化，使用模型: {self.model_name}")
-    
+        # 重试预算为进程级，所有分析请求共享
+        self.retry = RetryRunner(
+            "gemini",
+            RetryPolicy(
+                deadline=settings.gemini_deadline_seconds,
+                max_attempts=settings.gemini_max_attempts,
+                attempt_timeout=settings.gemini_attempt_timeout_seconds,
+                backoff_base=settings.gemini_backoff_base_seconds,
+                backoff_max=settings.gemini_backoff_max_seconds,
+            ),
+            RetryBudget(ratio=settings.gemini_retry_budget_ratio),
+            on_attempt=_record_attempt,
+            on_give_up=lambda reason: metrics.GEMINI_RETRY_GIVE_UPS.labels(reason=reason).inc(),
+        )
+        # 输出上限：开启自适应时按近期实际用量调整，截断后调高
+        self.output_budget = OutputBudget(
+            settings.gemini_max_output_tokens,
+            floor=settings.gemini_output_budget_floor if settings.gemini_adaptive_output_budget else settings.gemini_max_output_tokens,
+            ceiling=settings.gemini_output_budget_ceiling if settings.gemini_adaptive_output_budget else settings.gemini_max_output_tokens,
+        )
+        metrics.GEMINI_OUTPUT_BUDGET.set_function(lambda: self.output_budget.current)
+        # 思考预算：关闭 GEMINI_ENABLE_THINKING 时固定为 0；开启自适应时按延迟 SLO 与并发深度调整，否则固定为上限
+        if not settings.gemini_enable_thinking:
+            self.thinking = ThinkingBudgetController.fixed(0)
+        elif settings.gemini_adaptive_thinking:
+            self.thinking = ThinkingBudgetController(
+                settings.gemini_latency_slo_seconds,
+                settings.gemini_thinking_budget_min,
+                settings.gemini_thinking_budget_max,
+                busy_depth=settings.gemini_thinking_busy_depth,
+            )
+        else:
+            self.thinking = ThinkingBudgetController.fixed(settings.gemini_thinking_budget_max)
+        metrics.GEMINI_THINKING_BUDGET.set_function(lambda: self.thinking.level)
+        self.validator = ResultValidator()
+        # 上下文缓存：系统提示词按模型缓存，请求引用缓存名（关闭时每次直接发送）
+        self.context_cache = ContextCache(
+            self.client,
+            ttl_seconds=settings.gemini_context_cache_ttl_seconds,
+            refresh_seconds=settings.gemini_context_cache_refresh_seconds,
+            retry_seconds=settings.gemini_context_cache_retry_seconds,
+        ) if settings.gemini_context_cache else None
+        logger.info(f"Gemini 服务已初始化，使用模型: {self.model_name} (模式: {settings.gemini_mode})")
+
+    async def _generate(self, contents, config: types.GenerateContentConfig, deadline: float):
+        """带重试地调用一次 generate_content（deadline 为整次分析共享的截止时间）"""
+        cache_name = None
+        if self.context_cache is not None:
+            cache_name = await self.context_cache.resolve(self.model_name, config.system_instruction)
+
+        async def attempt_call(attempt: int, timeout: float):
+            nonlocal cache_name
+            logger.info("正在调用 Gemini API (尝试 %d/%d, 超时 %.0fs)", attempt, self.retry.policy.max_attempts, timeout)
+            # SDK 的异步调用在线程中发起 HTTP 请求，HTTP 超时与本次尝试一致，超时后线程也会随之结束
+            attempt_config = config.model_copy(update={"http_options": types.HttpOptions(timeout=int(timeout * 1000))})
+            if cache_name is None:
+                return await self.client.aio.models.generate_content(
+                    model=self.model_name,
+                    contents=contents,
+                    config=attempt_config,
+                )
+            try:
+                # 引用缓存时不能再携带 system_instruction
+                return await self.client.aio.models.generate_content(
+                    model=self.model_name,
+                    contents=contents,
+                    config=attempt_config.model_copy(update={"cached_content": cache_name, "system_instruction": None}),
+                )
+            except Exception as e:
+                if not is_cache_miss(e):
+                    raise
+                # 缓存已被删除或过期：本次尝试内立即改为直接发送系统提示词
+                self.context_cache.invalidate(cache_name)
+                cache_name = None
+                return await self.client.aio.models.generate_content(
+                    model=self.model_name,
+                    contents=contents,
+                    config=attempt_config,
+                )
+
+        # 重试 429 / 5xx / 超时 / 网络错误，受总截止时间与进程级重试预算约束
+        start_time = time.perf_counter()
+        response = await self.retry.run(attempt_call, deadline)
+        prompt_tokens, cached_tokens = self._observe_input(response)
+        logger.info("Gemini API 调用成功，耗时: %.2fs，输入 token: %s (缓存 %s)",
+                    time.perf_counter() - start_time, prompt_tokens, cached_tokens)
+        return response
+
+    @staticmethod
+    def _fit_thinking(budget: int, max_output_tokens: int, children: int = 1) -> int:
+        """思考 token 计入 max_output_tokens：为答案预留 GEMINI_ANSWER_RESERVE_TOKENS（按孩子数），思考预算不超过剩余部分"""
+        return max(0, min(budget, max_output_tokens - settings.gemini_answer_reserve_tokens * children))
+
+    def _observe_input(self, response):
+        """记录输入 token 与其中由缓存提供的部分（显式缓存与服务端隐式缓存都计入），返回 (输入, 缓存)"""
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", None)
+        if prompt_tokens is None:
+            return None, None
+        cached_tokens = usage.cached_content_token_count or 0
+        metrics.GEMINI_INPUT_TOKENS.labels(kind="total").inc(prompt_tokens)
+        metrics.GEMINI_INPUT_TOKENS.labels(kind="cached").inc(cached_tokens)
+        metrics.GEMINI_CACHED_INPUT_TOKENS.observe(cached_tokens)
+        return prompt_tokens, cached_tokens
+
+    def _observe_output(self, response, children: int = 1) -> bool:
+        """记录输出用量并调整输出上限（多个孩子一次分析时按每个孩子的用量计），返回是否因 MAX_TOKENS 被截断"""
+        candidates = getattr(response, "candidates", None) or []
+        truncated = bool(candidates) and candidates[0].finish_reason == types.FinishReason.MAX_TOKENS
+        used = output_tokens(response)
+        budget = self.output_budget.observe(used // children if used else used, truncated)
+        if truncated:
+            logger.warning("Gemini 输出被截断 (MAX_TOKENS)，输出 token: %s，输出上限调整为 %d", used, budget)
+        return truncated
+
+    def _parse(self, text: str):
+        """解析模型文本；严格解析失败（需去掉代码块等）与彻底失败均记录指标"""
+        try:
+            data, method = parse_model_json(text)
+        except ResultParseError as e:
+            metrics.GEMINI_PARSE_FAILURES.labels(reason=e.reason).inc()
+            logger.error("解析彻底失败", extra={"raw_text": (text or "")[:2000]})
+            raise
+        if method != "json":
+            metrics.GEMINI_PARSE_FAILURES.labels(reason=method).inc()
+            logger.warning("标准 JSON 解析失败，已按 %s 方式容错解析", method)
+        return data
+
+    def _validate(self, data, target_role: Optional[str]) -> ValidationReport:
+        try:
+            return self.validator.validate(data, target_role)
+        except ResultValidationError:
+            metrics.GEMINI_PARSE_FAILURES.labels(reason="invalid").inc()
+            raise
+
+    async def _request_missing(self, contents, config: types.GenerateContentConfig, report: ValidationReport,
+                               deadline: float, target_role: Optional[str]) -> ValidationReport:
+        """只请求缺失的 analysis_results 项（及缺失的坐标）并合并；补充后仍不完整时抛出 ValueError，不完整的结果不会被保存"""
+        logger.warning("Gemini 输出不完整，已完成 %d 项，补充请求: %s",
+                       len(report.result["analysis_results"]), "、".join(report.missing))
+        follow_up = list(contents) + [
+            types.Content(role="model", parts=[types.Part.from_text(text=json.dumps(report.result, ensure_ascii=False))]),
+            types.Content(role="user", parts=[types.Part.from_text(text=CONTINUATION_PROMPT.format(parts="、".join(report.missing)))]),
+        ]
+        # 补充请求只输出 analysis_results，不适用完整结果的结构定义
+        config = config.model_copy(update={"response_schema": None})
+        response = await self._generate(follow_up, config, deadline)
+        self._observe_output(response)
+        report = self.validator.merge(report, salvage_truncated(response.text or ""), target_role)
+        if report.missing:
+            logger.warning("补充请求后仍缺少: %s", "、".join(report.missing))
+            raise ValueError(f"AI 输出不完整，补充请求后仍缺少: {'、'.join(report.missing)}")
+        return report
+
+    async def _complete_truncated(self, contents, config: types.GenerateContentConfig, text: str,
+                                  deadline: float, target_role: Optional[str]) -> ValidationReport:
+        """
+        截断恢复：抢救已完整输出的部分，只请求缺失的 analysis_results 项并合并；
+        连坐标都未输出（通常是思考耗尽了上限）时，用调高后的上限重新请求一次
+        """
+        config = config.model_copy(update={"max_output_tokens": self.output_budget.current})
+        partial = salvage_truncated(text) if text else None
+        if not partial or "face_center" not in partial or "face_width" not in partial:
+            logger.warning("截断发生在坐标输出之前，以输出上限 %d 重新请求", config.max_output_tokens)
+            metrics.GEMINI_TRUNCATIONS.labels(recovery="refetched").inc()
+            response = await self._generate(contents, config, deadline)
+            truncated = self._observe_output(response)
+            text = response.text or ""
+            result = salvage_truncated(text) if truncated else None
+            if result is None:
+                try:
+                    result = self._parse(text)
+                except ResultParseError:
+                    raise ValueError("AI 输出被截断，重新请求后仍无法解析")
+            report = self._validate(result, target_role)
+            if report.missing:
+                # 重新请求再次被截断：同样只补充缺失的部位
+                report = await self._request_missing(contents, config, report, deadline, target_role)
+            return report
+
+        report = self._validate(partial, target_role)
+        if not report.missing:
+            metrics.GEMINI_TRUNCATIONS.labels(recovery="salvaged").inc()
+            return report
+
+        try:
+            report = await self._request_missing(contents, config, report, deadline, target_role)
+        except ValueError:
+            metrics.GEMINI_TRUNCATIONS.labels(recovery="incomplete").inc()
+            raise
+        metrics.GEMINI_TRUNCATIONS.labels(recovery="continued").inc()
+        return report
+
+    async def locate_face(self, child_image: bytes, child_mime_type: str = "image/jpeg") -> dict:
+        """拆分模式的坐标请求：只对孩子照片定位鼻尖与脸宽（低思考、小输出上限），返回 face_center / face_width"""
+        contents = [types.Content(role="user", parts=[
+            types.Part.from_text(text="孩子照片（请基于此图输出坐标）："),
+            types.Part.from_bytes(data=child_image, mime_type=child_mime_type),
+        ])]
+        config = types.GenerateContentConfig(
+            system_instruction=LOCATE_INSTRUCTION,
+            temperature=settings.gemini_temperature,
+            max_output_tokens=settings.gemini_locate_max_output_tokens,
+            thinking_config=thinking_config(self._fit_thinking(
+                settings.gemini_locate_thinking_budget, settings.gemini_locate_max_output_tokens)),
+            response_mime_type="application/json",
+            response_schema=FaceLocationSchema if settings.gemini_structured_output else None,
+            safety_settings=SAFETY_SETTINGS,
+        )
+        start = time.perf_counter()
+        with tracing.span("gemini.locate"):
+            response = await self._generate(contents, config, time.monotonic() + self.retry.policy.deadline)
+        metrics.stage("gemini_locate").observe(time.perf_counter() - start)
+        report = self.validator.validate_location(self._parse(response.text))
+        for kind in report.repairs:
+            metrics.GEMINI_RESULT_REPAIRS.labels(kind=kind).inc()
+        return report.result
+
+    async def analyze_family_photos_split(
+        self,
+        child_image: bytes,
+        child_mime_type: str = "image/jpeg",
+        father_image: Optional[bytes] = None,
+        father_mime_type: Optional[str] = None,
+        mother_image: Optional[bytes] = None,
+        mother_mime_type: Optional[str] = None,
+        on_location: Optional[Callable[[dict], None]] = None,
+    ) -> dict:
+        """
+        拆分模式：坐标请求与完整分析并行，坐标先返回时通过 on_location 交给调用方（用于尽早渲染结果页）
+        最终结果使用坐标请求的坐标；完整分析先结束或坐标请求失败时取消它，改用完整分析中的坐标
+        """
+        async def locate() -> dict:
+            location = await self.locate_face(child_image, child_mime_type)
+            if on_location is not None:
+                on_location(location)
+            return location
+
+        location_task = asyncio.ensure_future(locate())
+        try:
+            result = await self.analyze_family_photos(
+                child_image=child_image,
+                child_mime_type=child_mime_type,
+                father_image=father_image,
+                father_mime_type=father_mime_type,
+                mother_image=mother_image,
+                mother_mime_type=mother_mime_type,
+            )
+        except BaseException:
+            location_task.cancel()
+            if location_task.done() and not location_task.cancelled():
+                location_task.exception()
+            raise
+
+        if not location_task.done():
+            location_task.cancel()
+            logger.info("完整分析先于坐标请求完成，使用完整分析中的坐标")
+            source = "full_first"
+        elif location_task.cancelled() or location_task.exception() is not None:
+            logger.warning("坐标请求失败，使用完整分析中的坐标: %s",
+                           "cancelled" if location_task.cancelled() else location_task.exception())
+            source = "locate_failed"
+        else:
+            location = location_task.result()
+            logger.info("拆分模式坐标: 坐标请求 %s / %s，完整分析 %s / %s", location["face_center"],
+                        location["face_width"], result.get("face_center"), result.get("face_width"))
+            result = dict(result, **location)
+            source = "locate"
+        metrics.GEMINI_SPLIT_COORDINATES.labels(source=source).inc()
+        return result
+
+    def _sibling_reports(self, text: str, truncated: bool, target_role: Optional[str],
+                         count: int) -> List[Optional[ValidationReport]]:
+        """解析多个孩子的结果，按孩子序号返回各自的校验结果；缺失、缺少部位或坐标、无法修复的孩子为 None"""
+        data = None
+        if truncated:
+            data = salvage_truncated(text) if text else None
+        else:
+            try:
+                data = self._parse(text)
+            except ResultParseError:
+                pass
+        items = data.get("children") if isinstance(data, dict) else data
+        if items is None and isinstance(data, dict) and "analysis_results" in data:
+            # 模型忽略了多孩子结构，只输出了一个孩子
+            items = [data]
+        if not isinstance(items, list):
+            items = []
+
+        reports: List[Optional[ValidationReport]] = [None] * count
+        for position, item in enumerate(items):
+            if not isinstance(item, dict):
+                continue
+            index = item.get("child")
+            index = index - 1 if isinstance(index, int) and 1 <= index <= count else position
+            if index >= count or reports[index] is not None:
+                continue
+            try:
+                report = self._validate(item, target_role)
+            except ResultValidationError:
+                continue
+            if report.missing:
+                continue
+            reports[index] = report
+        return reports
+
+    async def _analyze_siblings(self, children: List[Tuple[bytes, str]],
+                                father_image: Optional[bytes], father_mime_type: Optional[str],
+                                mother_image: Optional[bytes], mother_mime_type: Optional[str]) -> dict:
+        """
+        多个孩子一次调用：父母照片只发送一次，模型按孩子序号返回每个孩子的完整结果（各自的坐标）
+        一次调用中缺失或不完整的孩子（截断、漏项）单独补充分析，不影响其他孩子
+        """
+        count = len(children)
+        parent_parts, target_role = _parent_parts(father_image, father_mime_type, mother_image, mother_mime_type)
+        parts = [types.Part.from_text(text="分析家庭照片，识别面部特征遗传来源。严格按照定义的 JSON 格式输出。")] + parent_parts
+        parts.append(types.Part.from_text(text=SIBLINGS_PROMPT.format(count=count)))
+        for index, (image, mime_type) in enumerate(children, 1):
+            parts.append(types.Part.from_text(text=f"孩子 {index} 照片（请基于此图输出孩子 {index} 的坐标）："))
+            parts.append(types.Part.from_bytes(data=image, mime_type=mime_type or "image/jpeg"))
+        contents = [types.Content(role="user", parts=parts)]
+        role = target_role or None
+        logger.info("Gemini 多孩子请求开始: model=%s, children=%d, parts=%d", self.model_name, count, len(parts))
+
+        thinking_budget = self.thinking.start()
+        latency = None
+        try:
+            # 输出上限按孩子数放大，不超过自适应上限的 ceiling
+            budget = self.output_budget
+            max_output_tokens = min(budget.current * count, max(budget.ceiling, budget.current))
+            thinking_budget = self._fit_thinking(thinking_budget, max_output_tokens, count)
+            config = types.GenerateContentConfig(
+                system_instruction=SYSTEM_INSTRUCTION,
+                temperature=settings.gemini_temperature,
+                max_output_tokens=max_output_tokens,
+                thinking_config=thinking_config(thinking_budget),
+                response_mime_type="application/json",
+                response_schema=sibling_response_schema(role, count) if settings.gemini_structured_output else None,
+                safety_settings=SAFETY_SETTINGS,
+            )
+            deadline = time.monotonic() + self.retry.policy.deadline
+            call_start = time.perf_counter()
+            with tracing.span("gemini.generate", thinking_budget=thinking_budget, children=count):
+                response = await self._generate(contents, config, deadline)
+            latency = time.perf_counter() - call_start
+            metrics.stage("gemini_analysis").observe(latency)
+        finally:
+            self.thinking.finish(latency)
+
+        truncated = self._observe_output(response, children=count)
+        text = response.text or ""
+        with metrics.stage("json_parse").time(), tracing.span("gemini.parse", chars=len(text), children=count):
+            reports = self._sibling_reports(text, truncated, role, count)
+        for report in reports:
+            for kind in report.repairs if report else ():
+                metrics.GEMINI_RESULT_REPAIRS.labels(kind=kind).inc()
+
+        results = [report.result if report else None for report in reports]
+        incomplete = [index for index, result in enumerate(results) if result is None]
+        if incomplete:
+            logger.warning("多孩子分析中 %d/%d 个孩子的结果不完整，单独补充分析: 孩子 %s", len(incomplete), count,
+                           "、".join(str(index + 1) for index in incomplete))
+            with tracing.span("gemini.siblings_fallback", children=len(incomplete)):
+                fallback = await asyncio.gather(*(
+                    self.analyze_family_photos(
+                        child_image=children[index][0],
+                        child_mime_type=children[index][1],
+                        father_image=father_image,
+                        father_mime_type=father_mime_type,
+                        mother_image=mother_image,
+                        mother_mime_type=mother_mime_type,
+                    )
+                    for index in incomplete
+                ))
+            for index, result in zip(incomplete, fallback):
+                results[index] = result
+        metrics.GEMINI_SIBLING_CHILDREN.labels(source="combined").inc(count - len(incomplete))
+        metrics.GEMINI_SIBLING_CHILDREN.labels(source="fallback").inc(len(incomplete))
+        logger.info("Gemini 多孩子分析完成: %d 个孩子 (单独补充 %d 个)", count, len(incomplete))
+        return dict(results[0], children=results)
+
     async def analyze_family_photos(
         self,
         child_image: bytes,
@@ -83,43 +565,18 @@ class GeminiService:
         father_mime_type: Optional[str] = None,
         mother_image: Optional[bytes] = None,
         mother_mime_type: Optional[str] = None,
+        sibling_images: Sequence[Tuple[bytes, str]] = (),
     ) -> dict:
         """
         分析家庭照片，识别遗传特征
+        sibling_images 为同一对父母的其他孩子照片 [(bytes, mime_type), ...]，与 child_image 在同一次调用中分析：
+        返回第一个孩子的结果，并附 children（按照片顺序的每个孩子的结果）
         """
-        # 定义响应结构 (JSON Schema)
-        response_schema = {
-            "type": "OBJECT",
-            "properties": {
-                "face_center": {
-                    "type": "OBJECT",
-                    "description": "Nose tip position in percentage (0-100)",
-                    "properties": {
-                        "x": {"type": "INTEGER"},
-                        "y": {"type": "INTEGER"}
-                    },
-                    "required": ["x", "y"]
-                },
-                "face_width": {
-                    "type": "INTEGER",
-                    "description": "Face width as percentage of image width (0-100)"
-                },
-                "analysis_results": {
-                    "type": "ARRAY",
-                    "items": {
-                        "type": "OBJECT",
-                        "properties": {
-                            "part": {"type": "STRING"},
-                            "similar_to": {"type": "STRING"},
-                            "similarity_score": {"type": "INTEGER"},
-                            "description": {"type": "STRING"}
-                        },
-                        "required": ["part", "similar_to", "similarity_score", "description"]
-                    }
-                }
-            },
-            "required": ["analysis_results", "face_center", "face_width"]
-        }
+        if sibling_images:
+            return await self._analyze_siblings(
+                [(child_image, child_mime_type)] + list(sibling_images),
+                father_image, father_mime_type, mother_image, mother_mime_type,
+            )
 
         # 构建消息内容
         contents = []
@@ -128,260 +585,139 @@ class GeminiService:
         prompt_text = "分析家庭照片，识别面部特征遗传来源。严格按照定义的 JSON 格式输出。"
         
         # 添加图片（按顺序：父亲、母亲、孩子）
-        parts = [types.Part.from_text(text=prompt_text)]
-        
-        if father_image:
-            parts.append(types.Part.from_text(text="父亲照片："))
-            parts.append(
-                types.Part.from_bytes(
-                    data=father_image, mime_type=father_mime_type or "image/jpeg"
-                )
-            )
-        else:
-            parts.append(types.Part.from_text(text="父亲照片：未提供"))
-
-        if mother_image:
-            parts.append(types.Part.from_text(text="母亲照片："))
-            parts.append(
-                types.Part.from_bytes(
-                    data=mother_image, mime_type=mother_mime_type or "image/jpeg"
-                )
-            )
-        else:
-            parts.append(types.Part.from_text(text="母亲照片：未提供"))
-        
-        # 动态提示词：处理单亲情况 (逻辑优化 v2)
-        # 核心策略：单亲模式下，所有相似度必须相对于"存在的家长"。
-        # 像对方 = 不像我 (分数 100 - X)
-        
-        single_parent_mode = False
-        target_role = ""
-
-        if father_image and not mother_image:
-            single_parent_mode = True
-            target_role = "Father"
-            parts.append(types.Part.from_text(text="""
-            **重要约束 (Single Parent Mode):**
-            1. 用户仅上传了【父亲】照片。
-            2. JSON 中所有 analysis_results 的 `similar_to` 字段必须严格强制为 "Father"。**严禁出现 "Mother"。**
-            3. 评分逻辑：
-               - 如果部位像父亲：`similarity_score` 给高分 (60-99)。
-               - 如果部位**不像**父亲 (或像缺席的母亲)：`similarity_score` 必须给**低分 (10-40)**，代表相似度低。
-            4. description 文案：请只点评"孩子与父亲在xx处的相似或不同"，**不要提及母亲**。
-            """))
-            
-        elif mother_image and not father_image:
-            single_parent_mode = True
-            target_role = "Mother"
-            parts.append(types.Part.from_text(text="""
-            **重要约束 (Single Parent Mode):**
-            1. 用户仅上传了【母亲】照片。
-            2. JSON 中所有 analysis_results 的 `similar_to` 字段必须严格强制为 "Mother"。**严禁出现 "Father"。**
-            3. 评分逻辑：
-               - 如果部位像母亲：`similarity_score` 给高分 (60-99)。
-               - 如果部位**不像**母亲 (或像缺席的父亲)：`similarity_score` 必须给**低分 (10-40)**，代表相似度低。
-            4. description 文案：请只点评"孩子与母亲在xx处的相似或不同"，**不要提及父亲**。
-            """))
+        parent_parts, target_role = _parent_parts(father_image, father_mime_type, mother_image, mother_mime_type)
+        parts = [types.Part.from_text(text=prompt_text)] + parent_parts
 
         parts.append(types.Part.from_text(text="孩子照片（请基于此图输出坐标）："))
         parts.append(types.Part.from_bytes(data=child_image, mime_type=child_mime_type))
         
         contents.append(types.Content(role="user", parts=parts))
+        # 详细载荷日志按 LOG_PAYLOAD_SAMPLE_RATE 采样（整个请求统一决定）
+        log_payload = payload_sampled()
         try:
             # -------------------------------------------------------
             # 1. 打印请求日志 (Request Log)
             # -------------------------------------------------------
-            log_contents = []
-            for c in contents:
-                # 深度复制以安全修改用于打印
+            images = sum(1 for p in parts if p.inline_data)
+            if log_payload:
                 log_parts = []
-                for p in c.parts:
+                for p in parts:
                     if p.text:
-                        log_parts.append({"text": p.text[:100] + "..." if len(p.text) > 100 else p.text})
+                        log_parts.append({"text": p.text[:100]})
                     elif p.inline_data:
-                        mime_type = getattr(p.inline_data, "mime_type", None) or "unknown"
-                        log_parts.append({"inline_data": f"<{mime_type} BASE64_IMAGE_DATA_TRUNCATED>"})
-                log_contents.append({"role": c.role, "parts": log_parts})
-            
-            logger.info(f"\n🚀 [GEMINI REQUEST START] ----------------------------------\n"
-                        f"Target Model: {self.model_name}\n"
-                        f"Payload Summary: {json.dumps(log_contents, indent=2, ensure_ascii=False)}\n"
-                        f"-------------------------------------------------------------")
+                        log_parts.append({"inline_data": p.inline_data.mime_type or "unknown", "bytes": len(p.inline_data.data or b"")})
+                logger.info("Gemini 请求开始: model=%s, parts=%d, images=%d",
+                            self.model_name, len(parts), images, extra={"payload": log_parts})
+            else:
+                logger.info("Gemini 请求开始: model=%s, parts=%d, images=%d", self.model_name, len(parts), images)
 
             # 调用 Gemini API
-            # 注意：不再使用 response_schema，改回纯文本模式以避免 SDK 在空响应时崩溃
-            # 我们通过 response_mime_type="application/json" 提示模型输出 JSON
-            
-            # 增加重试机制，应对 503 Overloaded
-            max_retries = 3
-            retry_delay = 2 # seconds
-            import time
-            from google.genai.errors import ServerError
-            
-            response = None
-            last_error = None
-            
-            for attempt in range(max_retries):
-                try:
-                    logger.info(f"正在调用 Gemini API (尝试 {attempt + 1}/{max_retries})...")
-                    start_time = time.time()
-                    
-                    response = self.client.models.generate_content(
-                        model=self.model_name,
-                        contents=contents,
-                        config=types.GenerateContentConfig(
-                            system_instruction=SYSTEM_INSTRUCTION,
-                            temperature=settings.gemini_temperature,
-                            max_output_tokens=8192,
-                            response_mime_type="application/json",
-                            safety_settings=[
-                                types.SafetySetting(category="HARM_CATEGORY_HATE_SPEECH", threshold="BLOCK_NONE"),
-                                types.SafetySetting(category="HARM_CATEGORY_DANGEROUS_CONTENT", threshold="BLOCK_NONE"),
-                                types.SafetySetting(category="HARM_CATEGORY_SEXUALLY_EXPLICIT", threshold="BLOCK_NONE"),
-                                types.SafetySetting(category="HARM_CATEGORY_HARASSMENT", threshold="BLOCK_NONE"),
-                            ]
-                        )
-                    )
-                    
-                    duration = time.time() - start_time
-                    logger.info(f"Gemini API 调用成功，耗时: {duration:.2f}s")
-                    
-                    # 显式检查 response 是否为空
-                    if not response:
-                        logger.error("Gemini 返回了空对象 (None)")
-                        raise ValueError("Gemini API returned None")
-                    
-                    # 尝试获取文本
-                    try:
-                        result_text = response.text
-                    except Exception as e:
-                        logger.error(f"无法从 Gemini 响应中获取文本: {e}")
-                        # 打印一下 dir(response) 看看有什么
-                        logger.info(f"Response attributes: {dir(response)}")
-                        raise ValueError(f"Failed to extract text from response: {e}")
-
-                    if not result_text:
-                        logger.error(f"Gemini 返回了空文本 (response.text is empty). Finish reason: {response.candidates[0].finish_reason if response.candidates else 'Unknown'}")
-                        raise ValueError("Gemini response text is empty")
-                    
-                    # 记录原始返回（截取前500字符以防日志爆炸，但足以排查 JSON 格式问题）
-                    logger.info(f"Gemini 原始返回 (前500字符): {result_text[:500]}...")
-
-                    # 清理 Markdown 代码块标记 ```json ... ```
-                    cleaned_text = result_text.strip()
-                    if cleaned_text.startswith("```"):
-                        # 去掉第一行 (```json) 和最后一行 (```)
-                        lines = cleaned_text.split('\n')
-                        if len(lines) >= 2:
-                            # 找到第一个 ``` 和最后一个 ```
-                            first_code_block = -1
-                            last_code_block = -1
-                            for i, line in enumerate(lines):
-                                if line.strip().startswith("```"):
-                                    if first_code_block == -1:
-                                        first_code_block = i
-                                    else:
-                                        last_code_block = i
-                            
-                            if first_code_block != -1 and last_code_block != -1:
-                                cleaned_text = "\n".join(lines[first_code_block+1 : last_code_block])
-                            else:
-                                # 简单的fallback
-                                cleaned_text = cleaned_text.replace("```json", "").replace("```", "")
-                    
-                    logger.info("开始解析 JSON...")
-                    # 如果成功调用，跳出重试循环
-                    break
-                except ServerError as e:
-                    if e.code == 503:
-                        last_error = e
-                        logger.warning(f"Gemini 服务过载 (503)，正在重试 ({attempt + 1}/{max_retries})...")
-                        time.sleep(retry_delay * (attempt + 1)) # 线性退避
-                    else:
-                        raise e # 其他 API 错误直接抛出
-                except Exception as e:
-                    raise e # 其他异常直接抛出
-            
-            # 如果重试完还是失败
-            if response is None and last_error:
-                raise last_error
-            
-            # 解析响应
-            # result_text = response.text # This line is now handled inside the retry loop
-            
-            # 兼容性检查：如果 text 依然为空，抛出更明确的错误而不是崩在 SDK 内部
-            if not result_text:
+            # 结构化输出：以 pydantic 模型作为 response_schema（SDK 对空响应只会放弃 parsed，不会崩溃），
+            # 关闭时只通过 response_mime_type="application/json" 提示模型输出 JSON
+            # 思考预算按本次开始时的并发深度与近期延迟决定，首次调用的耗时反馈给控制器
+            thinking_budget = self.thinking.start()
+            latency = None
+            try:
+                max_output_tokens = self.output_budget.current
+                thinking_budget = self._fit_thinking(thinking_budget, max_output_tokens)
+                config = types.GenerateContentConfig(
+                    system_instruction=SYSTEM_INSTRUCTION,
+                    temperature=settings.gemini_temperature,
+                    max_output_tokens=max_output_tokens,
+                    thinking_config=thinking_config(thinking_budget),
+                    response_mime_type="application/json",
+                    response_schema=response_schema(target_role or None) if settings.gemini_structured_output else None,
+                    safety_settings=SAFETY_SETTINGS,
+                )
+                deadline = time.monotonic() + self.retry.policy.deadline
+                call_start = time.perf_counter()
+                with tracing.span("gemini.generate", thinking_budget=thinking_budget):
+                    response = await self._generate(contents, config, deadline)
+                latency = time.perf_counter() - call_start
+                metrics.stage("gemini_analysis").observe(latency)
+            finally:
+                self.thinking.finish(latency)
+
+            # 显式检查 response 是否为空
+            if not response:
+                logger.error("Gemini 返回了空对象 (None)")
+                raise ValueError("Gemini API returned None")
+
+            # 尝试获取文本
+            try:
+                result_text = response.text
+            except Exception as e:
+                logger.error("无法从 Gemini 响应中获取文本: %s (response 类型: %s)", e, type(response).__name__)
+                raise ValueError(f"Failed to extract text from response: {e}")
+
+            truncated = self._observe_output(response)
+            # 兼容性检查：text 为空时抛出更明确的错误（可能被安全策略拦截，或模型拒绝回答）
+            if not result_text and not truncated:
                 error_msg = "Gemini 返回了空内容 (None)。可能被安全策略拦截，或模型拒绝回答。"
-                # 尝试检查是否有候选对象的安全评级信息
                 try:
                     if response.candidates:
-                         error_msg += f" 候选结果: {response.candidates[0].finish_reason}"
-                except:
+                        error_msg += f" 候选结果: {response.candidates[0].finish_reason}"
+                except Exception:
                     pass
+                metrics.GEMINI_PARSE_FAILURES.labels(reason="empty").inc()
                 logger.error(error_msg)
                 raise ValueError(error_msg)
 
-            # logger.info(f"Gemini 原始响应: {result_text[:200]}...")
-            
-            # 强化清洗逻辑
-            try:
-                # 寻找第一个 { 和最后一个 }
-                start_idx = result_text.find('{')
-                end_idx = result_text.rfind('}')
-                if start_idx != -1 and end_idx != -1:
-                    cleaned_text = result_text[start_idx : end_idx + 1]
-                else:
-                    cleaned_text = result_text
-
-                # 尝试标准解析
-                result = json.loads(cleaned_text)
-
-                # -------------------------------------------------------
-                # 数据清洗与兜底 (Single Parent Enforcer)
-                # -------------------------------------------------------
-                if single_parent_mode and target_role:
-                    if "analysis_results" in result:
-                        for item in result["analysis_results"]:
-                            current_role = item.get("similar_to")
-                            current_score = item.get("similarity_score", 50)
-                            
-                            # 如果 AI 返回了不存在的家长 (叛逆情况)
-                            if current_role != target_role:
-                                logger.warning(f"单亲模式纠正: {item['part']} 指向了 {current_role}, 强制重定向至 {target_role}")
-                                item["similar_to"] = target_role
-                                # 既然 AI 认为像缺席方，说明不像当前方 -> 反转分数
-                                # 例: 像 Mother 80% -> 像 Father 20%
-                                item["similarity_score"] = 100 - current_score
-                                
-                                # 简单的文案修饰 (可选，防止文案里还提缺席方)
-                                # item["description"] = f"(自动校正) {item['description']}"
-                
-                # -------------------------------------------------------
-                # 2. 打印响应日志 (Response Log)
-                # -------------------------------------------------------
-                logger.info(f"\n✅ [GEMINI RESPONSE END] ------------------------------------\n"
-                            f"{json.dumps(result, indent=2, ensure_ascii=False)}\n"
-                            f"-------------------------------------------------------------")
-
-                return result
-
-            except json.JSONDecodeError as e:
-                logger.warning(f"标准 JSON 解析失败: {e}，尝试 AST 解析...")
-                try:
-                    # AST 容错
-                    result = ast.literal_eval(cleaned_text)
-                    if isinstance(result, dict):
-                        return result
-                    else:
-                        raise ValueError("AST 解析结果不是字典")
-                except Exception:
-                    logger.error(f"解析彻底失败。\n原始文本: {result_text}")
-                    raise ValueError(f"AI 返回数据异常: {str(e)}")
-            
+            # 记录原始返回（采样；截取前500字符以防日志爆炸，但足以排查 JSON 格式问题）
+            result_text = result_text or ""
+            if log_payload:
+                logger.info("Gemini 原始返回 (%d 字符)", len(result_text), extra={"raw_text": result_text[:500]})
+
+            role = target_role or None
+            if truncated:
+                # 截断：合并已完成部分与补充请求的结果，无需用户重新上传
+                with tracing.span("gemini.continue", chars=len(result_text)):
+                    report = await self._complete_truncated(contents, config, result_text, deadline, role)
+            else:
+                # 一次遍历完成解析、校验与本地修复（单亲纠正、分数/坐标越界、部位与家长别名等）
+                with metrics.stage("json_parse").time(), tracing.span("gemini.parse", chars=len(result_text)):
+                    report = self._validate(self._parse(result_text), role)
+                if report.missing:
+                    report = await self._request_missing(contents, config, report, deadline, role)
+
+            if report.repairs:
+                for kind in report.repairs:
+                    metrics.GEMINI_RESULT_REPAIRS.labels(kind=kind).inc()
+                logger.warning("Gemini 结果已本地修复 %d 处: %s", len(report.repairs),
+                               ", ".join(sorted(set(report.repairs))))
+            result = report.result
+
+            # -------------------------------------------------------
+            # 2. 打印响应日志 (Response Log)
+            # -------------------------------------------------------
+            if log_payload:
+                logger.info("Gemini 响应解析完成: %d 项", len(result["analysis_results"]), extra={"result": result})
+            else:
+                logger.info("Gemini 响应解析完成: %d 项", len(result["analysis_results"]))
+
+            return result
+
         except Exception as e:
-            logger.error(f"Gemini API 调用异常: {str(e)}", exc_info=True)
+            logger.error("Gemini API 调用异常: %s", e, exc_info=True)
             raise
 
 
-# 创建服务单例
-gemini_service = GeminiService()
+# 服务单例：首次使用时才创建客户端（应用启动时由 gemini_loader 在后台预热）
+_service: Optional[GeminiService] = None
+_service_lock = threading.Lock()
+
+
+def get_gemini_service() -> GeminiService:
+    global _service
+    if _service is None:
+        with _service_lock:
+            if _service is None:
+                _service = GeminiService()
+    return _service
+
+
+def __getattr__(name: str):
+    # 兼容 from app.services.gemini_service import gemini_service（基准脚本等）
+    if name == "gemini_service":
+        return get_gemini_service()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
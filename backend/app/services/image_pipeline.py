@@ -0,0 +1,142 @@
+"""
+Gemini 输入图片预处理
+满足尺寸/大小/格式要求的图片原样发送（保证坐标精度），否则旋转、转 RGB、按需缩放并重新编码为 JPEG
+
+独立于 API 层，便于基准测试 (benchmarks/bench_image_pipeline.py) 直接调用
+Pillow 在首次处理图片时才导入（应用启动后由 gemini_loader 在后台预热），不计入应用导入时间
+"""
+from typing import Optional
+from app.core import metrics, tracing
+import io
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 按角色的预处理参数（见 app/api/analyze.py）
+# 孩子照片: 阈值 6MB，保持高分辨率 (max_dim=8192)，质量 90（关键：避免 resize 导致坐标偏移）
+CHILD_PROFILE = {"max_dim": 8192, "max_bytes": 6 * 1024 * 1024, "quality": 90}
+# 父母照片: 阈值 3MB，可以压缩 (max_dim=2048)，质量 85
+PARENT_PROFILE = {"max_dim": 2048, "max_bytes": 3 * 1024 * 1024, "quality": 85}
+
+
+class InvalidImageError(Exception):
+    """图片无法解码或处理"""
+
+
+def _normalize_mime_type(content_type: Optional[str]) -> Optional[str]:
+    if not content_type:
+        return None
+    ct = content_type.strip().lower()
+    if ct == "image/jpg":
+        return "image/jpeg"
+    if ct.startswith("image/"):
+        return ct
+    return None
+
+
+def _pil_format_to_mime(pil_format: Optional[str]) -> Optional[str]:
+    if not pil_format:
+        return None
+    fmt = pil_format.upper()
+    if fmt == "JPEG":
+        return "image/jpeg"
+    if fmt == "PNG":
+        return "image/png"
+    if fmt == "WEBP":
+        return "image/webp"
+    if fmt == "GIF":
+        return "image/gif"
+    if fmt == "BMP":
+        return "image/bmp"
+    if fmt == "TIFF":
+        return "image/tiff"
+    return None
+
+
+def format_mb(size_in_bytes: int) -> str:
+    return f"{size_in_bytes / (1024 * 1024):.2f} MB"
+
+
+def preload() -> None:
+    """提前导入 Pillow"""
+    from PIL import Image, ImageOps  # noqa: F401
+
+
+def prepare_image_for_gemini(
+    file_bytes: bytes,
+    content_type: Optional[str],
+    label: str,
+    *,
+    max_dim: int = 8192,
+    max_bytes: int = 10 * 1024 * 1024,
+    quality: int = 95
+) -> tuple[bytes, str]:
+    """
+    为 Gemini 准备图片输入
+    """
+    from PIL import Image, ImageOps
+
+    normalized_ct = _normalize_mime_type(content_type)
+
+    try:
+        with metrics.stage("decode").time(), tracing.span("image.open", label=label, bytes=len(file_bytes)):
+            img = Image.open(io.BytesIO(file_bytes))
+        pil_mime = _pil_format_to_mime(img.format)
+        mime_type = normalized_ct or pil_mime or "image/jpeg"
+
+        exif = getattr(img, "getexif", lambda: None)()
+        orientation = 1
+        if exif:
+            orientation = int(exif.get(274, 1) or 1)
+
+        within_dim = max(img.size) <= max_dim
+        within_bytes = len(file_bytes) <= max_bytes
+        orientation_ok = (orientation == 1)
+        keep_mimes = {"image/jpeg", "image/png", "image/webp"}
+
+        # 满足条件: 保持原样
+        if (
+            mime_type in keep_mimes
+            and within_dim
+            and within_bytes
+            and (mime_type != "image/jpeg" or orientation_ok)
+        ):
+            logger.info(
+                "[%s] 保持原始发送: mime=%s, 尺寸=%s, 大小=%d bytes",
+                label, mime_type, img.size, len(file_bytes)
+            )
+            return file_bytes, mime_type
+
+        # 否则: 标准化处理
+        # 0. 解码像素 (Image.open 只读取了文件头)
+        with metrics.stage("decode").time(), tracing.span("image.decode", label=label):
+            img.load()
+
+        with metrics.stage("transform").time(), tracing.span("image.transform", label=label, size=str(img.size)):
+            # 1. 自动旋转
+            img = ImageOps.exif_transpose(img)
+            # 2. 转 RGB
+            if img.mode in ("RGBA", "P"):
+                img = img.convert("RGB")
+            
+            # 3. 压缩尺寸 (仅当超过 max_dim 时)
+            if max(img.size) > max_dim:
+                ratio = max_dim / max(img.size)
+                new_size = (int(img.width * ratio), int(img.height * ratio))
+                img = img.resize(new_size, Image.Resampling.LANCZOS)
+                logger.info("[%s] 触发尺寸压缩: %dpx 限制", label, max_dim)
+        
+        # 4. 重新编码 (JPEG)
+        with metrics.stage("encode").time(), tracing.span("image.encode", label=label, quality=quality):
+            buffer = io.BytesIO()
+            img.save(buffer, format="JPEG", quality=quality)
+            out_bytes = buffer.getvalue()
+        
+        logger.info(
+            "[%s] 标准化处理后 (Q=%d): in_mime=%s, in_size=%s, in_bytes=%d -> out_mime=image/jpeg, out_bytes=%d",
+            label, quality, mime_type, img.size, len(file_bytes), len(out_bytes)
+        )
+        return out_bytes, "image/jpeg"
+    except Exception as e:
+        logger.error("[%s] 图片处理失败: %s", label, e)
+        raise InvalidImageError(f"{label} 图片格式无效或已损坏") from e
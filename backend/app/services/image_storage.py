@@ -0,0 +1,88 @@
+"""
+分析图片存储
+统一图片文件名、磁盘路径与对外 URL (/api/images/...) 之间的映射，
+以及签名 URL 的生成与校验
+"""
+from datetime import datetime
+from typing import Optional
+from urllib.parse import urlsplit
+from app.core.config import get_settings
+import hashlib
+import hmac
+import os
+import re
+import time
+
+settings = get_settings()
+
+# 图片对外访问前缀（见 main.py 中的静态目录挂载 / app/api/images.py）
+IMAGE_URL_PREFIX = "/api/images/"
+
+# 允许访问的文件名（禁止子目录与路径穿越）
+SAFE_FILENAME = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,127}$")
+
+
+def images_dir() -> str:
+    """图片存储目录"""
+    return settings.images_storage_path
+
+
+def image_path(filename: str) -> str:
+    """文件名 -> 磁盘路径"""
+    return os.path.join(images_dir(), filename)
+
+
+def _signing_key() -> bytes:
+    """URL 签名密钥（未单独配置时由管理员密码派生）"""
+    secret = settings.image_url_secret or f"image-url:{settings.admin_password}"
+    return hashlib.sha256(secret.encode("utf-8")).digest()
+
+
+def sign(filename: str, expires: int) -> str:
+    """计算 文件名 + 过期时间 的 HMAC 签名"""
+    message = f"{filename}:{expires}".encode("utf-8")
+    return hmac.new(_signing_key(), message, hashlib.sha256).hexdigest()[:32]
+
+
+def verify_signature(filename: str, expires: int, signature: str) -> bool:
+    """校验签名且未过期"""
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(sign(filename, expires), signature)
+
+
+def image_url(filename: str, expires_at: Optional[datetime] = None) -> str:
+    """
+    文件名 -> 前端可访问的 URL
+    非 static 分发模式下附带签名，有效期到 expires_at（通常为兑换码过期时间）。
+    同一张图片的 URL 在有效期内保持不变，因此可以写入预序列化的结果响应体。
+    """
+    url = f"{IMAGE_URL_PREFIX}{filename}"
+    if settings.image_delivery_mode == "static" or expires_at is None:
+        return url
+    expires = int(expires_at.timestamp())
+    return f"{url}?exp={expires}&sig={sign(filename, expires)}"
+
+
+def filename_for_url(url: str) -> Optional[str]:
+    """前端 URL -> 文件名（忽略查询参数），不合法时返回 None"""
+    if not url:
+        return None
+    path = urlsplit(url).path
+    if not path.startswith(IMAGE_URL_PREFIX):
+        return None
+    filename = path[len(IMAGE_URL_PREFIX):]
+    if not SAFE_FILENAME.match(filename):
+        return None
+    return filename
+
+
+def image_path_for_url(url: str) -> Optional[str]:
+    """
+    前端 URL -> 磁盘路径
+    只接受 /api/images/ 下的文件名，防止路径穿越
+    """
+    filename = filename_for_url(url)
+    if not filename:
+        return None
+    return image_path(filename)
@@ -0,0 +1,496 @@
+"""
+模型调用后端
+GeminiService 通过 create_client() 获取客户端，按 GEMINI_MODE 选择：
+- live   - 直接调用 Gemini API（默认）
+- record - 调用 Gemini API，同时把请求指纹、原始响应与耗时写入录制文件 (cassette)
+- replay - 不访问网络，按请求指纹从录制文件返回响应，并按录制时的耗时等待
+
+录制/回放客户端与 genai.Client 接口一致（models.generate_content 及 aio 异步版本），
+GeminiService 的解析、单亲纠正与后续持久化逻辑完全不变，便于离线、确定性地压测与采样分析整条 /api/analyze 链路
+
+上下文缓存 (caches)：live / record 使用 Gemini 的缓存接口；replay 使用本地替身 LocalCaches（按 TTL 过期，
+过期或不存在时与服务端一样返回 404），可离线测试缓存的创建、续期与失效回退
+
+请求指纹：模型名 + 生成配置 + 各 part 文本 + 图片内容哈希 (SHA-256)；
+引用 cached_content 的请求按缓存中的系统提示词展开后计算，与直接发送系统提示词的请求指纹相同
+形状指纹：同上但不含图片内容，GEMINI_REPLAY_MATCH=shape 时找不到精确匹配会按形状轮流回放
+（压测脚本每次生成的图片都不同，用形状匹配即可复用少量录制）
+"""
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+from google.genai import errors, types
+from pydantic import BaseModel
+from app.core.config import get_settings
+import asyncio
+import hashlib
+import httpx
+import itertools
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+GEMINI_MODES = ("live", "record", "replay")
+REPLAY_MATCHES = ("exact", "shape")
+
+# 录制文件格式版本，结构不兼容时递增
+CASSETTE_VERSION = 1
+
+
+class CassetteMissError(LookupError):
+    """回放模式下找不到与请求匹配的录制"""
+
+
+_STATUS_NAMES = {
+    400: "INVALID_ARGUMENT",
+    403: "PERMISSION_DENIED",
+    404: "NOT_FOUND",
+    429: "RESOURCE_EXHAUSTED",
+    500: "INTERNAL",
+    502: "UNAVAILABLE",
+    503: "UNAVAILABLE",
+    504: "DEADLINE_EXCEEDED",
+}
+
+
+def api_error(code: int, message: str, retry_after: Optional[float] = None) -> errors.APIError:
+    """构造与 SDK 真实错误一致的异常（含 response，可读取状态码与 Retry-After 头）"""
+    status = _STATUS_NAMES.get(code, "UNKNOWN")
+    body = {"error": {"code": code, "message": message, "status": status}}
+    headers = {"Retry-After": f"{retry_after:g}"} if retry_after is not None else None
+    response = httpx.Response(code, json=body, headers=headers)
+    error_class = errors.ServerError if code >= 500 else errors.ClientError
+    return error_class(code, body, response)
+
+
+def _expand_cached(config: Optional[types.GenerateContentConfig], instruction) -> Optional[types.GenerateContentConfig]:
+    """引用缓存的配置 -> 等价的直接发送系统提示词的配置（用于计算指纹）"""
+    if config is None or instruction is None:
+        return config
+    return config.model_copy(update={"system_instruction": instruction, "cached_content": None})
+
+
+def _part_entry(part: types.Part, with_data: bool) -> dict:
+    if part.inline_data is not None:
+        entry = {"mime_type": part.inline_data.mime_type}
+        if with_data:
+            data = part.inline_data.data or b""
+            entry["sha256"] = hashlib.sha256(data).hexdigest()
+            entry["bytes"] = len(data)
+        return entry
+    return {"text": part.text}
+
+
+def _config_document(config: Optional[types.GenerateContentConfig]) -> dict:
+    if config is None:
+        return {}
+    # http_options 只含每次尝试的超时等传输参数，thinking_config 随负载自适应变化，均不参与指纹；
+    # pydantic 模型形式的 response_schema 按其 JSON Schema 计入
+    document = config.model_dump(mode="json", exclude_none=True,
+                                 exclude={"http_options", "thinking_config", "response_schema"})
+    schema = config.response_schema
+    if isinstance(schema, type) and issubclass(schema, BaseModel):
+        document["response_schema"] = schema.model_json_schema()
+    elif isinstance(schema, types.Schema):
+        document["response_schema"] = schema.model_dump(mode="json", exclude_none=True)
+    elif schema is not None:
+        document["response_schema"] = schema
+    return document
+
+
+def _request_document(model: str, contents, config: Optional[types.GenerateContentConfig], with_data: bool) -> dict:
+    if isinstance(contents, types.Content):
+        contents = [contents]
+    return {
+        "model": model,
+        "config": _config_document(config),
+        "contents": [
+            {"role": content.role, "parts": [_part_entry(p, with_data) for p in content.parts or []]}
+            for content in contents
+        ],
+    }
+
+
+def _digest(document: dict) -> str:
+    raw = json.dumps(document, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def fingerprint(model: str, contents, config: Optional[types.GenerateContentConfig] = None) -> str:
+    """请求指纹（包含图片内容）"""
+    return _digest(_request_document(model, contents, config, with_data=True))
+
+
+def shape_fingerprint(model: str, contents, config: Optional[types.GenerateContentConfig] = None) -> str:
+    """形状指纹（不含图片内容）"""
+    return _digest(_request_document(model, contents, config, with_data=False))
+
+
+@dataclass
+class Cassette:
+    """一条录制：请求指纹 + 原始响应 + 耗时"""
+    fingerprint: str
+    shape: str
+    latency_ms: float
+    response: dict
+    request: dict
+    recorded_at: str = ""
+
+    def to_response(self) -> types.GenerateContentResponse:
+        return types.GenerateContentResponse.model_validate(self.response)
+
+    def to_dict(self) -> dict:
+        return {
+            "version": CASSETTE_VERSION,
+            "fingerprint": self.fingerprint,
+            "shape": self.shape,
+            "latency_ms": round(self.latency_ms, 1),
+            "recorded_at": self.recorded_at,
+            "request": self.request,
+            "response": self.response,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Cassette":
+        return cls(
+            fingerprint=data["fingerprint"],
+            shape=data["shape"],
+            latency_ms=float(data.get("latency_ms") or 0),
+            response=data["response"],
+            request=data.get("request") or {},
+            recorded_at=data.get("recorded_at", ""),
+        )
+
+
+class CassetteStore:
+    """录制文件目录：每个请求指纹一个 JSON 文件"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._by_fingerprint: Optional[Dict[str, Cassette]] = None
+        self._by_shape: Dict[str, List[Cassette]] = {}
+        self._cycles: Dict[str, itertools.cycle] = {}
+
+    def path_for(self, fp: str) -> str:
+        return os.path.join(self.directory, f"{fp}.json")
+
+    def save(self, cassette: Cassette) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path_for(cassette.fingerprint)
+        # 同一指纹可能被多个线程同时写入，临时文件按进程与线程区分
+        tmp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(cassette.to_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+    def _load(self) -> Dict[str, Cassette]:
+        """首次回放时把目录中的录制全部读入内存"""
+        if self._by_fingerprint is not None:
+            return self._by_fingerprint
+        with self._lock:
+            if self._by_fingerprint is not None:
+                return self._by_fingerprint
+            by_fingerprint: Dict[str, Cassette] = {}
+            if os.path.isdir(self.directory):
+                for name in sorted(os.listdir(self.directory)):
+                    if not name.endswith(".json"):
+                        continue
+                    try:
+                        with open(os.path.join(self.directory, name), encoding="utf-8") as f:
+                            cassette = Cassette.from_dict(json.load(f))
+                    except (OSError, ValueError, KeyError) as e:
+                        logger.warning("跳过无效录制文件 %s: %s", name, e)
+                        continue
+                    by_fingerprint[cassette.fingerprint] = cassette
+            for cassette in by_fingerprint.values():
+                self._by_shape.setdefault(cassette.shape, []).append(cassette)
+            self._cycles = {shape: itertools.cycle(items) for shape, items in self._by_shape.items()}
+            logger.info("已加载 %d 条 Gemini 录制: %s", len(by_fingerprint), self.directory)
+            self._by_fingerprint = by_fingerprint
+            return by_fingerprint
+
+    def find(self, fp: str, shape: str, match: str = "exact") -> Optional[Cassette]:
+        cassette = self._load().get(fp)
+        if cassette is None and match == "shape" and shape in self._cycles:
+            with self._lock:
+                cassette = next(self._cycles[shape])
+        return cassette
+
+
+class _AsyncNamespace:
+    """对应 genai.Client.aio"""
+
+    def __init__(self, models, caches=None):
+        self.models = models
+        self.caches = caches
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数（中日韩字符约 1 个/token，其余约 4 字符/token），仅用于本地替身"""
+    cjk = len(re.findall(r"[\u3000-\u9fff\uff00-\uffef]", text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+class LocalCaches:
+    """
+    cached content 的本地替身（对应 genai.Client.caches 的 create / get / update / delete）
+    条目按 TTL 过期，过期或不存在时返回 404，与服务端行为一致
+    """
+
+    def __init__(self):
+        self._items: Dict[str, dict] = {}
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _ttl_seconds(config) -> float:
+        ttl = getattr(config, "ttl", None) if config is not None else None
+        return float(ttl.rstrip("s")) if ttl else 3600.0
+
+    def _content(self, name: str, item: dict) -> types.CachedContent:
+        return types.CachedContent(
+            name=name,
+            display_name=item["display_name"],
+            model=item["model"],
+            expire_time=datetime.fromtimestamp(item["expires_at"], timezone.utc),
+            usage_metadata=types.CachedContentUsageMetadata(total_token_count=item["tokens"]),
+        )
+
+    def _item(self, name: str) -> dict:
+        item = self._items.get(name)
+        if item is None or item["expires_at"] <= time.time():
+            self._items.pop(name, None)
+            raise api_error(404, f"CachedContent not found (or expired): {name}")
+        return item
+
+    def create(self, *, model: str, config: Optional[types.CreateCachedContentConfig] = None) -> types.CachedContent:
+        instruction = config.system_instruction if config is not None else None
+        text = instruction if isinstance(instruction, str) else ""
+        with self._lock:
+            name = f"cachedContents/local-{next(self._counter)}"
+            self._items[name] = {
+                "model": model,
+                "display_name": getattr(config, "display_name", None),
+                "system_instruction": instruction,
+                "tokens": estimate_tokens(text),
+                "expires_at": time.time() + self._ttl_seconds(config),
+            }
+            return self._content(name, self._items[name])
+
+    def get(self, *, name: str, config=None) -> types.CachedContent:
+        with self._lock:
+            return self._content(name, self._item(name))
+
+    def update(self, *, name: str, config: Optional[types.UpdateCachedContentConfig] = None) -> types.CachedContent:
+        with self._lock:
+            item = self._item(name)
+            item["expires_at"] = time.time() + self._ttl_seconds(config)
+            return self._content(name, item)
+
+    def delete(self, *, name: str, config=None) -> None:
+        with self._lock:
+            self._item(name)
+            del self._items[name]
+
+    def resolve(self, name: str):
+        """缓存名 -> (系统提示词, token 数)；不存在或已过期时抛出 404"""
+        with self._lock:
+            item = self._item(name)
+            return item["system_instruction"], item["tokens"]
+
+
+class _AsyncLocalCaches:
+    """LocalCaches 的异步接口（对应 genai.Client.aio.caches）"""
+
+    def __init__(self, caches: LocalCaches):
+        self._caches = caches
+
+    async def create(self, *, model: str, config=None):
+        return self._caches.create(model=model, config=config)
+
+    async def get(self, *, name: str, config=None):
+        return self._caches.get(name=name, config=config)
+
+    async def update(self, *, name: str, config=None):
+        return self._caches.update(name=name, config=config)
+
+    async def delete(self, *, name: str, config=None):
+        return self._caches.delete(name=name, config=config)
+
+
+class _RecordingModels:
+    def __init__(self, client: "RecordingClient", models, is_async: bool):
+        self._client = client
+        self._models = models
+        self._is_async = is_async
+
+    def generate_content(self, *, model: str, contents, config=None):
+        if self._is_async:
+            return self._generate_async(model, contents, config)
+        start = time.perf_counter()
+        response = self._models.generate_content(model=model, contents=contents, config=config)
+        self._client.record(model, contents, config, response, time.perf_counter() - start)
+        return response
+
+    async def _generate_async(self, model, contents, config):
+        start = time.perf_counter()
+        response = await self._models.generate_content(model=model, contents=contents, config=config)
+        # 指纹计算（图片哈希）与写文件在线程中进行，不阻塞事件循环
+        await asyncio.to_thread(self._client.record, model, contents, config, response, time.perf_counter() - start)
+        return response
+
+
+class _RecordingCaches:
+    """记录本进程创建的缓存对应的系统提示词，录制时按其展开指纹"""
+
+    def __init__(self, client: "RecordingClient", caches, is_async: bool):
+        self._client = client
+        self._caches = caches
+        self._is_async = is_async
+
+    def create(self, *, model: str, config=None):
+        if self._is_async:
+            return self._create_async(model, config)
+        cached = self._caches.create(model=model, config=config)
+        self._client.cache_instructions[cached.name] = getattr(config, "system_instruction", None)
+        return cached
+
+    async def _create_async(self, model, config):
+        cached = await self._caches.create(model=model, config=config)
+        self._client.cache_instructions[cached.name] = getattr(config, "system_instruction", None)
+        return cached
+
+    def __getattr__(self, name):
+        return getattr(self._caches, name)
+
+
+class RecordingClient:
+    """包装真实客户端，成功的调用写入录制文件（失败的调用不录制）"""
+
+    def __init__(self, client, store: CassetteStore):
+        self._client = client
+        self.store = store
+        self.cache_instructions: Dict[str, object] = {}
+        self.models = _RecordingModels(self, client.models, is_async=False)
+        caches, async_caches = getattr(client, "caches", None), getattr(client.aio, "caches", None)
+        self.caches = _RecordingCaches(self, caches, is_async=False) if caches is not None else None
+        self.aio = _AsyncNamespace(_RecordingModels(self, client.aio.models, is_async=True),
+                                   _RecordingCaches(self, async_caches, is_async=True) if async_caches is not None else None)
+
+    def __getattr__(self, name):
+        # 其余接口 (files / caches 等) 直接交给真实客户端
+        return getattr(self._client, name)
+
+    def record(self, model: str, contents, config, response: types.GenerateContentResponse, elapsed: float) -> None:
+        try:
+            if config is not None and config.cached_content:
+                config = _expand_cached(config, self.cache_instructions.get(config.cached_content))
+            cassette = Cassette(
+                fingerprint=fingerprint(model, contents, config),
+                shape=shape_fingerprint(model, contents, config),
+                latency_ms=elapsed * 1000,
+                response=response.model_dump(mode="json", exclude_none=True),
+                request=_request_document(model, contents, None, with_data=True),
+                recorded_at=datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            )
+            path = self.store.save(cassette)
+            logger.info("已录制 Gemini 响应: %s (%.0fms)", os.path.basename(path), cassette.latency_ms)
+        except Exception:
+            # 录制失败不影响正常请求
+            logger.exception("写入 Gemini 录制失败")
+
+
+class _ReplayModels:
+    def __init__(self, client: "ReplayClient", is_async: bool):
+        self._client = client
+        self._is_async = is_async
+
+    def generate_content(self, *, model: str, contents, config=None):
+        cached_tokens = None
+        if config is not None and config.cached_content:
+            # 缓存已过期或不存在时与服务端一样返回 404
+            instruction, cached_tokens = self._client.local_caches.resolve(config.cached_content)
+            config = _expand_cached(config, instruction)
+        cassette = self._client.lookup(model, contents, config)
+        delay = self._client.delay_for(cassette)
+        if self._is_async:
+            return self._replay_async(cassette, delay, cached_tokens)
+        if delay > 0:
+            time.sleep(delay)
+        return self._response(cassette, cached_tokens)
+
+    async def _replay_async(self, cassette: Cassette, delay: float, cached_tokens: Optional[int]):
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self._response(cassette, cached_tokens)
+
+    @staticmethod
+    def _response(cassette: Cassette, cached_tokens: Optional[int]) -> types.GenerateContentResponse:
+        response = cassette.to_response()
+        if cached_tokens is not None:
+            usage = response.usage_metadata or types.GenerateContentResponseUsageMetadata()
+            response.usage_metadata = usage.model_copy(update={"cached_content_token_count": cached_tokens})
+        return response
+
+
+class ReplayClient:
+    """从录制文件回放响应，不访问网络"""
+
+    def __init__(self, store: CassetteStore, match: str = "exact", latency_scale: float = 1.0):
+        self.store = store
+        self.match = match
+        self.latency_scale = latency_scale
+        self.local_caches = LocalCaches()
+        self.models = _ReplayModels(self, is_async=False)
+        self.caches = self.local_caches
+        self.aio = _AsyncNamespace(_ReplayModels(self, is_async=True), _AsyncLocalCaches(self.local_caches))
+
+    def lookup(self, model: str, contents, config) -> Cassette:
+        fp = fingerprint(model, contents, config)
+        cassette = self.store.find(fp, shape_fingerprint(model, contents, config), self.match)
+        if cassette is None:
+            raise CassetteMissError(f"没有与请求匹配的 Gemini 录制: {fp[:16]} (目录 {self.store.directory})")
+        if cassette.fingerprint != fp:
+            logger.debug("按形状回放录制 %s", cassette.fingerprint[:16])
+        return cassette
+
+    def delay_for(self, cassette: Cassette) -> float:
+        return max(cassette.latency_ms, 0) / 1000 * self.latency_scale
+
+
+def create_client():
+    """按 GEMINI_MODE 创建模型客户端（开启 GEMINI_FAULT_INJECTION 时再包装一层故障注入）"""
+    from app.services.fault_injection import wrap_client
+
+    return wrap_client(_create_base_client())
+
+
+def _create_base_client():
+    mode = settings.gemini_mode.lower()
+    if mode not in GEMINI_MODES:
+        raise ValueError(f"未知的 GEMINI_MODE: {settings.gemini_mode}，可选 {', '.join(GEMINI_MODES)}")
+
+    store = CassetteStore(settings.gemini_cassette_dir)
+    if mode == "replay":
+        if settings.gemini_replay_match not in REPLAY_MATCHES:
+            raise ValueError(f"未知的 GEMINI_REPLAY_MATCH: {settings.gemini_replay_match}，可选 {', '.join(REPLAY_MATCHES)}")
+        logger.info("Gemini 回放模式: %s (匹配方式 %s, 耗时倍率 %s)",
+                    store.directory, settings.gemini_replay_match, settings.gemini_replay_latency_scale)
+        return ReplayClient(store, settings.gemini_replay_match, settings.gemini_replay_latency_scale)
+
+    from google import genai
+
+    client = genai.Client(api_key=settings.gemini_api_key)
+    if mode == "record":
+        logger.info("Gemini 录制模式: %s", store.directory)
+        return RecordingClient(client, store)
+    return client
@@ -0,0 +1,143 @@
+"""
+分析结果响应体缓存
+分析完成时一次性序列化 /api/analyze/result 的最终响应体并（可选）压缩，
+之后每次查看都原样返回，配合强 ETag 支持 304 Not Modified
+"""
+from typing import Optional, Tuple
+import gzip
+import hashlib
+import json
+import logging
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+IDENTITY = "identity"
+GZIP = "gzip"
+ZSTD = "zstd"
+
+
+def child_image_key(child: int) -> str:
+    """第 child 个孩子（1 起）在 image_paths 中的键：child / child_2 / child_3 ..."""
+    return "child" if child == 1 else f"child_{child}"
+
+
+def child_count(result: Optional[dict]) -> int:
+    """结果中的孩子数（多个孩子一次分析时结果带 children）"""
+    children = result.get("children") if isinstance(result, dict) else None
+    return len(children) if children else 1
+
+
+def build_result_payload(result: dict, images: Optional[dict], child: int = 1) -> dict:
+    """
+    构建 /api/analyze/result 的响应结构
+    多个孩子时 child 为孩子序号 (1 起)：返回该孩子的结果，images.child 为该孩子的照片，并附 child / child_count
+    """
+    count = child_count(result)
+    if count > 1:
+        result = result["children"][child - 1]
+        if isinstance(images, dict):
+            images = {
+                "child": images.get(child_image_key(child)),
+                **{role: images[role] for role in ("father", "mother") if role in images},
+            }
+    payload = {
+        "success": True,
+        "analysis_results": result.get("analysis_results", []),
+        "face_center": result.get("face_center"),
+        "face_width": result.get("face_width"),
+        "images": images,  # 返回图片 URL
+    }
+    if count > 1:
+        payload["child"] = child
+        payload["child_count"] = count
+    return payload
+
+
+def serialize_payload(payload: dict) -> bytes:
+    """紧凑序列化（无多余空白，保留中文）"""
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def compute_etag(body: bytes) -> str:
+    """基于未压缩内容计算强 ETag 的标识部分（不含引号）"""
+    return hashlib.sha256(body).hexdigest()[:32]
+
+
+def encode_body(body: bytes, compression: str) -> Tuple[bytes, str]:
+    """
+    按配置压缩响应体
+    返回 (存储字节, 实际编码)，压缩不可用或无收益时退回 identity
+    """
+    compression = (compression or IDENTITY).strip().lower()
+
+    if compression == GZIP:
+        encoded = gzip.compress(body, compresslevel=9, mtime=0)
+    elif compression == ZSTD:
+        if zstandard is None:
+            logger.warning("未安装 zstandard，结果响应体改为 gzip 压缩")
+            return encode_body(body, GZIP)
+        encoded = zstandard.ZstdCompressor(level=19).compress(body)
+    else:
+        return body, IDENTITY
+
+    if len(encoded) >= len(body):
+        return body, IDENTITY
+    return encoded, compression
+
+
+def decode_body(data: bytes, encoding: Optional[str]) -> bytes:
+    """还原为未压缩的响应体"""
+    if encoding == GZIP:
+        return gzip.decompress(data)
+    if encoding == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("结果响应体为 zstd 压缩，但未安装 zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def accepts_encoding(accept_encoding: Optional[str], encoding: str) -> bool:
+    """判断客户端 Accept-Encoding 是否接受指定编码（忽略 q=0）"""
+    if not accept_encoding or encoding == IDENTITY:
+        return encoding == IDENTITY
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        if name.strip().lower() not in (encoding, "*"):
+            continue
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        return True
+    return False
+
+
+def format_etag(tag: str, encoding: str) -> str:
+    """不同压缩编码是不同表示，强 ETag 需要区分"""
+    if encoding == IDENTITY:
+        return f'"{tag}"'
+    return f'"{tag}-{encoding}"'
+
+
+def etag_matches(if_none_match: Optional[str], tag: str) -> bool:
+    """If-None-Match 是否命中（任一表示的 ETag 均视为命中）"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        candidate = candidate.strip('"')
+        if candidate == tag or candidate.startswith(f"{tag}-"):
+            return True
+    return False
@@ -0,0 +1,361 @@
+"""
+分析结果的结构定义与校验
+- response_schema: 发送给 Gemini 的结构化输出定义（pydantic 模型，分数范围随单亲/双亲模式变化）；
+  sibling_response_schema 为多个孩子一次分析的定义，FaceLocationSchema 为拆分模式下坐标请求的定义
+- parse_model_json: 把模型返回的文本解析为 JSON；严格解析失败时才依次尝试去掉代码块 / 截取 {...} / AST 解析
+- ResultValidator: 一次遍历完成校验与本地修复（固定 7 个部位、分数范围、0-100 坐标、Father/Mother），
+  轻微问题（别名、字符串数字、0-1 小数、越界、单亲指向缺席方等）直接修正并记录修复类型，不再请求 Gemini；
+  缺失的部位与坐标字段在结果中列出，由调用方决定是否补充请求
+
+校验器在创建时预先编译部位/家长别名表，校验本身只做字典查找与数值比较
+"""
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Literal, Optional, Tuple, Type
+from pydantic import BaseModel, Field, create_model
+import ast
+import json
+import math
+import re
+
+# 固定的 7 个分析部位（与提示词一致，顺序即展示顺序）
+FIXED_PARTS = ("眉毛", "眼睛", "鼻子", "嘴巴", "脸型", "头型", "总结")
+
+PARENT_ROLES = ("Father", "Mother")
+
+# 结果必须包含的坐标字段（缺失或无法修复时与缺失的部位一起列入 missing）
+LOCATION_FIELDS = ("face_center", "face_width")
+
+# 相似度分数范围：双亲模式像哪一方就给哪一方 50-99；单亲模式不像在场家长时给低分
+SCORE_RANGE = (50, 99)
+SINGLE_PARENT_SCORE_RANGE = (1, 99)
+
+# 缺少文案时的兜底描述
+FALLBACK_DESCRIPTION = "{part}更像{parent}。"
+
+_PARENT_NAMES = {"Father": "爸爸", "Mother": "妈妈"}
+
+_PART_ALIASES = {
+    "眉": "眉毛", "眉形": "眉毛", "eyebrow": "眉毛", "eyebrows": "眉毛",
+    "眼": "眼睛", "眼型": "眼睛", "双眼": "眼睛", "eye": "眼睛", "eyes": "眼睛",
+    "鼻": "鼻子", "鼻型": "鼻子", "nose": "鼻子",
+    "嘴": "嘴巴", "嘴唇": "嘴巴", "嘴型": "嘴巴", "唇形": "嘴巴", "mouth": "嘴巴", "lips": "嘴巴",
+    "脸": "脸型", "脸部": "脸型", "脸形": "脸型", "面型": "脸型", "脸部轮廓": "脸型", "face": "脸型", "faceshape": "脸型",
+    "头": "头型", "头部": "头型", "头形": "头型", "head": "头型", "headshape": "头型",
+    "总评": "总结", "总体": "总结", "整体": "总结", "综合": "总结", "总结分析": "总结", "summary": "总结", "overall": "总结",
+}
+
+_ROLE_ALIASES = {
+    "father": "Father", "dad": "Father", "daddy": "Father", "papa": "Father",
+    "爸爸": "Father", "父亲": "Father", "爸": "Father", "爹": "Father",
+    "mother": "Mother", "mom": "Mother", "mum": "Mother", "mommy": "Mother", "mama": "Mother",
+    "妈妈": "Mother", "母亲": "Mother", "妈": "Mother", "娘": "Mother",
+}
+
+# 部位名前的序号与空白，如 "1. 眉毛"、"（7）总结"
+_PART_PREFIX = re.compile(r"^[\s\d.、:：()（）\-]+")
+
+
+class ResultParseError(ValueError):
+    """模型返回的文本无法解析为 JSON"""
+
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+class ResultValidationError(ValueError):
+    """解析出的数据结构无法在本地修复"""
+
+
+class FaceCenterSchema(BaseModel):
+    """鼻尖坐标（占图片宽/高的百分比）"""
+    x: int = Field(ge=0, le=100)
+    y: int = Field(ge=0, le=100)
+
+
+class FaceLocationSchema(BaseModel):
+    """坐标请求（拆分模式）的结构化输出定义"""
+    face_center: FaceCenterSchema
+    face_width: int = Field(ge=0, le=100, description="脸部最宽处占图片宽度的百分比")
+
+
+@lru_cache(maxsize=None)
+def response_schema(target_role: Optional[str] = None) -> Type[BaseModel]:
+    """
+    结构化输出定义；target_role 为单亲模式下在场的家长（决定分数范围）
+    similar_to 始终允许 Father/Mother：SDK 会把单值 Literal 转成 Gemini 不支持的 const，单亲指向由校验器纠正
+    """
+    low, high = score_range(target_role)
+    item = create_model(
+        "AnalysisItem",
+        part=(Literal[FIXED_PARTS], ...),
+        similar_to=(Literal[PARENT_ROLES], ...),
+        similarity_score=(int, Field(ge=low, le=high)),
+        description=(str, ...),
+    )
+    return create_model(
+        "AnalysisResult",
+        face_center=(FaceCenterSchema, ...),
+        face_width=(int, Field(ge=0, le=100, description="脸部最宽处占图片宽度的百分比")),
+        analysis_results=(List[item], Field(min_length=len(FIXED_PARTS), max_length=len(FIXED_PARTS))),
+    )
+
+
+@lru_cache(maxsize=None)
+def sibling_response_schema(target_role: Optional[str], count: int) -> Type[BaseModel]:
+    """多个孩子一次分析的结构化输出定义：children 中每项为一个孩子的完整结果，child 为照片序号 (1 起)"""
+    child = create_model(
+        "ChildResult",
+        __base__=response_schema(target_role),
+        child=(int, Field(ge=1, le=count, description="孩子照片序号")),
+    )
+    return create_model(
+        "SiblingResult",
+        children=(List[child], Field(min_length=count, max_length=count)),
+    )
+
+
+def score_range(target_role: Optional[str] = None) -> Tuple[int, int]:
+    return SINGLE_PARENT_SCORE_RANGE if target_role else SCORE_RANGE
+
+
+def parse_model_json(text: Optional[str]) -> Tuple[object, str]:
+    """
+    模型文本 -> (JSON 值, 解析方式)
+    解析方式: json (直接解析) / fenced (去掉代码块或多余文字后解析) / ast (Python 字面量)
+    """
+    if not text or not text.strip():
+        raise ResultParseError("Gemini 返回了空内容", "empty")
+    try:
+        return json.loads(text), "json"
+    except ValueError:
+        pass
+
+    cleaned = text.strip()
+    if cleaned.startswith("```"):
+        lines = cleaned.split("\n")
+        fences = [i for i, line in enumerate(lines) if line.strip().startswith("```")]
+        if len(fences) >= 2:
+            cleaned = "\n".join(lines[fences[0] + 1:fences[-1]])
+        else:
+            cleaned = cleaned.replace("```json", "").replace("```", "")
+    start_idx, end_idx = cleaned.find("{"), cleaned.rfind("}")
+    if start_idx != -1 and end_idx > start_idx:
+        cleaned = cleaned[start_idx:end_idx + 1]
+
+    try:
+        return json.loads(cleaned), "fenced"
+    except ValueError as e:
+        error = e
+    try:
+        value = ast.literal_eval(cleaned)
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        raise ResultParseError(f"AI 返回数据异常: {error}", "not_json")
+    return value, "ast"
+
+
+@dataclass
+class ValidationReport:
+    """校验结果：修复后的数据、修复类型列表、缺失的部位与坐标字段"""
+    result: dict
+    repairs: List[str] = field(default_factory=list)
+    missing: List[str] = field(default_factory=list)
+
+
+def _number(value) -> Optional[float]:
+    """数值或数字字符串 ("85"、"85%") -> float；无法识别时返回 None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if math.isfinite(value) else None
+    if isinstance(value, str):
+        try:
+            number = float(value.strip().rstrip("%"))
+        except ValueError:
+            return None
+        return number if math.isfinite(number) else None
+    return None
+
+
+class ResultValidator:
+    """分析结果校验器（一次遍历完成校验与修复）"""
+
+    def __init__(self, parts: Tuple[str, ...] = FIXED_PARTS):
+        self.parts = parts
+        self._order = {part: i for i, part in enumerate(parts)}
+        self._part_lookup: Dict[str, str] = {self._key(part): part for part in parts}
+        self._part_lookup.update({self._key(alias): part for alias, part in _PART_ALIASES.items() if part in self._order})
+        self._role_lookup: Dict[str, str] = {role.lower(): role for role in PARENT_ROLES}
+        self._role_lookup.update(_ROLE_ALIASES)
+
+    @staticmethod
+    def _key(name: str) -> str:
+        return re.sub(r"[\s_\-]", "", _PART_PREFIX.sub("", name)).lower()
+
+    def canonical_part(self, name) -> Optional[str]:
+        if not isinstance(name, str):
+            return None
+        key = self._key(name)
+        part = self._part_lookup.get(key)
+        if part is None:
+            # "眉毛特征"、"眼睛 (Eyes)" 之类带后缀的写法
+            part = next((p for p in self.parts if key.startswith(p)), None)
+        return part
+
+    def canonical_role(self, name) -> Optional[str]:
+        if not isinstance(name, str):
+            return None
+        return self._role_lookup.get(name.strip().lower())
+
+    def validate(self, data, target_role: Optional[str] = None) -> ValidationReport:
+        """
+        校验并修复；target_role 为单亲模式下在场的家长
+        结构无法修复（不是对象、analysis_results 不是列表）时抛出 ResultValidationError
+        """
+        if not isinstance(data, dict):
+            raise ResultValidationError(f"AI 返回数据不是 JSON 对象 ({type(data).__name__})")
+        repairs: List[str] = []
+        result = {
+            "face_center": self._face_center(data.get("face_center"), repairs),
+            "face_width": self._percent(data.get("face_width"), "face_width", repairs),
+        }
+
+        raw_items = data.get("analysis_results")
+        if raw_items is None:
+            raw_items = []
+        if not isinstance(raw_items, list):
+            raise ResultValidationError("AI 返回数据中 analysis_results 不是列表")
+
+        items: Dict[str, dict] = {}
+        for raw in raw_items:
+            item = self._item(raw, target_role, repairs)
+            if item is None:
+                continue
+            if item["part"] in items:
+                repairs.append("duplicate_part")
+                continue
+            items[item["part"]] = item
+
+        result["analysis_results"] = [items[part] for part in self.parts if part in items]
+        return ValidationReport(result, repairs, self._missing(result))
+
+    def validate_location(self, data) -> ValidationReport:
+        """校验坐标请求的结果（face_center / face_width），缺少任一项时抛出 ResultValidationError"""
+        if not isinstance(data, dict):
+            raise ResultValidationError(f"坐标结果不是 JSON 对象 ({type(data).__name__})")
+        repairs: List[str] = []
+        result = {
+            "face_center": self._face_center(data.get("face_center"), repairs),
+            "face_width": self._percent(data.get("face_width"), "face_width", repairs),
+        }
+        if result["face_center"] is None or result["face_width"] is None:
+            raise ResultValidationError("坐标结果缺少 face_center 或 face_width")
+        return ValidationReport(result, repairs)
+
+    def merge(self, report: ValidationReport, data, target_role: Optional[str] = None) -> ValidationReport:
+        """把补充请求返回的 analysis_results 与坐标合并进已有结果（只补缺失的部位与坐标）"""
+        data = data if isinstance(data, dict) else {}
+        raw_items = data.get("analysis_results")
+        extra = self.validate(dict(data, analysis_results=raw_items if isinstance(raw_items, list) else []),
+                              target_role)
+        items = {item["part"]: item for item in report.result["analysis_results"]}
+        for item in extra.result["analysis_results"]:
+            items.setdefault(item["part"], item)
+        result = dict(report.result, analysis_results=[items[part] for part in self.parts if part in items])
+        for name in LOCATION_FIELDS:
+            if result[name] is None:
+                result[name] = extra.result[name]
+        return ValidationReport(result, report.repairs + extra.repairs, self._missing(result))
+
+    def _missing(self, result: dict) -> List[str]:
+        """缺失的部位，加上缺失或无法修复的坐标字段"""
+        parts = {item["part"] for item in result["analysis_results"]}
+        return [part for part in self.parts if part not in parts] + [
+            name for name in LOCATION_FIELDS if result[name] is None]
+
+    def _face_center(self, value, repairs: List[str]) -> Optional[dict]:
+        if value is None:
+            return None
+        if isinstance(value, (list, tuple)) and len(value) == 2:
+            value = {"x": value[0], "y": value[1]}
+            repairs.append("coordinate_coerced")
+        if not isinstance(value, dict):
+            repairs.append("coordinate_dropped")
+            return None
+        x, y = _number(value.get("x")), _number(value.get("y"))
+        if x is None or y is None:
+            repairs.append("coordinate_dropped")
+            return None
+        # 0-1 的比例坐标
+        if 0 <= x <= 1 and 0 <= y <= 1 and not (x.is_integer() and y.is_integer()):
+            x, y = x * 100, y * 100
+            repairs.append("coordinate_scaled")
+        return {"x": self._clamp(x, 0, 100, "coordinate_clamped", repairs),
+                "y": self._clamp(y, 0, 100, "coordinate_clamped", repairs)}
+
+    def _percent(self, value, name: str, repairs: List[str]) -> Optional[int]:
+        if value is None:
+            return None
+        number = _number(value)
+        if number is None:
+            repairs.append(f"{name}_dropped")
+            return None
+        if 0 < number < 1:
+            number *= 100
+            repairs.append(f"{name}_scaled")
+        return self._clamp(number, 0, 100, f"{name}_clamped", repairs)
+
+    def _item(self, raw, target_role: Optional[str], repairs: List[str]) -> Optional[dict]:
+        if not isinstance(raw, dict):
+            repairs.append("item_dropped")
+            return None
+        part = self.canonical_part(raw.get("part"))
+        if part is None:
+            repairs.append("unknown_part")
+            return None
+        if part != raw.get("part"):
+            repairs.append("part_renamed")
+
+        role = self.canonical_role(raw.get("similar_to"))
+        if role is None and target_role is None:
+            repairs.append("unknown_role")
+            return None
+        if role is not None and role != raw.get("similar_to"):
+            repairs.append("role_renamed")
+
+        score = _number(raw.get("similarity_score"))
+        if score is None:
+            repairs.append("score_dropped")
+            return None
+        if 0 < score < 1:
+            score *= 100
+            repairs.append("score_scaled")
+
+        if target_role is not None and role != target_role:
+            # 单亲模式：像缺席方 = 不像在场家长，分数反转（像 Mother 80 -> 像 Father 20）
+            if role is not None:
+                score = 100 - score
+            role = target_role
+            repairs.append("role_redirected")
+        elif target_role is None and score < SCORE_RANGE[0]:
+            # 双亲模式：像 Father 30 等价于像 Mother 70
+            role = PARENT_ROLES[1] if role == PARENT_ROLES[0] else PARENT_ROLES[0]
+            score = 100 - score
+            repairs.append("role_flipped")
+        low, high = score_range(target_role)
+        score = self._clamp(score, low, high, "score_clamped", repairs)
+
+        description = raw.get("description")
+        if not isinstance(description, str) or not description.strip():
+            description = FALLBACK_DESCRIPTION.format(part=part, parent=_PARENT_NAMES[role])
+            repairs.append("description_missing")
+        return {"part": part, "similar_to": role, "similarity_score": score, "description": description.strip()}
+
+    @staticmethod
+    def _clamp(value: float, low: int, high: int, kind: str, repairs: List[str]) -> int:
+        number = int(round(value))
+        if number < low or number > high:
+            repairs.append(kind)
+            number = min(high, max(low, number))
+        return number
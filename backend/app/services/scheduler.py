@@ -4,72 +4,274 @@
 """
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
-from sqlalchemy import delete
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import delete, select
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
 from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
 from app.core.database import async_session
 from app.core.config import get_settings
-from app.models import CardKey
+from app.core import metrics
+from app.models import CardKey, CardResultBody, ImageBlob, utcnow
+from app.services import image_storage, blob_store
+from app.services.storage import TEMP_PREFIX, get_storage
+import asyncio
 import logging
 import os
+import re
+import time
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
 scheduler = AsyncIOScheduler()
 
+# 每批删除的过期记录数（每批一个短事务，避免长时间持有 SQLite 写锁）
+CLEANUP_BATCH_SIZE = 500
+
+# 删除文件使用的线程数
+FILE_DELETE_WORKERS = 4
+
+# 孤儿图片宽限期：刚写入、尚未提交到数据库的图片不会被误删
+ORPHAN_GRACE_SECONDS = 3600
+
+# 旧版按兑换码命名的图片: {兑换码}_{角色}.{扩展名}
+LEGACY_IMAGE_PATTERN = re.compile(r"^(?P<code>.+)_(child|father|mother)\.(jpg|jpeg|png|webp)$")
+
+
+@dataclass
+class CleanupStats:
+    """单次清理的统计数据"""
+    started_at: str = ""
+    duration_seconds: float = 0.0
+    batches: int = 0
+    expired_records: int = 0
+    deleted_files: int = 0
+    missing_files: int = 0
+    failed_files: int = 0
+    released_blobs: int = 0
+    orphan_files: int = 0
+    orphan_scan_seconds: float = 0.0
+
+
+# 最近一次清理的统计（供监控读取）
+last_cleanup_stats: Optional[CleanupStats] = None
+
+
+def _remove_file(path: str) -> str:
+    """删除单个文件，返回结果: deleted / missing / failed"""
+    try:
+        os.remove(path)
+        return "deleted"
+    except FileNotFoundError:
+        return "missing"
+    except OSError as e:
+        logger.warning(f"删除文件失败: {path}, {e}")
+        return "failed"
+
+
+async def _remove_files(pool: ThreadPoolExecutor, paths: Iterable[str], stats: CleanupStats):
+    """在线程池中并发删除文件并累计统计"""
+    loop = asyncio.get_running_loop()
+    outcomes = await asyncio.gather(*(loop.run_in_executor(pool, _remove_file, p) for p in paths))
+    for outcome in outcomes:
+        if outcome == "deleted":
+            stats.deleted_files += 1
+        elif outcome == "missing":
+            stats.missing_files += 1
+        else:
+            stats.failed_files += 1
+
+
+def _filenames_from_image_urls(image_paths) -> List[str]:
+    """从 image_paths 中保存的 /api/images/... URL 提取文件名"""
+    if not image_paths:
+        return []
+    urls = image_paths.values() if isinstance(image_paths, dict) else image_paths
+    filenames = []
+    for url in urls:
+        filename = image_storage.filename_for_url(url) if isinstance(url, str) else None
+        if filename:
+            filenames.append(filename)
+    return filenames
+
+
+async def _delete_expired_batches(pool: ThreadPoolExecutor, expiry_time: datetime, stats: CleanupStats):
+    """
+    按 activated_at 索引分批删除过期记录，同一事务内释放 Blob 引用，
+    提交后再删除旧版按兑换码命名的文件和引用归零的 Blob
+    （Blob 只删除修改时间早于宽限期的：被重新引用时会刷新时间，避免与并发写入竞争）
+    """
+    storage = get_storage()
+    while True:
+        async with async_session() as db:
+            stmt = (
+                select(CardKey.id, CardKey.image_keys, CardKey.image_paths)
+                .where(CardKey.activated_at < expiry_time)
+                .order_by(CardKey.activated_at)
+                .limit(CLEANUP_BATCH_SIZE)
+            )
+            rows = (await db.execute(stmt)).all()
+            if not rows:
+                break
+
+            filenames = []
+            for row in rows:
+                if row.image_keys:
+                    filenames.extend(row.image_keys)
+                else:
+                    # 旧数据没有 image_keys，从 URL 中解析
+                    filenames.extend(_filenames_from_image_urls(row.image_paths))
+
+            ids = [row.id for row in rows]
+            await db.execute(delete(CardResultBody).where(CardResultBody.card_id.in_(ids)))
+            await db.execute(delete(CardKey).where(CardKey.id.in_(ids)))
+            dead_blobs = await blob_store.release_refs(db, filenames)
+            await db.commit()
+
+        stats.batches += 1
+        stats.expired_records += len(rows)
+
+        legacy_paths = [
+            image_storage.image_path(name) for name in filenames if not blob_store.is_blob_key(name)
+        ]
+        await _remove_files(pool, legacy_paths, stats)
+
+        cutoff = time.time() - ORPHAN_GRACE_SECONDS
+        outcomes = await storage.delete_stale(dead_blobs, cutoff)
+        stats.released_blobs += len(dead_blobs)
+        stats.deleted_files += outcomes.count("deleted")
+        stats.missing_files += outcomes.count("missing")
+        stats.failed_files += outcomes.count("failed")
+
+        if len(rows) < CLEANUP_BATCH_SIZE:
+            break
+
+
+def _scan_orphan_candidates(directory: str, cutoff: float) -> tuple:
+    """
+    扫描图片目录中超过宽限期的文件
+    只认 Blob 文件名、旧版 {兑换码}_{角色} 文件名与原子写入遗留的临时文件，其余文件一律不动
+    返回 ({Blob 文件名: 路径}, {兑换码: [旧版文件路径, ...]}, [临时文件路径, ...])
+    """
+    blobs = {}
+    legacy = {}
+    temps = []
+    try:
+        entries = os.scandir(directory)
+    except FileNotFoundError:
+        return blobs, legacy, temps
+    with entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            try:
+                if entry.stat().st_mtime >= cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            if blob_store.is_blob_key(entry.name):
+                blobs[entry.name] = entry.path
+            elif entry.name.startswith(TEMP_PREFIX):
+                temps.append(entry.path)
+            else:
+                match = LEGACY_IMAGE_PATTERN.match(entry.name)
+                if match:
+                    legacy.setdefault(match.group("code"), []).append(entry.path)
+    return blobs, legacy, temps
+
+
+async def _find_missing(column, candidates: list) -> set:
+    """分块查询，返回 candidates 中在数据库里不存在的值"""
+    missing = set()
+    for i in range(0, len(candidates), CLEANUP_BATCH_SIZE):
+        chunk = candidates[i:i + CLEANUP_BATCH_SIZE]
+        async with async_session() as db:
+            result = await db.execute(select(column).where(column.in_(chunk)))
+            existing = set(result.scalars().all())
+        missing.update(value for value in chunk if value not in existing)
+    return missing
+
+
+async def _sweep_orphan_images(pool: ThreadPoolExecutor, stats: CleanupStats):
+    """删除数据库中已无对应记录（兑换码或 Blob 引用）的图片文件，以及超过宽限期的写入临时文件"""
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    cutoff = time.time() - ORPHAN_GRACE_SECONDS
+    blobs, legacy, temps = await loop.run_in_executor(
+        pool, _scan_orphan_candidates, image_storage.images_dir(), cutoff
+    )
+
+    orphan_paths = list(temps)
+    for key in await _find_missing(ImageBlob.key, list(blobs)):
+        orphan_paths.append(blobs[key])
+    for code in await _find_missing(CardKey.code, list(legacy)):
+        orphan_paths.extend(legacy[code])
+
+    before = stats.deleted_files
+    await _remove_files(pool, orphan_paths, stats)
+    stats.orphan_files = stats.deleted_files - before
+    stats.orphan_scan_seconds = round(time.perf_counter() - start, 3)
+
+
+def _record_metrics(stats: CleanupStats, failed: bool) -> None:
+    """单次清理的统计累加到 /metrics"""
+    metrics.CLEANUP_RUNS.labels(outcome="failed" if failed else "success").inc()
+    metrics.CLEANUP_ROWS_DELETED.inc(stats.expired_records)
+    metrics.CLEANUP_FILES_REMOVED.labels(result="deleted").inc(stats.deleted_files)
+    metrics.CLEANUP_FILES_REMOVED.labels(result="missing").inc(stats.missing_files)
+    metrics.CLEANUP_FILES_REMOVED.labels(result="failed").inc(stats.failed_files)
+    metrics.CLEANUP_ORPHANS_SWEPT.inc(stats.orphan_files)
+    metrics.CLEANUP_DURATION.observe(stats.duration_seconds)
+    if not failed:
+        metrics.CLEANUP_LAST_SUCCESS.set(time.time())
+
 
 async def cleanup_expired_data():
     """
     清理过期数据
-    
+
     来自设计文档：
     - 每小时运行一次
     - 删除激活时间超过 24 小时的记录
     - 同时删除对应的临时文件
+
+    实现：按 activated_at 索引分批删除（每批一个短事务），
+    文件删除放到线程池，最后清扫无主的孤儿图片。
+    对象存储由存储桶生命周期规则删除图片，这里只维护数据库记录与引用计数
     """
-    async with async_session() as db:
+    global last_cleanup_stats
+
+    stats = CleanupStats(started_at=utcnow().isoformat(timespec="seconds"))
+    start = time.perf_counter()
+
+    # 计算过期时间点
+    expiry_time = utcnow() - timedelta(hours=settings.data_retention_hours)
+
+    failed = False
+    with ThreadPoolExecutor(max_workers=FILE_DELETE_WORKERS, thread_name_prefix="cleanup") as pool:
         try:
-            # 计算过期时间点
-            expiry_time = datetime.now() - timedelta(hours=settings.data_retention_hours)
-            
-            # 查询要删除的记录（用于清理文件）
-            from sqlalchemy import select
-            stmt = select(CardKey).where(
-                CardKey.activated_at < expiry_time,
-                CardKey.activated_at.isnot(None)
-            )
-            result = await db.execute(stmt)
-            expired_cards = result.scalars().all()
-            
-            # 删除临时文件
-            for card in expired_cards:
-                if card.image_paths:
-                    import json
-                    try:
-                        paths = json.loads(card.image_paths)
-                        for path in paths:
-                            if os.path.exists(path):
-                                os.remove(path)
-                                logger.debug(f"已删除临时文件: {path}")
-                    except Exception as e:
-                        logger.warning(f"清理临时文件失败: {e}")
-            
-            # 删除数据库记录
-            delete_stmt = delete(CardKey).where(
-                CardKey.activated_at < expiry_time,
-                CardKey.activated_at.isnot(None)
-            )
-            result = await db.execute(delete_stmt)
-            await db.commit()
-            
-            deleted_count = result.rowcount
-            if deleted_count > 0:
-                logger.info(f"清理过期数据完成，删除 {deleted_count} 条记录")
-            
-        except Exception as e:
+            await _delete_expired_batches(pool, expiry_time, stats)
+        except Exception:
+            failed = True
             logger.exception("清理过期数据时发生错误")
 
+        if not get_storage().manages_expiry:
+            try:
+                await _sweep_orphan_images(pool, stats)
+            except Exception:
+                failed = True
+                logger.exception("清理孤儿图片时发生错误")
+
+    stats.duration_seconds = round(time.perf_counter() - start, 3)
+    last_cleanup_stats = stats
+    _record_metrics(stats, failed)
+
+    if stats.expired_records or stats.deleted_files or stats.failed_files:
+        logger.info(f"清理过期数据完成: {asdict(stats)}")
+    else:
+        logger.debug(f"清理过期数据完成: {asdict(stats)}")
+
 
 def start_scheduler():
     """启动定时任务调度器"""
@@ -81,7 +283,7 @@ def start_scheduler():
         name="清理过期数据",
         replace_existing=True
     )
-    
+
     scheduler.start()
     logger.info("定时任务调度器已启动")
 
@@ -0,0 +1,254 @@
+"""
+图片对象存储抽象
+- FilesystemStorage: 本地目录（默认），经 /api/images 分发
+- S3Storage: S3 兼容对象存储（AWS S3 / MinIO 等），读取走预签名 URL，
+  过期由存储桶生命周期规则处理，API 层不再依赖本机磁盘，可横向扩展
+
+上层（blob_store / analyze / 清理任务）只通过 get_storage() 使用
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Iterable, List, Optional
+from app.core.config import get_settings
+from app.services import image_storage
+import asyncio
+import logging
+import math
+import os
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+# 预签名 URL 最长有效期 (SigV4 上限 7 天)
+MAX_PRESIGN_SECONDS = 7 * 24 * 3600
+
+# 原子写入使用的临时文件前缀（写入中途崩溃会留下这类文件，由清理任务回收）
+TEMP_PREFIX = ".tmp-"
+
+# HEAD 请求没有响应体，不存在时错误码为 "404"；其余请求为 NoSuchBucket / NoSuchKey
+_NOT_FOUND_CODES = {"404", "NotFound", "NoSuchBucket", "NoSuchKey"}
+
+
+def _is_not_found(error) -> bool:
+    """botocore ClientError 是否表示存储桶 / 对象不存在（403、区域错误等不属于此类）"""
+    return str(error.response.get("Error", {}).get("Code", "")) in _NOT_FOUND_CODES
+
+
+class Storage:
+    """存储后端接口"""
+
+    # 是否由存储自身负责过期删除（如 S3 生命周期规则）
+    manages_expiry = False
+
+    async def startup(self) -> None:
+        """启动时初始化（建目录 / 校验存储桶等）"""
+
+    async def put(self, key: str, data: bytes, content_type: str) -> bool:
+        """写入对象，已存在时刷新其时间戳；返回是否实际上传了数据"""
+        raise NotImplementedError
+
+    def url(self, key: str, expires_at: Optional[datetime]) -> str:
+        """生成前端可访问的 URL，有效期到 expires_at"""
+        raise NotImplementedError
+
+    async def delete_stale(self, keys: Iterable[str], cutoff: float) -> List[str]:
+        """删除修改时间早于 cutoff 的对象，返回每个对象的结果 deleted / missing / skipped / failed"""
+        raise NotImplementedError
+
+
+class FilesystemStorage(Storage):
+    """本地目录存储：临时文件 + rename 原子写入，I/O 在线程池执行"""
+
+    def __init__(self, directory: str, max_workers: int = 4):
+        self.directory = directory
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="storage-fs")
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def startup(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _write_atomic(self, key: str, data: bytes) -> bool:
+        path = os.path.join(self.directory, key)
+        if os.path.exists(path):
+            try:
+                # 内容寻址：已存在即内容相同，只刷新修改时间（防止被当作过期文件删除）
+                os.utime(path)
+                return False
+            except FileNotFoundError:
+                pass  # 恰好被清理任务删除，重新写入
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=TEMP_PREFIX)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+        return True
+
+    async def put(self, key: str, data: bytes, content_type: str) -> bool:
+        return await self._run(self._write_atomic, key, data)
+
+    def url(self, key: str, expires_at: Optional[datetime]) -> str:
+        return image_storage.image_url(key, expires_at)
+
+    def _delete_if_stale(self, key: str, cutoff: float) -> str:
+        path = os.path.join(self.directory, key)
+        try:
+            if os.stat(path).st_mtime >= cutoff:
+                return "skipped"
+            os.remove(path)
+            return "deleted"
+        except FileNotFoundError:
+            return "missing"
+        except OSError as e:
+            logger.warning(f"删除文件失败: {path}, {e}")
+            return "failed"
+
+    async def delete_stale(self, keys: Iterable[str], cutoff: float) -> List[str]:
+        return list(await asyncio.gather(*(self._run(self._delete_if_stale, k, cutoff) for k in keys)))
+
+
+class S3Storage(Storage):
+    """
+    S3 兼容对象存储
+    - boto3 客户端在专用线程池中调用，连接池大小与线程数一致
+    - 读取走预签名 GET URL（可单独配置对外地址，如 MinIO 在容器内外地址不同）
+    - 过期由存储桶生命周期规则删除，清理任务只维护数据库引用计数
+    """
+
+    manages_expiry = True
+
+    def __init__(self):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError as e:
+            raise RuntimeError("STORAGE_BACKEND=s3 需要安装 boto3") from e
+
+        if not settings.s3_bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 需要配置 S3_BUCKET")
+
+        self.bucket = settings.s3_bucket
+        self.prefix = settings.s3_prefix
+        pool_size = settings.s3_max_pool_connections
+        config = Config(
+            max_pool_connections=pool_size,
+            retries={"max_attempts": 3, "mode": "standard"},
+            s3={"addressing_style": "path"} if settings.s3_endpoint_url else None,
+        )
+        options = {
+            "region_name": settings.s3_region,
+            "aws_access_key_id": settings.s3_access_key_id or None,
+            "aws_secret_access_key": settings.s3_secret_access_key or None,
+            "config": config,
+        }
+        session = boto3.session.Session()
+        self._client = session.client("s3", endpoint_url=settings.s3_endpoint_url or None, **options)
+        # 预签名 URL 需要浏览器可访问的地址
+        public_endpoint = settings.s3_public_endpoint_url or settings.s3_endpoint_url or None
+        self._presign_client = session.client("s3", endpoint_url=public_endpoint, **options)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="storage-s3")
+
+    async def _run(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: fn(*args, **kwargs))
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def _ensure_bucket(self) -> None:
+        from botocore.exceptions import ClientError
+
+        try:
+            self._client.head_bucket(Bucket=self.bucket)
+        except ClientError as e:
+            # 无权限 (403)、区域错误 (301/400) 等不能当作不存在：直接报错，避免在错误的位置创建存储桶
+            if not _is_not_found(e):
+                raise
+            # 本地 MinIO 等开发环境自动创建存储桶
+            self._client.create_bucket(Bucket=self.bucket)
+            logger.info(f"已创建存储桶: {self.bucket}")
+
+        if settings.s3_manage_lifecycle:
+            # 对象最后一次写入/刷新后保留「数据保留时间 + 1 天」，覆盖最晚过期的引用
+            days = math.ceil(settings.data_retention_hours / 24) + 1
+            self._client.put_bucket_lifecycle_configuration(
+                Bucket=self.bucket,
+                LifecycleConfiguration={"Rules": [{
+                    "ID": "expire-analysis-images",
+                    "Filter": {"Prefix": self.prefix},
+                    "Status": "Enabled",
+                    "Expiration": {"Days": days},
+                }]},
+            )
+
+    async def startup(self) -> None:
+        await self._run(self._ensure_bucket)
+
+    def _put(self, key: str, data: bytes, content_type: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        object_key = self._object_key(key)
+        try:
+            self._client.head_object(Bucket=self.bucket, Key=object_key)
+        except ClientError as e:
+            if not _is_not_found(e):
+                raise
+            self._client.put_object(
+                Bucket=self.bucket, Key=object_key, Body=data, ContentType=content_type,
+                CacheControl="private, max-age=31536000, immutable",
+            )
+            return True
+
+        # 已存在：服务端原地复制以刷新 LastModified，生命周期从最新引用重新计时
+        self._client.copy_object(
+            Bucket=self.bucket, Key=object_key,
+            CopySource={"Bucket": self.bucket, "Key": object_key},
+            MetadataDirective="REPLACE", ContentType=content_type,
+            CacheControl="private, max-age=31536000, immutable",
+        )
+        return False
+
+    async def put(self, key: str, data: bytes, content_type: str) -> bool:
+        return await self._run(self._put, key, data, content_type)
+
+    def url(self, key: str, expires_at: Optional[datetime]) -> str:
+        seconds = MAX_PRESIGN_SECONDS
+        if expires_at is not None:
+            seconds = int(expires_at.timestamp() - time.time())
+        seconds = min(max(seconds, 60), MAX_PRESIGN_SECONDS)
+        return self._presign_client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self._object_key(key)},
+            ExpiresIn=seconds,
+        )
+
+    async def delete_stale(self, keys: Iterable[str], cutoff: float) -> List[str]:
+        # 由生命周期规则删除，这里不逐个删除
+        return ["skipped" for _ in keys]
+
+
+_storage: Optional[Storage] = None
+
+
+def get_storage() -> Storage:
+    """按配置创建存储后端单例"""
+    global _storage
+    if _storage is None:
+        if settings.storage_backend == "s3":
+            _storage = S3Storage()
+        else:
+            _storage = FilesystemStorage(settings.images_storage_path)
+    return _storage
@@ -0,0 +1,94 @@
+"""
+思考预算控制
+思考时长是 Gemini 延迟中波动最大的部分，ThinkingBudgetController 为每次分析选择 thinking_budget：
+- 基准预算 (level)：按延迟 SLO 反馈调整，每 adjust_every 个样本比较近期 p95 与 SLO，
+  p95 超过 SLO 时乘以 decrease，低于 SLO × headroom 时增加上限的 increase_step
+- 每次请求再按当前并发深度（进行中的 Gemini 分析数）线性压低：深度 1 时取 level，达到 busy_depth 时取下限
+
+即负载高、延迟逼近 SLO 时少思考，空闲时多思考；预算按 128 取整
+预算通过 ThinkingConfig.thinking_budget 下发（google-genai >= 1.10）
+"""
+from collections import deque
+from typing import Optional
+from google.genai import types
+import logging
+import math
+import threading
+
+logger = logging.getLogger(__name__)
+
+def thinking_config(budget: int) -> types.ThinkingConfig:
+    """思考预算 -> ThinkingConfig（0 表示不思考）"""
+    return types.ThinkingConfig(thinking_budget=budget)
+
+
+class ThinkingBudgetController:
+    """按延迟 SLO 与并发深度自适应的思考预算"""
+
+    def __init__(self, slo_seconds: float, min_budget: int, max_budget: int, busy_depth: int = 8,
+                 window: int = 100, min_samples: int = 10, adjust_every: int = 5,
+                 decrease: float = 0.7, increase_step: float = 0.1, headroom: float = 0.7):
+        self.slo_seconds = slo_seconds
+        self.min_budget = min_budget
+        self.max_budget = max(max_budget, min_budget)
+        self.busy_depth = max(busy_depth, 2)
+        self.min_samples = min_samples
+        self.adjust_every = adjust_every
+        self.decrease = decrease
+        self.increase_step = increase_step
+        self.headroom = headroom
+        self._level = float(self.max_budget)
+        self._samples = deque(maxlen=window)
+        self._since_adjust = 0
+        self._active = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def fixed(cls, budget: int) -> "ThinkingBudgetController":
+        """固定预算（不自适应）"""
+        return cls(slo_seconds=math.inf, min_budget=budget, max_budget=budget)
+
+    @property
+    def level(self) -> int:
+        return self._round(self._level)
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def _round(self, value: float) -> int:
+        if self.min_budget == self.max_budget:
+            return self.max_budget
+        value = math.floor(value / 128) * 128
+        return int(min(self.max_budget, max(self.min_budget, value)))
+
+    def start(self) -> int:
+        """开始一次分析，按当前并发深度返回本次的思考预算；结束后必须调用 finish()"""
+        with self._lock:
+            self._active += 1
+            load = min(1.0, (self._active - 1) / (self.busy_depth - 1))
+            return self._round(self._level - (self._level - self.min_budget) * load)
+
+    def finish(self, latency: Optional[float] = None) -> None:
+        """结束一次分析；latency 为成功调用的耗时（秒），失败时不传"""
+        with self._lock:
+            self._active = max(self._active - 1, 0)
+            if latency is None:
+                return
+            self._samples.append(latency)
+            self._since_adjust += 1
+            if len(self._samples) < self.min_samples or self._since_adjust < self.adjust_every:
+                return
+            self._since_adjust = 0
+            ordered = sorted(self._samples)
+            p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+            previous = self.level
+            if p95 > self.slo_seconds:
+                self._level = max(self.min_budget, self._level * self.decrease)
+            elif p95 < self.slo_seconds * self.headroom:
+                self._level = min(self.max_budget, self._level + self.max_budget * self.increase_step)
+            if self.level != previous:
+                # 调整后重新积累样本，下一次只按新预算下的延迟判断
+                self._samples.clear()
+                logger.info("思考预算调整: %d -> %d (近期 p95 %.1fs, SLO %.1fs)",
+                            previous, self.level, p95, self.slo_seconds)
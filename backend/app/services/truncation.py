@@ -0,0 +1,120 @@
+"""
+输出截断处理
+- salvage_truncated: 从被 MAX_TOKENS 截断的 JSON 文本中抢救出最长的合法前缀（补齐未闭合的括号）
+- OutputBudget: 根据近期实际输出 token 数（含思考）自适应调整 max_output_tokens，
+  截断后立即调高，长期用量下降后逐步回落，作为防止输出失控的上限
+
+GeminiService 检测到截断时先抢救已完整输出的部分，再只请求缺失的 analysis_results 项并合并，
+用户无需重新上传，也省去一次完整分析的输出与思考开销
+"""
+from collections import deque
+from typing import Optional
+import json
+import math
+import threading
+
+
+# 尝试补齐的切点数量上限（从文本末尾往前）
+MAX_SALVAGE_CUTS = 400
+
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def salvage_truncated(text: str) -> Optional[dict]:
+    """
+    被截断的 JSON 对象 -> 最长的可解析前缀（缺失的括号自动补齐）
+    只在完整的值之后切断（逗号前、右括号后），不会产生半截字符串或数字；无法抢救时返回 None
+    """
+    start = text.find("{")
+    if start == -1:
+        return None
+    text = text[start:]
+
+    cuts = []  # (切点, 需要补齐的括号)
+    stack = []
+    in_string = escaped = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in _CLOSERS:
+            stack.append(_CLOSERS[ch])
+        elif ch in "}]":
+            if not stack:
+                break
+            stack.pop()
+            if not stack:
+                # 根对象已完整，后面的内容无需处理
+                cuts.append((i + 1, ""))
+                break
+            cuts.append((i + 1, "".join(reversed(stack))))
+        elif ch == ",":
+            cuts.append((i, "".join(reversed(stack))))
+
+    for cut, closing in reversed(cuts[-MAX_SALVAGE_CUTS:]):
+        try:
+            result = json.loads(text[:cut] + closing)
+        except ValueError:
+            continue
+        if isinstance(result, dict):
+            return result
+    return None
+
+
+class OutputBudget:
+    """
+    自适应输出 token 上限
+    budget = clamp(近期用量的 p99 × headroom, floor, ceiling)，向上取整到 256；
+    发生截断时立即放大 growth 倍，并把新上限记入样本，使其在窗口内保持
+    """
+
+    def __init__(self, initial: int, floor: int, ceiling: int, headroom: float = 1.5,
+                 growth: float = 1.5, window: int = 200, min_samples: int = 20):
+        self.floor = floor
+        self.ceiling = ceiling
+        self.headroom = headroom
+        self.growth = growth
+        self.min_samples = min_samples
+        self._budget = self._clamp(initial)
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def _clamp(self, value: float) -> int:
+        value = math.ceil(value / 256) * 256
+        return int(min(self.ceiling, max(self.floor, value)))
+
+    @property
+    def current(self) -> int:
+        return self._budget
+
+    def observe(self, used_tokens: Optional[int], truncated: bool) -> int:
+        """记录一次调用的输出用量，返回调整后的上限"""
+        with self._lock:
+            if truncated:
+                self._budget = self._clamp(max(self._budget, used_tokens or 0) * self.growth)
+                self._samples.append(self._budget / self.headroom)
+            elif used_tokens:
+                self._samples.append(used_tokens)
+                if len(self._samples) >= self.min_samples:
+                    ordered = sorted(self._samples)
+                    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+                    self._budget = self._clamp(p99 * self.headroom)
+            return self._budget
+
+
+def output_tokens(response) -> Optional[int]:
+    """响应实际消耗的输出 token（含思考；SDK 未单独给出思考用量时按 total - prompt 计算）"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None
+    # prompt_token_count 已包含缓存命中的部分
+    if usage.total_token_count and usage.prompt_token_count is not None:
+        return usage.total_token_count - usage.prompt_token_count
+    return usage.candidates_token_count
@@ -0,0 +1,361 @@
+"""
+离线批量分析
+对一组（带标注的）家庭照片按线上流程（prepare_image_for_gemini 预处理 + GeminiService 分析）批量运行，
+用于评估更换 GEMINI_MODEL 或修改提示词后的效果，替代逐张手动运行 debug_coordinates.py：
+- 并发数 (--concurrency) 与调用速率上限 (--rate，每秒开始的分析数)
+- 断点续跑：成功的用例记入检查点文件 (--checkpoint)，重新运行时跳过；失败的用例下次重试
+- 每个用例输出一行 JSONL：耗时、Gemini 调用次数与 token 用量、结果，以及有标注时的坐标误差
+- 结束时按输出文件中每个用例的最后一条记录汇总（含之前中断的运行）
+
+用例来源（二选一）：
+- --dir：每个子目录是一个家庭，包含 child.*（多个孩子为 child.* / child_2.* / child_3.*）与 father.* / mother.*，
+  可选 truth.json：{"face_center": {"x": .., "y": ..}, "face_width": ..}，多个孩子时为按顺序的列表
+- --manifest：JSONL，每行 {"id": "..", "child": "a.jpg" 或 [..], "father": "..", "mother": "..", "truth": 同上}，
+  路径相对于 manifest 所在目录
+
+用法（在 backend 目录下）：
+    python -m benchmarks.batch_analyze --dir photos/labelled --output runs/flash.jsonl --concurrency 4 --rate 1
+    GEMINI_MODEL=gemini-2.5-pro python -m benchmarks.batch_analyze --manifest photos/set.jsonl --output runs/pro.jsonl
+    # 中断后以相同参数重新运行即可继续；--report 另存汇总 (JSON)
+"""
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import argparse
+import asyncio
+import json
+import math
+import mimetypes
+import os
+import statistics
+import sys
+import time
+
+from app.core.config import get_settings
+from app.services.gemini_service import gemini_service
+from app.services.image_pipeline import prepare_image_for_gemini, CHILD_PROFILE, PARENT_PROFILE
+from app.services.model_backends import _AsyncNamespace
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".heic", ".heif")
+
+# 坐标误差不超过该值（0-100 坐标系）视为命中
+HIT_THRESHOLD = 5.0
+
+# 当前用例的 Gemini 用量（每个用例在独立的 task 中运行）
+_usage: ContextVar[Optional[dict]] = ContextVar("batch_usage", default=None)
+
+
+@dataclass
+class FamilyCase:
+    """一个家庭用例（图片路径，运行时才读取与预处理）"""
+    id: str
+    children: List[str]
+    father: Optional[str] = None
+    mother: Optional[str] = None
+    truth: List[Optional[dict]] = field(default_factory=list)
+
+
+def _truth_list(truth, count: int) -> List[Optional[dict]]:
+    if truth is None:
+        return [None] * count
+    if isinstance(truth, dict):
+        truth = [truth]
+    return (list(truth) + [None] * count)[:count]
+
+
+def load_directory(directory: str) -> List[FamilyCase]:
+    cases = []
+    for name in sorted(os.listdir(directory)):
+        family_dir = os.path.join(directory, name)
+        if not os.path.isdir(family_dir):
+            continue
+        images: Dict[str, str] = {}
+        for filename in sorted(os.listdir(family_dir)):
+            stem, ext = os.path.splitext(filename)
+            if ext.lower() in IMAGE_EXTENSIONS:
+                images.setdefault(stem.lower(), os.path.join(family_dir, filename))
+        children = [images[key] for key in ["child"] + [f"child_{i}" for i in range(2, 10)] if key in images]
+        if not children or not ({"father", "mother"} & images.keys()):
+            print(f"跳过 {family_dir}: 需要 child.* 以及 father.* / mother.* 图片", file=sys.stderr)
+            continue
+        truth = None
+        truth_path = os.path.join(family_dir, "truth.json")
+        if os.path.exists(truth_path):
+            with open(truth_path, encoding="utf-8") as f:
+                truth = json.load(f)
+        cases.append(FamilyCase(name, children, images.get("father"), images.get("mother"),
+                                _truth_list(truth, len(children))))
+    return cases
+
+
+def load_manifest(path: str) -> List[FamilyCase]:
+    base = os.path.dirname(os.path.abspath(path))
+    resolve = lambda p: os.path.join(base, p) if p else None
+    cases = []
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            children = entry["child"] if isinstance(entry["child"], list) else [entry["child"]]
+            cases.append(FamilyCase(
+                str(entry.get("id", line_no)),
+                [resolve(p) for p in children],
+                resolve(entry.get("father")),
+                resolve(entry.get("mother")),
+                _truth_list(entry.get("truth"), len(children)),
+            ))
+    return cases
+
+
+def _prepare(path: str, label: str, profile: dict) -> tuple:
+    with open(path, "rb") as f:
+        data = f.read()
+    content_type = mimetypes.guess_type(path)[0] or "image/jpeg"
+    return prepare_image_for_gemini(data, content_type, label=label, **profile)
+
+
+class _UsageModels:
+    """记录每次成功调用的 token 用量到当前用例"""
+
+    def __init__(self, models):
+        self._models = models
+
+    async def generate_content(self, *, model: str, contents, config=None):
+        response = await self._models.generate_content(model=model, contents=contents, config=config)
+        usage = _usage.get()
+        metadata = getattr(response, "usage_metadata", None)
+        if usage is not None:
+            usage["calls"] += 1
+            if metadata is not None:
+                usage["prompt"] += metadata.prompt_token_count or 0
+                usage["cached"] += metadata.cached_content_token_count or 0
+                usage["total"] += metadata.total_token_count or 0
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self._models, name)
+
+
+class UsageRecordingClient:
+    """包装 GeminiService 的客户端，按用例统计调用次数与 token"""
+
+    def __init__(self, client):
+        self._client = client
+        self.models = getattr(client, "models", None)
+        self.aio = _AsyncNamespace(_UsageModels(client.aio.models), getattr(client.aio, "caches", None))
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class RateLimiter:
+    """限制每秒开始的分析数（均匀间隔）"""
+
+    def __init__(self, rate: Optional[float]):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def coordinate_error(result: dict, truth: Optional[dict]) -> Optional[dict]:
+    """模型坐标与标注的误差（0-100 坐标系）"""
+    if not truth:
+        return None
+    error = {}
+    center, expected = result.get("face_center"), truth.get("face_center")
+    if center and expected:
+        dx, dy = center["x"] - expected["x"], center["y"] - expected["y"]
+        error.update(dx=dx, dy=dy, center=round(math.hypot(dx, dy), 3))
+    if result.get("face_width") is not None and truth.get("face_width") is not None:
+        error["width"] = abs(result["face_width"] - truth["face_width"])
+    return error or None
+
+
+async def run_case(case: FamilyCase) -> dict:
+    """预处理并分析一个家庭，返回 JSONL 记录"""
+    record = {"id": case.id, "children": len(case.children), "model": gemini_service.model_name}
+    usage = {"calls": 0, "prompt": 0, "cached": 0, "total": 0}
+    _usage.set(usage)
+    start = time.perf_counter()
+    try:
+        # 预处理在线程中进行，不阻塞其他用例的 Gemini 调用
+        children = [await asyncio.to_thread(_prepare, path, "Child" if i == 0 else f"Child {i + 1}", CHILD_PROFILE)
+                    for i, path in enumerate(case.children)]
+        father = await asyncio.to_thread(_prepare, case.father, "Father", PARENT_PROFILE) if case.father else (None, None)
+        mother = await asyncio.to_thread(_prepare, case.mother, "Mother", PARENT_PROFILE) if case.mother else (None, None)
+        record["preprocess_s"] = round(time.perf_counter() - start, 3)
+        call_start = time.perf_counter()
+        result = await gemini_service.analyze_family_photos(
+            child_image=children[0][0],
+            child_mime_type=children[0][1],
+            father_image=father[0],
+            father_mime_type=father[1],
+            mother_image=mother[0],
+            mother_mime_type=mother[1],
+            sibling_images=children[1:],
+        )
+        record["latency_s"] = round(time.perf_counter() - call_start, 3)
+    except Exception as e:
+        record["latency_s"] = round(time.perf_counter() - start, 3)
+        record["error"] = f"{type(e).__name__}: {str(e)[:300]}"
+        record["tokens"] = usage
+        return record
+
+    results = result.get("children") or [result]
+    record["tokens"] = usage
+    record["results"] = results
+    record["coordinate_errors"] = [coordinate_error(r, t) for r, t in zip(results, case.truth)]
+    return record
+
+
+def _load_checkpoint(path: str) -> set:
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+async def run_batch(cases: List[FamilyCase], args) -> None:
+    done = _load_checkpoint(args.checkpoint)
+    pending = [case for case in cases if case.id not in done]
+    print(f"用例 {len(cases)} 个，已完成 {len(cases) - len(pending)} 个，本次运行 {len(pending)} 个 "
+          f"(并发 {args.concurrency}, 速率 {f'{args.rate:g}/s' if args.rate else '不限'}, 模型 {gemini_service.model_name})")
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    limiter = RateLimiter(args.rate)
+    output_dir = os.path.dirname(os.path.abspath(args.output))
+    os.makedirs(output_dir, exist_ok=True)
+    finished = 0
+
+    with open(args.output, "a", encoding="utf-8") as output, open(args.checkpoint, "a", encoding="utf-8") as checkpoint:
+        async def one(case: FamilyCase) -> None:
+            nonlocal finished
+            async with semaphore:
+                await limiter.wait()
+                record = await run_case(case)
+            # 先写结果再记检查点，中断时最多重复分析一个用例，不会丢失记录
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+            if "error" not in record:
+                checkpoint.write(case.id + "\n")
+                checkpoint.flush()
+            finished += 1
+            status = record.get("error") or f"{record['latency_s']:.1f}s, {record['tokens']['total']} tokens"
+            print(f"[{finished}/{len(pending)}] {case.id}: {status}")
+
+        await asyncio.gather(*(one(case) for case in pending))
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def _stats(values: List[float]) -> dict:
+    return {
+        "n": len(values),
+        "mean": round(statistics.fmean(values), 3) if values else None,
+        "p50": _percentile(values, 0.5),
+        "p95": _percentile(values, 0.95),
+    }
+
+
+def aggregate(output_path: str) -> dict:
+    """按每个用例的最后一条记录汇总"""
+    records: Dict[str, dict] = {}
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                records[record["id"]] = record
+
+    ok = [r for r in records.values() if "error" not in r]
+    center_errors = [e["center"] for r in ok for e in r["coordinate_errors"] if e and "center" in e]
+    width_errors = [e["width"] for r in ok for e in r["coordinate_errors"] if e and "width" in e]
+    return {
+        "items": len(records),
+        "succeeded": len(ok),
+        "failed": len(records) - len(ok),
+        "children": sum(r["children"] for r in ok),
+        "latency_s": _stats([r["latency_s"] for r in ok]),
+        "calls": sum(r["tokens"]["calls"] for r in records.values()),
+        "tokens": {kind: sum(r["tokens"][kind] for r in records.values()) for kind in ("prompt", "cached", "total")},
+        "tokens_per_item": _stats([r["tokens"]["total"] for r in ok]),
+        "center_error": dict(_stats(center_errors),
+                             hit_rate=round(sum(e <= HIT_THRESHOLD for e in center_errors) / len(center_errors), 3)
+                             if center_errors else None),
+        "width_error": _stats(width_errors),
+        "errors": sorted({r["error"].split(":")[0] for r in records.values() if "error" in r}),
+    }
+
+
+def _fmt(value, digits: int = 2) -> str:
+    return "-" if value is None else f"{value:.{digits}f}"
+
+
+def print_report(report: dict) -> None:
+    latency, center, width = report["latency_s"], report["center_error"], report["width_error"]
+    print(f"\n用例 {report['items']} 个：成功 {report['succeeded']}，失败 {report['failed']} "
+          f"(孩子 {report['children']} 个，Gemini 调用 {report['calls']} 次)")
+    print(f"耗时 (s): mean {_fmt(latency['mean'])} / p50 {_fmt(latency['p50'])} / p95 {_fmt(latency['p95'])}")
+    print(f"token: 输入 {report['tokens']['prompt']} (缓存 {report['tokens']['cached']})，合计 {report['tokens']['total']}，"
+          f"每个用例 mean {_fmt(report['tokens_per_item']['mean'], 0)}")
+    print(f"鼻尖误差 ({center['n']} 个有标注): mean {_fmt(center['mean'])} / p50 {_fmt(center['p50'])} / "
+          f"p95 {_fmt(center['p95'])}，≤{HIT_THRESHOLD:g} 占比 {_fmt(center['hit_rate'], 3)}")
+    print(f"脸宽误差 ({width['n']} 个有标注): mean {_fmt(width['mean'])} / p50 {_fmt(width['p50'])} / p95 {_fmt(width['p95'])}")
+    if report["errors"]:
+        print(f"失败类型: {', '.join(report['errors'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线批量分析（评估模型 / 提示词）")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--dir", help="用例目录（每个子目录一个家庭）")
+    source.add_argument("--manifest", help="用例清单 (JSONL)")
+    parser.add_argument("--output", required=True, help="结果输出 (JSONL，追加写入)")
+    parser.add_argument("--checkpoint", help="检查点文件（默认 <output>.done）")
+    parser.add_argument("--concurrency", type=int, default=2, help="同时进行的分析数")
+    parser.add_argument("--rate", type=float, default=None, help="每秒最多开始的分析数（默认不限）")
+    parser.add_argument("--limit", type=int, default=None, help="只运行前 N 个用例")
+    parser.add_argument("--report", help="汇总另存为 JSON")
+    args = parser.parse_args()
+
+    if args.concurrency < 1:
+        parser.error("--concurrency 至少为 1")
+    if args.rate is not None and args.rate <= 0:
+        parser.error("--rate 必须大于 0")
+    args.checkpoint = args.checkpoint or args.output + ".done"
+
+    cases = load_directory(args.dir) if args.dir else load_manifest(args.manifest)
+    if len({case.id for case in cases}) != len(cases):
+        parser.error("用例 id 重复")
+    cases = cases[:args.limit] if args.limit else cases
+    if get_settings().gemini_mode == "replay":
+        print("注意：GEMINI_MODE=replay 时结果来自录制", file=sys.stderr)
+
+    gemini_service.client = UsageRecordingClient(gemini_service.client)
+    asyncio.run(run_batch(cases, args))
+    if not os.path.exists(args.output):
+        return
+    report = aggregate(args.output)
+    print_report(report)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+图片预处理微基准测试
+对 prepare_image_for_gemini 在各种合成图片（不同像素数、格式、EXIF 方向、透明通道）上测量：
+墙钟时间、CPU 时间、峰值内存增量、输出字节数，并与提交在仓库中的基线比较
+
+每个用例在由 forkserver 派生的干净子进程中运行（不继承主进程生成图片时的堆），
+峰值内存互不干扰；只依赖 Pillow，离线、纯 CPU 即可运行（Linux）
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_image_pipeline                       # 与基线比较，超出容差时退出码为 1
+    python -m benchmarks.bench_image_pipeline --update-baseline     # 重新生成基线
+    python -m benchmarks.bench_image_pipeline --quick --repeat 3    # 只跑小图
+    python -m benchmarks.bench_image_pipeline --filter 12mp
+
+基线与机器相关：更换 CI 机器或 Pillow 版本后请先 --update-baseline
+"""
+from dataclasses import dataclass
+from functools import partial
+from typing import Callable, Dict, List, Optional
+from PIL import Image
+import argparse
+import io
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+import PIL  # noqa: E402
+from app.services.image_pipeline import prepare_image_for_gemini, CHILD_PROFILE, PARENT_PROFILE  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "image_pipeline.json")
+
+# 默认容差：超过基线 25% 视为回归
+DEFAULT_TOLERANCE = 0.25
+
+# 绝对容差：小于该差值的变化视为噪声 (毫秒 / MB)
+TIME_SLACK_MS = 3.0
+MEMORY_SLACK_MB = 4.0
+
+# 参与比较的指标
+METRICS = ("wall_ms", "cpu_ms", "peak_rss_mb", "out_bytes")
+
+# 被测的预处理方式：新增预处理选项时在这里注册，与 current-* 对比
+PIPELINES: Dict[str, Callable[[bytes, str], tuple]] = {
+    "current-child": partial(prepare_image_for_gemini, label="Child", **CHILD_PROFILE),
+    "current-parent": partial(prepare_image_for_gemini, label="Parent", **PARENT_PROFILE),
+}
+
+
+@dataclass
+class ImageCase:
+    """一张合成测试图片"""
+    name: str
+    megapixels: float
+    fmt: str  # JPEG / PNG / WEBP
+    mode: str = "RGB"  # RGB / RGBA / P
+    orientation: int = 1  # EXIF Orientation
+    quality: int = 92
+    quick: bool = False
+
+    @property
+    def content_type(self) -> str:
+        return f"image/{self.fmt.lower()}"
+
+
+IMAGE_CASES: List[ImageCase] = [
+    ImageCase("jpeg-0.3mp", 0.3, "JPEG", quick=True),
+    ImageCase("jpeg-2mp", 2, "JPEG", quick=True),
+    ImageCase("jpeg-2mp-exif6", 2, "JPEG", orientation=6, quick=True),
+    ImageCase("jpeg-12mp", 12, "JPEG"),
+    ImageCase("jpeg-12mp-exif6", 12, "JPEG", orientation=6),
+    ImageCase("jpeg-24mp", 24, "JPEG"),
+    ImageCase("png-2mp-rgba", 2, "PNG", mode="RGBA", quick=True),
+    ImageCase("png-2mp-palette", 2, "PNG", mode="P"),
+    ImageCase("png-12mp", 12, "PNG"),
+    ImageCase("webp-2mp", 2, "WEBP", quick=True),
+    ImageCase("webp-12mp-rgba", 12, "WEBP", mode="RGBA"),
+]
+
+
+def synthesize(case: ImageCase) -> bytes:
+    """生成确定性的合成照片：渐变 + 噪声纹理（压缩率接近真实照片）"""
+    width = int((case.megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    radial = Image.radial_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 40)
+    img = Image.merge("RGB", (gradient, radial, noise))
+
+    if case.mode == "RGBA":
+        img = img.convert("RGBA")
+        img.putalpha(radial)
+    elif case.mode == "P":
+        img = img.convert("P", palette=Image.Palette.ADAPTIVE, colors=64)
+
+    options = {}
+    if case.fmt in ("JPEG", "WEBP"):
+        options["quality"] = case.quality
+    if case.orientation != 1:
+        exif = Image.Exif()
+        exif[274] = case.orientation
+        options["exif"] = exif.tobytes()
+
+    buffer = io.BytesIO()
+    img.save(buffer, format=case.fmt, **options)
+    return buffer.getvalue()
+
+
+def _current_rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def _run_case(pipeline: str, data: bytes, content_type: str, repeat: int, conn) -> None:
+    """子进程：重复执行并回传中位数"""
+    try:
+        logging.disable(logging.CRITICAL)
+        fn = PIPELINES[pipeline]
+        rss_before = _current_rss_mb()
+        walls, cpus = [], []
+        out_bytes = 0
+        for _ in range(repeat):
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            out, _mime = fn(data, content_type)
+            walls.append((time.perf_counter() - wall_start) * 1000)
+            cpus.append((time.process_time() - cpu_start) * 1000)
+            out_bytes = len(out)
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 - rss_before
+        conn.send({
+            "wall_ms": round(statistics.median(walls), 2),
+            "cpu_ms": round(statistics.median(cpus), 2),
+            "peak_rss_mb": round(max(peak_mb, 0.0), 1),
+            "out_bytes": out_bytes,
+        })
+    except Exception as e:
+        conn.send({"error": repr(e)})
+    finally:
+        conn.close()
+
+
+def measure(pipeline: str, data: bytes, content_type: str, repeat: int) -> dict:
+    ctx = multiprocessing.get_context("forkserver")
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_run_case, args=(pipeline, data, content_type, repeat, child_conn))
+    process.start()
+    child_conn.close()
+    result = parent_conn.recv()
+    process.join()
+    if "error" in result:
+        raise RuntimeError(f"{pipeline} 执行失败: {result['error']}")
+    return result
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> List[str]:
+    """返回回归描述列表（空列表表示通过）"""
+    regressions = []
+    for key, result in current.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        for metric in METRICS:
+            old, new = base.get(metric), result.get(metric)
+            if old is None or new is None:
+                continue
+            slack = {"wall_ms": TIME_SLACK_MS, "cpu_ms": TIME_SLACK_MS, "peak_rss_mb": MEMORY_SLACK_MB}.get(metric, 0)
+            if new > old * (1 + tolerance) + slack:
+                regressions.append(f"{key} {metric}: {old} -> {new} (+{(new / old - 1) * 100 if old else 0:.0f}%)")
+    return regressions
+
+
+def machine_info() -> dict:
+    return {
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图片预处理微基准测试")
+    parser.add_argument("--repeat", type=int, default=5, help="每个用例重复次数（取中位数）")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE, help="回归容差比例")
+    parser.add_argument("--quick", action="store_true", help="只运行小图用例")
+    parser.add_argument("--filter", default="", help="只运行名称包含该字符串的用例")
+    parser.add_argument("--pipeline", action="append", help="只运行指定预处理方式（可重复）")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="基线文件路径")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果覆盖基线")
+    parser.add_argument("--output", help="另存本次结果 (JSON)")
+    args = parser.parse_args()
+
+    # forkserver 预先导入 Pillow 与被测模块，子进程无需重复导入
+    multiprocessing.set_forkserver_preload(["PIL.Image", "app.services.image_pipeline"])
+
+    pipelines = args.pipeline or list(PIPELINES)
+    cases = [
+        c for c in IMAGE_CASES
+        if (not args.quick or c.quick) and args.filter in c.name
+    ]
+
+    results = {}
+    print(f"{'用例':<36} {'wall_ms':>9} {'cpu_ms':>9} {'peak_MB':>8} {'in_KB':>8} {'out_KB':>8}")
+    for case in cases:
+        data = synthesize(case)
+        for pipeline in pipelines:
+            key = f"{pipeline}/{case.name}"
+            result = measure(pipeline, data, case.content_type, args.repeat)
+            result["in_bytes"] = len(data)
+            results[key] = result
+            print(f"{key:<36} {result['wall_ms']:>9.1f} {result['cpu_ms']:>9.1f} "
+                  f"{result['peak_rss_mb']:>8.1f} {len(data) / 1024:>8.0f} {result['out_bytes'] / 1024:>8.0f}")
+
+    report = {"machine": machine_info(), "repeat": args.repeat, "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.update_baseline:
+        existing = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                existing = json.load(f).get("results", {})
+        existing.update(results)
+        report["results"] = dict(sorted(existing.items()))
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"\n基线已更新: {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"\n未找到基线 {args.baseline}，请先运行 --update-baseline")
+        return
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("machine") != machine_info():
+        print(f"\n注意：基线来自不同环境 {baseline.get('machine')}，时间对比仅供参考")
+
+    regressions = compare(baseline.get("results", {}), results, args.tolerance)
+    if regressions:
+        print(f"\n发现 {len(regressions)} 项回归（容差 {args.tolerance:.0%}）：")
+        for line in regressions:
+            print(f"  - {line}")
+        sys.exit(1)
+    print(f"\n与基线相比无回归（容差 {args.tolerance:.0%}）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+SQLite 性能配置基准测试
+对比 default / production 两种配置在「验证兑换码 + 分析结果提交」并发负载下的吞吐与延迟
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_sqlite_profile
+    python -m benchmarks.bench_sqlite_profile --verify 4000 --analyze 1000 --concurrency 32
+"""
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
+from app.core.database import Base, create_engine_for
+from app.models import CardKey, CardStatus, utcnow
+from app.services.code_provisioning import insert_codes_chunked
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+# 模拟一次分析结果（约 4KB JSON + 2KB 压缩响应体）
+FAKE_RESULT = {
+    "face_center": {"x": 50, "y": 42},
+    "face_width": 36,
+    "analysis_results": [
+        {"part": part, "similar_to": "Father", "similarity_score": 80, "description": "像" * 120}
+        for part in ("眉毛", "眼睛", "鼻子", "嘴巴", "脸型", "头型", "总结")
+    ],
+}
+FAKE_BODY = os.urandom(2048)
+
+
+async def _verify(session_factory, code: str):
+    """对应 /api/code/verify：按码查询并激活"""
+    async with session_factory() as db:
+        card = (await db.execute(select(CardKey).where(CardKey.code == code))).scalar_one_or_none()
+        if card and card.status == CardStatus.UNUSED:
+            card.status = CardStatus.USED
+            card.device_id = "bench-device"
+            card.activated_at = utcnow()
+            await db.commit()
+
+
+async def _analyze_commit(session_factory, code: str):
+    """对应 /api/analyze 末尾：写入结果缓存并提交"""
+    async with session_factory() as db:
+        card = (await db.execute(select(CardKey).where(CardKey.code == code))).scalar_one_or_none()
+        if card:
+            card.result_cache = FAKE_RESULT
+            card.image_paths = {}
+            card.result_body = FAKE_BODY
+            card.result_encoding = "gzip"
+            card.result_etag = code
+            await db.commit()
+
+
+async def run_profile(profile: str, verify_ops: int, analyze_ops: int, concurrency: int, seed: int) -> dict:
+    """在独立的临时数据库上运行一种配置"""
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine_for(f"sqlite+aiosqlite:///{tmp}/bench.db", profile)
+        session_factory = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+        codes = [f"B{i:08d}" for i in range(seed)]
+        async with session_factory() as db:
+            await insert_codes_chunked(db, codes)
+
+        rng = random.Random(42)
+        jobs = [("verify", rng.choice(codes)) for _ in range(verify_ops)]
+        jobs += [("analyze", rng.choice(codes)) for _ in range(analyze_ops)]
+        rng.shuffle(jobs)
+
+        latencies = {"verify": [], "analyze": []}
+        errors = {"verify": 0, "analyze": 0}
+        queue = asyncio.Queue()
+        for job in jobs:
+            queue.put_nowait(job)
+
+        async def worker():
+            while not queue.empty():
+                kind, code = queue.get_nowait()
+                op = _verify if kind == "verify" else _analyze_commit
+                start = time.perf_counter()
+                try:
+                    await op(session_factory, code)
+                except Exception:
+                    errors[kind] += 1
+                    continue
+                latencies[kind].append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        await engine.dispose()
+
+    def summarize(values):
+        if not values:
+            return {"count": 0}
+        values = sorted(values)
+        return {
+            "count": len(values),
+            "p50_ms": round(statistics.median(values), 2),
+            "p95_ms": round(values[int(len(values) * 0.95) - 1], 2),
+            "max_ms": round(values[-1], 2),
+        }
+
+    return {
+        "profile": profile,
+        "elapsed_s": round(elapsed, 3),
+        "ops_per_s": round(len(jobs) / elapsed, 1),
+        "verify": summarize(latencies["verify"]),
+        "analyze_commit": summarize(latencies["analyze"]),
+        "errors": errors,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="SQLite 性能配置基准测试")
+    parser.add_argument("--verify", type=int, default=2000, help="验证操作次数")
+    parser.add_argument("--analyze", type=int, default=500, help="分析提交操作次数")
+    parser.add_argument("--concurrency", type=int, default=16, help="并发协程数")
+    parser.add_argument("--seed", type=int, default=20000, help="预置兑换码数量")
+    parser.add_argument("--profiles", default="default,production", help="逗号分隔的配置名")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    args = parser.parse_args()
+
+    results = []
+    for profile in args.profiles.split(","):
+        results.append(await run_profile(
+            profile.strip(), args.verify, args.analyze, args.concurrency, args.seed
+        ))
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    print(f"{'profile':<12}{'ops/s':>10}{'verify p50':>12}{'verify p95':>12}"
+          f"{'commit p50':>12}{'commit p95':>12}{'errors':>8}")
+    for r in results:
+        v, a = r["verify"], r["analyze_commit"]
+        print(f"{r['profile']:<12}{r['ops_per_s']:>10}{v.get('p50_ms', '-'):>12}{v.get('p95_ms', '-'):>12}"
+              f"{a.get('p50_ms', '-'):>12}{a.get('p95_ms', '-'):>12}{sum(r['errors'].values()):>8}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
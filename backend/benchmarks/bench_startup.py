@@ -0,0 +1,173 @@
+"""
+启动时间基准
+在干净的子进程中测量后端冷启动：
+- import_s：import app.main 的耗时（路由、模型、配置）
+- startup_s：lifespan 启动阶段的耗时（建表、存储、定时任务），到此服务即可接受请求
+- boot_s = import_s + startup_s，与预算比较；process_s 为父进程看到的子进程总耗时（含解释器启动、等待预热与关闭）
+- warm_s：启动后后台预热（google-genai / Pillow）完成的耗时，只报告不计入预算
+
+另外用一次 python -X importtime 汇总导入耗时最高的包与模块，
+并检查延迟加载的模块（DEFERRED_MODULES）没有在 import app.main 时被导入
+
+用法（在 backend 目录下）：
+    python -m benchmarks.bench_startup                      # 中位数 boot_s 超过预算时退出码为 1
+    python -m benchmarks.bench_startup --runs 10 --budget 1.5
+    python -m benchmarks.bench_startup --top 30 --output startup.json
+
+子进程在临时目录中运行（SQLite 与本地图片存储写到临时目录），不需要网络与真实的 API Key；
+预算与机器相关，CI 上请按机器调整 --budget
+"""
+from collections import defaultdict
+from typing import Dict, List
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 默认启动预算（秒）
+DEFAULT_BUDGET = 2.0
+
+# 只应在后台预热或首次使用时导入的模块
+DEFERRED_MODULES = ("google.genai", "PIL", "apscheduler", "requests")
+
+# 子进程：计时 import 与 lifespan 启动，输出一行 JSON
+_CHILD = r"""
+import asyncio, json, sys, time
+t0 = time.perf_counter()
+import app.main
+t1 = time.perf_counter()
+deferred = [m for m in DEFERRED if m in sys.modules]
+
+async def boot():
+    from app.services import gemini_loader
+    async with app.main.app.router.lifespan_context(app.main.app):
+        t2 = time.perf_counter()
+        warm = None
+        for _ in range(600):
+            if gemini_loader._service is not None:
+                warm = time.perf_counter() - t2
+                break
+            await asyncio.sleep(0.01)
+    return t2, warm
+
+t2, warm = asyncio.run(boot())
+print("BENCH_STARTUP " + json.dumps({"import_s": t1 - t0, "startup_s": t2 - t1, "warm_s": warm, "deferred_loaded": deferred}))
+"""
+
+
+def _env() -> Dict[str, str]:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = BACKEND_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    env.setdefault("GEMINI_API_KEY", "benchmark")
+    env["LOG_LEVEL"] = "WARNING"
+    return env
+
+
+def run_once() -> dict:
+    """在新的解释器与临时工作目录中冷启动一次"""
+    with tempfile.TemporaryDirectory(prefix="bench-startup-") as workdir:
+        os.makedirs(os.path.join(workdir, "data", "images"))
+        child = "DEFERRED = %r\n%s" % (DEFERRED_MODULES, _CHILD)
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-c", child], cwd=workdir, env=_env(),
+                              capture_output=True, text=True, timeout=120)
+        process_s = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"启动失败 (exit {proc.returncode}):\n{proc.stderr[-2000:]}")
+    line = next(l for l in proc.stdout.splitlines() if l.startswith("BENCH_STARTUP "))
+    result = json.loads(line[len("BENCH_STARTUP "):])
+    result["boot_s"] = result["import_s"] + result["startup_s"]
+    result["process_s"] = process_s
+    return result
+
+
+def import_profile(top: int) -> dict:
+    """python -X importtime -c 'import app.main'，按包与模块汇总自身耗时"""
+    with tempfile.TemporaryDirectory(prefix="bench-startup-") as workdir:
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app.main"],
+                              cwd=workdir, env=_env(), capture_output=True, text=True, timeout=120)
+    modules: List[tuple] = []
+    for line in proc.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+
+    packages: Dict[str, int] = defaultdict(int)
+    for name, self_us, _ in modules:
+        packages[name.split(".")[0]] += self_us
+    total_us = sum(packages.values())
+    return {
+        "total_ms": total_us / 1000,
+        "packages": [{"package": name, "self_ms": us / 1000}
+                     for name, us in sorted(packages.items(), key=lambda kv: -kv[1])[:top]],
+        "modules": [{"module": name, "self_ms": self_us / 1000, "cumulative_ms": cumulative_us / 1000}
+                    for name, self_us, cumulative_us in sorted(modules, key=lambda m: -m[1])[:top]],
+    }
+
+
+def _median(runs: List[dict], key: str):
+    values = [r[key] for r in runs if r[key] is not None]
+    return statistics.median(values) if values else None
+
+
+def _fmt(value) -> str:
+    return "-" if value is None else f"{value:.3f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="后端启动时间基准")
+    parser.add_argument("--runs", type=int, default=5, help="冷启动次数（取中位数）")
+    parser.add_argument("--budget", type=float, default=DEFAULT_BUDGET, help="boot_s 中位数的预算（秒）")
+    parser.add_argument("--top", type=int, default=15, help="导入耗时报告显示的条目数")
+    parser.add_argument("--output", help="保存每次运行与导入耗时报告 (JSON)")
+    args = parser.parse_args()
+
+    runs = []
+    print(f"{'run':>4} {'import_s':>9} {'startup_s':>10} {'boot_s':>7} {'process_s':>10} {'warm_s':>7}")
+    for i in range(args.runs):
+        r = run_once()
+        runs.append(r)
+        print(f"{i + 1:>4} {_fmt(r['import_s']):>9} {_fmt(r['startup_s']):>10} {_fmt(r['boot_s']):>7} "
+              f"{_fmt(r['process_s']):>10} {_fmt(r['warm_s']):>7}")
+
+    summary = {key: _median(runs, key) for key in ("import_s", "startup_s", "boot_s", "process_s", "warm_s")}
+    print(f"{'p50':>4} {_fmt(summary['import_s']):>9} {_fmt(summary['startup_s']):>10} {_fmt(summary['boot_s']):>7} "
+          f"{_fmt(summary['process_s']):>10} {_fmt(summary['warm_s']):>7}")
+
+    profile = import_profile(args.top)
+    print(f"\nimport app.main 导入耗时 (-X importtime, 自身耗时合计 {profile['total_ms']:.0f}ms)")
+    print(f"{'package':<32} {'self_ms':>8}")
+    for p in profile["packages"]:
+        print(f"{p['package']:<32} {p['self_ms']:>8.1f}")
+    print(f"\n{'module':<48} {'self_ms':>8} {'cum_ms':>8}")
+    for m in profile["modules"]:
+        print(f"{m['module']:<48} {m['self_ms']:>8.1f} {m['cumulative_ms']:>8.1f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"budget_s": args.budget, "summary": summary, "runs": runs, "import_profile": profile},
+                      f, indent=2, ensure_ascii=False)
+
+    failed = False
+    deferred = sorted({m for r in runs for m in r["deferred_loaded"]})
+    if deferred:
+        print(f"\n回归：以下模块应延迟加载，却在 import app.main 时被导入: {', '.join(deferred)}", file=sys.stderr)
+        failed = True
+    if summary["boot_s"] > args.budget:
+        print(f"\n回归：启动耗时中位数 {summary['boot_s']:.3f}s 超过预算 {args.budget:.3f}s", file=sys.stderr)
+        failed = True
+    if failed:
+        sys.exit(1)
+    print(f"\n启动耗时中位数 {summary['boot_s']:.3f}s，预算 {args.budget:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+思考预算与结果稳定性基准
+对同一组照片在不同 thinking_budget 下重复调用 Gemini 分析，记录：
+- 延迟 p50 / p95
+- 分数波动：各部位「偏向父亲程度」(像 Father 取分数，像 Mother 取 100 - 分数) 的标准差均值
+- 家长一致率：各部位 similar_to 与多数结果一致的比例
+- 坐标波动：鼻尖坐标 (x, y) 的标准差、脸宽标准差
+用于在延迟与结果稳定性之间选择 GEMINI_THINKING_BUDGET_MIN / MAX 与 GEMINI_LATENCY_SLO_SECONDS
+
+需要真实的 Gemini API（GEMINI_MODE=live 或 record），且 google-genai 支持 thinking_budget
+
+用法（在 backend 目录下）：
+    # 每个用例目录包含 child.* 以及 father.* / mother.* 图片
+    python -m benchmarks.bench_thinking_budget --case photos/family1 --case photos/family2 \\
+        --budgets 0,1024,4096,8192 --repeat 5 --output thinking.json
+"""
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import argparse
+import asyncio
+import json
+import math
+import mimetypes
+import os
+import statistics
+import sys
+import time
+
+from app.core.config import get_settings
+from app.services.gemini_service import gemini_service
+from app.services.image_pipeline import prepare_image_for_gemini, CHILD_PROFILE, PARENT_PROFILE
+from app.services.result_schema import FIXED_PARTS
+from app.services.thinking_budget import ThinkingBudgetController
+
+ROLES = ("child", "father", "mother")
+
+
+@dataclass
+class PhotoCase:
+    """一组家庭照片（已按线上方式预处理）"""
+    name: str
+    images: Dict[str, tuple] = field(default_factory=dict)  # role -> (bytes, mime_type)
+
+    def kwargs(self) -> dict:
+        kwargs = {}
+        for role, (data, mime_type) in self.images.items():
+            kwargs[f"{role}_image"] = data
+            kwargs[f"{role}_mime_type"] = mime_type
+        return kwargs
+
+
+def load_case(directory: str) -> PhotoCase:
+    case = PhotoCase(os.path.basename(os.path.normpath(directory)))
+    for name in sorted(os.listdir(directory)):
+        role = os.path.splitext(name)[0].lower()
+        if role not in ROLES or role in case.images:
+            continue
+        with open(os.path.join(directory, name), "rb") as f:
+            data = f.read()
+        content_type = mimetypes.guess_type(name)[0] or "image/jpeg"
+        profile = CHILD_PROFILE if role == "child" else PARENT_PROFILE
+        case.images[role] = prepare_image_for_gemini(data, content_type, label=role.capitalize(), **profile)
+    if "child" not in case.images or not ({"father", "mother"} & case.images.keys()):
+        raise SystemExit(f"{directory}: 需要 child.* 以及 father.* / mother.* 图片")
+    return case
+
+
+async def run_budget(case: PhotoCase, budget: int, repeat: int, concurrency: int) -> List[dict]:
+    """以固定思考预算重复分析 repeat 次"""
+    gemini_service.thinking = ThinkingBudgetController.fixed(budget)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one() -> dict:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = await gemini_service.analyze_family_photos(**case.kwargs())
+            except Exception as e:
+                return {"error": f"{type(e).__name__}: {str(e)[:200]}"}
+            return {"latency": time.perf_counter() - start, "result": result}
+
+    return list(await asyncio.gather(*(one() for _ in range(repeat))))
+
+
+def _pstdev(values: List[float]) -> Optional[float]:
+    return statistics.pstdev(values) if len(values) >= 2 else None
+
+
+def _mean(values: List[Optional[float]]) -> Optional[float]:
+    values = [v for v in values if v is not None]
+    return statistics.fmean(values) if values else None
+
+
+def stability(results: List[dict]) -> dict:
+    """同一用例多次结果的波动"""
+    lean: Dict[str, List[float]] = {part: [] for part in FIXED_PARTS}
+    roles: Dict[str, Counter] = {part: Counter() for part in FIXED_PARTS}
+    xs, ys, widths = [], [], []
+    for result in results:
+        for item in result.get("analysis_results") or []:
+            part = item["part"]
+            score = item["similarity_score"]
+            lean[part].append(score if item["similar_to"] == "Father" else 100 - score)
+            roles[part][item["similar_to"]] += 1
+        center = result.get("face_center")
+        if center:
+            xs.append(center["x"])
+            ys.append(center["y"])
+        if result.get("face_width") is not None:
+            widths.append(result["face_width"])
+
+    sd_x, sd_y = _pstdev(xs), _pstdev(ys)
+    return {
+        "score_sd": _mean([_pstdev(values) for values in lean.values()]),
+        "role_agreement": _mean([max(c.values()) / sum(c.values()) if c else None for c in roles.values()]),
+        "center_sd": math.hypot(sd_x, sd_y) if sd_x is not None and sd_y is not None else None,
+        "width_sd": _pstdev(widths),
+    }
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def summarize(budget: int, per_case: Dict[str, List[dict]]) -> dict:
+    latencies = [run["latency"] for runs in per_case.values() for run in runs if "latency" in run]
+    failures = sum(1 for runs in per_case.values() for run in runs if "error" in run)
+    case_stats = [stability([run["result"] for run in runs if "result" in run]) for runs in per_case.values()]
+    summary = {
+        "budget": budget,
+        "runs": sum(len(runs) for runs in per_case.values()),
+        "failures": failures,
+        "p50_s": _percentile(latencies, 0.5),
+        "p95_s": _percentile(latencies, 0.95),
+    }
+    for key in ("score_sd", "role_agreement", "center_sd", "width_sd"):
+        summary[key] = _mean([stats[key] for stats in case_stats])
+    return summary
+
+
+def _fmt(value: Optional[float], digits: int = 2) -> str:
+    return "-" if value is None else f"{value:.{digits}f}"
+
+
+async def main_async(args) -> dict:
+    cases = [load_case(directory) for directory in args.case]
+    budgets = [int(b) for b in args.budgets.split(",")]
+    report = {"model": gemini_service.model_name, "repeat": args.repeat, "budgets": []}
+
+    print(f"{'budget':>7} {'runs':>5} {'fail':>5} {'p50_s':>7} {'p95_s':>7} "
+          f"{'score_sd':>9} {'role_agree':>10} {'center_sd':>9} {'width_sd':>8}")
+    for budget in budgets:
+        per_case = {case.name: await run_budget(case, budget, args.repeat, args.concurrency) for case in cases}
+        summary = summarize(budget, per_case)
+        print(f"{budget:>7} {summary['runs']:>5} {summary['failures']:>5} {_fmt(summary['p50_s']):>7} "
+              f"{_fmt(summary['p95_s']):>7} {_fmt(summary['score_sd']):>9} {_fmt(summary['role_agreement']):>10} "
+              f"{_fmt(summary['center_sd']):>9} {_fmt(summary['width_sd']):>8}")
+        report["budgets"].append({"summary": summary, "cases": per_case})
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="思考预算与结果稳定性基准")
+    parser.add_argument("--case", action="append", required=True, help="用例目录（可重复）")
+    parser.add_argument("--budgets", default="0,1024,4096,8192", help="逗号分隔的思考预算")
+    parser.add_argument("--repeat", type=int, default=5, help="每个用例每个预算的重复次数（至少 2）")
+    parser.add_argument("--concurrency", type=int, default=1, help="同一预算下的并发调用数")
+    parser.add_argument("--output", help="保存每次调用的结果与汇总 (JSON)")
+    args = parser.parse_args()
+
+    if args.repeat < 2:
+        parser.error("--repeat 至少为 2 才能计算波动")
+    if get_settings().gemini_mode == "replay":
+        print("注意：GEMINI_MODE=replay 时结果来自录制，不反映思考预算的影响", file=sys.stderr)
+
+    report = asyncio.run(main_async(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+pytest 公共配置
+配置在模块导入时读取，需在导入 app 之前设置环境变量；不访问网络与真实的 Gemini API
+"""
+import asyncio
+import os
+
+import pytest
+
+os.environ.setdefault("GEMINI_API_KEY", "test")
+os.environ.setdefault("GEMINI_MODE", "live")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+# 全局引擎不指向开发库；需要数据库的用例使用 run_db 创建的临时库
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite://")
+
+
+@pytest.fixture
+def run_db(tmp_path):
+    """
+    在临时 SQLite 库上执行 fn(session_factory) 并返回其结果
+    未依赖 pytest-asyncio：每次调用自带事件循环，引擎在同一循环内创建与释放
+    """
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+    from app.core.database import Base, create_engine_for
+    import app.models  # noqa: F401  注册全部表
+
+    def run(fn):
+        async def main():
+            engine = create_engine_for(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+            try:
+                async with engine.begin() as conn:
+                    await conn.run_sync(Base.metadata.create_all)
+                return await fn(async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False))
+            finally:
+                await engine.dispose()
+        return asyncio.run(main())
+
+    return run
@@ -0,0 +1,305 @@
+"""分析接口（ASGI 层）：客户端断开时的取消与 499、persist 阶段不取消、拆分模式下提前返回的坐标"""
+from datetime import timedelta
+from types import SimpleNamespace
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from google.genai import types
+from sqlalchemy import select
+
+from app.api import analyze
+from app.core import metrics
+from app.core.database import get_db
+from app.models import CardKey, CardStatus, ImageBlob, utcnow
+from app.services import blob_store
+from app.services import gemini_service as gs
+from app.services.thinking_budget import ThinkingBudgetController
+from app.services.result_schema import FIXED_PARTS
+from app.services.storage import FilesystemStorage
+
+CODE = "CARD0001"
+RESULT = {
+    "face_center": {"x": 50, "y": 40},
+    "face_width": 30,
+    "analysis_results": [{"part": part, "similar_to": "Father", "similarity_score": 80, "description": "像"}
+                         for part in FIXED_PARTS],
+}
+
+
+@pytest.fixture
+def api(run_db, tmp_path, monkeypatch):
+    """在临时库上运行 fn(app, sessions)：已激活的兑换码、本地存储、不解码图片"""
+    storage = FilesystemStorage(str(tmp_path / "images"))
+    (tmp_path / "images").mkdir()
+    monkeypatch.setattr(blob_store, "get_storage", lambda: storage)
+    monkeypatch.setattr(analyze, "get_storage", lambda: storage)
+    monkeypatch.setattr(analyze, "prepare_image_for_gemini", lambda data, content_type, label, **profile: (data, "image/jpeg"))
+
+    def run(fn):
+        async def body(sessions):
+            async with sessions() as db:
+                db.add(CardKey(code=CODE, status=CardStatus.USED, activated_at=utcnow() - timedelta(minutes=1)))
+                await db.commit()
+
+            async def override_db():
+                async with sessions() as session:
+                    yield session
+
+            app = FastAPI()
+            app.include_router(analyze.router)
+            app.dependency_overrides[get_db] = override_db
+            return await fn(app, sessions)
+        return run_db(body)
+
+    return run
+
+
+def use_service(monkeypatch, service):
+    async def get_service():
+        return service
+    monkeypatch.setattr(analyze, "get_gemini_service", get_service)
+
+
+def _upload():
+    """multipart 请求 -> (ASGI scope, 请求体)"""
+    request = httpx.Request("POST", "http://test/analyze", files={
+        "child": ("child.jpg", b"child-bytes", "image/jpeg"),
+        "father": ("father.jpg", b"father-bytes", "image/jpeg"),
+    }, headers={"Authorization": f"Bearer {CODE}"})
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/analyze", "raw_path": b"/analyze", "query_string": b"", "root_path": "",
+        "headers": [(k.lower(), v) for k, v in request.headers.raw], "client": ("test", 1), "server": ("test", 80),
+    }
+    return scope, request.read()
+
+
+async def call(app, disconnect: asyncio.Event):
+    """发送上传请求；请求体读完后 receive() 等到 disconnect 置位才返回 http.disconnect。返回 (状态码, 响应体)"""
+    scope, body = _upload()
+    pending = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        if pending:
+            return pending.pop(0)
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    return sent[0]["status"], b"".join(m.get("body", b"") for m in sent[1:])
+
+
+async def saved(sessions):
+    """(结果是否已保存, Blob 引用)"""
+    async with sessions() as db:
+        card = await db.scalar(select(CardKey).where(CardKey.code == CODE))
+        refs = dict((await db.execute(select(ImageBlob.key, ImageBlob.ref_count))).all())
+        return card.result_cache is not None, refs
+
+
+class BlockingService:
+    """analyze_family_photos 一直等待，记录是否被取消"""
+
+    def __init__(self):
+        self.started = asyncio.Event()
+        self.cancelled = False
+
+    async def analyze_family_photos(self, **kwargs):
+        self.started.set()
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+def _abandoned(stage):
+    return metrics.ANALYZE_ABANDONED.labels(stage=stage)._value
+
+
+def test_disconnect_during_gemini_cancels_and_returns_499(api, monkeypatch):
+    before = _abandoned("gemini")
+
+    async def fn(app, sessions):
+        service = BlockingService()
+        use_service(monkeypatch, service)
+        status, _ = await asyncio.wait_for(call(app, service.started), 5)
+        return status, service.cancelled, await saved(sessions)
+
+    status, cancelled, (has_result, refs) = api(fn)
+    assert status == 499
+    assert cancelled
+    assert _abandoned("gemini") == before + 1
+    assert not has_result and refs == {}
+    # finally 中释放了并发锁，用户可重新上传
+    assert CODE not in analyze.processing_codes
+
+
+def test_disconnect_during_persist_still_saves(api, monkeypatch):
+    before = _abandoned("persist")
+
+    async def fn(app, sessions):
+        disconnected = asyncio.Event()
+        persisting = asyncio.Event()
+
+        class Service:
+            async def analyze_family_photos(self, **kwargs):
+                return RESULT
+
+        original_put = blob_store.put
+
+        async def slow_put(data, mime_type=None):
+            # 写图片时客户端断开，之后才完成写入
+            persisting.set()
+            await asyncio.sleep(0.05)
+            return await original_put(data, mime_type)
+
+        use_service(monkeypatch, Service())
+        monkeypatch.setattr(blob_store, "put", slow_put)
+
+        async def disconnect_when_persisting():
+            await persisting.wait()
+            disconnected.set()
+
+        waiter = asyncio.ensure_future(disconnect_when_persisting())
+        status, body = await asyncio.wait_for(call(app, disconnected), 5)
+        await waiter
+        return status, json.loads(body), await saved(sessions)
+
+    status, body, (has_result, refs) = api(fn)
+    # 断开发生在保存途中：记为放弃，但不取消，结果照常保存
+    assert _abandoned("persist") == before + 1
+    assert status == 200
+    assert body["face_center"] == RESULT["face_center"]
+    assert has_result
+    assert sorted(refs.values()) == [1, 1]
+
+
+def test_analysis_completing_first_returns_result(api, monkeypatch):
+    class Service:
+        async def analyze_family_photos(self, **kwargs):
+            return RESULT
+
+    async def fn(app, sessions):
+        use_service(monkeypatch, Service())
+        status, body = await call(app, asyncio.Event())
+        return status, json.loads(body), await saved(sessions)
+
+    status, body, (has_result, _) = api(fn)
+    assert status == 200 and body["success"]
+    assert has_result
+
+
+LOCATION = {"face_center": {"x": 61, "y": 47}, "face_width": 33}
+
+
+def _model_response(data):
+    return types.GenerateContentResponse(candidates=[types.Candidate(
+        content=types.Content(role="model", parts=[types.Part(text=json.dumps(data, ensure_ascii=False))]),
+        finish_reason="STOP")])
+
+
+class SplitModels:
+    """坐标请求立即返回；完整分析等到 release 置位（locate_fails 时坐标请求返回无法修复的结果）"""
+
+    def __init__(self, locate_first=True, locate_fails=False):
+        self.release = asyncio.Event()
+        self.located = asyncio.Event()
+        self.locate_first = locate_first
+        self.locate_fails = locate_fails
+
+    async def generate_content(self, *, model, contents, config=None):
+        if config.system_instruction == gs.LOCATE_INSTRUCTION:
+            if not self.locate_first:
+                await asyncio.Event().wait()
+            self.located.set()
+            return _model_response({"face_center": "?"} if self.locate_fails else LOCATION)
+        await self.release.wait()
+        return _model_response(RESULT)
+
+
+def split_service(models):
+    service = gs.GeminiService()
+    service.client = SimpleNamespace(aio=SimpleNamespace(models=models))
+    service.context_cache = None
+    service.thinking = ThinkingBudgetController.fixed(0)
+    return service
+
+
+async def coordinates(app):
+    """GET /analyze/coordinates -> (状态码, 响应)"""
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.get("/analyze/coordinates", headers={"Authorization": f"Bearer {CODE}"})
+    return response.status_code, response.json()
+
+
+def test_split_mode_serves_coordinates_before_the_full_result(api, monkeypatch):
+    monkeypatch.setattr(analyze.settings, "gemini_split_coordinates", True)
+
+    async def fn(app, sessions):
+        models = SplitModels()
+        use_service(monkeypatch, split_service(models))
+        upload = asyncio.ensure_future(call(app, asyncio.Event()))
+        while CODE not in analyze.early_locations:
+            await asyncio.sleep(0)
+        early = await coordinates(app)
+        assert not upload.done()  # 完整分析仍在进行
+        models.release.set()
+        status, body = await asyncio.wait_for(upload, 5)
+        return early, status, json.loads(body), await coordinates(app)
+
+    early, status, body, final = api(fn)
+    assert early == (200, dict(ready=True, final=False, **LOCATION))
+    assert status == 200
+    # 最终结果使用坐标请求的坐标，部位来自完整分析
+    assert (body["face_center"], body["face_width"]) == (LOCATION["face_center"], LOCATION["face_width"])
+    assert [item["part"] for item in body["analysis_results"]] == list(FIXED_PARTS)
+    # 保存后的坐标与提前返回的一致
+    assert final == (200, dict(ready=True, final=True, **LOCATION))
+    assert CODE not in analyze.early_locations
+
+
+def test_coordinates_pending_until_located(api, monkeypatch):
+    monkeypatch.setattr(analyze.settings, "gemini_split_coordinates", True)
+
+    async def fn(app, sessions):
+        before = await coordinates(app)
+        models = SplitModels(locate_first=False)
+        use_service(monkeypatch, split_service(models))
+        upload = asyncio.ensure_future(call(app, asyncio.Event()))
+        while CODE not in analyze.processing_codes:
+            await asyncio.sleep(0)
+        pending = await coordinates(app)
+        models.release.set()
+        status, body = await asyncio.wait_for(upload, 5)
+        return before, pending, json.loads(body)
+
+    before, pending, body = api(fn)
+    assert before[0] == 404
+    assert pending == (202, {"ready": False, "final": False, "face_center": None, "face_width": None})
+    # 完整分析先完成：取消坐标请求，使用完整分析中的坐标
+    assert body["face_center"] == RESULT["face_center"]
+
+
+def test_split_mode_falls_back_when_locate_fails():
+    async def main():
+        models = SplitModels(locate_fails=True)
+        service = split_service(models)
+        seen = []
+        task = asyncio.ensure_future(service.analyze_family_photos_split(
+            child_image=b"child", father_image=b"father", father_mime_type="image/jpeg", on_location=seen.append))
+        await models.located.wait()
+        models.release.set()
+        return await task, seen
+
+    result, seen = asyncio.run(main())
+    assert seen == []
+    assert (result["face_center"], result["face_width"]) == (RESULT["face_center"], RESULT["face_width"])
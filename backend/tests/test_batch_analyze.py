@@ -0,0 +1,156 @@
+"""离线批量分析 CLI 冒烟测试：参数校验，录制后以回放后端运行、输出记录与汇总、断点续跑"""
+from types import SimpleNamespace
+import io
+import json
+import sys
+
+import pytest
+from google.genai import types
+from PIL import Image
+
+from app.services import gemini_service as gs
+from app.services import model_backends as mb
+from app.services.result_schema import FIXED_PARTS
+from app.services.thinking_budget import ThinkingBudgetController
+from benchmarks import batch_analyze
+
+RESULT = {
+    "face_center": {"x": 50, "y": 40},
+    "face_width": 30,
+    "analysis_results": [{"part": part, "similar_to": "Father", "similarity_score": 80, "description": "像"}
+                         for part in FIXED_PARTS],
+}
+
+
+class FakeModels:
+    """录制时代替 Gemini：每次返回 RESULT 与固定的 token 用量"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def generate_content(self, *, model, contents, config=None):
+        self.calls += 1
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(
+                role="model", parts=[types.Part(text=json.dumps(RESULT, ensure_ascii=False))]), finish_reason="STOP")],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(prompt_token_count=100, total_token_count=150),
+        )
+
+
+def _jpeg(path, color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), color).save(buffer, format="JPEG")
+    path.write_bytes(buffer.getvalue())
+
+
+@pytest.fixture
+def families(tmp_path):
+    """两个家庭：A 有标注，B 只有母亲照片；另有一个缺少孩子照片的目录会被跳过"""
+    root = tmp_path / "families"
+    for name, parent, color in (("A", "father", "red"), ("B", "mother", "blue")):
+        (root / name).mkdir(parents=True)
+        _jpeg(root / name / "child.jpg", color)
+        _jpeg(root / name / f"{parent}.jpg", "gray")
+    (root / "A" / "truth.json").write_text(json.dumps({"face_center": {"x": 53, "y": 44}, "face_width": 31}))
+    (root / "empty").mkdir()
+    _jpeg(root / "empty" / "father.jpg", "gray")
+    return root
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """替换批量脚本使用的服务：固定输出预算与思考预算、不使用上下文缓存，录制与回放发出相同的请求"""
+    monkeypatch.setattr(gs.settings, "gemini_adaptive_output_budget", False)
+    monkeypatch.setattr(gs, "create_client", lambda: None)
+
+    def use(client):
+        service = gs.GeminiService()
+        service.client = client
+        service.context_cache = None
+        service.thinking = ThinkingBudgetController.fixed(0)
+        # batch_analyze 在导入时已取得服务单例
+        monkeypatch.setattr(batch_analyze, "gemini_service", service)
+        return service
+    return use
+
+
+def _main(monkeypatch, *argv):
+    monkeypatch.setattr(sys, "argv", ["batch_analyze", *argv])
+    batch_analyze.main()
+
+
+def _records(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+@pytest.mark.parametrize("argv", [
+    [],  # --dir / --manifest 二选一，必须指定
+    ["--dir", "x", "--manifest", "y", "--output", "out.jsonl"],
+    ["--dir", "x"],  # 缺少 --output
+    ["--dir", "x", "--output", "out.jsonl", "--concurrency", "0"],
+    ["--dir", "x", "--output", "out.jsonl", "--rate", "0"],
+])
+def test_invalid_arguments_exit_with_usage_error(monkeypatch, capsys, argv):
+    with pytest.raises(SystemExit) as info:
+        _main(monkeypatch, *argv)
+    assert info.value.code == 2
+    assert "usage:" in capsys.readouterr().err
+
+
+def test_duplicate_manifest_ids_are_rejected(monkeypatch, tmp_path, capsys):
+    manifest = tmp_path / "set.jsonl"
+    manifest.write_text('{"id": "x", "child": "a.jpg"}\n{"id": "x", "child": "b.jpg"}\n')
+    with pytest.raises(SystemExit):
+        _main(monkeypatch, "--manifest", str(manifest), "--output", str(tmp_path / "out.jsonl"))
+    assert "用例 id 重复" in capsys.readouterr().err
+
+
+def test_replay_run_writes_records_report_and_resumes(monkeypatch, tmp_path, capsys, families, service):
+    cassettes = tmp_path / "cassettes"
+    fake = FakeModels()
+    service(mb.RecordingClient(SimpleNamespace(models=None, aio=SimpleNamespace(models=fake, caches=None)),
+                               mb.CassetteStore(str(cassettes))))
+    _main(monkeypatch, "--dir", str(families), "--output", str(tmp_path / "record.jsonl"))
+    assert fake.calls == 2 and len(list(cassettes.glob("*.json"))) == 2
+
+    # 以回放后端重新运行：不访问模型，结果与 token 用量来自录制
+    monkeypatch.setattr(gs.settings, "gemini_mode", "replay")
+    service(mb.ReplayClient(mb.CassetteStore(str(cassettes)), latency_scale=0))
+    output, report = tmp_path / "runs" / "replay.jsonl", tmp_path / "report.json"
+    _main(monkeypatch, "--dir", str(families), "--output", str(output), "--concurrency", "2", "--rate", "100",
+          "--report", str(report))
+    captured = capsys.readouterr()
+    assert "跳过" in captured.err and "GEMINI_MODE=replay" in captured.err
+    assert "用例 2 个，已完成 0 个，本次运行 2 个" in captured.out
+
+    records = {record["id"]: record for record in _records(output)}
+    assert sorted(records) == ["A", "B"]
+    a = records["A"]
+    assert "error" not in a and a["children"] == 1
+    assert a["tokens"] == {"calls": 1, "prompt": 100, "cached": 0, "total": 150}
+    assert a["results"][0]["face_center"] == RESULT["face_center"]
+    assert a["coordinate_errors"] == [{"dx": -3, "dy": -4, "center": 5.0, "width": 1}]
+    assert records["B"]["coordinate_errors"] == [None]
+    assert sorted((tmp_path / "runs" / "replay.jsonl.done").read_text().split()) == ["A", "B"]
+
+    summary = json.loads(report.read_text(encoding="utf-8"))
+    assert (summary["items"], summary["succeeded"], summary["failed"], summary["calls"]) == (2, 2, 0, 2)
+    assert summary["tokens"] == {"prompt": 200, "cached": 0, "total": 300}
+    assert summary["center_error"]["n"] == 1 and summary["center_error"]["hit_rate"] == 1.0
+
+    # 再次运行：检查点中的用例全部跳过，不追加记录
+    _main(monkeypatch, "--dir", str(families), "--output", str(output))
+    assert "本次运行 0 个" in capsys.readouterr().out
+    assert len(_records(output)) == 2
+
+
+def test_replay_miss_is_recorded_and_retried(monkeypatch, tmp_path, capsys, families, service):
+    # 没有录制：每个用例记录错误，不写入检查点，下次运行会重试
+    service(mb.ReplayClient(mb.CassetteStore(str(tmp_path / "cassettes")), latency_scale=0))
+    output = tmp_path / "out.jsonl"
+    _main(monkeypatch, "--dir", str(families), "--output", str(output), "--limit", "1")
+    records = _records(output)
+    assert [record["id"] for record in records] == ["A"]
+    assert records[0]["error"].startswith("CassetteMissError")
+    assert (tmp_path / "out.jsonl.done").read_text() == ""
+    assert "失败类型: CassetteMissError" in capsys.readouterr().out
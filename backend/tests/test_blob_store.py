@@ -0,0 +1,106 @@
+"""图片 Blob 引用计数：增加、释放与孤儿文件清理"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+import time
+
+from sqlalchemy import select
+
+from app.models import ImageBlob
+from app.services import blob_store, scheduler
+
+KEY_A = blob_store.blob_key(b"father")
+KEY_B = blob_store.blob_key(b"mother", "image/png")
+
+
+async def _refs(db):
+    rows = (await db.execute(select(ImageBlob.key, ImageBlob.ref_count))).all()
+    return dict(rows)
+
+
+def test_blob_key_is_content_addressed():
+    assert KEY_A == blob_store.blob_key(b"father", "image/jpeg")
+    assert KEY_B.endswith(".png")
+    assert blob_store.is_blob_key(KEY_A) and blob_store.is_blob_key(KEY_B)
+    assert not blob_store.is_blob_key("ABCD1234_father.jpg")
+    assert not blob_store.is_blob_key("../" + KEY_A)
+
+
+def test_add_refs_counts_every_reference(run_db):
+    async def body(sessions):
+        async with sessions() as db:
+            await blob_store.add_refs(db, [KEY_A, KEY_A, KEY_B], sizes={KEY_A: 10})
+            await blob_store.add_refs(db, [KEY_A])
+            await blob_store.add_refs(db, [])
+            await db.commit()
+            size = await db.scalar(select(ImageBlob.size).where(ImageBlob.key == KEY_A))
+            return await _refs(db), size
+
+    refs, size = run_db(body)
+    assert refs == {KEY_A: 3, KEY_B: 1}
+    assert size == 10
+
+
+def test_release_refs_returns_only_dead_blobs(run_db):
+    async def body(sessions):
+        async with sessions() as db:
+            await blob_store.add_refs(db, [KEY_A, KEY_A, KEY_B])
+            await db.commit()
+            first = await blob_store.release_refs(db, [KEY_A, KEY_B, "LEGACY_child.jpg"])
+            await db.commit()
+            after_first = await _refs(db)
+            second = await blob_store.release_refs(db, [KEY_A])
+            await db.commit()
+            nothing = await blob_store.release_refs(db, ["LEGACY_child.jpg"])
+            return first, after_first, second, nothing, await _refs(db)
+
+    first, after_first, second, nothing, refs = run_db(body)
+    assert first == [KEY_B]
+    assert after_first == {KEY_A: 1}
+    assert second == [KEY_A]
+    assert nothing == []
+    assert refs == {}
+
+
+def test_release_refs_rolls_back_with_caller(run_db):
+    async def body(sessions):
+        async with sessions() as db:
+            await blob_store.add_refs(db, [KEY_A])
+            await db.commit()
+            assert await blob_store.release_refs(db, [KEY_A]) == [KEY_A]
+            await db.rollback()
+            return await _refs(db)
+
+    assert run_db(body) == {KEY_A: 1}
+
+
+def test_orphan_sweep_removes_unreferenced_old_files(run_db, monkeypatch, tmp_path):
+    images = tmp_path / "images"
+    images.mkdir()
+    monkeypatch.setattr(scheduler.image_storage.settings, "images_storage_path", str(images))
+    old = time.time() - scheduler.ORPHAN_GRACE_SECONDS - 60
+
+    def touch(name, mtime=old):
+        path = images / name
+        path.write_bytes(b"x")
+        os.utime(path, (mtime, mtime))
+        return path
+
+    referenced = touch(KEY_A)
+    orphan = touch(KEY_B)
+    fresh_orphan = touch(blob_store.blob_key(b"just uploaded"), mtime=time.time())
+    legacy_orphan = touch("GONE1234_child.jpg")
+
+    async def body(sessions):
+        monkeypatch.setattr(scheduler, "async_session", sessions)
+        async with sessions() as db:
+            await blob_store.add_refs(db, [KEY_A])
+            await db.commit()
+        stats = scheduler.CleanupStats()
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            await scheduler._sweep_orphan_images(pool, stats)
+        return stats
+
+    stats = run_db(body)
+    assert stats.orphan_files == 2
+    assert referenced.exists() and fresh_orphan.exists()
+    assert not orphan.exists() and not legacy_orphan.exists()
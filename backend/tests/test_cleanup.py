@@ -0,0 +1,173 @@
+"""过期数据清理：分批删除、Blob 引用释放、结果体删除、宽限期与孤儿文件识别"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import os
+import time
+
+import pytest
+from sqlalchemy import select
+
+from app.models import CardKey, CardResultBody, CardStatus, ImageBlob, utcnow
+from app.services import blob_store, scheduler
+from app.services.storage import FilesystemStorage
+
+KEY_A = blob_store.blob_key(b"father")
+KEY_B = blob_store.blob_key(b"mother")
+OLD = time.time() - scheduler.ORPHAN_GRACE_SECONDS - 60
+
+
+@pytest.fixture
+def images(tmp_path, monkeypatch):
+    directory = tmp_path / "images"
+    directory.mkdir()
+    monkeypatch.setattr(scheduler.image_storage.settings, "images_storage_path", str(directory))
+    monkeypatch.setattr(scheduler, "get_storage", lambda: FilesystemStorage(str(directory)))
+    return directory
+
+
+def _touch(directory, name, mtime=OLD):
+    path = directory / name
+    path.write_bytes(b"x")
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def _card(code, hours_ago, **fields):
+    return CardKey(code=code, status=CardStatus.USED, activated_at=utcnow() - timedelta(hours=hours_ago), **fields)
+
+
+async def _cleanup(sessions, monkeypatch, expiry_hours=24):
+    monkeypatch.setattr(scheduler, "async_session", sessions)
+    stats = scheduler.CleanupStats()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        await scheduler._delete_expired_batches(pool, utcnow() - timedelta(hours=expiry_hours), stats)
+    return stats
+
+
+async def _codes(db):
+    return set((await db.execute(select(CardKey.code))).scalars().all())
+
+
+@pytest.mark.parametrize("expired, batches", [(0, 0), (2, 1), (3, 1), (6, 2), (7, 3)])
+def test_expired_records_are_deleted_in_batches(run_db, monkeypatch, images, expired, batches):
+    monkeypatch.setattr(scheduler, "CLEANUP_BATCH_SIZE", 3)
+
+    async def body(sessions):
+        async with sessions() as db:
+            db.add_all([_card(f"OLD{i}", 48 + i) for i in range(expired)])
+            db.add(_card("FRESH", 1))
+            await db.commit()
+        stats = await _cleanup(sessions, monkeypatch)
+        async with sessions() as db:
+            return stats, await _codes(db)
+
+    stats, remaining = run_db(body)
+    assert stats.batches == batches
+    assert stats.expired_records == expired
+    assert remaining == {"FRESH"}
+
+
+def test_cleanup_releases_blobs_and_result_bodies(run_db, monkeypatch, images):
+    shared = _touch(images, KEY_A)
+    still_used = _touch(images, KEY_B)
+    legacy = _touch(images, "LEGACY1_child.jpg")
+
+    async def body(sessions):
+        async with sessions() as db:
+            expired = [
+                _card("OLD1", 48, image_keys=[KEY_A, KEY_B]),
+                _card("OLD2", 49, image_keys=[KEY_A]),
+                # 旧数据没有 image_keys，文件名从 URL 中解析
+                _card("LEGACY1", 50, image_paths={"child": "/api/images/LEGACY1_child.jpg?exp=1&sig=x"}),
+            ]
+            live = _card("LIVE", 1, image_keys=[KEY_B])
+            db.add_all(expired + [live])
+            await db.flush()
+            await blob_store.add_refs(db, [KEY_A, KEY_B, KEY_A, KEY_B])
+            for card in expired + [live]:
+                db.add(CardResultBody(card_id=card.id, child=1, body=b"{}", encoding="identity", etag="e"))
+            await db.commit()
+            live_id = live.id
+
+        stats = await _cleanup(sessions, monkeypatch)
+        async with sessions() as db:
+            refs = dict((await db.execute(select(ImageBlob.key, ImageBlob.ref_count))).all())
+            bodies = (await db.execute(select(CardResultBody.card_id))).scalars().all()
+            return stats, refs, bodies, live_id
+
+    stats, refs, bodies, live_id = run_db(body)
+    assert refs == {KEY_B: 1}
+    assert bodies == [live_id]
+    assert stats.released_blobs == 1
+    assert not shared.exists() and not legacy.exists()
+    assert still_used.exists()
+    assert stats.deleted_files == 2
+
+
+def test_released_blob_within_grace_period_is_kept(run_db, monkeypatch, images):
+    # 引用归零但文件刚被写入（可能正被新请求重新引用），本次不删除
+    fresh = _touch(images, KEY_A, mtime=time.time())
+
+    async def body(sessions):
+        async with sessions() as db:
+            db.add(_card("OLD1", 48, image_keys=[KEY_A]))
+            await blob_store.add_refs(db, [KEY_A])
+            await db.commit()
+        stats = await _cleanup(sessions, monkeypatch)
+        async with sessions() as db:
+            return stats, await db.scalar(select(ImageBlob).where(ImageBlob.key == KEY_A))
+
+    stats, blob = run_db(body)
+    assert blob is None
+    assert stats.released_blobs == 1 and stats.deleted_files == 0
+    assert fresh.exists()
+
+    # 过了宽限期后由孤儿清扫删除
+    os.utime(fresh, (OLD, OLD))
+
+    async def sweep(sessions):
+        monkeypatch.setattr(scheduler, "async_session", sessions)
+        stats = scheduler.CleanupStats()
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            await scheduler._sweep_orphan_images(pool, stats)
+        return stats
+
+    assert run_db(sweep).orphan_files == 1
+    assert not fresh.exists()
+
+
+def test_scan_only_matches_blob_legacy_and_temp_names(images):
+    for name in (KEY_A, "ABC123_father.jpeg", "A_B_child.webp", ".tmp-abc", "notes.txt", "ABC123_sibling.jpg",
+                 "ABC123_child.gif", "README", "father.jpg", ".gitkeep"):
+        _touch(images, name)
+    _touch(images, ".tmp-fresh", mtime=time.time())
+    _touch(images, "NEW1_child.jpg", mtime=time.time())
+    (images / "ABC123_mother.jpg").mkdir()
+
+    blobs, legacy, temps = scheduler._scan_orphan_candidates(str(images), time.time() - scheduler.ORPHAN_GRACE_SECONDS)
+    assert list(blobs) == [KEY_A]
+    assert {code: [os.path.basename(p) for p in paths] for code, paths in legacy.items()} == {
+        "ABC123": ["ABC123_father.jpeg"], "A_B": ["A_B_child.webp"],
+    }
+    assert [os.path.basename(p) for p in temps] == [".tmp-abc"]
+
+
+def test_orphan_sweep_leaves_unrecognised_files(run_db, monkeypatch, images):
+    unrelated = [_touch(images, name) for name in ("notes.txt", "backup_2024.tar", "LIVE_child.gif")]
+    kept_legacy = _touch(images, "LIVE_mother.png")
+    gone_legacy = _touch(images, "GONE_father.jpg")
+    stale_temp = _touch(images, ".tmp-crashed")
+
+    async def body(sessions):
+        monkeypatch.setattr(scheduler, "async_session", sessions)
+        async with sessions() as db:
+            db.add(_card("LIVE", 1))
+            await db.commit()
+        stats = scheduler.CleanupStats()
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            await scheduler._sweep_orphan_images(pool, stats)
+        return stats
+
+    assert run_db(body).orphan_files == 2
+    assert all(path.exists() for path in unrelated) and kept_legacy.exists()
+    assert not gone_legacy.exists() and not stale_temp.exists()
@@ -0,0 +1,179 @@
+"""兑换码管理接口：流式导入的逐行读取与生成接口的分块交付、失败与断开后的清理"""
+import asyncio
+import json
+
+import pytest
+from fastapi import FastAPI
+from sqlalchemy import select
+from starlette.requests import Request
+
+from app.api import code
+from app.core.security import get_current_admin
+from app.models import CardKey
+from app.services import code_provisioning as cp
+
+
+def _receiver(chunks, disconnect=None):
+    """依次返回请求体各块；之后等待 disconnect 事件再报告断开（不传则立即断开）"""
+    messages = [{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        if disconnect is not None:
+            await disconnect.wait()
+        return {"type": "http.disconnect"}
+    return receive
+
+
+def _lines(chunks):
+    async def main():
+        request = Request({"type": "http", "method": "POST", "headers": []}, _receiver(chunks))
+        return [line async for line in code._iter_body_lines(request)]
+    return asyncio.run(main())
+
+
+def test_iter_body_lines_joins_lines_across_chunks():
+    chunks = [b"\xef\xbb\xbfco", b"de\nA1\nB", b"2", b"", b"\nC3\n", b"D4"]
+    assert _lines(chunks) == ["code", "A1", "B2", "C3", "D4"]
+
+
+def test_iter_body_lines_without_trailing_data():
+    assert _lines([b"A1\n", b"B2\n"]) == ["A1", "B2"]
+    assert _lines([b""]) == []
+
+
+@pytest.mark.parametrize("line, ndjson, value", [
+    ("", False, ""),
+    ("code,note", False, ""),
+    ('"A1",note', False, "A1"),
+    ('" B2 ","x,y"', False, "B2"),
+    ("C3\r", False, "C3"),
+    ('"D4"', True, "D4"),
+    ('{"code": "E5"}', True, "E5"),
+])
+def test_parse_import_line(line, ndjson, value):
+    assert code._parse_import_line(line, ndjson) == value
+
+
+@pytest.mark.parametrize("line", ['{"other": 1}', "not json", "[1]"])
+def test_parse_import_line_rejects_bad_ndjson(line):
+    with pytest.raises(ValueError):
+        code._parse_import_line(line, True)
+
+
+def _app(sessions, monkeypatch):
+    monkeypatch.setattr(code, "async_session", sessions)
+    app = FastAPI()
+    app.include_router(code.router)
+    app.dependency_overrides[get_current_admin] = lambda: "admin"
+    return app
+
+
+def _scope():
+    return {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/code/generate", "raw_path": b"/code/generate", "query_string": b"",
+        "root_path": "", "headers": [(b"content-type", b"application/json")],
+        "client": ("test", 1), "server": ("test", 80),
+    }
+
+
+async def _codes(sessions):
+    async with sessions() as db:
+        return set((await db.execute(select(CardKey.code))).scalars().all())
+
+
+def test_generate_streams_every_chunk_after_commit(run_db, monkeypatch):
+    monkeypatch.setattr(cp, "INSERT_CHUNK_SIZE", 3)
+
+    async def body(sessions):
+        app = _app(sessions, monkeypatch)
+        sent = []
+        committed = []
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message["body"]:
+                # 发送这一块时它必须已在库中（其他会话可见）
+                chunk = message["body"].decode().split()
+                assert set(chunk) - {"code"} <= await _codes(sessions)
+                committed.extend(chunk)
+            sent.append(message)
+
+        # 客户端保持连接直到响应结束
+        receive = _receiver([json.dumps({"count": 7, "length": 8, "prefix": "T"}).encode()], asyncio.Event())
+        await app(_scope(), receive, send)
+        return sent, committed, await _codes(sessions)
+
+    sent, committed, stored = run_db(body)
+    start = sent[0]
+    assert start["status"] == 200
+    assert (b"x-code-count", b"7") in start["headers"]
+    assert committed[0] == "code"
+    assert len(committed) == 8 and set(committed[1:]) == stored
+    # 表头 + 3 块
+    assert len([m for m in sent if m["type"] == "http.response.body" and m["body"]]) == 4
+
+
+def test_generate_discards_codes_after_disconnect(run_db, monkeypatch):
+    monkeypatch.setattr(cp, "INSERT_CHUNK_SIZE", 2)
+
+    async def body(sessions):
+        app = _app(sessions, monkeypatch)
+        first_chunk = asyncio.Event()
+        delivered = []
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message["body"] not in (b"", b"code\n"):
+                delivered.extend(message["body"].decode().split())
+                first_chunk.set()
+                # 客户端读得慢：断开发生在发送途中
+                await asyncio.sleep(5)
+
+        receive = _receiver([json.dumps({"count": 10, "length": 8}).encode()], first_chunk)
+        await asyncio.wait_for(app(_scope(), receive, send), 2)
+        return delivered, await _codes(sessions)
+
+    delivered, stored = run_db(body)
+    assert len(delivered) == 2
+    assert stored == set()
+
+
+def test_generate_discards_codes_when_generation_fails(run_db, monkeypatch):
+    async def failing(db, count, length, prefix=""):
+        await cp.insert_codes(db, ["F1", "F2"])
+        yield ["F1", "F2"]
+        raise ValueError("兑换码空间不足")
+
+    monkeypatch.setattr(code, "generate_codes", failing)
+
+    async def body(sessions):
+        app = _app(sessions, monkeypatch)
+        async with sessions() as db:
+            await cp.insert_codes(db, ["KEEP"])
+
+        async def send(message):
+            pass
+
+        # 生成器在 StreamingResponse 的任务组里失败，异常以 ExceptionGroup 抛出，连接被中止
+        with pytest.raises(ExceptionGroup) as info:
+            await app(_scope(), _receiver([json.dumps({"count": 4, "length": 8}).encode()], asyncio.Event()), send)
+        assert info.group_contains(ValueError)
+        return await _codes(sessions)
+
+    assert run_db(body) == {"KEEP"}
+
+
+def test_generate_rejects_bad_params_before_streaming(run_db, monkeypatch):
+    async def body(sessions):
+        app = _app(sessions, monkeypatch)
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        await app(_scope(), _receiver([json.dumps({"count": 1, "length": 18, "prefix": "ABC"}).encode()]), send)
+        return sent
+
+    assert run_db(body)[0]["status"] == 400
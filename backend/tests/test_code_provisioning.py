@@ -0,0 +1,110 @@
+"""兑换码批量发放：分块插入、冲突计数与两种方言的计数分支"""
+from unittest import mock
+
+import pytest
+from sqlalchemy import func, select
+
+from app.models import CardKey, CardStatus
+from app.services import code_provisioning as cp
+
+
+async def _codes(db):
+    return set((await db.execute(select(CardKey.code))).scalars().all())
+
+
+def test_insert_codes_counts_conflicts(run_db):
+    async def body(sessions):
+        async with sessions() as db:
+            first = await cp.insert_codes(db, ["aaa1", " AAA1 ", "bbb2", "", "X" * 21])
+            second = await cp.insert_codes(db, ["AAA1", "CCC3"])
+            return first, second, await _codes(db)
+
+    first, second, codes = run_db(body)
+    # 块内重复与超长的码计入 skipped，空白行不计数
+    assert first == (2, 2)
+    assert second == (1, 1)
+    assert codes == {"AAA1", "BBB2", "CCC3"}
+
+
+def test_insert_codes_only_duplicates(run_db):
+    async def body(sessions):
+        async with sessions() as db:
+            await cp.insert_codes(db, ["A1"])
+            return await cp.insert_codes(db, ["A1", "a1"])
+
+    assert run_db(body) == (0, 2)
+
+
+@pytest.mark.parametrize("sane_rowcount", [True, False])
+def test_insert_codes_dialect_branches(run_db, sane_rowcount):
+    async def body(sessions):
+        async with sessions() as db:
+            await cp.insert_codes(db, ["A1"])
+            dialect = db.bind.dialect
+            # False 时走 RETURNING 计数（asyncpg 等 executemany 不返回可靠 rowcount 的驱动）
+            with mock.patch.object(type(dialect), "supports_sane_multi_rowcount", sane_rowcount):
+                return await cp.insert_codes(db, ["A1", "B2", "C3"])
+
+    assert run_db(body) == (2, 1)
+
+
+def test_insert_codes_chunked_commits_per_chunk(run_db, monkeypatch):
+    monkeypatch.setattr(cp, "INSERT_CHUNK_SIZE", 3)
+    chunks = []
+    original = cp.insert_codes
+
+    async def spy(db, codes):
+        chunks.append(list(codes))
+        return await original(db, codes)
+
+    monkeypatch.setattr(cp, "insert_codes", spy)
+
+    async def body(sessions):
+        async with sessions() as db:
+            await original(db, ["C1"])
+            result = await cp.insert_codes_chunked(db, (f"C{i}" for i in range(8)))
+            count = await db.scalar(select(func.count()).select_from(CardKey))
+            return result, count
+
+    result, count = run_db(body)
+    assert [len(chunk) for chunk in chunks] == [3, 3, 2]
+    assert result == (7, 1)
+    assert count == 8
+
+
+def test_discard_codes_keeps_used_codes(run_db, monkeypatch):
+    monkeypatch.setattr(cp, "INSERT_CHUNK_SIZE", 2)
+
+    async def body(sessions):
+        async with sessions() as db:
+            await cp.insert_codes(db, ["A1", "B2", "C3"])
+            card = await db.scalar(select(CardKey).where(CardKey.code == "B2"))
+            card.status = CardStatus.USED
+            await db.commit()
+            deleted = await cp.discard_codes(db, ["A1", "B2", "C3", "D4"])
+            return deleted, await _codes(db)
+
+    assert run_db(body) == (2, {"B2"})
+
+
+def test_generate_codes_retries_collisions(run_db, monkeypatch):
+    monkeypatch.setattr(cp, "INSERT_CHUNK_SIZE", 4)
+    # 前 4 个候选中有 2 个已存在
+    candidates = iter(["P-AA", "P-BB", "P-CC", "P-DD", "P-EE", "P-FF", "P-GG"])
+    monkeypatch.setattr(cp, "random_code", lambda length, prefix="": next(candidates))
+
+    async def body(sessions):
+        async with sessions() as db:
+            await cp.insert_codes(db, ["P-AA", "P-BB"])
+            batches = [batch async for batch in cp.generate_codes(db, count=4, length=4, prefix="p-")]
+            return batches, await _codes(db)
+
+    batches, codes = run_db(body)
+    assert sorted(code for batch in batches for code in batch) == ["P-CC", "P-DD", "P-EE", "P-FF"]
+    assert len(codes) == 6
+
+
+@pytest.mark.parametrize("count, length, prefix", [(0, 8, ""), (1, 18, "ABC"), (10_000, 2, "")])
+def test_validate_generate_params_rejects(count, length, prefix):
+    with pytest.raises(ValueError):
+        cp.validate_generate_params(count, length, prefix)
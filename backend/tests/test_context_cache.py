@@ -0,0 +1,213 @@
+"""上下文缓存：对本地替身 LocalCaches 的创建、续期、失败冷却与失效后改为直接发送"""
+from types import SimpleNamespace
+import asyncio
+import time
+
+import pytest
+from google.genai import types
+
+from app.core import metrics
+from app.services import context_cache as cc
+from app.services import gemini_service as gs
+from app.services import model_backends as mb
+
+MODEL = "gemini-test"
+INSTRUCTION = "系统提示词" * 10
+
+
+class Clock:
+    """同时替换 ContextCache 的 monotonic 与 LocalCaches 的 time"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CountingCaches(mb._AsyncLocalCaches):
+    """记录 create / update 调用次数；fail_create 时创建失败"""
+
+    def __init__(self, caches):
+        super().__init__(caches)
+        self.created = 0
+        self.updated = 0
+        self.fail_create = False
+
+    async def create(self, *, model, config=None):
+        self.created += 1
+        if self.fail_create:
+            raise mb.api_error(400, "Cached content is too small")
+        return await super().create(model=model, config=config)
+
+    async def update(self, *, name, config=None):
+        self.updated += 1
+        return await super().update(name=name, config=config)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cc, "time", SimpleNamespace(monotonic=clock))
+    monkeypatch.setattr(mb, "time", SimpleNamespace(time=clock))
+    return clock
+
+
+@pytest.fixture
+def local():
+    return mb.LocalCaches()
+
+
+def _cache(local, **kwargs):
+    caches = CountingCaches(local)
+    options = dict(ttl_seconds=100, refresh_seconds=20, retry_seconds=60)
+    options.update(kwargs)
+    return cc.ContextCache(SimpleNamespace(aio=SimpleNamespace(caches=caches)), **options), caches
+
+
+def _events(event):
+    return metrics.GEMINI_CONTEXT_CACHE.labels(event=event)._value
+
+
+def test_resolve_creates_once_and_reuses(clock, local):
+    cache, caches = _cache(local)
+    first = asyncio.run(cache.resolve(MODEL, INSTRUCTION))
+    clock.now += 50
+    assert asyncio.run(cache.resolve(MODEL, INSTRUCTION)) == first
+    assert caches.created == 1 and caches.updated == 0
+    assert local.resolve(first)[0] == INSTRUCTION
+    # 不同的提示词使用不同的缓存
+    assert asyncio.run(cache.resolve(MODEL, INSTRUCTION + "!")) != first
+
+
+@pytest.mark.parametrize("instruction", [None, "", ["not", "a", "string"]])
+def test_resolve_skips_non_text_instruction(clock, local, instruction):
+    cache, caches = _cache(local)
+    assert asyncio.run(cache.resolve(MODEL, instruction)) is None
+    assert caches.created == 0
+
+
+def test_resolve_refreshes_near_expiry(clock, local):
+    cache, caches = _cache(local)
+    name = asyncio.run(cache.resolve(MODEL, INSTRUCTION))
+    before = _events("refreshed")
+    clock.now += 85  # 剩余 15s，少于 refresh_seconds
+    assert asyncio.run(cache.resolve(MODEL, INSTRUCTION)) == name
+    assert caches.updated == 1 and _events("refreshed") == before + 1
+    # 续期后服务端与本地的有效期都延长了
+    clock.now += 90
+    assert local.resolve(name)[0] == INSTRUCTION
+    assert asyncio.run(cache.resolve(MODEL, INSTRUCTION)) == name
+
+
+def test_failed_refresh_recreates(clock, local):
+    cache, caches = _cache(local)
+    name = asyncio.run(cache.resolve(MODEL, INSTRUCTION))
+    local.delete(name=name)  # 服务端已删除
+    clock.now += 85
+    before = _events("refresh_failed")
+    renewed = asyncio.run(cache.resolve(MODEL, INSTRUCTION))
+    assert renewed not in (None, name)
+    assert caches.created == 2 and _events("refresh_failed") == before + 1
+
+
+def test_create_failure_cools_down(clock, local):
+    cache, caches = _cache(local)
+    caches.fail_create = True
+    assert asyncio.run(cache.resolve(MODEL, INSTRUCTION)) is None
+    clock.now += 59
+    assert asyncio.run(cache.resolve(MODEL, INSTRUCTION)) is None
+    assert caches.created == 1  # 冷却期内不再尝试
+    caches.fail_create = False
+    clock.now += 2
+    assert asyncio.run(cache.resolve(MODEL, INSTRUCTION)) is not None
+    assert caches.created == 2
+
+
+def test_invalidate_drops_only_the_named_cache(clock, local):
+    cache, caches = _cache(local)
+    name = asyncio.run(cache.resolve(MODEL, INSTRUCTION))
+    cache.invalidate("cachedContents/other")
+    assert asyncio.run(cache.resolve(MODEL, INSTRUCTION)) == name
+    cache.invalidate(name)
+    assert asyncio.run(cache.resolve(MODEL, INSTRUCTION)) not in (None, name)
+    assert caches.created == 2
+
+
+@pytest.mark.parametrize("code, message, miss", [
+    (404, "CachedContent not found", True),
+    (404, "Not found", True),
+    (400, "Cached content is expired", True),
+    (403, "Permission denied on cachedContents/abc", True),
+    (400, "Invalid argument: contents", False),
+    (403, "Permission denied", False),
+    (429, "cache quota", False),
+    (500, "cache backend error", False),
+])
+def test_is_cache_miss(code, message, miss):
+    assert cc.is_cache_miss(mb.api_error(code, message)) is miss
+
+
+class CachedModels:
+    """引用缓存时像回放客户端一样查询 LocalCaches（已删除返回 404），或直接抛出 error"""
+
+    def __init__(self, local, error=None):
+        self.local = local
+        self.error = error
+        self.configs = []
+
+    async def generate_content(self, *, model, contents, config=None):
+        self.configs.append(config)
+        if config.cached_content:
+            if self.error is not None:
+                raise self.error
+            self.local.resolve(config.cached_content)
+        return types.GenerateContentResponse(candidates=[types.Candidate(
+            content=types.Content(role="model", parts=[types.Part(text="{}")]), finish_reason="STOP")])
+
+
+def _generate(local, models):
+    service = gs.GeminiService()
+    service.model_name = MODEL
+    service.client = SimpleNamespace(aio=SimpleNamespace(models=models, caches=mb._AsyncLocalCaches(local)))
+    service.context_cache = cc.ContextCache(service.client, ttl_seconds=100, refresh_seconds=20)
+    config = types.GenerateContentConfig(system_instruction=INSTRUCTION)
+
+    async def main():
+        for _ in range(2):
+            await service._generate([], config, time.monotonic() + 30)
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("error", [
+    None,  # 服务端已删除缓存，回放替身返回 404
+    mb.api_error(400, "Cached content is invalid"),
+    mb.api_error(403, "Permission denied on cached content"),
+])
+def test_cache_miss_falls_back_and_recreates(clock, local, error):
+    models = CachedModels(local, error)
+    if error is None:
+        # 创建后立即在服务端删除
+        original = local.create
+
+        def create_and_delete(**kwargs):
+            cached = original(**kwargs)
+            local.delete(name=cached.name)
+            return cached
+        local.create = create_and_delete
+
+    before = _events("invalidated")
+    _generate(local, models)
+    cached = [config.cached_content for config in models.configs]
+    direct = [config.system_instruction for config in models.configs]
+    # 每次请求：先引用缓存失败，同一次尝试内改为直接发送系统提示词；下一次请求重新创建缓存
+    assert cached == ["cachedContents/local-1", None, "cachedContents/local-2", None]
+    assert direct == [None, INSTRUCTION, None, INSTRUCTION]
+    assert _events("invalidated") == before + 2
+
+
+def test_other_errors_are_not_treated_as_cache_miss(clock, local):
+    models = CachedModels(local, mb.api_error(400, "Invalid argument: contents"))
+    with pytest.raises(Exception, match="Invalid argument"):
+        _generate(local, models)
+    assert len(models.configs) == 1
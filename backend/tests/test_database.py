@@ -0,0 +1,140 @@
+"""SQLite 性能配置：每个新连接应用的 PRAGMA 与连接池参数；PostgreSQL 旧库列类型升级"""
+from datetime import datetime, timezone
+import asyncio
+import json
+import os
+import uuid
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
+
+import app.models  # noqa: F401  注册所有模型
+from app.core.database import Base, _upgrade_schema, create_engine_for, settings, sqlite_pragmas
+
+PRAGMAS = ("journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size", "temp_store")
+
+
+def _read_pragmas(url: str, profile: str):
+    async def main():
+        engine = create_engine_for(url, sqlite_profile=profile)
+        try:
+            values = []
+            # 两个并发连接：PRAGMA 必须在每个新连接上生效，而不只是第一个
+            async with engine.connect() as first, engine.connect() as second:
+                for conn in (first, second):
+                    values.append({name: (await conn.execute(text(f"PRAGMA {name}"))).scalar()
+                                   for name in PRAGMAS})
+            return engine.pool, values
+        finally:
+            await engine.dispose()
+    return asyncio.run(main())
+
+
+def test_production_profile_applies_pragmas_on_every_connection(tmp_path):
+    pool, values = _read_pragmas(f"sqlite+aiosqlite:///{tmp_path / 'app.db'}", "production")
+    for pragmas in values:
+        assert pragmas["journal_mode"] == "wal"
+        assert pragmas["synchronous"] == 1  # NORMAL
+        assert pragmas["busy_timeout"] == settings.sqlite_busy_timeout_ms
+        assert pragmas["cache_size"] == -settings.sqlite_cache_size_kb
+        assert pragmas["mmap_size"] == settings.sqlite_mmap_size_mb * 1024 * 1024
+        assert pragmas["temp_store"] == 2  # MEMORY
+
+
+def test_default_profile_leaves_sqlite_defaults(tmp_path):
+    assert sqlite_pragmas("default") == {}
+    _, values = _read_pragmas(f"sqlite+aiosqlite:///{tmp_path / 'app.db'}", "default")
+    assert values[0]["journal_mode"] == "delete"
+    assert values[0]["synchronous"] == 2  # FULL
+
+
+def test_file_database_uses_sized_queue_pool(tmp_path):
+    pool, _ = _read_pragmas(f"sqlite+aiosqlite:///{tmp_path / 'app.db'}", "production")
+    assert isinstance(pool, AsyncAdaptedQueuePool)
+    assert pool.size() == settings.db_pool_size
+    assert pool._max_overflow == settings.db_max_overflow
+    assert pool._timeout == settings.db_pool_timeout
+
+
+def test_in_memory_database_keeps_default_pool():
+    pool, _ = _read_pragmas("sqlite+aiosqlite://", "production")
+    # 内存库只能有一个连接，保持 SQLAlchemy 的 StaticPool
+    assert isinstance(pool, StaticPool)
+
+
+POSTGRES_URL = os.environ.get("DATABASE_URL", "")
+postgres = pytest.mark.skipif(not POSTGRES_URL.startswith("postgresql"),
+                              reason="需要 DATABASE_URL 指向 PostgreSQL")
+
+LEGACY_CARD_KEYS = """
+CREATE TABLE card_keys (
+    id SERIAL PRIMARY KEY,
+    code VARCHAR(20) UNIQUE NOT NULL,
+    status INTEGER NOT NULL,
+    device_id VARCHAR(64),
+    activated_at TIMESTAMP WITHOUT TIME ZONE,
+    result_cache TEXT,
+    image_paths TEXT,
+    created_at TIMESTAMP WITHOUT TIME ZONE DEFAULT now()
+)
+"""
+
+
+def _upgrade_legacy(rows):
+    """在独立 schema 中建旧版 card_keys（TEXT JSON、无时区时间），写入 rows 后执行建表与升级"""
+    schema = f"upgrade_{uuid.uuid4().hex[:8]}"
+
+    async def main():
+        engine = create_async_engine(POSTGRES_URL, connect_args={"server_settings": {"search_path": schema}})
+        try:
+            async with engine.begin() as conn:
+                await conn.execute(text(f"CREATE SCHEMA {schema}"))
+                await conn.execute(text(LEGACY_CARD_KEYS))
+                for row in rows:
+                    await conn.execute(text(
+                        "INSERT INTO card_keys (code, status, activated_at, result_cache, image_paths) "
+                        "VALUES (:code, 1, :activated_at, :result_cache, :image_paths)"), row)
+            try:
+                async with engine.begin() as conn:
+                    await conn.run_sync(Base.metadata.create_all)
+                    await conn.run_sync(_upgrade_schema)
+                async with engine.connect() as conn:
+                    types = dict((await conn.execute(text(
+                        "SELECT column_name, data_type FROM information_schema.columns "
+                        "WHERE table_schema = :schema AND table_name = 'card_keys'"), {"schema": schema})).all())
+                    values = (await conn.execute(text(
+                        "SELECT code, activated_at, result_cache::text, image_paths::text, image_keys::text "
+                        "FROM card_keys ORDER BY code"))).all()
+                return types, values
+            finally:
+                async with engine.begin() as conn:
+                    await conn.execute(text(f"DROP SCHEMA {schema} CASCADE"))
+        finally:
+            await engine.dispose()
+    return asyncio.run(main())
+
+
+@postgres
+def test_postgres_upgrade_converts_legacy_column_types():
+    types, values = _upgrade_legacy([
+        {"code": "OLD1", "activated_at": datetime(2024, 1, 2, 3, 4, 5),
+         "result_cache": '{"face_width": 30, "描述": "像"}', "image_paths": '{"child": "/api/images/OLD1_child.jpg"}'},
+        {"code": "OLD2", "activated_at": None, "result_cache": None, "image_paths": ""},
+    ])
+    assert types["result_cache"] == types["image_paths"] == types["image_keys"] == "jsonb"
+    assert types["activated_at"] == "timestamp with time zone"
+    (_, old1_at, old1_result, old1_paths, _), (_, _, *old2_json) = values
+    # 旧的无时区时间按 UTC 解释
+    assert old1_at == datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    assert json.loads(old1_result) == {"face_width": 30, "描述": "像"}
+    assert json.loads(old1_paths) == {"child": "/api/images/OLD1_child.jpg"}
+    # 空文本视为无数据；新增的列为空
+    assert old2_json == [None, None, None]
+
+
+@postgres
+def test_postgres_upgrade_refuses_invalid_json():
+    with pytest.raises(RuntimeError, match="card_keys.result_cache 无法从 TEXT 转换为 JSONB"):
+        _upgrade_legacy([{"code": "BAD1", "activated_at": None, "result_cache": "not json", "image_paths": None}])
@@ -0,0 +1,148 @@
+"""模型调用故障注入：配置校验、按种子可复现的抽样与客户端包装"""
+from collections import Counter
+from types import SimpleNamespace
+from google.genai import types
+import asyncio
+
+import pytest
+from pydantic import ValidationError
+
+from app.core.retry import retry_after_of, status_code_of
+from app.services.fault_injection import NON_JSON_TEXT, FaultConfig, FaultInjectingClient, FaultInjector
+
+TEXT = '{"face_width": 30, "analysis_results": []}'
+
+
+def _plans(config: FaultConfig, n: int):
+    injector = FaultInjector(config)
+    return [injector.plan() for _ in range(n)]
+
+
+@pytest.mark.parametrize("fields", [
+    {"error_codes": [200]},
+    {"error_rate": 0.5, "error_codes": []},
+    {"error_rate": 0.6, "empty_rate": 0.5},
+    {"latency_rate": 1.5},
+])
+def test_config_rejects_invalid(fields):
+    with pytest.raises(ValidationError):
+        FaultConfig(**fields)
+
+
+def test_config_active():
+    assert not FaultConfig().active
+    assert not FaultConfig(latency_rate=1.0).active  # 没有延迟时长
+    assert FaultConfig(latency_rate=1.0, latency_ms=10).active
+    assert FaultConfig(fence_rate=0.1).active
+
+
+def test_inactive_config_injects_nothing():
+    assert set(_plans(FaultConfig(), 100)) == {(0.0, None, None)}
+
+
+def test_same_seed_same_plan():
+    config = FaultConfig(seed=7, error_rate=0.2, empty_rate=0.2, truncate_rate=0.2,
+                         latency_rate=0.5, latency_ms=100, latency_distribution="lognormal")
+    assert _plans(config, 200) == _plans(config, 200)
+
+
+def test_kind_frequencies_follow_rates():
+    config = FaultConfig(seed=1, error_rate=0.1, empty_rate=0.2, truncate_rate=0.1, fence_rate=0.2,
+                         non_json_rate=0.1)
+    kinds = Counter(kind for _, kind, _ in _plans(config, 10_000))
+    for kind, rate in (("error", 0.1), ("empty", 0.2), ("truncate", 0.1), ("fence", 0.2), ("non_json", 0.1),
+                       (None, 0.3)):
+        assert abs(kinds[kind] / 10_000 - rate) < 0.02, kind
+
+
+def test_error_burst_continues_failing():
+    config = FaultConfig(seed=3, error_rate=0.01, error_codes=[429, 503], error_burst=5)
+    plans = _plans(config, 5000)
+    first = next(i for i, (_, kind, _) in enumerate(plans) if kind == "error")
+    assert all(kind == "error" and code in (429, 503) for _, kind, code in plans[first:first + 5])
+
+
+@pytest.mark.parametrize("distribution, low, high", [
+    ("fixed", 100, 100), ("uniform", 0, 200), ("exponential", 0, None), ("lognormal", 0, None),
+])
+def test_latency_distributions(distribution, low, high):
+    config = FaultConfig(seed=5, latency_rate=1.0, latency_ms=100, latency_distribution=distribution)
+    delays = [delay * 1000 for delay, _, _ in _plans(config, 2000)]
+    assert min(delays) >= low
+    if high is not None:
+        assert max(delays) <= high
+    if distribution in ("exponential", "lognormal"):
+        assert max(delays) > 300  # 长尾
+
+
+def test_latency_rate_is_respected():
+    config = FaultConfig(seed=9, latency_rate=0.25, latency_ms=10)
+    delayed = sum(1 for delay, _, _ in _plans(config, 4000) if delay)
+    assert abs(delayed / 4000 - 0.25) < 0.03
+
+
+def test_configure_resets_rng_and_burst():
+    injector = FaultInjector(FaultConfig(seed=2, error_rate=1.0, error_burst=100))
+    injector.plan()
+    injector.configure(FaultConfig(seed=2))
+    assert injector.plan() == (0.0, None, None)
+
+
+def test_truncate_at_keeps_a_prefix():
+    injector = FaultInjector(FaultConfig(seed=4))
+    for _ in range(100):
+        assert 30 <= injector.truncate_at(100) <= 90
+
+
+class _Models:
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, *, model, contents, config=None):
+        self.calls += 1
+        return types.GenerateContentResponse(candidates=[types.Candidate(
+            content=types.Content(role="model", parts=[types.Part(text=TEXT)]), finish_reason="STOP")])
+
+
+class _AsyncModels(_Models):
+    async def generate_content(self, *, model, contents, config=None):
+        return super().generate_content(model=model, contents=contents, config=config)
+
+
+def _client(config: FaultConfig):
+    inner = SimpleNamespace(models=_Models(), aio=SimpleNamespace(models=_AsyncModels()))
+    return FaultInjectingClient(inner, FaultInjector(config)), inner
+
+
+def test_client_injects_error_before_call():
+    client, inner = _client(FaultConfig(error_rate=1.0, error_codes=[429], retry_after_s=2))
+    with pytest.raises(Exception) as info:
+        client.models.generate_content(model="m", contents=[])
+    assert status_code_of(info.value) == 429
+    assert retry_after_of(info.value) == 2
+    assert inner.models.calls == 0
+
+
+@pytest.mark.parametrize("field, text, finish_reason", [
+    ("empty_rate", None, "STOP"),
+    ("fence_rate", f"```json\n{TEXT}\n```", "STOP"),
+    ("non_json_rate", NON_JSON_TEXT, "STOP"),
+])
+def test_client_rewrites_response(field, text, finish_reason):
+    client, _ = _client(FaultConfig(**{field: 1.0}))
+    response = asyncio.run(client.aio.models.generate_content(model="m", contents=[]))
+    assert response.text == text
+    assert response.candidates[0].finish_reason == finish_reason
+
+
+def test_client_truncates_response():
+    client, _ = _client(FaultConfig(truncate_rate=1.0))
+    response = client.models.generate_content(model="m", contents=[])
+    assert TEXT.startswith(response.text) and len(response.text) < len(TEXT)
+    assert response.candidates[0].finish_reason == "MAX_TOKENS"
+
+
+def test_client_passes_through_when_inactive():
+    client, inner = _client(FaultConfig())
+    assert client.models.generate_content(model="m", contents=[]).text == TEXT
+    assert inner.models.calls == 1
@@ -0,0 +1,56 @@
+"""图片分发：signed / accel 两种模式下的 Cache-Control"""
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import images
+from app.services import blob_store, image_storage
+
+BLOB = blob_store.blob_key(b"jpeg-bytes")
+LEGACY = "ABCD1234_child.jpg"
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(image_storage.settings, "images_storage_path", str(tmp_path))
+    for name in (BLOB, LEGACY):
+        (tmp_path / name).write_bytes(b"jpeg-bytes")
+    app = FastAPI()
+    app.include_router(images.router)
+    return TestClient(app)
+
+
+def _signed_url(filename: str, ttl: int = 3600) -> str:
+    exp = int(time.time()) + ttl
+    return f"/images/{filename}?exp={exp}&sig={image_storage.sign(filename, exp)}"
+
+
+@pytest.mark.parametrize("mode", ["signed", "accel"])
+def test_signed_blob_is_publicly_cacheable(client, monkeypatch, mode):
+    monkeypatch.setattr(images.settings, "image_delivery_mode", mode)
+    response = client.get(_signed_url(BLOB))
+    assert response.status_code == 200
+    scope, max_age, immutable = [part.strip() for part in response.headers["cache-control"].split(",")]
+    assert (scope, immutable) == ("public", "immutable")
+    assert 3590 <= int(max_age.split("=")[1]) <= 3600
+    if mode == "accel":
+        assert response.headers["x-accel-redirect"].endswith(BLOB)
+    else:
+        assert response.content == b"jpeg-bytes"
+
+
+@pytest.mark.parametrize("mode", ["signed", "accel"])
+def test_legacy_file_stays_private(client, monkeypatch, mode):
+    monkeypatch.setattr(images.settings, "image_delivery_mode", mode)
+    response = client.get(_signed_url(LEGACY))
+    assert response.status_code == 200
+    assert response.headers["cache-control"].startswith("private, ")
+
+
+def test_invalid_signature_is_rejected(client):
+    exp = int(time.time()) + 3600
+    response = client.get(f"/images/{BLOB}?exp={exp}&sig=bad")
+    assert response.status_code == 403
+    assert "cache-control" not in response.headers
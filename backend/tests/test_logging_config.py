@@ -0,0 +1,91 @@
+"""结构化日志：JSON 格式、trace_id / card_id 附加、入队不格式化、队列满时丢弃与载荷采样"""
+import contextvars
+import json
+import logging
+import queue
+
+import pytest
+
+from app.core import logging_config as lc
+from app.core import tracing
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+
+
+def _emit(log_queue, message, *args, **kwargs):
+    """经 QueueHandler + ContextFilter 写一条日志，返回入队的 LogRecord"""
+    handler = lc.NonBlockingQueueHandler(log_queue)
+    handler.addFilter(lc.ContextFilter())
+    logger = logging.Logger("test.logging")
+    logger.addHandler(handler)
+    logger.warning(message, *args, **kwargs)
+    return log_queue.get_nowait() if not log_queue.empty() else None
+
+
+def _in_request(fn, card_id=None):
+    """在模拟的请求上下文中运行 fn：当前 trace 与绑定的 card_id"""
+    def run():
+        tracing._current_trace.set(tracing.Trace(trace_id=TRACE_ID))
+        if card_id is not None:
+            lc.bind_card_id(card_id)
+        return fn()
+    return contextvars.copy_context().run(run)
+
+
+def test_json_record_carries_trace_and_card_id():
+    record = _in_request(lambda: _emit(queue.Queue(), "分析完成 %s", "OK", extra={"stage": "gemini"}), card_id=42)
+    entry = json.loads(lc.JsonFormatter().format(record))
+    assert entry["msg"] == "分析完成 OK"
+    assert entry["level"] == "WARNING" and entry["logger"] == "test.logging"
+    assert entry["trace_id"] == TRACE_ID and entry["card_id"] == 42
+    assert entry["stage"] == "gemini"
+    assert "args" not in entry and "exc" not in entry
+
+
+def test_json_record_outside_request():
+    entry = json.loads(lc.JsonFormatter().format(_emit(queue.Queue(), "启动")))
+    assert entry["trace_id"] == "-"
+    assert "card_id" not in entry
+
+
+def test_card_id_does_not_leak_between_requests():
+    _in_request(lambda: None, card_id=7)
+    record = _in_request(lambda: _emit(queue.Queue(), "另一个请求"))
+    assert json.loads(lc.JsonFormatter().format(record)).get("card_id") is None
+
+
+def test_record_is_enqueued_unformatted_with_exception_text():
+    def fail():
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            return _emit(queue.Queue(), "失败 %d", 3, exc_info=True)
+
+    record = fail()
+    # 格式化留给后台线程；异常堆栈在调用线程中转成文本
+    assert record.msg == "失败 %d" and record.args == (3,)
+    assert record.exc_info is None and "ValueError: boom" in record.exc_text
+    assert "ValueError: boom" in json.loads(lc.JsonFormatter().format(record))["exc"]
+
+
+def test_full_queue_drops_records():
+    log_queue = queue.Queue(maxsize=1)
+    handler = lc.NonBlockingQueueHandler(log_queue)
+    logger = logging.Logger("test.full")
+    logger.addHandler(handler)
+    for _ in range(3):
+        logger.warning("x")
+    assert log_queue.qsize() == 1 and handler.dropped == 2
+
+
+def test_text_formatter_tolerates_missing_trace_id():
+    formatter = lc._TextFormatter("[%(trace_id)s] %(message)s")
+    record = logging.LogRecord("t", logging.INFO, "", 0, "hello", (), None)
+    assert formatter.format(record) == "[-] hello"
+
+
+@pytest.mark.parametrize("rate, draw, sampled", [(0, 0.0, False), (1, 0.99, True), (0.3, 0.2, True), (0.3, 0.5, False)])
+def test_payload_sampling(monkeypatch, rate, draw, sampled):
+    monkeypatch.setattr(lc.settings, "log_payload_sample_rate", rate)
+    monkeypatch.setattr(lc.random, "random", lambda: draw)
+    assert lc.payload_sampled() is sampled
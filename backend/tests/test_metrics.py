@@ -0,0 +1,111 @@
+"""指标导出：Prometheus 文本格式、标签转义、直方图分桶与累计计数"""
+import pytest
+
+from app.core import metrics
+from app.core.metrics import Counter, Gauge, Histogram, Registry
+
+
+@pytest.fixture
+def registry():
+    return Registry()
+
+
+def test_counter_renders_help_type_and_total(registry):
+    plain = Counter("jobs", "Jobs processed", registry=registry)
+    plain.inc()
+    plain.inc(2.5)
+    labelled = Counter("events", "Events by kind", labelnames=("kind",), registry=registry)
+    labelled.labels(kind="a").inc()
+    labelled.labels(kind="b").inc(3)
+    assert registry.render() == (
+        "# HELP jobs Jobs processed\n"
+        "# TYPE jobs counter\n"
+        "jobs_total 3.5\n"
+        "# HELP events Events by kind\n"
+        "# TYPE events counter\n"
+        'events_total{kind="a"} 1\n'
+        'events_total{kind="b"} 3\n'
+    )
+
+
+def test_label_values_are_escaped(registry):
+    counter = Counter("paths", "Paths", labelnames=("path", "note"), registry=registry)
+    counter.labels(path='C:\\data\\"x"', note="line1\nline2").inc()
+    assert 'paths_total{path="C:\\\\data\\\\\\"x\\"",note="line1\\nline2"} 1' in registry.render()
+
+
+def test_labels_returns_the_same_child(registry):
+    counter = Counter("hits", "Hits", labelnames=("code",), registry=registry)
+    # 标签值统一转为字符串
+    assert counter.labels(code=200) is counter.labels(code="200")
+
+
+def test_duplicate_registration_is_rejected(registry):
+    Counter("dup", "First", registry=registry)
+    with pytest.raises(ValueError, match="dup"):
+        Gauge("dup", "Second", registry=registry)
+
+
+def test_gauge_value_and_function(registry):
+    gauge = Gauge("in_flight", "In flight", registry=registry)
+    gauge.inc(3)
+    gauge.dec()
+    assert "in_flight 2\n" in registry.render()
+    gauge.set_function(lambda: 0.25)
+    assert "in_flight 0.25\n" in registry.render()
+    with pytest.raises(ValueError):
+        gauge.labels()
+
+
+def test_histogram_buckets_are_cumulative_with_inclusive_bounds(registry):
+    histogram = Histogram("latency", "Latency", buckets=(1.0, 0.1, 0.5), registry=registry)
+    # 恰好等于上界的样本计入该桶 (le = less or equal)
+    for value in (0.05, 0.1, 0.3, 0.5, 2.0):
+        histogram.observe(value)
+    lines = registry.render().splitlines()
+    assert lines[2:] == [
+        'latency_bucket{le="0.1"} 2',
+        'latency_bucket{le="0.5"} 4',
+        'latency_bucket{le="1"} 4',
+        'latency_bucket{le="+Inf"} 5',
+        "latency_sum 2.95",
+        "latency_count 5",
+    ]
+
+
+def test_labelled_histogram_keeps_label_order_before_le(registry):
+    histogram = Histogram("stage", "Stage", labelnames=("stage",), buckets=(1.0,), registry=registry)
+    histogram.labels(stage="decode").observe(0.5)
+    histogram.labels(stage="gemini").observe(3)
+    assert registry.render().splitlines()[2:] == [
+        'stage_bucket{stage="decode",le="1"} 1',
+        'stage_bucket{stage="decode",le="+Inf"} 1',
+        'stage_sum{stage="decode"} 0.5',
+        'stage_count{stage="decode"} 1',
+        'stage_bucket{stage="gemini",le="1"} 0',
+        'stage_bucket{stage="gemini",le="+Inf"} 1',
+        'stage_sum{stage="gemini"} 3',
+        'stage_count{stage="gemini"} 1',
+    ]
+
+
+def test_histogram_timer_observes_elapsed(registry):
+    histogram = Histogram("block", "Block", buckets=(60.0,), registry=registry)
+    with histogram.time():
+        pass
+    counts, total = histogram._value.snapshot()
+    assert counts == [1, 0] and 0 <= total < 60
+
+
+def test_stage_helper_and_status_outcomes():
+    assert metrics.stage("decode") is metrics.ANALYZE_STAGE_SECONDS.labels(stage="decode")
+    assert metrics.outcome_for_status(200) == "success"
+    assert metrics.outcome_for_status(409) == "busy"
+    assert metrics.outcome_for_status(502) == "failed"
+
+
+def test_default_registry_renders_exposition_text():
+    text = metrics.REGISTRY.render()
+    assert text.endswith("\n")
+    assert "# TYPE analyze_stage_seconds histogram" in text
+    assert "# TYPE analyze_in_flight gauge" in text
@@ -0,0 +1,116 @@
+"""录制与回放：录制在线程中写入、录制后可回放，指纹不受每次尝试的超时与思考预算影响"""
+from types import SimpleNamespace
+import asyncio
+import threading
+
+import pytest
+from google.genai import types
+
+from app.services import model_backends as mb
+
+MODEL = "gemini-test"
+TEXT = '{"face_width": 30}'
+CONTENTS = [types.Content(role="user", parts=[
+    types.Part.from_text(text="分析"),
+    types.Part.from_bytes(data=b"child-image", mime_type="image/jpeg"),
+])]
+
+
+def _config(timeout_ms=1000, thinking=128, **fields):
+    return types.GenerateContentConfig(
+        system_instruction="系统提示词",
+        temperature=0.2,
+        http_options=types.HttpOptions(timeout=timeout_ms),
+        thinking_config=types.ThinkingConfig(thinking_budget=thinking),
+        **fields,
+    )
+
+
+class _Models:
+    def __init__(self):
+        self.calls = 0
+
+    async def generate_content(self, *, model, contents, config=None):
+        self.calls += 1
+        return types.GenerateContentResponse(candidates=[types.Candidate(
+            content=types.Content(role="model", parts=[types.Part(text=TEXT)]), finish_reason="STOP")])
+
+
+def _record(store, config, caches=None):
+    inner = SimpleNamespace(models=None, aio=SimpleNamespace(models=_Models(), caches=caches))
+    client = mb.RecordingClient(inner, store)
+    return client, asyncio.run(client.aio.models.generate_content(model=MODEL, contents=CONTENTS, config=config))
+
+
+def test_async_recording_saves_off_the_event_loop(tmp_path, monkeypatch):
+    store = mb.CassetteStore(str(tmp_path))
+    threads = []
+    original = store.save
+
+    def save(cassette):
+        threads.append(threading.get_ident())
+        return original(cassette)
+
+    monkeypatch.setattr(store, "save", save)
+    _, response = _record(store, _config())
+    assert response.text == TEXT
+    assert len(threads) == 1 and threads[0] != threading.get_ident()
+    assert len(list(tmp_path.glob("*.json"))) == 1
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_recording_failure_does_not_fail_the_call(tmp_path, monkeypatch):
+    store = mb.CassetteStore(str(tmp_path))
+
+    def broken(cassette):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(store, "save", broken)
+    assert _record(store, _config())[1].text == TEXT
+
+
+@pytest.mark.parametrize("replay_config", [
+    _config(),
+    _config(timeout_ms=30000),  # 每次尝试的超时不同
+    _config(thinking=0),  # 自适应思考预算不同
+    _config(timeout_ms=5000, thinking=2048),
+])
+def test_record_then_replay_round_trip(tmp_path, replay_config):
+    _record(mb.CassetteStore(str(tmp_path)), _config())
+    replay = mb.ReplayClient(mb.CassetteStore(str(tmp_path)), latency_scale=0)
+    response = asyncio.run(replay.aio.models.generate_content(model=MODEL, contents=CONTENTS, config=replay_config))
+    assert response.text == TEXT
+    assert mb.fingerprint(MODEL, CONTENTS, replay_config) == mb.fingerprint(MODEL, CONTENTS, _config())
+
+
+@pytest.mark.parametrize("changed", [
+    {"config": _config().model_copy(update={"temperature": 0.9})},
+    {"contents": [types.Content(role="user", parts=[
+        types.Part.from_text(text="分析"), types.Part.from_bytes(data=b"other-image", mime_type="image/jpeg")])]},
+])
+def test_replay_misses_when_request_changes(tmp_path, changed):
+    _record(mb.CassetteStore(str(tmp_path)), _config())
+    replay = mb.ReplayClient(mb.CassetteStore(str(tmp_path)), latency_scale=0)
+    request = dict(model=MODEL, contents=CONTENTS, config=_config())
+    request.update(changed)
+    with pytest.raises(mb.CassetteMissError):
+        replay.models.generate_content(**request)
+
+
+def test_cached_request_replays_like_direct_request(tmp_path):
+    local = mb.LocalCaches()
+    caches = mb._AsyncLocalCaches(local)
+    store = mb.CassetteStore(str(tmp_path))
+    inner = SimpleNamespace(models=None, aio=SimpleNamespace(models=_Models(), caches=caches))
+    client = mb.RecordingClient(inner, store)
+
+    async def record():
+        cached = await client.aio.caches.create(
+            model=MODEL, config=types.CreateCachedContentConfig(system_instruction="系统提示词"))
+        config = _config().model_copy(update={"cached_content": cached.name, "system_instruction": None})
+        await client.aio.models.generate_content(model=MODEL, contents=CONTENTS, config=config)
+
+    asyncio.run(record())
+    # 录制时引用缓存，回放时直接发送系统提示词：按展开后的配置计算指纹，同一条录制可用
+    replay = mb.ReplayClient(mb.CassetteStore(str(tmp_path)), latency_scale=0)
+    assert replay.models.generate_content(model=MODEL, contents=CONTENTS, config=_config(thinking=0)).text == TEXT
@@ -0,0 +1,127 @@
+"""请求采样分析：采样计划的占用、中间件采样并在线程中停止与保存结果"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.core import profiling
+
+
+@pytest.fixture(autouse=True)
+def clean_plan(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling.settings, "profiles_storage_path", str(tmp_path))
+    profiling.disarm()
+    profiling._active.clear()
+    yield
+    profiling.disarm()
+    profiling._active.clear()
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"route": "api/analyze", "count": 1},
+    {"route": "/api", "count": 0},
+    {"route": "/api", "count": profiling.MAX_PROFILE_REQUESTS + 1},
+    {"route": "/api", "count": 1, "interval_ms": 0},
+])
+def test_arm_rejects_invalid(kwargs):
+    with pytest.raises(ValueError):
+        profiling.arm(**kwargs)
+
+
+def test_claim_matches_route_method_and_count():
+    profiling.arm("/api/analyze", 2, method="post")
+    assert profiling._claim("GET", "/api/analyze") is None
+    assert profiling._claim("POST", "/api/other") is None
+    assert profiling._claim("POST", "/api/analyze").remaining == 1
+    # 同一时刻只采样一个请求
+    assert profiling._claim("POST", "/api/analyze") is None
+    profiling._active.clear()
+    assert profiling._claim("POST", "/api/analyze") is not None
+    assert profiling.current_plan() is None
+
+
+def busy_handler(duration):
+    """占用事件循环线程的 CPU"""
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        pass
+
+
+def _app(duration=0.05):
+    async def app(scope, receive, send):
+        busy_handler(duration)
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+    return app
+
+
+def _run(app, path="/api/analyze"):
+    scope = {"type": "http", "method": "POST", "path": path}
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    asyncio.run(profiling.ProfilingMiddleware(app)(scope, receive, send))
+
+
+def test_middleware_writes_collapsed_stacks(tmp_path):
+    profiling.arm("/api/analyze", 1, interval_ms=1)
+    _run(_app())
+    profiles = profiling.list_profiles()
+    assert len(profiles) == 1
+    path = profiling.profile_path(profiles[0]["name"])
+    lines = open(path, encoding="utf-8").read().splitlines()
+    assert any("busy_handler" in line for line in lines)
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0 and ";" in stack
+    # 名额用完后不再采样
+    _run(_app())
+    assert len(profiling.list_profiles()) == 1
+    assert not profiling._active.is_set()
+
+
+def test_stop_and_save_run_off_the_event_loop(monkeypatch):
+    threads = {}
+    stop, save = profiling.StackSampler.stop, profiling.ProfilingMiddleware._save
+
+    def record_stop(self):
+        threads["stop"] = threading.get_ident()
+        return stop(self)
+
+    def record_save(*args):
+        threads["save"] = threading.get_ident()
+        return save(*args)
+
+    monkeypatch.setattr(profiling.StackSampler, "stop", record_stop)
+    monkeypatch.setattr(profiling.ProfilingMiddleware, "_save", staticmethod(record_save))
+    profiling.arm("/api/analyze", 1)
+    loop_thread = threading.get_ident()  # asyncio.run 在当前线程上运行事件循环
+    _run(_app(0.01))
+    assert set(threads) == {"stop", "save"}
+    assert loop_thread not in threads.values()
+    assert len(profiling.list_profiles()) == 1
+
+
+def test_failing_request_still_saves_and_releases(monkeypatch):
+    async def failing(scope, receive, send):
+        raise RuntimeError("boom")
+
+    profiling.arm("/api/analyze", 2)
+    with pytest.raises(RuntimeError):
+        _run(failing)
+    assert not profiling._active.is_set()
+    assert len(profiling.list_profiles()) == 1
+
+
+def test_prune_keeps_latest(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling.settings, "profiles_keep", 2)
+    names = [f"2026010{i}T000000_POST_api_x.collapsed" for i in range(1, 5)]
+    for name in names + ["notes.txt"]:
+        (tmp_path / name).write_text("a;b 1\n")
+    profiling._prune_profiles(str(tmp_path))
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(names[2:] + ["notes.txt"])
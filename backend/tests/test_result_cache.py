@@ -0,0 +1,105 @@
+"""结果响应体缓存：ETag、压缩编码与条件请求匹配"""
+import pytest
+
+from app.services import result_cache as rc
+
+BODY = rc.serialize_payload({"success": True, "analysis_results": [{"part": "眉毛", "description": "像爸爸"}] * 20})
+
+
+def test_compute_etag_is_stable_and_content_addressed():
+    tag = rc.compute_etag(BODY)
+    assert tag == rc.compute_etag(bytes(BODY))
+    assert len(tag) == 32 and all(c in "0123456789abcdef" for c in tag)
+    assert rc.compute_etag(BODY + b" ") != tag
+
+
+def test_serialize_payload_is_compact_and_keeps_chinese():
+    assert rc.serialize_payload({"a": [1, "像"]}) == '{"a":[1,"像"]}'.encode("utf-8")
+
+
+def test_encode_body_gzip_round_trip_is_deterministic():
+    encoded, encoding = rc.encode_body(BODY, " GZIP ")
+    assert encoding == rc.GZIP
+    assert len(encoded) < len(BODY)
+    assert rc.encode_body(BODY, "gzip")[0] == encoded  # mtime=0：相同内容得到相同字节
+    assert rc.decode_body(encoded, encoding) == BODY
+
+
+@pytest.mark.parametrize("compression", ["", None, "identity", "br"])
+def test_encode_body_identity_for_unknown_compression(compression):
+    assert rc.encode_body(BODY, compression) == (BODY, rc.IDENTITY)
+
+
+def test_encode_body_falls_back_to_identity_without_gain():
+    body = b'{"a":1}'
+    assert rc.encode_body(body, "gzip") == (body, rc.IDENTITY)
+
+
+def test_zstd_without_library(monkeypatch):
+    monkeypatch.setattr(rc, "zstandard", None)
+    encoded, encoding = rc.encode_body(BODY, "zstd")
+    assert encoding == rc.GZIP
+    assert rc.decode_body(encoded, encoding) == BODY
+    with pytest.raises(RuntimeError):
+        rc.decode_body(encoded, rc.ZSTD)
+
+
+def test_zstd_round_trip():
+    pytest.importorskip("zstandard")
+    encoded, encoding = rc.encode_body(BODY, "zstd")
+    assert encoding == rc.ZSTD
+    assert rc.decode_body(encoded, encoding) == BODY
+
+
+def test_format_etag_distinguishes_encodings():
+    assert rc.format_etag("abc", rc.IDENTITY) == '"abc"'
+    assert rc.format_etag("abc", rc.GZIP) == '"abc-gzip"'
+
+
+@pytest.mark.parametrize("header, matched", [
+    (None, False),
+    ("", False),
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"abc-gzip"', True),
+    ('W/"abc-zstd"', True),
+    ("*", True),
+    ('"other", "abc"', True),
+    ('"other",W/"abc-gzip"', True),
+    ('"other", "abcd"', False),
+    ('"ab"', False),
+    ('"xabc"', False),
+])
+def test_etag_matches(header, matched):
+    assert rc.etag_matches(header, "abc") is matched
+
+
+@pytest.mark.parametrize("header, encoding, accepted", [
+    (None, rc.IDENTITY, True),
+    (None, rc.GZIP, False),
+    ("gzip, deflate, br", rc.GZIP, True),
+    ("GZIP", rc.GZIP, True),
+    ("deflate", rc.GZIP, False),
+    ("*", rc.ZSTD, True),
+    ("gzip;q=0", rc.GZIP, False),
+    ("gzip; q=0.5", rc.GZIP, True),
+    ("gzip;q=0, *", rc.GZIP, True),
+    ("gzip;q=bad", rc.GZIP, False),
+])
+def test_accepts_encoding(header, encoding, accepted):
+    assert rc.accepts_encoding(header, encoding) is accepted
+
+
+def test_build_result_payload_selects_child():
+    result = {"children": [
+        {"analysis_results": [{"part": "眉毛"}], "face_center": {"x": 1, "y": 2}, "face_width": 30},
+        {"analysis_results": [{"part": "眼睛"}], "face_center": {"x": 3, "y": 4}, "face_width": 40},
+    ]}
+    images = {"child": "/c1", "child_2": "/c2", "father": "/f"}
+    payload = rc.build_result_payload(result, images, child=2)
+    assert payload["analysis_results"] == [{"part": "眼睛"}]
+    assert payload["images"] == {"child": "/c2", "father": "/f"}
+    assert (payload["child"], payload["child_count"]) == (2, 2)
+
+    single = rc.build_result_payload(result["children"][0], {"child": "/c1"})
+    assert "child" not in single and single["face_width"] == 30
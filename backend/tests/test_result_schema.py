@@ -0,0 +1,167 @@
+"""分析结果校验：解析兜底与 ResultValidator 的本地修复"""
+import pytest
+
+from app.services.result_schema import (FALLBACK_DESCRIPTION, FIXED_PARTS, ResultParseError, ResultValidationError,
+                                        ResultValidator, parse_model_json)
+
+
+def _item(part, role="Father", score=80, description="像"):
+    return {"part": part, "similar_to": role, "similarity_score": score, "description": description}
+
+
+def _full(**overrides):
+    data = {"face_center": {"x": 50, "y": 40}, "face_width": 30,
+            "analysis_results": [_item(part) for part in FIXED_PARTS]}
+    data.update(overrides)
+    return data
+
+
+@pytest.fixture(scope="module")
+def validator():
+    return ResultValidator()
+
+
+def test_valid_result_needs_no_repairs(validator):
+    report = validator.validate(_full())
+    assert report.repairs == [] and report.missing == []
+    assert report.result == _full()
+
+
+@pytest.mark.parametrize("name, part", [
+    ("眉毛", "眉毛"), ("1. 眉毛", "眉毛"), ("（7）总结", "总结"), ("Eyebrows", "眉毛"),
+    ("face_shape", "脸型"), ("眼睛 (Eyes)", "眼睛"), ("嘴唇", "嘴巴"), ("耳朵", None), (None, None),
+])
+def test_canonical_part(validator, name, part):
+    assert validator.canonical_part(name) == part
+
+
+@pytest.mark.parametrize("name, role", [
+    ("Father", "Father"), (" dad ", "Father"), ("妈妈", "Mother"), ("MOTHER", "Mother"), ("uncle", None), (1, None),
+])
+def test_canonical_role(validator, name, role):
+    assert validator.canonical_role(name) == role
+
+
+def test_aliases_are_renamed_and_reordered(validator):
+    items = [_item(part) for part in reversed(FIXED_PARTS)]
+    items[0] = _item("Summary", role="爸爸")
+    report = validator.validate(_full(analysis_results=items))
+    assert [item["part"] for item in report.result["analysis_results"]] == list(FIXED_PARTS)
+    assert report.result["analysis_results"][-1]["similar_to"] == "Father"
+    assert {"part_renamed", "role_renamed"} <= set(report.repairs)
+
+
+def test_scores_are_coerced_scaled_and_clamped(validator):
+    items = [_item("眉毛", score="85%"), _item("眼睛", score=0.9), _item("鼻子", score=120),
+             _item("嘴巴", score="abc")]
+    report = validator.validate({"analysis_results": items})
+    scores = {item["part"]: item["similarity_score"] for item in report.result["analysis_results"]}
+    assert scores == {"眉毛": 85, "眼睛": 90, "鼻子": 99}
+    assert {"score_scaled", "score_clamped", "score_dropped"} <= set(report.repairs)
+    assert "嘴巴" in report.missing
+
+
+def test_low_score_flips_role_in_two_parent_mode(validator):
+    report = validator.validate({"analysis_results": [_item("眉毛", role="Father", score=30)]})
+    item = report.result["analysis_results"][0]
+    assert (item["similar_to"], item["similarity_score"]) == ("Mother", 70)
+    assert "role_flipped" in report.repairs
+
+
+def test_single_parent_redirects_to_present_parent(validator):
+    items = [_item("眉毛", role="Mother", score=80), _item("眼睛", role="Father", score=20),
+             _item("鼻子", role="someone", score=60)]
+    report = validator.validate({"analysis_results": items}, target_role="Father")
+    got = [(item["similar_to"], item["similarity_score"]) for item in report.result["analysis_results"]]
+    # 像缺席方 80 = 像在场家长 20；低分在单亲模式下合法；无法识别的角色直接归到在场家长
+    assert got == [("Father", 20), ("Father", 20), ("Father", 60)]
+    assert report.repairs.count("role_redirected") == 2
+
+
+def test_invalid_items_are_dropped(validator):
+    items = ["眉毛", _item("耳朵"), _item("眼睛", role="uncle"), _item("鼻子"), _item("鼻子", score=60)]
+    report = validator.validate({"analysis_results": items})
+    assert [item["part"] for item in report.result["analysis_results"]] == ["鼻子"]
+    assert report.result["analysis_results"][0]["similarity_score"] == 80  # 保留先出现的
+    for repair in ("item_dropped", "unknown_part", "unknown_role", "duplicate_part"):
+        assert repair in report.repairs
+
+
+def test_missing_description_uses_fallback(validator):
+    report = validator.validate({"analysis_results": [_item("鼻子", role="Mother", description="  ")]})
+    assert report.result["analysis_results"][0]["description"] == FALLBACK_DESCRIPTION.format(part="鼻子", parent="妈妈")
+    assert report.repairs == ["description_missing"]
+
+
+@pytest.mark.parametrize("center, width, expected, repairs", [
+    ([30, 40], 25, ({"x": 30, "y": 40}, 25), ["coordinate_coerced"]),
+    ({"x": 0.3, "y": 0.45}, 0.25, ({"x": 30, "y": 45}, 25), ["coordinate_scaled", "face_width_scaled"]),
+    ({"x": "120", "y": -5}, 130, ({"x": 100, "y": 0}, 100),
+     ["coordinate_clamped", "coordinate_clamped", "face_width_clamped"]),
+    ("center", "wide", (None, None), ["coordinate_dropped", "face_width_dropped"]),
+    ({"x": 1, "y": 1}, 1, ({"x": 1, "y": 1}, 1), []),  # 整数 1 不视为比例
+])
+def test_location_repairs(validator, center, width, expected, repairs):
+    report = validator.validate(_full(face_center=center, face_width=width))
+    assert (report.result["face_center"], report.result["face_width"]) == expected
+    assert report.repairs == repairs
+
+
+def test_structural_errors_raise(validator):
+    with pytest.raises(ResultValidationError):
+        validator.validate(["not", "an", "object"])
+    with pytest.raises(ResultValidationError):
+        validator.validate({"analysis_results": {"眉毛": 80}})
+    with pytest.raises(ResultValidationError):
+        validator.validate_location({"face_center": {"x": 1, "y": 2}})
+
+
+def test_merge_fills_only_missing_parts(validator):
+    report = validator.validate(_full(analysis_results=[_item("眉毛"), _item("眼睛")]))
+    assert report.missing == list(FIXED_PARTS[2:])
+    extra = {"analysis_results": [_item("眉毛", score=60)] + [_item(part) for part in FIXED_PARTS[2:]]}
+    merged = validator.merge(report, extra)
+    assert merged.missing == []
+    assert merged.result["analysis_results"][0]["similarity_score"] == 80
+    assert validator.merge(report, "garbage").missing == report.missing
+
+
+@pytest.mark.parametrize("center, width, missing", [
+    (None, 30, ["face_center"]),
+    ({"x": 50, "y": 40}, None, ["face_width"]),
+    ("center", "wide", ["face_center", "face_width"]),  # 无法修复的坐标同样视为缺失
+])
+def test_missing_coordinates_are_reported(validator, center, width, missing):
+    data = _full(face_center=center, face_width=width)
+    assert validator.validate(data).missing == missing
+    report = validator.validate(dict(data, analysis_results=data["analysis_results"][:6]))
+    assert report.missing == ["总结"] + missing
+
+
+def test_merge_fills_missing_coordinates(validator):
+    report = validator.validate(_full(face_center=None, face_width=None))
+    assert validator.merge(report, {"analysis_results": []}).missing == ["face_center", "face_width"]
+    merged = validator.merge(report, {"face_center": [20, 30], "face_width": 0.4})
+    assert merged.missing == []
+    assert (merged.result["face_center"], merged.result["face_width"]) == ({"x": 20, "y": 30}, 40)
+    assert "coordinate_coerced" in merged.repairs
+    # 已有的坐标不会被补充结果覆盖
+    kept = validator.merge(validator.validate(_full(face_width=None)), {"face_center": [1, 2], "face_width": 50})
+    assert (kept.result["face_center"], kept.result["face_width"]) == ({"x": 50, "y": 40}, 50)
+
+
+@pytest.mark.parametrize("text, method", [
+    ('{"a": 1}', "json"),
+    ('```json\n{"a": 1}\n```', "fenced"),
+    ('结果如下：{"a": 1} 以上', "fenced"),
+    ("{'a': 1}", "ast"),
+])
+def test_parse_model_json(text, method):
+    assert parse_model_json(text) == ({"a": 1}, method)
+
+
+@pytest.mark.parametrize("text, reason", [(None, "empty"), ("  ", "empty"), ("抱歉，无法分析", "not_json")])
+def test_parse_model_json_errors(text, reason):
+    with pytest.raises(ResultParseError) as info:
+        parse_model_json(text)
+    assert info.value.reason == reason
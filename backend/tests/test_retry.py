@@ -0,0 +1,163 @@
+"""模型调用重试：截止时间、Retry-After、重试预算与放弃原因"""
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from types import SimpleNamespace
+import asyncio
+import time
+
+import pytest
+
+from app.core.retry import (DeadlineExceeded, RetryBudget, RetryPolicy, RetryRunner, classify,
+                            retry_after_of, status_code_of)
+from app.services.model_backends import api_error
+
+# 无退避等待，用例只验证决策
+FAST = dict(backoff_base=0.0, backoff_max=0.0, min_attempt_timeout=0.01)
+
+
+class Flaky:
+    """按顺序抛出给定异常，之后返回 "ok"；记录每次尝试的 (attempt, timeout)"""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = []
+
+    async def __call__(self, attempt, timeout):
+        self.calls.append((attempt, timeout))
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def _runner(policy: RetryPolicy, budget=None):
+    outcomes, reasons = [], []
+    runner = RetryRunner("test", policy, budget,
+                         on_attempt=lambda outcome, _: outcomes.append(outcome),
+                         on_give_up=reasons.append)
+    return runner, outcomes, reasons
+
+
+def test_retries_until_success():
+    runner, outcomes, reasons = _runner(RetryPolicy(max_attempts=4, **FAST))
+    call = Flaky(api_error(503, "busy"), api_error(429, "slow down"))
+    assert asyncio.run(runner.run(call)) == "ok"
+    assert [attempt for attempt, _ in call.calls] == [1, 2, 3]
+    assert outcomes == ["server_error", "rate_limited", "success"]
+    assert reasons == []
+
+
+def test_not_retryable_error_is_raised_immediately():
+    runner, outcomes, reasons = _runner(RetryPolicy(**FAST))
+    call = Flaky(api_error(400, "bad request"))
+    with pytest.raises(Exception) as info:
+        asyncio.run(runner.run(call))
+    assert status_code_of(info.value) == 400
+    assert len(call.calls) == 1
+    assert (outcomes, reasons) == (["error"], ["not_retryable"])
+
+
+def test_gives_up_after_max_attempts():
+    runner, _, reasons = _runner(RetryPolicy(max_attempts=3, **FAST))
+    call = Flaky(*[api_error(503, "busy")] * 5)
+    with pytest.raises(Exception):
+        asyncio.run(runner.run(call))
+    assert len(call.calls) == 3
+    assert reasons == ["max_attempts"]
+
+
+def test_attempt_timeouts_stop_at_deadline():
+    policy = RetryPolicy(deadline=0.3, attempt_timeout=0.1, max_attempts=10, **FAST)
+    runner, outcomes, reasons = _runner(policy)
+
+    async def hang(attempt, timeout):
+        await asyncio.sleep(5)
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(runner.run(hang))
+    assert time.monotonic() - start < 1.0
+    assert outcomes and set(outcomes) == {"timeout"}
+    assert reasons == ["deadline"]
+
+
+def test_attempt_timeout_is_capped_by_remaining_time():
+    runner, _, _ = _runner(RetryPolicy(attempt_timeout=60, **FAST))
+    call = Flaky()
+    asyncio.run(runner.run(call, deadline=time.monotonic() + 2))
+    assert call.calls[0][1] <= 2
+
+
+def test_expired_deadline_fails_without_calling():
+    runner, _, reasons = _runner(RetryPolicy(**FAST))
+    call = Flaky()
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(runner.run(call, deadline=time.monotonic() - 1))
+    assert call.calls == [] and reasons == ["deadline"]
+
+
+def test_retry_after_overrides_backoff():
+    runner, _, _ = _runner(RetryPolicy(backoff_base=100, backoff_max=100))
+    error = api_error(429, "slow down", retry_after=1.5)
+    assert retry_after_of(error) == 1.5
+    assert runner._next_delay(error, 1, time.monotonic() + 60) == 1.5
+
+
+def test_retry_after_beyond_deadline_gives_up():
+    runner, _, reasons = _runner(RetryPolicy(deadline=5, min_attempt_timeout=1))
+    call = Flaky(api_error(429, "slow down", retry_after=30))
+    start = time.monotonic()
+    with pytest.raises(Exception) as info:
+        asyncio.run(runner.run(call))
+    assert status_code_of(info.value) == 429
+    assert time.monotonic() - start < 1.0  # 不会等待 Retry-After
+    assert reasons == ["deadline"]
+
+
+def test_retry_after_http_date():
+    when = datetime.now(timezone.utc) + timedelta(seconds=30)
+    error = SimpleNamespace(response=SimpleNamespace(headers={"retry-after": format_datetime(when, usegmt=True)}))
+    assert 25 <= retry_after_of(error) <= 30
+    past = SimpleNamespace(response=SimpleNamespace(headers={"Retry-After": "Mon, 01 Jan 2001 00:00:00 GMT"}))
+    assert retry_after_of(past) == 0.0
+    assert retry_after_of(SimpleNamespace(response=SimpleNamespace(headers={"Retry-After": "soon"}))) is None
+    assert retry_after_of(api_error(503, "busy")) is None
+
+
+def test_budget_exhaustion_stops_retries():
+    budget = RetryBudget(ratio=0.0, min_per_second=0.0, max_tokens=1)
+    runner, _, reasons = _runner(RetryPolicy(max_attempts=10, **FAST), budget)
+    call = Flaky(*[api_error(503, "busy")] * 5)
+    with pytest.raises(Exception):
+        asyncio.run(runner.run(call))
+    assert len(call.calls) == 2  # 唯一的令牌用于第一次重试
+    assert reasons == ["budget_exhausted"]
+
+
+def test_budget_refills_by_ratio_per_request():
+    budget = RetryBudget(ratio=0.25, min_per_second=0.0, max_tokens=2)
+    assert budget.try_acquire() and budget.try_acquire()
+    assert not budget.try_acquire()
+    for _ in range(3):
+        budget.record_request()
+    assert not budget.try_acquire()
+    budget.record_request()
+    assert budget.try_acquire()
+    for _ in range(100):
+        budget.record_request()
+    assert budget.tokens == 2  # 不超过上限
+
+
+@pytest.mark.parametrize("error, cause", [
+    (api_error(429, "x"), "rate_limited"),
+    (api_error(503, "x"), "server_error"),
+    (api_error(504, "x"), "server_error"),
+    (api_error(400, "x"), None),
+    (api_error(403, "x"), None),
+    (asyncio.TimeoutError(), "timeout"),
+    (ConnectionResetError(), "network"),
+    (type("ReadTimeout", (Exception,), {})(), "timeout"),
+    (type("ConnectError", (Exception,), {})(), "network"),
+    (ValueError("bad json"), None),
+])
+def test_classify(error, cause):
+    assert classify(error, RetryPolicy()) == cause
@@ -0,0 +1,112 @@
+"""多个孩子一次分析：按孩子序号对应结果、重复或越界的序号、不完整的孩子单独补充分析"""
+from types import SimpleNamespace
+import asyncio
+import json
+
+from google.genai import types
+
+from app.services import gemini_service as gs
+from app.services.result_schema import FIXED_PARTS
+from app.services.thinking_budget import ThinkingBudgetController
+
+CHILDREN = [b"child-1", b"child-2", b"child-3"]
+
+
+def _child(width, child=None, parts=FIXED_PARTS, center=True):
+    """一个孩子的结果；face_width 用来区分是哪个孩子"""
+    result = {"face_width": width,
+              "analysis_results": [{"part": part, "similar_to": "Father", "similarity_score": 80, "description": "像"}
+                                   for part in parts]}
+    if center:
+        result["face_center"] = {"x": 50, "y": 40}
+    if child is not None:
+        result["child"] = child
+    return result
+
+
+def _response(data):
+    text = json.dumps(data, ensure_ascii=False)
+    return types.GenerateContentResponse(candidates=[types.Candidate(
+        content=types.Content(role="model", parts=[types.Part(text=text)]), finish_reason="STOP")])
+
+
+class ScriptedModels:
+    """多孩子调用返回 combined；单独补充分析按请求中的孩子照片返回 fallback[照片]"""
+
+    def __init__(self, combined, fallback=None):
+        self.combined = combined
+        self.fallback = fallback or {}
+        self.calls = []
+
+    async def generate_content(self, *, model, contents, config=None):
+        images = [part.inline_data.data for part in contents[0].parts if part.inline_data]
+        self.calls.append(images)
+        children = [image for image in images if image in CHILDREN]
+        if len(children) > 1:
+            return _response(self.combined)
+        return _response(self.fallback[children[0]])
+
+
+def _analyze(models, count=3):
+    service = gs.GeminiService()
+    service.client = SimpleNamespace(aio=SimpleNamespace(models=models))
+    service.context_cache = None
+    service.thinking = ThinkingBudgetController.fixed(0)
+    return asyncio.run(service.analyze_family_photos(
+        child_image=CHILDREN[0], father_image=b"father", father_mime_type="image/jpeg",
+        sibling_images=[(image, "image/jpeg") for image in CHILDREN[1:count]],
+    ))
+
+
+def _widths(result):
+    return [child["face_width"] for child in result["children"]]
+
+
+def test_results_follow_child_index_not_position():
+    models = ScriptedModels({"children": [_child(3, child=3), _child(1, child=1), _child(2, child=2)]})
+    result = _analyze(models)
+    assert _widths(result) == [1, 2, 3]
+    # 顶层为第一个孩子的结果
+    assert result["face_width"] == 1
+    assert len(models.calls) == 1
+    # 父母照片只发送一次
+    assert models.calls[0].count(b"father") == 1
+
+
+def test_missing_child_index_falls_back_to_position():
+    models = ScriptedModels({"children": [_child(1), _child(2), _child(3)]})
+    assert _widths(_analyze(models)) == [1, 2, 3]
+
+
+def test_duplicate_child_index_keeps_first_and_reanalyzes_the_rest():
+    models = ScriptedModels(
+        {"children": [_child(1, child=1), _child(99, child=1), _child(3, child=3)]},
+        fallback={b"child-2": _child(2)},
+    )
+    assert _widths(_analyze(models)) == [1, 2, 3]
+    assert models.calls[1] == [b"father", b"child-2"]
+
+
+def test_out_of_range_child_index_uses_position():
+    models = ScriptedModels({"children": [_child(1, child=1), _child(2, child=7), _child(3, child=0)]})
+    assert _widths(_analyze(models)) == [1, 2, 3]
+    assert len(models.calls) == 1
+
+
+def test_incomplete_children_are_analyzed_separately():
+    models = ScriptedModels(
+        {"children": [_child(1, child=1), _child(20, child=2, parts=FIXED_PARTS[:5]),
+                      _child(30, child=3, center=False)]},
+        fallback={b"child-2": _child(2), b"child-3": _child(3)},
+    )
+    result = _analyze(models)
+    # 缺少部位与缺少坐标的孩子都单独分析，不影响完整的孩子
+    assert _widths(result) == [1, 2, 3]
+    assert sorted(call[-1] for call in models.calls[1:]) == [b"child-2", b"child-3"]
+
+
+def test_single_child_output_is_used_for_the_first_child():
+    # 模型忽略了多孩子结构，只输出了一个孩子
+    models = ScriptedModels(_child(1), fallback={b"child-2": _child(2)})
+    assert _widths(_analyze(models, count=2)) == [1, 2]
+    assert len(models.calls) == 2
@@ -0,0 +1,112 @@
+"""S3Storage：以 moto 模拟的 S3 代替 MinIO，覆盖建桶、上传去重、刷新、预签名与删除路径"""
+from datetime import timedelta
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+from botocore.exceptions import ClientError  # noqa: E402
+
+from app.models.types import utcnow  # noqa: E402
+from app.services import storage  # noqa: E402
+
+BUCKET = "gene-test"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    for name, value in (("s3_bucket", BUCKET), ("s3_prefix", "images/"), ("s3_region", "us-east-1"),
+                        ("s3_endpoint_url", ""), ("s3_public_endpoint_url", ""),
+                        ("s3_manage_lifecycle", True), ("data_retention_hours", 24)):
+        monkeypatch.setattr(storage.settings, name, value)
+    with moto.mock_aws():
+        backend = storage.S3Storage()
+        asyncio.run(backend.startup())
+        yield backend
+
+
+def _client_error(code: str, operation: str = "HeadBucket") -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}}, operation)
+
+
+def test_startup_creates_bucket_with_lifecycle(s3):
+    s3._client.head_bucket(Bucket=BUCKET)
+    rules = s3._client.get_bucket_lifecycle_configuration(Bucket=BUCKET)["Rules"]
+    assert rules[0]["Expiration"]["Days"] == 2
+    assert rules[0]["Filter"]["Prefix"] == "images/"
+    # 再次启动：存储桶已存在，不重复创建
+    asyncio.run(s3.startup())
+
+
+@pytest.mark.parametrize("code", ["403", "AccessDenied", "301", "PermanentRedirect"])
+def test_ensure_bucket_reraises_non_missing_errors(s3, code):
+    client = mock.Mock()
+    client.head_bucket.side_effect = _client_error(code)
+    s3._client = client
+    with pytest.raises(ClientError):
+        s3._ensure_bucket()
+    client.create_bucket.assert_not_called()
+
+
+@pytest.mark.parametrize("code", ["404", "NoSuchBucket"])
+def test_ensure_bucket_creates_only_when_missing(s3, code):
+    client = mock.Mock()
+    client.head_bucket.side_effect = _client_error(code)
+    s3._client = client
+    s3._ensure_bucket()
+    client.create_bucket.assert_called_once_with(Bucket=BUCKET)
+
+
+def test_put_uploads_then_dedupes_and_refreshes(s3):
+    key = "a" * 64 + ".jpg"
+    assert asyncio.run(s3.put(key, b"jpeg-bytes", "image/jpeg")) is True
+    head = s3._client.head_object(Bucket=BUCKET, Key=f"images/{key}")
+    assert head["ContentType"] == "image/jpeg"
+    assert "immutable" in head["CacheControl"]
+
+    # 已存在：不重新上传，改为原地复制刷新 LastModified
+    with mock.patch.object(s3._client, "put_object", wraps=s3._client.put_object) as put_object, \
+            mock.patch.object(s3._client, "copy_object", wraps=s3._client.copy_object) as copy_object:
+        assert asyncio.run(s3.put(key, b"jpeg-bytes", "image/jpeg")) is False
+    put_object.assert_not_called()
+    copy_object.assert_called_once()
+    body = s3._client.get_object(Bucket=BUCKET, Key=f"images/{key}")["Body"].read()
+    assert body == b"jpeg-bytes"
+
+
+def test_put_reraises_non_missing_head_errors(s3):
+    client = mock.Mock()
+    client.head_object.side_effect = _client_error("403", "HeadObject")
+    s3._client = client
+    with pytest.raises(ClientError):
+        asyncio.run(s3.put("b" * 64 + ".jpg", b"x", "image/jpeg"))
+    client.put_object.assert_not_called()
+
+
+def test_presigned_url_expiry_is_clamped(s3):
+    key = "c" * 64 + ".jpg"
+
+    def expires(url: str) -> int:
+        query = parse_qs(urlparse(url).query)
+        assert urlparse(url).path.endswith(f"/images/{key}")
+        if "X-Amz-Expires" in query:  # SigV4：相对秒数
+            return int(query["X-Amz-Expires"][0])
+        return round(int(query["Expires"][0]) - time.time())  # 查询串签名：绝对时间
+
+    assert 3500 <= expires(s3.url(key, utcnow() + timedelta(hours=1))) <= 3600
+    assert abs(expires(s3.url(key, utcnow() - timedelta(hours=1))) - 60) <= 2
+    assert abs(expires(s3.url(key, None)) - storage.MAX_PRESIGN_SECONDS) <= 2
+    assert abs(expires(s3.url(key, utcnow() + timedelta(days=30))) - storage.MAX_PRESIGN_SECONDS) <= 2
+
+
+def test_delete_is_left_to_lifecycle(s3):
+    key = "d" * 64 + ".jpg"
+    asyncio.run(s3.put(key, b"x", "image/jpeg"))
+    assert asyncio.run(s3.delete_stale([key, "missing.jpg"], cutoff=0)) == ["skipped", "skipped"]
+    s3._client.head_object(Bucket=BUCKET, Key=f"images/{key}")
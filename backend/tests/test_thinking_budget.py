@@ -0,0 +1,114 @@
+"""思考预算：控制器调整与 GenerateContentConfig 中实际下发的 thinking_budget"""
+from types import SimpleNamespace
+from google.genai import types
+import asyncio
+import json
+
+from app.services import gemini_service as gs
+from app.services.thinking_budget import ThinkingBudgetController, thinking_config
+
+RESULT = {
+    "face_center": {"x": 50, "y": 40},
+    "face_width": 30,
+    "analysis_results": [
+        {"part": part, "similar_to": "Father", "similarity_score": 80, "description": "d"}
+        for part in ("眉毛", "眼睛", "鼻子", "嘴巴", "脸型", "头型", "总结")
+    ],
+}
+
+
+class RecordingModels:
+    """记录每次 generate_content 的配置，返回固定结果"""
+
+    def __init__(self):
+        self.configs = []
+        self.result = RESULT
+
+    async def generate_content(self, *, model, contents, config=None):
+        self.configs.append(config)
+        return types.GenerateContentResponse(candidates=[types.Candidate(
+            content=types.Content(role="model", parts=[types.Part(text=json.dumps(self.result, ensure_ascii=False))]),
+            finish_reason="STOP",
+        )])
+
+
+def _service(thinking: ThinkingBudgetController):
+    service = gs.GeminiService()
+    models = RecordingModels()
+    service.client = SimpleNamespace(aio=SimpleNamespace(models=models))
+    service.context_cache = None
+    service.thinking = thinking
+    return service, models
+
+
+def test_thinking_config_carries_budget():
+    assert thinking_config(0).thinking_budget == 0
+    assert thinking_config(4096).thinking_budget == 4096
+
+
+def test_generate_config_carries_fixed_budget():
+    service, models = _service(ThinkingBudgetController.fixed(2048))
+    asyncio.run(service.analyze_family_photos(child_image=b"child"))
+    config = models.configs[-1]
+    assert isinstance(config, types.GenerateContentConfig)
+    assert config.thinking_config.thinking_budget == 2048
+
+
+def test_generate_config_carries_disabled_budget():
+    # GEMINI_ENABLE_THINKING=false 时固定为 0
+    service, models = _service(ThinkingBudgetController.fixed(0))
+    asyncio.run(service.analyze_family_photos(child_image=b"child"))
+    assert models.configs[-1].thinking_config.thinking_budget == 0
+
+
+def test_generate_config_carries_adaptive_budget():
+    controller = ThinkingBudgetController(slo_seconds=10, min_budget=0, max_budget=4096)
+    service, models = _service(controller)
+    asyncio.run(service.analyze_family_photos(child_image=b"child"))
+    assert models.configs[-1].thinking_config.thinking_budget == controller.level == 4096
+
+
+def test_thinking_budget_leaves_room_for_the_answer():
+    # 思考计入 max_output_tokens：预算等于输出上限时必须为答案预留空间
+    service, models = _service(ThinkingBudgetController.fixed(8192))
+    service.output_budget._budget = 8192
+    asyncio.run(service.analyze_family_photos(child_image=b"child"))
+    config = models.configs[-1]
+    reserve = gs.settings.gemini_answer_reserve_tokens
+    assert config.max_output_tokens == 8192
+    assert config.thinking_config.thinking_budget == 8192 - reserve
+
+    # 输出上限小于预留时不思考
+    service.output_budget._budget = reserve // 2
+    asyncio.run(service.analyze_family_photos(child_image=b"child"))
+    assert models.configs[-1].thinking_config.thinking_budget == 0
+
+
+def test_sibling_call_reserves_answer_per_child():
+    service, models = _service(ThinkingBudgetController.fixed(100_000))
+    service.output_budget._budget = 8192
+    siblings = {"children": [dict(RESULT, child=1), dict(RESULT, child=2)]}
+    models.result = siblings
+    asyncio.run(service.analyze_family_photos(child_image=b"child", sibling_images=[(b"child2", "image/jpeg")]))
+    config = models.configs[-1]
+    reserve = gs.settings.gemini_answer_reserve_tokens
+    assert config.thinking_config.thinking_budget == config.max_output_tokens - 2 * reserve
+
+
+def test_controller_scales_down_with_depth():
+    controller = ThinkingBudgetController(slo_seconds=10, min_budget=0, max_budget=8192, busy_depth=3)
+    assert controller.start() == 8192
+    assert controller.start() == 4096
+    assert controller.start() == 0
+    for _ in range(3):
+        controller.finish()
+    assert controller.active == 0
+
+
+def test_controller_lowers_level_above_slo():
+    controller = ThinkingBudgetController(slo_seconds=1, min_budget=0, max_budget=8192,
+                                          min_samples=5, adjust_every=5)
+    for _ in range(5):
+        controller.start()
+        controller.finish(latency=2.0)
+    assert controller.level == 5632  # 8192 × 0.7 按 128 取整
@@ -0,0 +1,134 @@
+"""链路追踪：traceparent 解析、尾部采样（出错与慢请求总是导出）、中间件的 span 与响应头"""
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+
+from app.core import tracing
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+
+class RecordingWorker:
+    """代替后台导出线程，直接记录提交的 span"""
+
+    def __init__(self):
+        self.batches = []
+
+    def submit(self, spans):
+        self.batches.append(spans)
+
+
+@pytest.fixture
+def exported(monkeypatch):
+    worker = RecordingWorker()
+    monkeypatch.setattr(tracing, "_exporter", worker)
+    monkeypatch.setattr(tracing.settings, "trace_sample_rate", 0.0)
+    monkeypatch.setattr(tracing.settings, "trace_slow_threshold_ms", 1000)
+    return worker.batches
+
+
+@pytest.mark.parametrize("header, expected", [
+    (f"00-{TRACE_ID}-{PARENT_ID}-01", (TRACE_ID, PARENT_ID)),
+    (f"  00-{TRACE_ID.upper()}-{PARENT_ID}-00 ", (TRACE_ID, PARENT_ID)),
+    (None, (None, None)),
+    ("", (None, None)),
+    (f"00-{'0' * 32}-{PARENT_ID}-01", (None, None)),  # 全零 trace id 无效
+    (f"00-{TRACE_ID[:-1]}-{PARENT_ID}-01", (None, None)),
+    (f"00-{TRACE_ID}-{PARENT_ID}", (None, None)),
+    (f"00-{TRACE_ID}-{PARENT_ID}-01-extra", (None, None)),
+    ("garbage", (None, None)),
+])
+def test_parse_traceparent(header, expected):
+    assert tracing._parse_traceparent(header) == expected
+
+
+@pytest.mark.parametrize("has_error, duration_ms, rate, exported", [
+    (True, 1, 0.0, True),
+    (False, 1000, 0.0, True),
+    (False, 999, 0.0, False),
+    (False, 1, 1.0, True),
+])
+def test_tail_sampling(monkeypatch, has_error, duration_ms, rate, exported):
+    monkeypatch.setattr(tracing.settings, "trace_sample_rate", rate)
+    monkeypatch.setattr(tracing.settings, "trace_slow_threshold_ms", 1000)
+    trace = tracing.Trace(trace_id=TRACE_ID, has_error=has_error)
+    assert tracing._should_export(trace, duration_ms) is exported
+
+
+def _app():
+    app = FastAPI()
+
+    @app.get("/ok")
+    async def ok():
+        with tracing.span("work", step=1):
+            pass
+        return {"trace_id": tracing.current_trace_id()}
+
+    @app.get("/broken")
+    async def broken():
+        raise HTTPException(status_code=503, detail="down")
+
+    @app.get("/raises")
+    async def raises():
+        with tracing.span("work"):
+            raise ValueError("boom")
+
+    return tracing.TracingMiddleware(app)
+
+
+def _get(path, headers=None):
+    async def main():
+        transport = httpx.ASGITransport(app=_app(), raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get(path, headers=headers)
+    return asyncio.run(main())
+
+
+def test_request_continues_incoming_trace(exported, monkeypatch):
+    monkeypatch.setattr(tracing.settings, "trace_sample_rate", 1.0)
+    response = _get("/ok", headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-01"})
+    assert response.headers["x-trace-id"] == TRACE_ID
+    assert response.json() == {"trace_id": TRACE_ID}
+    [spans] = exported
+    work, root = spans
+    assert root["name"] == "GET /ok" and root["parent_id"] == PARENT_ID
+    assert root["attributes"]["http.status_code"] == 200
+    assert work["parent_id"] == root["span_id"] and work["attributes"] == {"step": 1}
+    assert tracing.current_trace_id() is None
+
+
+def test_fast_successful_request_is_sampled_out(exported):
+    response = _get("/ok")
+    # 没有 traceparent 时生成新的 trace id
+    assert len(response.headers["x-trace-id"]) == 32
+    assert exported == []
+
+
+def test_server_error_status_is_always_exported(exported):
+    assert _get("/broken").status_code == 503
+    [[root]] = exported
+    assert root["attributes"]["http.status_code"] == 503
+
+
+def test_raised_exception_is_always_exported(exported):
+    assert _get("/raises").status_code == 500
+    [spans] = exported
+    assert spans[0]["name"] == "work" and spans[0]["error"] == "ValueError: boom"
+
+
+def test_slow_request_is_always_exported(exported, monkeypatch):
+    monkeypatch.setattr(tracing.settings, "trace_slow_threshold_ms", 0)
+    _get("/ok")
+    assert len(exported) == 1
+
+
+def test_span_is_noop_outside_requests_or_without_exporter(monkeypatch):
+    monkeypatch.setattr(tracing, "_exporter", RecordingWorker())
+    assert tracing.span("outside") is tracing._NOOP
+    monkeypatch.setattr(tracing, "_exporter", None)
+    # 未启用导出时仍分配 trace id（日志关联用），只是不记录 span
+    response = _get("/ok")
+    assert response.json() == {"trace_id": response.headers["x-trace-id"]}
@@ -0,0 +1,198 @@
+"""输出截断：抢救被截断的 JSON、自适应输出上限与 GeminiService 的截断恢复"""
+from types import SimpleNamespace
+import asyncio
+import json
+
+import pytest
+
+from app.services.truncation import OutputBudget, output_tokens, salvage_truncated
+
+FULL = json.dumps({
+    "face_center": {"x": 50, "y": 40},
+    "face_width": 30,
+    "analysis_results": [
+        {"part": "眉毛", "similar_to": "Father", "similarity_score": 80, "description": "浓密, 像爸爸 {\"x\"}"},
+        {"part": "眼睛", "similar_to": "Mother", "similarity_score": 70, "description": "双眼皮"},
+    ],
+}, ensure_ascii=False)
+
+
+def test_complete_json_is_returned_unchanged():
+    assert salvage_truncated("前缀 " + FULL + " 后缀") == json.loads(FULL)
+
+
+def test_truncated_inside_second_item_keeps_first():
+    cut = FULL.index('{"part": "眼睛"') + 12
+    result = salvage_truncated(FULL[:cut])
+    assert result["face_width"] == 30
+    assert [item["part"] for item in result["analysis_results"]] == ["眉毛"]
+
+
+def test_truncated_inside_string_with_braces_and_commas():
+    # 截断点位于含逗号与括号的字符串中，不能在字符串内部切断
+    cut = FULL.index("像爸爸") + 2
+    result = salvage_truncated(FULL[:cut])
+    # 只保留到上一个完整的值，半截的 description 被整体丢弃
+    assert result["analysis_results"] == [{"part": "眉毛", "similar_to": "Father", "similarity_score": 80}]
+
+
+@pytest.mark.parametrize("text", ["", "没有 JSON", "{", '{"face_center": {"x": 5', "[1, 2"])
+def test_unsalvageable_returns_none(text):
+    assert salvage_truncated(text) is None
+
+
+def test_every_prefix_is_valid_or_none():
+    for cut in range(len(FULL)):
+        result = salvage_truncated(FULL[:cut])
+        assert result is None or isinstance(result, dict)
+
+
+def test_budget_clamps_and_rounds_initial():
+    assert OutputBudget(initial=1000, floor=512, ceiling=8192).current == 1024
+    assert OutputBudget(initial=100, floor=512, ceiling=8192).current == 512
+    assert OutputBudget(initial=99999, floor=512, ceiling=8192).current == 8192
+
+
+def test_truncation_grows_budget_immediately():
+    budget = OutputBudget(initial=2048, floor=512, ceiling=8192, growth=1.5)
+    assert budget.observe(2048, truncated=True) == 3072
+    assert budget.observe(None, truncated=True) == 4608
+    for _ in range(5):
+        budget.observe(4000, truncated=True)
+    assert budget.current == 8192
+
+
+def test_budget_follows_p99_after_min_samples():
+    budget = OutputBudget(initial=8192, floor=512, ceiling=16384, headroom=1.5, min_samples=20)
+    for _ in range(19):
+        assert budget.observe(1000, truncated=False) == 8192  # 样本不足时不调整
+    assert budget.observe(1000, truncated=False) == 1536
+    assert budget.observe(None, truncated=False) == 1536  # 无用量数据的调用不计入样本
+
+
+def test_truncation_sample_keeps_budget_within_window():
+    budget = OutputBudget(initial=1024, floor=512, ceiling=16384, headroom=1.5, growth=2, min_samples=5)
+    raised = budget.observe(1024, truncated=True)
+    for _ in range(10):
+        budget.observe(500, truncated=False)
+    assert budget.current == raised  # 截断后的上限按 p99 保持
+
+
+def test_output_tokens():
+    usage = SimpleNamespace(total_token_count=1500, prompt_token_count=1000, candidates_token_count=200)
+    assert output_tokens(SimpleNamespace(usage_metadata=usage)) == 500  # 含思考
+    usage = SimpleNamespace(total_token_count=None, prompt_token_count=None, candidates_token_count=200)
+    assert output_tokens(SimpleNamespace(usage_metadata=usage)) == 200
+    assert output_tokens(SimpleNamespace(usage_metadata=None)) is None
+
+
+# ---- GeminiService 的截断恢复 ----
+
+PARTS = ("眉毛", "眼睛", "鼻子", "嘴巴", "脸型", "头型", "总结")
+
+
+def _items(parts):
+    return [{"part": part, "similar_to": "Father", "similarity_score": 80, "description": "像"} for part in parts]
+
+
+def _response(text, finish_reason="STOP"):
+    from google.genai import types
+    return types.GenerateContentResponse(candidates=[types.Candidate(
+        content=types.Content(role="model", parts=[types.Part(text=text)]), finish_reason=finish_reason)])
+
+
+class ScriptedModels:
+    """按顺序返回预设响应，记录请求内容"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    async def generate_content(self, *, model, contents, config=None):
+        self.calls.append(contents)
+        return self.responses.pop(0)
+
+
+def _service(*responses):
+    from app.services import gemini_service as gs
+    from app.services.thinking_budget import ThinkingBudgetController
+    service = gs.GeminiService()
+    models = ScriptedModels(*responses)
+    service.client = SimpleNamespace(aio=SimpleNamespace(models=models))
+    service.context_cache = None
+    service.thinking = ThinkingBudgetController.fixed(0)
+    return service, models
+
+
+def _truncated_full(parts):
+    """输出了坐标与 parts，之后被截断"""
+    text = json.dumps({"face_center": {"x": 50, "y": 40}, "face_width": 30,
+                       "analysis_results": _items(parts) + [{"part": "截断"}]}, ensure_ascii=False)
+    return text[:text.index('{"part": "截断"')]
+
+
+def test_truncation_is_continued_with_missing_parts():
+    service, models = _service(
+        _response(_truncated_full(PARTS[:3]), "MAX_TOKENS"),
+        _response(json.dumps({"analysis_results": _items(PARTS[3:])}, ensure_ascii=False)),
+    )
+    result = asyncio.run(service.analyze_family_photos(child_image=b"child"))
+    assert [item["part"] for item in result["analysis_results"]] == list(PARTS)
+    assert len(models.calls) == 2
+
+
+def test_incomplete_continuation_fails_instead_of_returning_partial():
+    service, models = _service(
+        _response(_truncated_full(PARTS[:3]), "MAX_TOKENS"),
+        _response(json.dumps({"analysis_results": _items(PARTS[3:5])}, ensure_ascii=False)),
+    )
+    with pytest.raises(ValueError, match="头型"):
+        asyncio.run(service.analyze_family_photos(child_image=b"child"))
+
+
+def test_refetch_truncated_again_requests_missing_parts():
+    service, models = _service(
+        _response('{"analysis_results": [', "MAX_TOKENS"),  # 坐标之前就被截断
+        _response(_truncated_full(PARTS[:5]), "MAX_TOKENS"),  # 重新请求再次截断
+        _response(json.dumps({"analysis_results": _items(PARTS[5:])}, ensure_ascii=False)),
+    )
+    result = asyncio.run(service.analyze_family_photos(child_image=b"child"))
+    assert len(result["analysis_results"]) == 7
+    assert len(models.calls) == 3
+
+
+def test_refetch_still_incomplete_fails():
+    service, _ = _service(
+        _response('{"analysis_results": [', "MAX_TOKENS"),
+        _response(_truncated_full(PARTS[:5]), "MAX_TOKENS"),
+        _response("{}"),
+    )
+    with pytest.raises(ValueError):
+        asyncio.run(service.analyze_family_photos(child_image=b"child"))
+
+
+def test_missing_parts_without_truncation_fail_after_follow_up():
+    complete_but_short = json.dumps({"face_center": {"x": 50, "y": 40}, "face_width": 30,
+                                     "analysis_results": _items(PARTS[:6])}, ensure_ascii=False)
+    service, models = _service(_response(complete_but_short), _response('{"analysis_results": []}'))
+    with pytest.raises(ValueError, match="总结"):
+        asyncio.run(service.analyze_family_photos(child_image=b"child"))
+    assert len(models.calls) == 2
+
+
+def test_missing_coordinates_fail_like_missing_parts():
+    # 部位齐全但没有坐标：不能当作完整结果保存
+    no_location = json.dumps({"analysis_results": _items(PARTS)}, ensure_ascii=False)
+    service, models = _service(_response(no_location), _response(json.dumps({"analysis_results": []})))
+    with pytest.raises(ValueError, match="face_center"):
+        asyncio.run(service.analyze_family_photos(child_image=b"child"))
+    assert len(models.calls) == 2
+
+
+def test_missing_coordinates_are_requested_in_follow_up():
+    no_width = json.dumps({"face_center": {"x": 50, "y": 40}, "face_width": "wide",
+                           "analysis_results": _items(PARTS)}, ensure_ascii=False)
+    service, models = _service(_response(no_width), _response('{"analysis_results": [], "face_width": 35}'))
+    result = asyncio.run(service.analyze_family_photos(child_image=b"child"))
+    assert (result["face_center"], result["face_width"]) == ({"x": 50, "y": 40}, 35)
+    assert "face_width" in models.calls[1][-1].parts[0].text
@@ -11,16 +11,18 @@ export default function Result() {
     const location = useLocation();
     const [resultData, setResultData] = useState(null);
     const [childImage, setChildImage] = useState(null);
+    // 多个孩子一起分析时，?child=N 选择查看的孩子
+    const childIndex = Math.max(1, parseInt(new URLSearchParams(location.search).get('child'), 10) || 1);
 
     useEffect(() => {
         const fetchResult = async () => {
             const activeCode = localStorage.getItem('active_code');
 
-            // 1. 尝试从 State 获取图片 (最高优先级，无网络延迟)
-            let imagesObj = location.state?.images;
+            // 1. 尝试从 State 获取图片 (最高优先级，无网络延迟)；其他孩子只使用后端返回的图片
+            let imagesObj = childIndex === 1 ? location.state?.images : null;
 
             // 2. 尝试本地兼容 (次优) - 注意我们稍后可能会废弃这个，因为 quota 问题
-            if (!imagesObj) {
+            if (!imagesObj && childIndex === 1) {
                 const stored = localStorage.getItem('upload_images');
                 if (stored) {
                     try { imagesObj = JSON.parse(stored); } catch (e) { }
@@ -34,7 +36,8 @@ export default function Result() {
 
             try {
                 console.log('Fetching result for code:', activeCode);
-                const result = await getCachedResult(activeCode);
+                setChildImage(null);
+                const result = await getCachedResult(activeCode, childIndex);
                 console.log('Result received:', result);
 
                 if (result.success) {
@@ -77,7 +80,7 @@ export default function Result() {
         };
 
         fetchResult();
-    }, [navigate]);
+    }, [navigate, childIndex]);
 
     // Redraw canvas on window resize or data change
     // Redraw canvas on window resize or data change
@@ -586,6 +589,19 @@ export default function Result() {
             </div>
 
             <div className="w-full max-w-md md:max-w-3xl lg:max-w-4xl mx-auto p-4 space-y-5">
+                {/* 多个孩子：切换查看 */}
+                {resultData?.child_count > 1 && (
+                    <div className="flex gap-2 justify-center">
+                        {Array.from({ length: resultData.child_count }, (_, i) => i + 1).map(n => (
+                            <Button key={n} size="sm" variant={n === childIndex ? 'primary' : 'outline'}
+                                className="rounded-full"
+                                onClick={() => navigate(n === 1 ? '/result' : `/result?child=${n}`)}>
+                                孩子 {n}
+                            </Button>
+                        ))}
+                    </div>
+                )}
+
                 {/* Canvas Container */}
                 <div className="relative rounded-3xl overflow-hidden glass-card p-1 min-h-[400px]" ref={containerRef}>
                     <canvas ref={canvasRef} className="block w-full rounded-2xl" />
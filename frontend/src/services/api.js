@@ -54,7 +54,7 @@ export const verifyCode = async (code, deviceId) => {
 /**
  * 上传照片并分析
  * @param {string} code - 兑换码
- * @param {Object} images - 图片对象 { child, father?, mother? }
+ * @param {Object} images - 图片对象 { child, siblings?, father?, mother? }，siblings 为同一对父母的其他孩子照片数组
  */
 export const analyzePhotos = async (code, images) => {
     console.log(`[api.js] analyzePhotos called via FormData. Code: ${code ? code.substring(0, 4) + '***' : 'missing'}`);
@@ -95,6 +95,11 @@ export const analyzePhotos = async (code, images) => {
             console.warn('[api.js] Missing child image!');
         }
 
+        // 其他孩子照片（选填，与第一个孩子一起分析）
+        (images.siblings || []).forEach((sibling, index) => {
+            formData.append('child', base64ToBlob(sibling), `child_${index + 2}.jpg`);
+        });
+
         // 添加父亲照片（选填）
         if (images.father) {
             console.log('[api.js] Appending father image...');
@@ -125,11 +130,14 @@ export const analyzePhotos = async (code, images) => {
 /**
  * 获取缓存的分析结果
  * @param {string} code - 兑换码
+ * @param {number} child - 孩子序号（多个孩子一起分析时，从 1 开始）
  */
-export const getCachedResult = async (code) => {
-    // 增加时间戳防止浏览器缓存 GET 请求
-    return request(`/api/analyze/result?_t=${Date.now()}`, {
+export const getCachedResult = async (code, child = 1) => {
+    // no-cache: 每次都向服务端校验 (If-None-Match)，结果未变时返回 304 复用本地缓存
+    const query = child > 1 ? `?child=${child}` : '';
+    return request(`/api/analyze/result${query}`, {
         method: 'GET',
+        cache: 'no-cache',
         headers: {
             'Authorization': `Bearer ${code}`,
         },